@@ -19,8 +19,11 @@ logger.addHandler(handler)
 f_logger = logging.getLogger("file_logger")
 f_logger.setLevel(logging.DEBUG)
 
+# delay=True defers opening (and truncating) the file until the first record is
+# logged, so importing the package never touches the file system.
 f_handler = logging.FileHandler(
     Path(__file__).parent.parent / "tests" / "output"/ "debug_log.csv",
-    mode="w"
+    mode="w",
+    delay=True,
 )
 f_logger.addHandler(f_handler)
\ No newline at end of file
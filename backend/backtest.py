@@ -0,0 +1,372 @@
+"""
+Backtests of rebalancing rules on the stored price and exchange rate history.
+
+A strategy starts with initial_cash in primary currency on start_date and
+holds target weights of its assets, in value in primary currency; what the
+weights leave stays in cash. Its rule decides on which trading days the
+holdings go back to the targets:
+
+- none: buy on the first trading day and hold
+- periodic: on the first trading day of every day, week, month, quarter or year
+- threshold: on the trading days a weight drifts from its target by more than
+  the threshold
+
+Rebalancing trades whole shares at the close of the day, with fees of fee_rate
+times the amount traded: sells first, then currency exchanges for the buys (a
+cash_out and a cash_in of the same value in primary currency, which cancel out
+in the NAV), then buys. Assets are not traded before their first price. Splits
+and dividends of the CorporateAction table become split and dividends
+transactions on their ex-dates.
+
+The generated ledger goes through PositionService.apply_transaction() and the
+NAV engine of PortfolioService.batch_nav_series() against one MarketDataSnapshot,
+all in memory: no Transaction or Position row is written. Strategies are
+independent, so many parameter variants run in parallel on a process pool.
+"""
+
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from decimal import ROUND_FLOOR, Decimal
+
+from sqlmodel import Session
+
+from backend import instrumentation, trading_calendar
+from backend.corporate_actions import CorporateActionService
+from backend.models import Position, Transaction
+from backend.services import MarketDataSnapshot, PortfolioService, PositionService
+
+RULES = ("none", "periodic", "threshold")
+FREQUENCIES = ("daily", "weekly", "monthly", "quarterly", "yearly")
+DEFAULT_INITIAL_CASH = Decimal("1000000")
+
+
+@dataclass(frozen=True)
+class Strategy:
+    name: str
+    weights: dict[int, float]  # Target weight per asset id; the rest stays in cash in primary currency
+    rule: str = "periodic"  # none, periodic or threshold
+    frequency: str = "monthly"  # Period of the periodic rule
+    threshold: float = 0.05  # Largest drift of a weight from its target under the threshold rule
+    fee_rate: float = 0.0  # Fees as a share of the amount traded
+
+    def __post_init__(self):
+        if self.rule not in RULES:
+            raise ValueError(f"Invalid rule: {self.rule}. Must be one of {', '.join(RULES)}")
+        if self.frequency not in FREQUENCIES:
+            raise ValueError(f"Invalid frequency: {self.frequency}. Must be one of {', '.join(FREQUENCIES)}")
+        if not self.weights:
+            raise ValueError(f"Strategy {self.name} has no weights")
+        if any(weight < 0 for weight in self.weights.values()) or sum(self.weights.values()) > 1 + 1e-9:
+            raise ValueError(f"The weights of strategy {self.name} must be positive and sum to 1 at most")
+        if self.threshold <= 0:
+            raise ValueError(f"The threshold must be positive, got {self.threshold}")
+        if not 0 <= self.fee_rate < 1:
+            raise ValueError(f"The fee rate must be at least 0 and below 1, got {self.fee_rate}")
+
+
+def period_of(day: date, frequency: str):
+    """The period of a day; the periodic rule rebalances when it changes"""
+    if frequency == "daily":
+        return day
+    if frequency == "weekly":
+        return day.isocalendar()[:2]
+    if frequency == "monthly":
+        return day.year, day.month
+    if frequency == "quarterly":
+        return day.year, (day.month - 1) // 3
+    return day.year
+
+
+class _Simulation:
+    """The ledger of a strategy, applied to in-memory positions as it is generated"""
+
+    def __init__(self, strategy: Strategy, snapshot: MarketDataSnapshot):
+        self.strategy = strategy
+        self.snapshot = snapshot
+        self.fee_rate = Decimal(str(strategy.fee_rate))
+        self.positions: dict[int, Position] = {}
+        self.ledger: list[Transaction] = []
+        self.rebalances = 0
+        self.fees = Decimal("0")
+        self.traded = Decimal("0")
+
+    def apply(self, transaction: Transaction) -> None:
+        PositionService.apply_transaction(
+            self.positions, transaction, self.snapshot.get_cash_asset_id(transaction.currency_id),
+            transaction.trade_date,
+        )
+        self.ledger.append(transaction)
+
+    def quantity(self, asset_id: int) -> Decimal:
+        position = self.positions.get(asset_id)
+        return position.quantity if position else Decimal("0")
+
+    def cash(self, currency_id: int) -> Decimal:
+        return self.quantity(self.snapshot.get_cash_asset_id(currency_id))
+
+    def deposit(self, day: date, amount: Decimal, currency_id: int, action: str = "cash_in") -> None:
+        self.apply(Transaction(
+            trade_date=day, action=action, asset_id=self.snapshot.get_cash_asset_id(currency_id),
+            quantity=amount, price=Decimal("1"), amount=amount, fees=Decimal("0"), currency_id=currency_id,
+        ))
+
+    def exchange(self, day: date, currency_id: int, amount: Decimal) -> None:
+        """Exchange primary currency for amount of a currency, or back when amount is negative"""
+        primary_amount = self.snapshot.convert_to_primary_currency(amount, currency_id, day)
+        primary_currency_id = self.snapshot.primary_currency_id
+        if amount > 0:
+            self.deposit(day, primary_amount, primary_currency_id, "cash_out")
+            self.deposit(day, amount, currency_id)
+        else:
+            self.deposit(day, -amount, currency_id, "cash_out")
+            self.deposit(day, -primary_amount, primary_currency_id)
+
+    def trade(self, day: date, action: str, asset_id: int, quantity: Decimal, price: Decimal) -> None:
+        currency_id = self.snapshot.assets[asset_id].currency_id
+        amount = quantity * price
+        fees = amount * self.fee_rate
+        self.apply(Transaction(
+            trade_date=day, action=action, asset_id=asset_id, quantity=quantity, price=price,
+            amount=amount, fees=fees, currency_id=currency_id,
+        ))
+        self.fees += self.snapshot.convert_to_primary_currency(fees, currency_id, day)
+        self.traded += self.snapshot.convert_to_primary_currency(amount, currency_id, day)
+
+    def drift(self, day: date) -> float:
+        """The largest difference between a weight and its target"""
+        total_value = self.snapshot.value_positions(self.positions, day)
+        if total_value <= 0:
+            return 0.0
+        drift = 0.0
+        for asset_id, target in self.strategy.weights.items():
+            price = self.snapshot.get_price(asset_id, day)
+            value = self.snapshot.convert_to_primary_currency(
+                self.quantity(asset_id) * (price or 0), self.snapshot.assets[asset_id].currency_id, day
+            )
+            drift = max(drift, abs(float(value / total_value) - target))
+        return drift
+
+    def rebalance(self, day: date) -> None:
+        """Trade the holdings back to the target weights at the prices of day"""
+        snapshot = self.snapshot
+        total_value = snapshot.value_positions(self.positions, day)
+        orders, prices = {}, {}
+        for asset_id, weight in self.strategy.weights.items():
+            price = snapshot.get_price(asset_id, day)
+            if not price:
+                continue
+            unit_value = snapshot.convert_to_primary_currency(price, snapshot.assets[asset_id].currency_id, day)
+            target = (Decimal(str(weight)) * total_value / (unit_value * (1 + self.fee_rate))).to_integral_value(
+                ROUND_FLOOR
+            )
+            if target != self.quantity(asset_id):
+                orders[asset_id], prices[asset_id] = target - self.quantity(asset_id), price
+        if not orders:
+            return
+        self.rebalances += 1
+
+        for asset_id, change in orders.items():
+            if change < 0:
+                self.trade(day, "sell", asset_id, -change, prices[asset_id])
+        # Every foreign currency holds what its buys cost, the rest goes back to primary currency
+        needs = defaultdict(Decimal)
+        for asset_id, change in orders.items():
+            if change > 0:
+                needs[snapshot.assets[asset_id].currency_id] += change * prices[asset_id] * (1 + self.fee_rate)
+        cash_currencies = {
+            currency_id for currency_id, cash_asset_id in snapshot.cash_asset_ids.items()
+            if cash_asset_id in self.positions
+        }
+        for currency_id in sorted(cash_currencies | set(needs)):
+            if currency_id == snapshot.primary_currency_id:
+                continue
+            shortfall = needs[currency_id] - self.cash(currency_id)
+            if shortfall > 0:
+                rate = snapshot.get_exchange_rate(currency_id, day)
+                shortfall = min(shortfall, max(self.cash(snapshot.primary_currency_id), Decimal("0")) / rate)
+            if shortfall:
+                self.exchange(day, currency_id, shortfall)
+        for asset_id, change in orders.items():
+            if change > 0:
+                # Fees of the sells can leave the buys a little short of cash
+                cost = prices[asset_id] * (1 + self.fee_rate)
+                affordable = (self.cash(snapshot.assets[asset_id].currency_id) / cost).to_integral_value(ROUND_FLOOR)
+                quantity = min(change, max(affordable, Decimal("0")))
+                if quantity > 0:
+                    self.trade(day, "buy", asset_id, quantity, prices[asset_id])
+
+    def corporate_action(self, asset_id: int, ex_date: date, action_type: str, ratio, amount) -> None:
+        """The split or dividends transaction of a corporate action of a held asset"""
+        held = self.quantity(asset_id)
+        if not held:
+            return
+        currency_id = self.snapshot.assets[asset_id].currency_id
+        if action_type == "split":
+            self.apply(Transaction(
+                trade_date=ex_date, action="split", asset_id=asset_id, quantity=ratio, amount=Decimal("0"),
+                fees=Decimal("0"), currency_id=currency_id,
+            ))
+        else:
+            self.apply(Transaction(
+                trade_date=ex_date, action="dividends", asset_id=asset_id, quantity=held, price=amount,
+                amount=held * amount, fees=Decimal("0"), currency_id=currency_id,
+            ))
+
+
+def simulate(
+    strategy: Strategy,
+    snapshot: MarketDataSnapshot,
+    actions: list[tuple],
+    start_date: date,
+    end_date: date,
+    initial_cash: Decimal,
+    numeric_mode: str = "decimal",
+) -> dict:
+    """
+    The NAV series of a strategy from start_date to end_date, a twr() style result with
+    extra "values", "cash_flows", "rebalances", "trades", "fees" and "traded" entries.
+
+    Args:
+        snapshot: prices and exchange rates covering start_date to end_date
+        actions: (asset_id, ex_date, action_type, ratio, amount) corporate actions sorted by ex_date
+    """
+    simulation = _Simulation(strategy, snapshot)
+    simulation.deposit(start_date, initial_cash, snapshot.primary_currency_id)
+    assets = [snapshot.assets[asset_id] for asset_id in strategy.weights]
+    calendar = trading_calendar.calendar_for_assets(snapshot.calendars, assets)
+    actions = [action for action in actions if action[0] in strategy.weights]
+    next_action = 0
+    period = None
+    with instrumentation.stage("replay"):
+        for day in calendar.trading_days(start_date, end_date):
+            while next_action < len(actions) and actions[next_action][1] <= day:
+                simulation.corporate_action(*actions[next_action])
+                next_action += 1
+            if not simulation.rebalances:
+                # The first allocation, as soon as an asset has a price
+                rebalance = True
+            elif strategy.rule == "periodic":
+                rebalance = period_of(day, strategy.frequency) != period
+            elif strategy.rule == "threshold":
+                rebalance = simulation.drift(day) > strategy.threshold
+            else:
+                rebalance = False
+            if rebalance:
+                simulation.rebalance(day)
+                period = period_of(day, strategy.frequency)
+        for action in actions[next_action:]:
+            simulation.corporate_action(*action)
+
+    # The NAV engines only read the snapshot
+    nav_series_from_ledger = PortfolioService(session=None).nav_series_engine(numeric_mode)
+    result = nav_series_from_ledger(simulation.ledger, snapshot, start_date, end_date)
+    result["rebalances"] = simulation.rebalances
+    result["trades"] = sum(transaction.action in ("buy", "sell") for transaction in simulation.ledger)
+    result["fees"] = float(simulation.fees)
+    result["traded"] = float(simulation.traded)
+    return result
+
+
+# The market data of a worker process, sent once per process rather than once per strategy
+_market = None
+
+
+def _initialize_worker(market: tuple) -> None:
+    global _market
+    _market = market
+
+
+def _simulate_in_worker(strategy: Strategy) -> dict:
+    return simulate(strategy, *_market)
+
+
+class BacktestService:
+    """Service replaying rebalancing strategies on the stored market data"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def run(
+        self,
+        strategies: list[Strategy],
+        start_date: date,
+        end_date: date,
+        initial_cash: Decimal = DEFAULT_INITIAL_CASH,
+        workers: int = 1,
+        numeric_mode: str = "decimal",
+    ) -> list[dict]:
+        """
+        NAV series and statistics of every strategy from start_date to end_date.
+
+        Args:
+            initial_cash: cash in primary currency deposited on start_date
+            workers: processes replaying the strategies; 1 replays them in this process
+            numeric_mode: "decimal" or "float" NAV engine, as in batch_nav_series()
+        """
+        if not strategies:
+            raise ValueError("No strategy to backtest")
+        if start_date >= end_date:
+            raise ValueError("start_date must be earlier than end_date")
+        if initial_cash <= 0:
+            raise ValueError(f"The initial cash must be positive, got {initial_cash}")
+        portfolio_service = PortfolioService(self.session)
+        portfolio_service.nav_series_engine(numeric_mode)
+
+        snapshot = MarketDataSnapshot(self.session, start_date, end_date)
+        asset_ids = {asset_id for strategy in strategies for asset_id in strategy.weights}
+        for asset_id in asset_ids:
+            if asset_id not in snapshot.assets:
+                raise ValueError(f"Asset {asset_id} not found")
+            if snapshot.assets[asset_id].type == "cash":
+                raise ValueError(f"Cash is what the weights leave, {snapshot.assets[asset_id].symbol} cannot have one")
+            snapshot.get_cash_asset_id(snapshot.assets[asset_id].currency_id)
+        actions = [
+            (action.asset_id, action.ex_date, action.action_type, action.ratio, action.amount)
+            for action in CorporateActionService(self.session).get_actions()
+            if action.asset_id in asset_ids and start_date < action.ex_date <= end_date
+        ]
+        actions.sort(key=lambda action: action[1])
+
+        market = (snapshot, actions, start_date, end_date, initial_cash, numeric_mode)
+        with instrumentation.stage("simulation"):
+            if workers > 1 and len(strategies) > 1:
+                # The API serves requests from threads, which fork() does not carry safely into children
+                context = multiprocessing.get_context("forkserver")
+                with ProcessPoolExecutor(
+                    max_workers=min(workers, len(strategies)), mp_context=context,
+                    initializer=_initialize_worker, initargs=(market,),
+                ) as executor:
+                    results = list(executor.map(_simulate_in_worker, strategies))
+            else:
+                results = [simulate(strategy, *market) for strategy in strategies]
+
+        backtests = []
+        for strategy, result in zip(strategies, results):
+            calendar = trading_calendar.calendar_for_assets(
+                snapshot.calendars, [snapshot.assets[asset_id] for asset_id in strategy.weights]
+            )
+            statistics = portfolio_service.calculate_portfolio_statistics(
+                None, start_date, end_date, twr_data=result, calendar=calendar
+            )
+            average_value = sum(result["values"]) / len(result["values"])
+            backtests.append({
+                "name": strategy.name,
+                "rule": strategy.rule,
+                "frequency": strategy.frequency,
+                "threshold": strategy.threshold,
+                "fee_rate": strategy.fee_rate,
+                "weights": strategy.weights,
+                "statistics": statistics,
+                "rebalances": result["rebalances"],
+                "trades": result["trades"],
+                "fees": result["fees"],
+                "turnover": result["traded"] / average_value if average_value > 0 else 0.0,
+                "history": [
+                    {"date": day.isoformat(), "value": value, "nav": nav}
+                    for day, value, nav in zip(result["dates"], result["values"], result["nav_history"])
+                ],
+            })
+        return backtests
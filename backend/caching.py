@@ -0,0 +1,246 @@
+"""
+HTTP caching and request coalescing for the read-heavy portfolio endpoints.
+
+Each response gets a strong ETag derived from the request (path and query), the
+current day and the data version of the portfolio (or of the member portfolios
+of a group): its transactions, the assets it holds and their prices, corporate
+actions and intraday prices from the feed, the exchange rates of their
+currencies and the last settings update. The version is read from the database
+and the price feed only, so every worker process computes the same ETag, and
+writes to one portfolio or prices of other assets leave it unchanged. Price and
+exchange rate upserts refresh created_at, which covers updates in place.
+
+A request whose If-None-Match matches the ETag is answered with 304 before the
+endpoint runs. Otherwise results are kept in a small LRU cache keyed by ETag,
+and concurrent requests with the same ETag share a single computation.
+
+The write generation is a separate, in-process counter bumped around every write
+request and background import, for in-memory caches of this process that are not
+keyed by a data version.
+
+Example:
+    @app.get("/portfolios/{portfolio_id}/summary")
+    @caching.coalesce
+    def get_portfolio_summary(portfolio_id: int, etag: str = Depends(caching.portfolio_etag), ...):
+        ...
+"""
+
+import functools
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import date
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from backend import realtime
+from backend.models import (
+    Asset,
+    CorporateAction,
+    Currency,
+    ExchangeRate,
+    Portfolio,
+    PortfolioGroupMember,
+    Price,
+    Settings,
+    Transaction,
+    get_session,
+)
+
+# Safe methods never bump the write generation
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_generation = itertools.count()
+_current_generation = next(_generation)
+
+
+def bump_generation() -> None:
+    """Mark that data may have changed in a way the ids do not show"""
+    global _current_generation
+    _current_generation = next(_generation)
+
+
+def current_generation() -> int:
+    """The write generation, which changes after every write handled by this process.
+
+    It is not part of the ETags, which must agree across processes.
+    """
+    return _current_generation
+
+
+def invalidates(handler: Callable) -> Callable:
+    """Wrap a background job handler so that it bumps the write generation when it finishes"""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            bump_generation()
+    return wrapper
+
+
+def data_version(session: Session, portfolio_ids: list[int]) -> str:
+    """Version of the data the endpoints of some portfolios read"""
+    held = select(Transaction.asset_id).where(Transaction.portfolio_id.in_(portfolio_ids)).distinct()
+    currencies = select(Asset.currency_id).where(Asset.id.in_(held))
+    row = session.exec(
+        select(
+            select(func.count(Transaction.id)).where(Transaction.portfolio_id.in_(portfolio_ids)).scalar_subquery(),
+            select(func.max(Transaction.id)).where(Transaction.portfolio_id.in_(portfolio_ids)).scalar_subquery(),
+            select(func.max(Price.id)).where(Price.asset_id.in_(held)).scalar_subquery(),
+            select(func.max(Price.created_at)).where(Price.asset_id.in_(held)).scalar_subquery(),
+            select(func.count(CorporateAction.id)).where(CorporateAction.asset_id.in_(held)).scalar_subquery(),
+            select(func.max(CorporateAction.id)).where(CorporateAction.asset_id.in_(held)).scalar_subquery(),
+            select(func.max(ExchangeRate.id)).where(ExchangeRate.currency_id.in_(currencies)).scalar_subquery(),
+            select(func.max(ExchangeRate.created_at))
+            .where(ExchangeRate.currency_id.in_(currencies)).scalar_subquery(),
+            select(func.max(Currency.id)).where(Currency.is_primary).scalar_subquery(),
+            select(func.max(Settings.updated_at)).scalar_subquery(),
+        )
+    ).one()
+    portfolios = session.exec(
+        select(Portfolio.id, Portfolio.base_currency_id).where(Portfolio.id.in_(portfolio_ids)).order_by(Portfolio.id)
+    ).all()
+    assets = session.exec(
+        select(Asset.id, Asset.symbol, Asset.name, Asset.type, Asset.currency_id)
+        .where(Asset.id.in_(held)).order_by(Asset.id)
+    ).all()
+    # Ticks of the assets held, but not of other assets
+    latest_prices = [realtime.feed.table.get(asset.id) for asset in assets]
+    ticks = [(latest.asset_id, latest.price, latest.timestamp) for latest in latest_prices if latest is not None]
+    # The database URL keeps processes serving several databases (like the tests) apart
+    return ":".join(str(value) for value in (session.get_bind().url, *row, portfolios, assets, ticks))
+
+
+def request_portfolio_ids(request: Request, session: Session) -> list[int]:
+    """The portfolio of a portfolio route, or the member portfolios of a group route"""
+    if "group_id" in request.path_params:
+        return list(session.exec(
+            select(PortfolioGroupMember.portfolio_id)
+            .where(PortfolioGroupMember.group_id == int(request.path_params["group_id"]))
+            .order_by(PortfolioGroupMember.portfolio_id)
+        ).all())
+    return [int(request.path_params["portfolio_id"])]
+
+
+def compute_etag(request: Request, version: str) -> str:
+    """Strong ETag of a request at a data version"""
+    digest = hashlib.sha256()
+    digest.update(request.url.path.encode("utf-8"))
+    digest.update(str(sorted(request.query_params.multi_items())).encode("utf-8"))
+    # Endpoints default to today's date
+    digest.update(date.today().isoformat().encode("utf-8"))
+    digest.update(version.encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def portfolio_etag(request: Request, response: Response, session: Session = Depends(get_session)) -> str:
+    """Dependency setting the ETag header and answering a matching If-None-Match with 304"""
+    etag = compute_etag(request, data_version(session, request_portfolio_ids(request, session)))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return etag
+
+
+class SingleFlight:
+    """Run a function once for all concurrent callers using the same key"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: BaseException | None = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, SingleFlight._Call] = {}
+
+    def do(self, key: str, function: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of endpoint results keyed by ETag"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+flights = SingleFlight()
+response_cache = ResponseCache()
+
+
+def coalesce(endpoint: Callable) -> Callable:
+    """Serve an endpoint taking an etag parameter from the cache, computing each ETag once.
+
+    Results are cached as returned, before serialization, so endpoints must not
+    return objects they modify later.
+    """
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        etag = kwargs["etag"]
+        cached = response_cache.get(etag)
+        if cached is not None:
+            return cached
+
+        def compute():
+            result = endpoint(*args, **kwargs)
+            response_cache.put(etag, result)
+            return result
+
+        return flights.do(etag, compute)
+    return wrapper
@@ -0,0 +1,229 @@
+"""
+Corporate actions and the adjusted price series derived from them.
+
+Price rows are raw closes, so a 2-for-1 split halves the price and a dividend
+lowers it by the amount paid out. Returns, charts and risk metrics read series
+adjusted backward from the CorporateAction table instead:
+
+- split: prices before the ex-date are divided by the split ratio
+- total_return: also multiplied by (1 - dividend / previous close) for every
+  dividend, so the series grows by the reinvested dividends
+
+Each action gives a factor for the prices before its ex-date. The factors are
+accumulated once per asset from the latest ex-date backward, so the adjusted
+price of any day is its close times the cumulative factor of the first ex-date
+after it. Holdings are not touched: quantities still change with `split`
+transactions, and dividends received with `dividends` transactions.
+
+Adjusted series are kept in an LRU cache keyed by a fingerprint of the price
+and corporate action rows of the asset (count, last id and sum of values), so
+new prices, upserted closes and new or deleted actions rebuild the series of
+that asset only, on its next read.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from backend import caching, instrumentation, logger
+from backend.models import Asset, CorporateAction, Price
+
+ACTION_TYPES = ("split", "dividend")
+ADJUSTMENTS = ("none", "split", "total_return")
+
+series_cache = caching.ResponseCache(maxsize=1024)
+
+
+def validate_adjustment(adjust: str) -> None:
+    if adjust not in ADJUSTMENTS:
+        raise ValueError(f"Invalid adjustment: {adjust}. Must be one of {', '.join(ADJUSTMENTS)}")
+
+
+@dataclass(frozen=True)
+class AdjustedSeries:
+    """Raw and adjusted closes of an asset on the dates it has a price"""
+    asset_id: int
+    dates: tuple[date, ...]
+    close: tuple[float, ...]
+    split: tuple[float, ...]
+    total_return: tuple[float, ...]
+
+    def values(self, adjust: str = "total_return") -> tuple[float, ...]:
+        validate_adjustment(adjust)
+        return self.close if adjust == "none" else getattr(self, adjust)
+
+    def window(self, start_date: date | None = None, end_date: date | None = None) -> slice:
+        """Indexes of the dates between start_date and end_date, both included"""
+        start = bisect_left(self.dates, start_date) if start_date else 0
+        end = bisect_right(self.dates, end_date) if end_date else len(self.dates)
+        return slice(start, end)
+
+
+def cumulative_factors(
+    actions: list[CorporateAction], dates: list[date], closes: list[float]
+) -> tuple[list[date], list[float], list[float]]:
+    """
+    Sorted ex-dates with the cumulative split and total return factors.
+
+    The factors have one more entry than the ex-dates: entry i applies to the
+    prices before ex_dates[i] and on or after ex_dates[i - 1], the last one (1.0)
+    to the prices from the latest ex-date on.
+    """
+    per_date = defaultdict(lambda: [1.0, 1.0])  # split and dividend factor of each ex-date
+    for action in actions:
+        if action.action_type == "split":
+            per_date[action.ex_date][0] /= float(action.ratio)
+            continue
+        previous = bisect_left(dates, action.ex_date) - 1
+        amount = float(action.amount)
+        if previous < 0 or amount >= closes[previous]:
+            logger.warning(
+                f"Ignoring dividend of asset {action.asset_id} on {action.ex_date}: "
+                f"no previous close above the dividend"
+            )
+            continue
+        per_date[action.ex_date][1] *= 1.0 - amount / closes[previous]
+
+    ex_dates = sorted(per_date)
+    split_factors = [1.0] * (len(ex_dates) + 1)
+    total_return_factors = [1.0] * (len(ex_dates) + 1)
+    for index in reversed(range(len(ex_dates))):
+        split_factor, dividend_factor = per_date[ex_dates[index]]
+        split_factors[index] = split_factors[index + 1] * split_factor
+        total_return_factors[index] = total_return_factors[index + 1] * split_factor * dividend_factor
+    return ex_dates, split_factors, total_return_factors
+
+
+def adjust_series(asset_id: int, dates: list[date], closes: list[float], actions: list[CorporateAction]) -> AdjustedSeries:
+    """Apply the corporate actions of an asset to its raw closes"""
+    ex_dates, split_factors, total_return_factors = cumulative_factors(actions, dates, closes)
+    split, total_return = [], []
+    position = 0
+    for price_date, close in zip(dates, closes):
+        # Dates are sorted, so the first ex-date after the price only moves forward
+        while position < len(ex_dates) and ex_dates[position] <= price_date:
+            position += 1
+        split.append(close * split_factors[position])
+        total_return.append(close * total_return_factors[position])
+    return AdjustedSeries(asset_id, tuple(dates), tuple(closes), tuple(split), tuple(total_return))
+
+
+class CorporateActionService:
+    """Service for corporate actions and adjusted price series"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def get_actions(self, asset_id: int | None = None) -> list[CorporateAction]:
+        query = select(CorporateAction).order_by(CorporateAction.asset_id, CorporateAction.ex_date)
+        if asset_id is not None:
+            query = query.where(CorporateAction.asset_id == asset_id)
+        return self.session.exec(query).all()
+
+    def create_action(
+        self,
+        asset_id: int,
+        ex_date: date,
+        action_type: str,
+        ratio: Decimal | None = None,
+        amount: Decimal | None = None,
+        notes: str | None = None,
+    ) -> CorporateAction:
+        if action_type not in ACTION_TYPES:
+            raise ValueError(f"Invalid action type: {action_type}. Must be one of {', '.join(ACTION_TYPES)}")
+        if not self.session.get(Asset, asset_id):
+            raise ValueError(f"Asset {asset_id} not found")
+        if action_type == "split" and not (ratio and ratio > 0):
+            raise ValueError("A split needs a positive ratio")
+        if action_type == "dividend" and not (amount and amount > 0):
+            raise ValueError("A dividend needs a positive amount")
+
+        action = CorporateAction(
+            asset_id=asset_id, ex_date=ex_date, action_type=action_type,
+            ratio=ratio if action_type == "split" else None,
+            amount=amount if action_type == "dividend" else None,
+            notes=notes,
+        )
+        self.session.add(action)
+        self.session.commit()
+        self.session.refresh(action)
+        return action
+
+    def _fingerprints(self, asset_ids: list[int]) -> dict[int, str]:
+        """Version of the price and corporate action rows of each asset"""
+        fingerprints = defaultdict(str)
+        for model, values in ((Price, (Price.price,)), (CorporateAction, (CorporateAction.ratio, CorporateAction.amount))):
+            rows = self.session.exec(
+                select(model.asset_id, func.count(), func.max(model.id), *(func.total(value) for value in values))
+                .where(model.asset_id.in_(asset_ids))
+                .group_by(model.asset_id)
+            ).all()
+            for asset_id, *version in rows:
+                fingerprints[asset_id] += f"{model.__name__}:{':'.join(map(str, version))};"
+        return fingerprints
+
+    def adjusted_series(self, asset_ids: list[int]) -> dict[int, AdjustedSeries]:
+        """Adjusted series of the assets with prices, from the cache where still current"""
+        asset_ids = list(dict.fromkeys(asset_ids))
+        if not asset_ids:
+            return {}
+        url = self.session.get_bind().url
+        keys = {
+            asset_id: f"{url}:{asset_id}:{fingerprint}"
+            for asset_id, fingerprint in self._fingerprints(asset_ids).items()
+            if fingerprint.startswith("Price:")
+        }
+        result = {asset_id: series_cache.get(key) for asset_id, key in keys.items()}
+        missing = [asset_id for asset_id, series in result.items() if series is None]
+        if missing:
+            result.update(self._build(missing))
+            for asset_id in missing:
+                series_cache.put(keys[asset_id], result[asset_id])
+        return result
+
+    def _build(self, asset_ids: list[int]) -> dict[int, AdjustedSeries]:
+        with instrumentation.stage("load_prices"):
+            price_rows = self.session.exec(
+                select(Price.asset_id, Price.price_date, Price.price)
+                .where(Price.asset_id.in_(asset_ids))
+                .order_by(Price.asset_id, Price.price_date)
+            ).all()
+        instrumentation.count_rows(len(price_rows))
+        prices = defaultdict(lambda: ([], []))
+        for asset_id, price_date, price in price_rows:
+            dates, closes = prices[asset_id]
+            dates.append(price_date)
+            closes.append(float(price))
+
+        actions = defaultdict(list)
+        for action in self.session.exec(
+            select(CorporateAction).where(CorporateAction.asset_id.in_(asset_ids))
+        ).all():
+            actions[action.asset_id].append(action)
+
+        return {
+            asset_id: adjust_series(asset_id, *prices[asset_id], actions[asset_id])
+            for asset_id in asset_ids
+        }
+
+    def get_adjusted_prices(
+        self, asset_id: int, start_date: date | None = None, end_date: date | None = None,
+        adjust: str = "total_return",
+    ) -> list[dict]:
+        """Raw and adjusted closes of an asset between two dates"""
+        validate_adjustment(adjust)
+        series = self.adjusted_series([asset_id]).get(asset_id)
+        if series is None:
+            return []
+        window = series.window(start_date, end_date)
+        return [
+            {"date": price_date.isoformat(), "close": close, "adjusted_close": adjusted}
+            for price_date, close, adjusted in zip(
+                series.dates[window], series.close[window], series.values(adjust)[window]
+            )
+        ]
@@ -0,0 +1,251 @@
+"""
+Covariance and correlation of asset returns.
+
+Estimates are built from the aligned daily log returns in primary currency of
+risk.load_returns, with one of the METHODS:
+
+- sample: the unbiased sample covariance
+- ewma: the RiskMetrics exponentially weighted covariance around a zero mean,
+  the weight of a return falling by decay every day
+- ledoit_wolf: the sample covariance shrunk towards a scaled identity by the
+  Ledoit-Wolf (2004) optimal intensity, well conditioned for many assets
+
+Every method only needs running sums of the return outer products, which cost
+O(days x assets^2) to build. An estimate keeps them in an LRU cache keyed by the
+asset set, window, method and decay, tagged with the version of the prices,
+rates and corporate actions. When the version changes and the new window only
+shifts the cached one by new days (e.g. daily prices arrive), the sums are
+updated with the added and dropped rows instead of being rebuilt; they are
+rebuilt whenever older returns changed or once a whole window has been updated,
+which bounds the rounding drift of the updates.
+"""
+
+from dataclasses import dataclass, field, replace
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from backend import caching, instrumentation
+from backend.models import CorporateAction, ExchangeRate, Price
+from backend.risk import DEFAULT_WINDOW, RiskService, classify_assets, load_returns
+
+METHODS = ("sample", "ewma", "ledoit_wolf")
+DEFAULT_METHOD = "ledoit_wolf"
+# RiskMetrics decay of daily returns
+DEFAULT_DECAY = 0.94
+
+_estimates = caching.ResponseCache(maxsize=64)
+
+
+def validate(method: str, decay: float = DEFAULT_DECAY) -> None:
+    if method not in METHODS:
+        raise ValueError(f"Invalid covariance method: {method}. Must be one of {', '.join(METHODS)}")
+    if not 0 < decay < 1:
+        raise ValueError(f"The EWMA decay must be between 0 and 1, got {decay}")
+
+
+def correlation(covariance: np.ndarray) -> np.ndarray:
+    """Correlation matrix of a covariance; assets without variance are uncorrelated"""
+    deviations = np.sqrt(np.clip(np.diag(covariance), 0.0, None))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = covariance / np.outer(deviations, deviations)
+    result[~np.isfinite(result)] = 0.0
+    np.fill_diagonal(result, 1.0)
+    return np.clip(result, -1.0, 1.0)
+
+
+def _row_weights(count: int, decay: float) -> np.ndarray:
+    """Weights of the rows of a window, oldest first, the newest weighing 1"""
+    return decay ** np.arange(count - 1, -1, -1, dtype=float)
+
+
+@dataclass(frozen=True)
+class _Moments:
+    """Running weighted sums of a return window; the weights are 1 with a decay of 1"""
+    count: int
+    decay: float
+    weights: float  # Sum of the weights
+    total: np.ndarray  # Weighted sum of the rows
+    cross: np.ndarray  # Weighted sum of the row outer products
+
+    @classmethod
+    def build(cls, returns: np.ndarray, decay: float) -> "_Moments":
+        weights = _row_weights(len(returns), decay)
+        instrumentation.count_ops(float_=2 * returns.size * returns.shape[1])
+        return cls(
+            len(returns), decay, float(weights.sum()), weights @ returns, (returns * weights[:, None]).T @ returns
+        )
+
+    def shift(self, dropped: np.ndarray, added: np.ndarray) -> "_Moments":
+        """The sums after dropping the oldest rows of the window and appending new ones"""
+        aging = self.decay ** len(added)
+        # One product for both: the dropped rows with negative aged weights
+        weights = np.concatenate([
+            -aging * _row_weights(self.count, self.decay)[:len(dropped)], _row_weights(len(added), self.decay)
+        ])
+        rows = np.vstack([dropped, added])
+        cross = self.cross * aging
+        cross += (rows * weights[:, None]).T @ rows
+        instrumentation.count_ops(float_=2 * rows.size * rows.shape[1] + cross.size)
+        return _Moments(
+            self.count - len(dropped) + len(added), self.decay,
+            self.weights * aging + float(weights.sum()), self.total * aging + weights @ rows, cross,
+        )
+
+    def covariance(self, method: str, returns: np.ndarray) -> tuple[np.ndarray, float]:
+        """Covariance estimate and shrinkage intensity (0 except for ledoit_wolf)"""
+        if method == "ewma":
+            return self.cross / self.weights, 0.0
+        mean = self.total / self.count
+        biased = self.cross / self.count
+        biased -= np.outer(mean, mean)
+        if method == "sample":
+            biased *= self.count / (self.count - 1)
+            return biased, 0.0
+        # Ledoit-Wolf towards m I, m the mean variance: with x the centered rows and
+        # S the biased covariance, sum_t |x_t x_t' - S|^2 = sum_t |x_t|^4 - T |S|^2
+        # only needs the window rows once
+        assets = len(mean)
+        scale = float(np.trace(biased)) / assets
+        norm = float(np.vdot(biased, biased))
+        distance = norm - assets * scale ** 2  # |S - m I|^2
+        squares = np.einsum("ij,ij->i", returns - mean, returns - mean)
+        spread = min(max(float(squares @ squares) - self.count * norm, 0.0) / self.count ** 2, distance)
+        shrinkage = spread / distance if distance > 0 else 1.0
+        biased *= 1 - shrinkage
+        biased[np.diag_indices(assets)] += shrinkage * scale
+        return biased, shrinkage
+
+
+@dataclass(frozen=True)
+class CovarianceEstimate:
+    """Covariance and correlation of the daily log returns of assets"""
+    method: str
+    decay: float
+    asset_ids: list[int]
+    dates: list[date]  # Dates of the returns
+    returns: np.ndarray
+    covariance: np.ndarray
+    correlation: np.ndarray
+    shrinkage: float = 0.0  # Weight of the Ledoit-Wolf target
+    excluded_asset_ids: list[int] = field(default_factory=list)  # Assets without enough history
+    version: str = ""  # Data version of the estimate
+    moments: _Moments | None = None
+    updates: int = 0  # Rows added incrementally since the sums were built
+
+
+def estimate(
+    method: str,
+    asset_ids: list[int],
+    dates: list[date],
+    returns: np.ndarray,
+    decay: float = DEFAULT_DECAY,
+    previous: CovarianceEstimate | None = None,
+) -> CovarianceEstimate:
+    """Estimate the covariance of a return matrix, updating the sums of a previous
+    estimate of the same assets when the new window only shifts the previous one forward"""
+    validate(method, decay)
+    weighting = decay if method == "ewma" else 1.0
+    moments, updates = None, 0
+    if (
+        previous is not None and previous.moments is not None and dates
+        and previous.moments.decay == weighting and previous.asset_ids == list(asset_ids)
+    ):
+        start = int(np.searchsorted(np.array(previous.dates, dtype="datetime64[D]"), np.datetime64(dates[0])))
+        overlap = len(previous.dates) - start
+        added = len(dates) - overlap
+        if (
+            0 < overlap <= len(dates)
+            and previous.dates[start:] == dates[:overlap]
+            and np.array_equal(previous.returns[start:], returns[:overlap])
+            and previous.updates + added < len(dates)
+        ):
+            moments = previous.moments.shift(previous.returns[:start], returns[overlap:])
+            updates = previous.updates + added
+    if moments is None:
+        moments = _Moments.build(returns, weighting)
+    covariance, shrinkage = moments.covariance(method, returns)
+    return CovarianceEstimate(
+        method, decay, list(asset_ids), list(dates), returns, covariance, correlation(covariance), shrinkage,
+        moments=moments, updates=updates,
+    )
+
+
+class CovarianceService:
+    """Service estimating the covariance and correlation of asset returns, cached per data version"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def data_version(self) -> str:
+        """Version of the prices, exchange rates and corporate actions; the write
+        generation covers in-place updates like price upserts"""
+        row = self.session.exec(
+            select(
+                select(func.max(Price.id)).scalar_subquery(),
+                select(func.max(ExchangeRate.id)).scalar_subquery(),
+                select(func.count(CorporateAction.id)).scalar_subquery(),
+                select(func.max(CorporateAction.id)).scalar_subquery(),
+            )
+        ).one()
+        return ":".join(str(value) for value in (*row, caching.current_generation()))
+
+    def estimate(
+        self,
+        asset_ids: list[int],
+        end_date: date,
+        window: int = DEFAULT_WINDOW,
+        method: str = DEFAULT_METHOD,
+        decay: float = DEFAULT_DECAY,
+    ) -> CovarianceEstimate:
+        """Covariance of the daily returns of the assets over the last window days up to end_date"""
+        validate(method, decay)
+        asset_ids = sorted(set(asset_ids))
+        key = f"{self.session.get_bind().url}:{method}:{window}:{decay}:{asset_ids}"
+        version = f"{self.data_version()}:{end_date}"
+        previous = _estimates.get(key)
+        if previous is not None and previous.version == version:
+            return previous
+
+        matrix = load_returns(self.session, asset_ids, end_date, window)
+        if len(matrix.dates) < 2:
+            raise ValueError("Not enough price history to estimate a covariance")
+        with instrumentation.stage("covariance"):
+            result = replace(
+                estimate(method, matrix.asset_ids, matrix.dates, matrix.returns, decay, previous),
+                excluded_asset_ids=matrix.excluded_asset_ids,
+                version=version,
+            )
+        _estimates.put(key, result)
+        return result
+
+    def portfolio_correlation(
+        self,
+        portfolio_id: int,
+        as_of_date: date,
+        window: int = DEFAULT_WINDOW,
+        method: str = DEFAULT_METHOD,
+        decay: float = DEFAULT_DECAY,
+    ) -> dict:
+        """Correlation and daily covariance of the returns of the holdings on as_of_date"""
+        asset_ids = list(RiskService(self.session).exposures(portfolio_id, as_of_date))
+        result = self.estimate(asset_ids, as_of_date, window, method, decay)
+        classes = classify_assets(self.session, result.asset_ids)
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of_date": as_of_date.isoformat(),
+            "method": method,
+            "observations": len(result.dates),
+            "start_date": result.dates[0].isoformat(),
+            "end_date": result.dates[-1].isoformat(),
+            "shrinkage": result.shrinkage,
+            "assets": [
+                {"asset_id": asset_id, "symbol": classes[asset_id]["symbol"]} for asset_id in result.asset_ids
+            ],
+            "excluded_asset_ids": result.excluded_asset_ids,
+            "volatilities": np.sqrt(np.clip(np.diag(result.covariance), 0.0, None)).tolist(),
+            "covariance": result.covariance.tolist(),
+            "correlation": result.correlation.tolist(),
+        }
@@ -0,0 +1,144 @@
+"""
+Marginal and component risk decomposition of the holdings.
+
+With the exposures w (market values in primary currency), their weights
+x = w / sum(w) and the covariance C of the daily returns, the volatility of the
+portfolio is s = sqrt(x' C x). Its Euler decomposition splits it over the
+positions:
+
+- marginal volatility: ds/dx_i = (C x)_i / s, the change of the volatility per
+  unit of weight added to the position
+- component volatility: x_i * (C x)_i / s, which sums to s over the positions
+- contribution: the component as a share of s, which sums to 1
+
+Volatilities are annualized with the trading days of the portfolio calendar.
+VaR is the delta-normal VaR z * s * sqrt(horizon) * sum(w) of the same
+covariance around a zero mean, so its marginal and component VaR are the
+volatility ones scaled by the same factor. Components add up within any
+grouping, so the types, sectors and currencies are plain sums of the positions.
+"""
+
+from datetime import date
+from statistics import NormalDist
+
+import numpy as np
+from sqlmodel import Session
+
+from backend import instrumentation, trading_calendar
+from backend.covariance import DEFAULT_DECAY, DEFAULT_METHOD, CovarianceService
+from backend.risk import DEFAULT_WINDOW, RiskService, classify_assets
+
+GROUPINGS = ("type", "sector", "currency")
+DEFAULT_CONFIDENCE = 0.99
+DEFAULT_HORIZON = 1
+
+
+def decompose(covariance: np.ndarray, exposures: np.ndarray) -> dict[str, np.ndarray | float]:
+    """Daily volatility of the weights of the exposures with its marginal and component volatilities"""
+    weights = exposures / exposures.sum()
+    exposure = covariance @ weights
+    variance = float(weights @ exposure)
+    volatility = float(np.sqrt(max(variance, 0.0)))
+    marginal = exposure / volatility if volatility > 0 else np.zeros_like(weights)
+    component = weights * marginal
+    instrumentation.count_ops(float_=2 * covariance.size + 4 * len(weights))
+    return {
+        "weights": weights,
+        "volatility": volatility,
+        "marginal": marginal,
+        "component": component,
+        "contribution": component / volatility if volatility > 0 else np.zeros_like(weights),
+    }
+
+
+def aggregate(labels: list[str], values: np.ndarray) -> tuple[list[str], np.ndarray]:
+    """Sums of the rows of values per label, labels sorted"""
+    keys, groups = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    sums = np.zeros((len(keys), *values.shape[1:]))
+    np.add.at(sums, groups, values)
+    return keys.tolist(), sums
+
+
+class DecompositionService:
+    """Service decomposing the volatility and VaR of a portfolio over its holdings"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def decomposition(
+        self,
+        portfolio_id: int,
+        as_of_date: date,
+        confidence: float = DEFAULT_CONFIDENCE,
+        horizon: int = DEFAULT_HORIZON,
+        window: int = DEFAULT_WINDOW,
+        method: str = DEFAULT_METHOD,
+        decay: float = DEFAULT_DECAY,
+    ) -> dict:
+        """Risk contributions of the holdings on as_of_date, per position and per type, sector and currency"""
+        if not 0 < confidence < 1:
+            raise ValueError(f"The confidence level must be between 0 and 1, got {confidence}")
+        if horizon < 1:
+            raise ValueError(f"The horizon must be at least 1 day, got {horizon}")
+        exposures = RiskService(self.session).exposures(portfolio_id, as_of_date)
+        asset_ids = sorted(exposures)
+        values = np.array([exposures[asset_id] for asset_id in asset_ids])
+        total_value = float(values.sum())
+        if not asset_ids or total_value <= 0:
+            raise ValueError("The portfolio has no holdings to decompose")
+
+        estimate = CovarianceService(self.session).estimate(asset_ids, as_of_date, window, method, decay)
+        # Positions without enough history contribute nothing
+        covariance = np.zeros((len(asset_ids), len(asset_ids)))
+        kept = np.searchsorted(asset_ids, estimate.asset_ids)
+        covariance[np.ix_(kept, kept)] = estimate.covariance
+
+        with instrumentation.stage("risk_decomposition"):
+            result = decompose(covariance, values)
+        calendar = trading_calendar.calendar_for_portfolio(self.session, portfolio_id)
+        annualization = float(np.sqrt(calendar.trading_days_per_year(estimate.dates[0], estimate.dates[-1])))
+        # Delta-normal VaR in primary currency per unit of daily volatility
+        var_scale = NormalDist().inv_cdf(confidence) * float(np.sqrt(horizon)) * total_value
+
+        classes = classify_assets(self.session, asset_ids)
+        columns = np.column_stack([
+            values, result["weights"], result["component"] * annualization,
+            result["contribution"], result["component"] * var_scale,
+        ])
+        groups = {}
+        for grouping in GROUPINGS:
+            keys, sums = aggregate([classes[asset_id][grouping] for asset_id in asset_ids], columns)
+            groups[grouping] = [
+                {
+                    "key": key, "value": row[0], "weight": row[1], "component_volatility": row[2],
+                    "contribution": row[3], "component_var": row[4],
+                }
+                for key, row in zip(keys, sums.tolist())
+            ]
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of_date": as_of_date.isoformat(),
+            "method": method,
+            "observations": len(estimate.dates),
+            "excluded_asset_ids": estimate.excluded_asset_ids,
+            "total_value": total_value,
+            "volatility": result["volatility"] * annualization,
+            "confidence": confidence,
+            "horizon_days": horizon,
+            "var": result["volatility"] * var_scale,
+            "assets": [
+                {
+                    "asset_id": asset_id,
+                    **classes[asset_id],
+                    "value": row[0],
+                    "weight": row[1],
+                    "marginal_volatility": marginal * annualization,
+                    "component_volatility": row[2],
+                    "contribution": row[3],
+                    "marginal_var": marginal * var_scale / total_value,
+                    "component_var": row[4],
+                }
+                for asset_id, row, marginal in zip(asset_ids, columns.tolist(), result["marginal"].tolist())
+            ],
+            "groups": groups,
+        }
@@ -7,10 +7,6 @@ from datetime import date, timedelta
 from decimal import Decimal
 import pandas as pd
 import os
-import akshare as ak
-import pandas as pd
-from datetime import date
-from decimal import Decimal
 
 from backend.models import (
     ROOT_PATH,
@@ -25,7 +21,6 @@ from backend.models import (
 )
 from backend.services import PositionService
 from backend.main import _import_transactions_from_dataframe
-from sqlmodel import Session, select
 
 
 def init_currencies():
@@ -208,6 +203,9 @@ def fetch_historical_prices(asset: Asset, start_date: date, end_date: date) -> p
     Returns:
         DataFrame with historical price data
     """
+    # AKShare is slow to import, so it is only loaded when prices are fetched
+    import akshare as ak
+
     symbol = asset.symbol
     if asset.type == "stock":
         # Chinese Stocks
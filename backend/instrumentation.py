@@ -0,0 +1,266 @@
+"""
+Built-in instrumentation for the hot paths of the services.
+
+When enabled, it records per-stage timers (load_ledger, load_prices, replay,
+valuation, persist), SQL query counts, rows fetched and Decimal/float arithmetic
+operation counts. Totals are kept for the whole process and exposed in the
+Prometheus text format; the numbers of the current HTTP request can also be
+returned in an X-Server-Timing response header.
+
+Instrumentation is disabled by default. Enable it with the environment variables
+NICEAMS_INSTRUMENTATION=1 (metrics) and NICEAMS_SERVER_TIMING=1 (response header),
+or by calling enable(). When disabled, stage() returns a shared no-op context
+manager and the counters return after a single boolean check.
+
+Example:
+    from backend import instrumentation
+
+    with instrumentation.stage("replay"):
+        ...
+    instrumentation.count_ops(decimal=3)
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel
+
+STAGES = ("load_ledger", "load_prices", "replay", "valuation", "persist")
+
+_NULL_STAGE = nullcontext()
+
+
+class RequestMetrics:
+    """Metrics collected while serving one request"""
+
+    __slots__ = (
+        "stage_seconds",
+        "stage_calls",
+        "sql_queries",
+        "rows_fetched",
+        "decimal_ops",
+        "float_ops",
+        "started_at",
+    )
+
+    def __init__(self):
+        self.stage_seconds: dict[str, float] = {}
+        self.stage_calls: dict[str, int] = {}
+        self.sql_queries = 0
+        self.rows_fetched = 0
+        self.decimal_ops = 0
+        self.float_ops = 0
+        self.started_at = time.perf_counter()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def server_timing(self) -> str:
+        """Format the metrics in the Server-Timing header syntax"""
+        entries = [
+            f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stage_seconds.items()
+        ]
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.3f}")
+        entries.append(f'sql;desc="queries={self.sql_queries} rows={self.rows_fetched}"')
+        entries.append(f'ops;desc="decimal={self.decimal_ops} float={self.float_ops}"')
+        return ", ".join(entries)
+
+
+class MetricsRegistry:
+    """Process-wide totals of all recorded metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stage_seconds: dict[str, float] = {}
+            self.stage_calls: dict[str, int] = {}
+            self.sql_queries = 0
+            self.rows_fetched = 0
+            self.decimal_ops = 0
+            self.float_ops = 0
+            self.request_seconds: dict[str, float] = {}
+            self.request_count: dict[str, int] = {}
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def add_counts(self, sql_queries: int = 0, rows_fetched: int = 0, decimal_ops: int = 0, float_ops: int = 0) -> None:
+        with self._lock:
+            self.sql_queries += sql_queries
+            self.rows_fetched += rows_fetched
+            self.decimal_ops += decimal_ops
+            self.float_ops += float_ops
+
+    def add_request(self, route: str, seconds: float) -> None:
+        with self._lock:
+            self.request_seconds[route] = self.request_seconds.get(route, 0.0) + seconds
+            self.request_count[route] = self.request_count.get(route, 0) + 1
+
+    def render_prometheus(self) -> str:
+        """Render all totals in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP niceams_instrumentation_enabled Whether instrumentation is recording.",
+                "# TYPE niceams_instrumentation_enabled gauge",
+                f"niceams_instrumentation_enabled {int(_settings['enabled'])}",
+                "# HELP niceams_stage_seconds_total Time spent in each service stage, including nested stages.",
+                "# TYPE niceams_stage_seconds_total counter",
+            ]
+            lines += [
+                f'niceams_stage_seconds_total{{stage="{name}"}} {seconds:.6f}'
+                for name, seconds in sorted(self.stage_seconds.items())
+            ]
+            lines += [
+                "# HELP niceams_stage_calls_total Number of times each service stage ran.",
+                "# TYPE niceams_stage_calls_total counter",
+            ]
+            lines += [
+                f'niceams_stage_calls_total{{stage="{name}"}} {calls}'
+                for name, calls in sorted(self.stage_calls.items())
+            ]
+            for metric, help_text, value in (
+                ("niceams_sql_queries_total", "Number of SQL statements executed.", self.sql_queries),
+                ("niceams_rows_fetched_total", "Number of rows loaded from the database.", self.rows_fetched),
+                ("niceams_decimal_ops_total", "Number of Decimal arithmetic operations in hot loops.", self.decimal_ops),
+                ("niceams_float_ops_total", "Number of float arithmetic operations in hot loops.", self.float_ops),
+            ):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {value}"]
+            lines += [
+                "# HELP niceams_request_seconds_total Time spent serving requests per route.",
+                "# TYPE niceams_request_seconds_total counter",
+            ]
+            lines += [
+                f'niceams_request_seconds_total{{route="{route}"}} {seconds:.6f}'
+                for route, seconds in sorted(self.request_seconds.items())
+            ]
+            lines += [
+                "# HELP niceams_requests_total Number of requests served per route.",
+                "# TYPE niceams_requests_total counter",
+            ]
+            lines += [
+                f'niceams_requests_total{{route="{route}"}} {count}'
+                for route, count in sorted(self.request_count.items())
+            ]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+_current_request: ContextVar[RequestMetrics | None] = ContextVar("niceams_request_metrics", default=None)
+_settings = {"enabled": False, "server_timing": False}
+
+
+class _Stage:
+    """Context manager timing one stage"""
+
+    __slots__ = ("name", "started_at")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.started_at
+        registry.add_stage(self.name, seconds)
+        metrics = _current_request.get()
+        if metrics is not None:
+            metrics.add_stage(self.name, seconds)
+        return False
+
+
+def stage(name: str):
+    """Time a block of code as the given stage"""
+    if not _settings["enabled"]:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count_ops(decimal: int = 0, float_: int = 0) -> None:
+    """Count arithmetic operations done with Decimal and float numbers"""
+    if not _settings["enabled"]:
+        return
+    registry.add_counts(decimal_ops=decimal, float_ops=float_)
+    metrics = _current_request.get()
+    if metrics is not None:
+        metrics.decimal_ops += decimal
+        metrics.float_ops += float_
+
+
+def count_rows(rows: int) -> None:
+    """Count rows fetched by queries that do not load ORM objects"""
+    if not _settings["enabled"]:
+        return
+    registry.add_counts(rows_fetched=rows)
+    metrics = _current_request.get()
+    if metrics is not None:
+        metrics.rows_fetched += rows
+
+
+def _on_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    registry.add_counts(sql_queries=1)
+    metrics = _current_request.get()
+    if metrics is not None:
+        metrics.sql_queries += 1
+
+
+def _on_instance_load(target, context):
+    count_rows(1)
+
+
+def is_enabled() -> bool:
+    return _settings["enabled"]
+
+
+def server_timing_enabled() -> bool:
+    return _settings["enabled"] and _settings["server_timing"]
+
+
+def enable(server_timing: bool = False) -> None:
+    """Start recording metrics, optionally with the X-Server-Timing header"""
+    _settings["server_timing"] = server_timing
+    if _settings["enabled"]:
+        return
+    event.listen(Engine, "before_cursor_execute", _on_cursor_execute)
+    event.listen(SQLModel, "load", _on_instance_load, propagate=True)
+    _settings["enabled"] = True
+
+
+def disable() -> None:
+    """Stop recording metrics"""
+    if not _settings["enabled"]:
+        return
+    event.remove(Engine, "before_cursor_execute", _on_cursor_execute)
+    event.remove(SQLModel, "load", _on_instance_load)
+    _settings["enabled"] = False
+    _settings["server_timing"] = False
+
+
+def begin_request() -> tuple[RequestMetrics, object]:
+    """Start collecting metrics for the current request"""
+    metrics = RequestMetrics()
+    return metrics, _current_request.set(metrics)
+
+
+def end_request(metrics: RequestMetrics, token: object, route: str) -> None:
+    """Stop collecting metrics for the current request"""
+    _current_request.reset(token)
+    registry.add_request(route, time.perf_counter() - metrics.started_at)
+
+
+def configure_from_environment() -> None:
+    """Enable instrumentation when the NICEAMS_* environment variables ask for it"""
+    if os.environ.get("NICEAMS_INSTRUMENTATION") == "1":
+        enable(server_timing=os.environ.get("NICEAMS_SERVER_TIMING") == "1")
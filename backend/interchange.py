@@ -0,0 +1,257 @@
+"""
+Bulk interchange of prices and transactions as Arrow IPC and Parquet.
+
+Imports read the uploaded file into an Arrow table and work on whole columns:
+symbols are dictionary encoded so every distinct symbol is resolved with one
+query, dates and numbers are cast once per column, and the rows are written
+with executemany. Prices are upserted on (asset_id, price_date), so a price
+file can be loaded again to correct earlier values.
+
+pyarrow is imported inside the functions; the rest of the API works without it.
+"""
+
+from datetime import date
+from typing import TYPE_CHECKING
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from backend.models import Asset, Currency, Portfolio, Price, Transaction, utcnow
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+IMPORT_FORMATS = ("arrow", "parquet")
+
+# Rows written per executemany call
+WRITE_BATCH_SIZE = 10_000
+
+# Actions whose symbol may be a currency code instead of an asset symbol
+CASH_ACTIONS = ("cash_in", "cash_out", "interest", "tax")
+
+
+def read_table(contents: bytes, file_format: str) -> "pa.Table":
+    """Read an Arrow IPC (stream or file) or Parquet file without copying its buffers"""
+    import pyarrow as pa
+
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_table(pa.BufferReader(contents))
+    if file_format == "arrow":
+        buffer = pa.py_buffer(contents)
+        try:
+            return pa.ipc.open_stream(buffer).read_all()
+        except pa.ArrowInvalid:
+            return pa.ipc.open_file(buffer).read_all()
+    raise ValueError(f"Invalid import format: {file_format}. Must be one of {', '.join(IMPORT_FORMATS)}")
+
+
+def _require_columns(table: "pa.Table", required_columns: list[str]) -> None:
+    missing_columns = [column for column in required_columns if column not in table.column_names]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+
+
+def _column(table: "pa.Table", name: str, arrow_type) -> list:
+    """A column cast to arrow_type as a Python list, or all None when the column is missing"""
+    import pyarrow.compute as pc
+
+    if name not in table.column_names:
+        return [None] * table.num_rows
+    return pc.cast(table[name], arrow_type).to_pylist()
+
+
+def resolve_import_portfolio(session: Session, portfolio_id: int | None = None) -> Portfolio:
+    """The portfolio receiving imported transactions, by default the first portfolio"""
+    if portfolio_id is None:
+        portfolio = session.exec(select(Portfolio).order_by(Portfolio.id)).first()
+        if not portfolio:
+            raise ValueError("No portfolio available. Please create a portfolio first.")
+        return portfolio
+    portfolio = session.get(Portfolio, portfolio_id)
+    if not portfolio:
+        raise ValueError(f"Portfolio {portfolio_id} not found")
+    return portfolio
+
+
+def resolve_import_asset(
+    session: Session, symbol: str, action: str, name: str | None, isin: str | None, currency_map: dict[str, int]
+) -> tuple[Asset, int]:
+    """Find or create the asset of an imported transaction.
+
+    Cash transactions may use a currency code (e.g. USD) as symbol, which maps to
+    the cash asset of that currency. Unknown symbols create a new asset whose type
+    and currency are guessed from the symbol.
+
+    Returns:
+        A tuple of (asset, currency_id of the transaction).
+    """
+    currency_id = 1  # Default to CNY
+    if action in CASH_ACTIONS and symbol in currency_map:
+        # Convert currency code to cash asset symbol
+        currency_id = currency_map[symbol]
+        symbol = f"{symbol}_CASH"
+
+    asset = session.exec(select(Asset).where(Asset.symbol == symbol)).first()
+    if asset:
+        # Use the asset's currency
+        return asset, asset.currency_id
+
+    # Determine asset type and currency
+    if symbol.endswith('_CASH'):
+        asset_type = 'cash'
+        currency_id = currency_map.get(symbol.replace('_CASH', ''), 1)
+    elif symbol.endswith('.SH') or symbol.endswith('.SZ'):
+        asset_type = 'stock'
+        currency_id = currency_map.get('CNY', 1)
+    elif symbol in ['AAPL', 'GOOGL', 'MSFT', 'TSLA']:  # US stocks
+        asset_type = 'stock'
+        currency_id = currency_map.get('USD', 1)
+    elif 'ETF' in str(name or '').upper():
+        asset_type = 'etf'
+        currency_id = currency_map.get('CNY', 1)
+    else:
+        asset_type = 'stock'  # Default
+        currency_id = currency_map.get('CNY', 1)
+
+    asset = Asset(symbol=symbol, name=name or symbol, isin=isin, type=asset_type, currency_id=currency_id)
+    session.add(asset)
+    session.commit()
+    session.refresh(asset)
+    return asset, currency_id
+
+
+def import_prices_table(
+    table: "pa.Table", session: Session, price_type: str = "historical", source: str = "bulk_import"
+) -> tuple[int, date | None]:
+    """Upsert the prices of a table with symbol, price_date and price columns.
+
+    Rows with an unknown symbol or a missing value are skipped, like the CSV import.
+
+    Returns:
+        A tuple of (number of prices written, earliest price date written).
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    _require_columns(table, ["symbol", "price_date", "price"])
+    table = table.select(["symbol", "price_date", "price"]).drop_null()
+
+    # Resolve each distinct symbol once
+    symbols = pc.dictionary_encode(pc.cast(table["symbol"], pa.string())).combine_chunks()
+    distinct_symbols = symbols.dictionary.to_pylist()
+    asset_ids = dict(session.exec(
+        select(Asset.symbol, Asset.id).where(Asset.symbol.in_(distinct_symbols))
+    ).all())
+    id_lookup = np.array([asset_ids.get(symbol, -1) for symbol in distinct_symbols], dtype=np.int64)
+    row_asset_ids = id_lookup[symbols.indices.to_numpy(zero_copy_only=False)]
+    known = row_asset_ids >= 0
+
+    mask = pa.array(known)
+    price_dates = pc.cast(table["price_date"], pa.date32()).filter(mask).to_pylist()
+    prices = pc.cast(table["price"], pa.float64()).filter(mask).to_numpy().tolist()
+    row_asset_ids = row_asset_ids[known].tolist()
+    if not price_dates:
+        return 0, None
+
+    statement = sqlite_insert(Price.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["asset_id", "price_date"],
+        set_={
+            "price": statement.excluded.price,
+            "price_type": statement.excluded.price_type,
+            "source": statement.excluded.source,
+            "created_at": statement.excluded.created_at,
+        },
+    )
+    created_at = utcnow()
+    connection = session.connection()
+    for start in range(0, len(price_dates), WRITE_BATCH_SIZE):
+        end = start + WRITE_BATCH_SIZE
+        connection.execute(statement, [
+            {
+                "asset_id": asset_id,
+                "price_date": price_date,
+                "price": price,
+                "price_type": price_type,
+                "source": source,
+                "created_at": created_at,
+            }
+            for asset_id, price_date, price in zip(
+                row_asset_ids[start:end], price_dates[start:end], prices[start:end]
+            )
+        ])
+    session.commit()
+    return len(price_dates), min(price_dates)
+
+
+def import_transactions_table(
+    table: "pa.Table", session: Session, portfolio_id: int | None = None
+) -> tuple[int, date | None]:
+    """Insert the transactions of a table with the columns of the transactions CSV
+    into a portfolio, by default the first portfolio.
+
+    Returns:
+        A tuple of (number of transactions inserted, earliest trade date).
+    """
+    import pyarrow as pa
+
+    _require_columns(table, ["trade_date", "action", "amount"])
+    portfolio = resolve_import_portfolio(session, portfolio_id)
+    currency_map = {currency.code: currency.id for currency in session.exec(select(Currency)).all()}
+
+    trade_dates = _column(table, "trade_date", pa.date32())
+    actions = _column(table, "action", pa.string())
+    symbols = _column(table, "symbol", pa.string())
+    names = _column(table, "name", pa.string())
+    isins = _column(table, "isin", pa.string())
+    quantities = _column(table, "quantity", pa.float64())
+    prices = _column(table, "price", pa.float64())
+    amounts = _column(table, "amount", pa.float64())
+    fees = _column(table, "fees", pa.float64())
+    notes = _column(table, "notes", pa.string())
+
+    resolved_assets = {}
+    rows = []
+    for index in range(table.num_rows):
+        action = actions[index]
+        asset, currency_id = None, 1
+        if symbols[index] is not None:
+            # Resolve each distinct symbol and action kind once
+            key = (symbols[index].strip(), action in CASH_ACTIONS)
+            if key not in resolved_assets:
+                resolved_assets[key] = resolve_import_asset(
+                    session, key[0], action, names[index], isins[index], currency_map
+                )
+            asset, currency_id = resolved_assets[key]
+
+        quantity = quantities[index]
+        if quantity is None and action in ['cash_in', 'cash_out'] and asset and asset.type == 'cash':
+            # For cash transactions without explicit quantity, use amount as quantity
+            quantity = amounts[index]
+        price = prices[index]
+        if price is None and asset and asset.type == 'cash':
+            # Cash assets always have a price of 1.0
+            price = 1.0
+
+        rows.append({
+            "portfolio_id": portfolio.id,
+            "trade_date": trade_dates[index],
+            "action": action,
+            "asset_id": asset.id if asset else None,
+            "quantity": quantity,
+            "price": price,
+            "amount": amounts[index],
+            "fees": fees[index] or 0.0,
+            "currency_id": currency_id,
+            "notes": notes[index],
+            "created_at": utcnow(),
+        })
+
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        session.connection().execute(insert(Transaction.__table__), rows[start:start + WRITE_BATCH_SIZE])
+    session.commit()
+    return len(rows), min((row["trade_date"] for row in rows), default=None)
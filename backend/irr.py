@@ -0,0 +1,115 @@
+"""
+Money-weighted return (XIRR) of many cash-flow series at once.
+
+A series is a list of dated cash flows, negative when money goes in (a deposit
+or a purchase) and positive when it comes out (a withdrawal, a sale, a dividend
+or the ending market value). Its XIRR is the annual rate r solving
+
+    NPV(r) = sum(amount_i * (1 + r) ** -t_i) = 0,  t_i = (date_i - date_0) / 365
+
+The series are padded into (series x flows) matrices and solved together, so
+every iteration is a few array operations for all series instead of one root
+finding call per series. The unknown is g = log(1 + r), bracketed where NPV
+changes sign; Newton steps leaving the bracket, or not shrinking faster than
+bisection would, fall back to bisection, so every series with a sign change
+converges. Series without one have no XIRR (NaN).
+"""
+
+from datetime import date
+
+import numpy as np
+
+DAYS_PER_YEAR = 365.0
+# exp() overflows float64 beyond ~709, so the bracket of g keeps |g * t| below this
+_EXPONENT_LIMIT = 600.0
+
+
+def _npv(g: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """NPV, its derivative in g and the scale sum(|amount| * discount) of every series"""
+    discounted = amounts * np.exp(-times * g[:, None])
+    return discounted.sum(axis=1), -(discounted * times).sum(axis=1), np.abs(discounted).sum(axis=1)
+
+
+def solve(
+    times: np.ndarray, amounts: np.ndarray, tol: float = 1e-12, max_iterations: int = 100
+) -> np.ndarray:
+    """
+    XIRR of every row of padded (series x flows) arrays.
+
+    Args:
+        times: years since the first flow of the series, 0 for padding
+        amounts: the cash flows, 0 for padding
+        tol: relative tolerance of the NPV and of the step in g
+        max_iterations: Newton/bisection iterations, the bisections alone halve the bracket each time
+    Returns:
+        The annual rates, NaN for series whose NPV has no sign change.
+    """
+    times = np.asarray(times, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    n_series = times.shape[0]
+    if times.size == 0:
+        return np.full(n_series, np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        horizon = np.maximum(times.max(axis=1), 1.0 / DAYS_PER_YEAR)
+        lo = -_EXPONENT_LIMIT / horizon
+        hi = _EXPONENT_LIMIT / horizon
+        f_lo = _npv(lo, times, amounts)[0]
+        f_hi = _npv(hi, times, amounts)[0]
+        solvable = np.sign(f_lo) * np.sign(f_hi) < 0
+
+        g = np.zeros(n_series)
+        previous_step = hi - lo
+        active = solvable.copy()
+        for _ in range(max_iterations):
+            if not active.any():
+                break
+            f, df, scale = _npv(g[active], times[active], amounts[active])
+            converged = np.abs(f) <= tol * scale
+
+            # Shrink the bracket to the side where NPV still changes sign
+            same_side = np.sign(f) == np.sign(f_lo[active])
+            lo[active] = np.where(same_side, g[active], lo[active])
+            f_lo[active] = np.where(same_side, f, f_lo[active])
+            hi[active] = np.where(same_side, hi[active], g[active])
+
+            newton = g[active] - f / df
+            use_newton = (
+                np.isfinite(newton) & (newton > lo[active]) & (newton < hi[active])
+                & (np.abs(newton - g[active]) <= np.abs(previous_step[active]) / 2)
+            )
+            step = np.where(use_newton, newton, (lo[active] + hi[active]) / 2) - g[active]
+            converged |= np.abs(step) <= tol * np.maximum(1.0, np.abs(g[active]))
+
+            g[active] = np.where(converged, g[active], g[active] + step)
+            previous_step[active] = step
+            active[np.flatnonzero(active)[converged]] = False
+
+    rates = np.expm1(g)
+    rates[~solvable] = np.nan
+    return rates
+
+
+def pad(series: list[list[tuple[date, float]]]) -> tuple[np.ndarray, np.ndarray]:
+    """Padded (series x flows) arrays of year fractions and amounts"""
+    width = max((len(flows) for flows in series), default=0)
+    times = np.zeros((len(series), width))
+    amounts = np.zeros((len(series), width))
+    for row, flows in enumerate(series):
+        if not flows:
+            continue
+        first = min(flow_date for flow_date, _ in flows).toordinal()
+        times[row, :len(flows)] = [(flow_date.toordinal() - first) / DAYS_PER_YEAR for flow_date, _ in flows]
+        amounts[row, :len(flows)] = [amount for _, amount in flows]
+    return times, amounts
+
+
+def xirr_many(series: list[list[tuple[date, float]]]) -> list[float | None]:
+    """XIRR of many lists of (date, amount) cash flows, None where it does not exist"""
+    rates = solve(*pad(series))
+    return [float(rate) if np.isfinite(rate) else None for rate in rates]
+
+
+def xirr(cash_flows: list[tuple[date, float]]) -> float | None:
+    """XIRR of one list of (date, amount) cash flows, None where it does not exist"""
+    return xirr_many([cash_flows])[0]
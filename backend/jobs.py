@@ -0,0 +1,234 @@
+"""
+In-process background jobs for long-running recalculations and imports.
+
+Jobs are rows of the Job table, so they survive restarts: resume() puts jobs
+interrupted by a shutdown back in the queue. Handlers run on a thread pool and
+report progress through a callable, which is saved to the job row at most a
+few times per second. Submitting a job identical to a pending or running one
+(same kind, parameters and uploaded data) returns the existing job.
+
+Example:
+    def handle_recalculation(session, parameters, data, progress):
+        ...
+        progress(done, total, "transactions replayed")
+        return {"message": "done"}
+
+    manager.register("recalculate_positions", handle_recalculation)
+    job = manager.submit(session, "recalculate_positions", {"portfolio_id": 1})
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from backend import logger
+from backend.models import Job, utcnow
+
+ACTIVE_STATUSES = ("pending", "running")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# handler(session, parameters, data, progress) -> JSON serializable result
+JobHandler = Callable[[Session, dict, bytes | None, "JobProgress"], object]
+
+
+class JobProgress:
+    """Progress callback of a running job.
+
+    Calling it records (current, total, message); the values are written to the
+    job row when at least interval seconds passed since the last write.
+    """
+
+    def __init__(self, engine, job_id: int, interval: float = 0.25):
+        self.engine = engine
+        self.job_id = job_id
+        self.interval = interval
+        self.current = 0
+        self.total: int | None = None
+        self.message: str | None = None
+        self._saved_at = 0.0
+
+    def __call__(self, current: int, total: int | None = None, message: str | None = None) -> None:
+        self.current = current
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the latest progress to the job row"""
+        self._saved_at = time.monotonic()
+        try:
+            with Session(self.engine) as session:
+                session.exec(
+                    update(Job)
+                    .where(Job.id == self.job_id)
+                    .values(
+                        progress_current=self.current,
+                        progress_total=self.total,
+                        progress_message=self.message,
+                    )
+                )
+                session.commit()
+        except OperationalError:
+            # The job itself may hold the SQLite write lock; the next update will catch up
+            logger.debug(f"Skipped a progress update of job {self.job_id}")
+
+
+class JobManager:
+    """Queue of background jobs run on a thread pool"""
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self.handlers: dict[str, JobHandler] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._futures: dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Register the handler running jobs of a kind"""
+        self.handlers[kind] = handler
+
+    @staticmethod
+    def dedupe_key(kind: str, parameters: dict, data: bytes | None = None) -> str:
+        """Key shared by jobs doing the same work"""
+        digest = hashlib.sha256()
+        digest.update(kind.encode("utf-8"))
+        digest.update(json.dumps(parameters, sort_keys=True, default=str).encode("utf-8"))
+        if data is not None:
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def submit(self, session: Session, kind: str, parameters: dict, data: bytes | None = None) -> Job:
+        """Queue a job, or return the identical pending or running job"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        dedupe_key = self.dedupe_key(kind, parameters, data)
+        with self._lock:
+            existing = session.exec(
+                select(Job)
+                .where(Job.dedupe_key == dedupe_key)
+                .where(Job.status.in_(ACTIVE_STATUSES))
+                .order_by(Job.id)
+            ).first()
+            if existing:
+                return existing
+
+            job = Job(
+                kind=kind,
+                dedupe_key=dedupe_key,
+                parameters=json.dumps(parameters, default=str),
+                data=data,
+            )
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+        self._schedule(session.get_bind(), job.id)
+        return job
+
+    def _schedule(self, engine, job_id: int) -> None:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="niceams-job")
+            future = self._executor.submit(self._run, engine, job_id)
+            self._futures[job_id] = future
+        # Outside the lock, as the callback runs at once if the job already finished
+        future.add_done_callback(lambda done: self._forget(job_id, done))
+
+    def _forget(self, job_id: int, future: Future) -> None:
+        with self._lock:
+            if self._futures.get(job_id) is future:
+                del self._futures[job_id]
+
+    def _run(self, engine, job_id: int) -> None:
+        with Session(engine) as session:
+            # Claim the job, so that it runs once even if it was queued twice
+            claimed = session.exec(
+                update(Job)
+                .where(Job.id == job_id)
+                .where(Job.status == "pending")
+                .values(status="running", started_at=utcnow())
+            )
+            session.commit()
+            if claimed.rowcount != 1:
+                return
+
+            job = session.get(Job, job_id)
+            progress = JobProgress(engine, job_id)
+            status, result, error = "succeeded", None, None
+            try:
+                handler = self.handlers[job.kind]
+                result = json.dumps(handler(session, json.loads(job.parameters), job.data, progress), default=str)
+            except Exception as e:
+                logger.exception(f"Job {job_id} ({job.kind}) failed")
+                session.rollback()
+                status, error = "failed", str(e)
+
+            progress.flush()
+            session.exec(
+                update(Job)
+                .where(Job.id == job_id)
+                .values(status=status, result=result, error=error, data=None, finished_at=utcnow())
+            )
+            session.commit()
+
+    def resume(self, engine) -> int:
+        """Queue the jobs left pending or running by a previous process"""
+        with Session(engine) as session:
+            session.exec(update(Job).where(Job.status == "running").values(status="pending", started_at=None))
+            session.commit()
+            job_ids = session.exec(select(Job.id).where(Job.status == "pending").order_by(Job.id)).all()
+        for job_id in job_ids:
+            self._schedule(engine, job_id)
+        if job_ids:
+            logger.info(f"Resumed {len(job_ids)} background jobs")
+        return len(job_ids)
+
+    def wait(self, job_id: int, timeout: float | None = None) -> None:
+        """Block until a job scheduled by this process finished
+
+        Finished jobs are forgotten, so waiting for them returns at once.
+        """
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=not wait)
+                self._executor = None
+            self._futures.clear()
+
+
+def job_to_dict(job: Job, include_result: bool = True) -> dict:
+    """The API representation of a job"""
+    data = {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "parameters": json.loads(job.parameters),
+        "progress": {
+            "current": job.progress_current,
+            "total": job.progress_total,
+            "message": job.progress_message,
+        },
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data["result"] = json.loads(job.result) if job.result is not None else None
+    return data
+
+
+manager = JobManager()
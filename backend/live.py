@@ -0,0 +1,332 @@
+"""
+Live portfolio valuation pushed to subscribers.
+
+A LivePortfolio holds the current holdings of a portfolio in memory, loaded once
+by a full replay when its first subscriber connects. Each price received by the
+intraday feed only revalues the positions of that asset, in the portfolios that
+hold it, and updates the totals incrementally. Changes are numbered and kept in
+a bounded change log.
+
+Subscribers are woken at most once per burst and read the changes since the
+version they last sent, so a slow client skips intermediate prices instead of
+queueing them, and the work per price update does not depend on the number of
+positions. After a write request, each live portfolio compares the count and last
+id of its transactions with those it was loaded from, and only portfolios whose
+ledger changed replay it again.
+
+Example:
+    subscriber = await hub.subscribe(portfolio_id, engine)
+    try:
+        async for message in hub.stream(subscriber, engine):
+            await websocket.send_json(message)
+    finally:
+        hub.unsubscribe(subscriber)
+"""
+
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+from backend import caching, realtime
+from backend.models import Asset, Transaction
+from backend.realtime import LatestPrice
+
+# Changes kept per portfolio; subscribers further behind get a new snapshot
+CHANGE_LOG_SIZE = 1024
+
+
+@dataclass
+class LivePosition:
+    asset_id: int
+    symbol: str
+    quantity: float
+    rate: float  # Exchange rate to the primary currency
+    price: float | None
+    pnl_base: float  # total_pnl - market_value, so that total_pnl follows the price
+    market_value: float = 0.0
+    total_pnl: float = 0.0
+
+    def revalue(self, price: float | None) -> None:
+        self.price = price
+        self.market_value = self.quantity * price * self.rate if price is not None else 0.0
+        self.total_pnl = self.pnl_base + self.market_value
+
+    def to_dict(self) -> dict:
+        return {
+            "asset_id": self.asset_id,
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "price": self.price,
+            "market_value_primary": self.market_value,
+            "total_pnl_primary": self.total_pnl,
+        }
+
+
+class LivePortfolio:
+    """In-memory holdings of a portfolio, revalued one asset at a time"""
+
+    def __init__(self, portfolio_id: int, positions: dict[int, LivePosition], ledger: tuple, generation: int):
+        self.portfolio_id = portfolio_id
+        self.positions = positions
+        self.ledger = ledger  # Ledger version the holdings were replayed from
+        self.generation = generation  # Write generation the ledger version was last checked at
+        self.version = 0
+        self.changes: deque[tuple[int, int]] = deque(maxlen=CHANGE_LOG_SIZE)  # (version, asset_id)
+        self.total_market_value = sum(position.market_value for position in positions.values())
+        self.total_pnl = sum(position.total_pnl for position in positions.values())
+        self.subscribers: set["Subscriber"] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def ledger_version(session: Session, portfolio_id: int) -> tuple:
+        """Number and last id of the transactions of a portfolio"""
+        return tuple(session.exec(
+            select(func.count(Transaction.id), func.max(Transaction.id)).where(Transaction.portfolio_id == portfolio_id)
+        ).one())
+
+    @classmethod
+    def load(cls, session: Session, portfolio_id: int, generation: int) -> "LivePortfolio":
+        """Replay the ledger up to today, valuing positions at the latest prices"""
+        from backend.services import CurrencyService, PositionService
+
+        today = date.today()
+        ledger = cls.ledger_version(session, portfolio_id)
+        replayed = PositionService(session).update_positions_for_period(
+            portfolio_id=portfolio_id, start_date=date(1982, 1, 1), end_date=today, save_to_db=False
+        )
+        assets = {
+            asset.id: asset
+            for asset in session.exec(select(Asset).where(Asset.id.in_(list(replayed)))).all()
+        }
+        currency_service = CurrencyService(session)
+        rates = {}
+        positions = {}
+        for asset_id, position in replayed.items():
+            asset = assets[asset_id]
+            if asset.currency_id not in rates:
+                rates[asset.currency_id] = float(currency_service.get_exchange_rate(asset.currency_id, today))
+            market_value = float(position.market_value or 0)
+            live_position = LivePosition(
+                asset_id=asset_id,
+                symbol=asset.symbol,
+                quantity=float(position.quantity),
+                rate=rates[asset.currency_id],
+                price=float(position.current_price) if position.current_price is not None else None,
+                pnl_base=(float(position.total_pnl or 0) - market_value) * rates[asset.currency_id],
+            )
+            live_position.revalue(live_position.price)
+            positions[asset_id] = live_position
+        return cls(portfolio_id, positions, ledger, generation)
+
+    def apply_price(self, asset_id: int, price: float) -> bool:
+        """Revalue the position of an asset. Returns whether the portfolio changed."""
+        position = self.positions.get(asset_id)
+        if position is None or position.price == price:
+            return False
+        with self._lock:
+            self.total_market_value -= position.market_value
+            self.total_pnl -= position.total_pnl
+            position.revalue(price)
+            self.total_market_value += position.market_value
+            self.total_pnl += position.total_pnl
+            self.version += 1
+            self.changes.append((self.version, asset_id))
+        return True
+
+    def totals(self) -> dict:
+        return {
+            "total_market_value_primary": self.total_market_value,
+            "total_pnl_primary": self.total_pnl,
+            "position_count": len(self.positions),
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "type": "snapshot",
+                "portfolio_id": self.portfolio_id,
+                "version": self.version,
+                "positions": [position.to_dict() for position in self.positions.values()],
+                **self.totals(),
+            }
+
+    def delta_since(self, version: int) -> dict | None:
+        """The positions changed after version, or None when the change log no longer reaches back"""
+        with self._lock:
+            if self.version == version:
+                return {
+                    "type": "delta", "portfolio_id": self.portfolio_id, "version": version, "positions": [],
+                    **self.totals(),
+                }
+            if not self.changes or self.changes[0][0] > version + 1:
+                return None
+            changed_asset_ids = []
+            for change_version, asset_id in reversed(self.changes):
+                if change_version <= version:
+                    break
+                if asset_id not in changed_asset_ids:
+                    changed_asset_ids.append(asset_id)
+            return {
+                "type": "delta",
+                "portfolio_id": self.portfolio_id,
+                "version": self.version,
+                "positions": [self.positions[asset_id].to_dict() for asset_id in reversed(changed_asset_ids)],
+                **self.totals(),
+            }
+
+
+class Subscriber:
+    """A client of a live portfolio, woken on its own event loop"""
+
+    def __init__(self, portfolio: LivePortfolio):
+        self.portfolio = portfolio
+        self.version = -1
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self._wake_pending = False
+
+    def wake(self) -> None:
+        """Thread-safe; a burst of calls schedules a single wake-up"""
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self.loop.call_soon_threadsafe(self._set)
+            except RuntimeError:
+                # The loop of a disconnected client is closed
+                pass
+
+    def _set(self) -> None:
+        self._wake_pending = False
+        self.changed.set()
+
+
+class LiveValuationHub:
+    """Live portfolios with subscribers, revalued by the prices of the intraday feed"""
+
+    def __init__(self):
+        self.portfolios: dict[int, LivePortfolio] = {}
+        self._portfolios_by_asset: dict[int, set[int]] = {}
+        self._table = None
+        self._loading: set[int] = set()
+        self._lock = threading.Lock()
+
+    def _listen(self) -> None:
+        # The feed may be replaced (tests do), so follow the current one
+        if self._table is not realtime.feed.table:
+            if self._table is not None:
+                self._table.remove_listener(self.on_price)
+            self._table = realtime.feed.table
+            self._table.add_listener(self.on_price)
+
+    def on_price(self, latest: LatestPrice) -> None:
+        """Revalue the portfolios holding the asset and wake their subscribers"""
+        with self._lock:
+            portfolio_ids = tuple(self._portfolios_by_asset.get(latest.asset_id, ()))
+        for portfolio_id in portfolio_ids:
+            portfolio = self.portfolios.get(portfolio_id)
+            if portfolio is not None and portfolio.apply_price(latest.asset_id, float(latest.price)):
+                for subscriber in list(portfolio.subscribers):
+                    subscriber.wake()
+
+    def wake_all(self) -> None:
+        """Wake every subscriber, e.g. so that they notice a write and check their ledger"""
+        with self._lock:
+            subscribers = [subscriber for portfolio in self.portfolios.values() for subscriber in portfolio.subscribers]
+        for subscriber in subscribers:
+            subscriber.wake()
+
+    async def _load(self, portfolio_id: int, engine) -> LivePortfolio:
+        def load():
+            with Session(engine) as session:
+                return LivePortfolio.load(session, portfolio_id, caching.current_generation())
+
+        with self._lock:
+            self._loading.add(portfolio_id)
+        try:
+            portfolio = await run_in_threadpool(load)
+        finally:
+            with self._lock:
+                self._loading.discard(portfolio_id)
+        with self._lock:
+            previous = self.portfolios.get(portfolio_id)
+            if previous is not None:
+                portfolio.subscribers = previous.subscribers
+                for subscriber in portfolio.subscribers:
+                    subscriber.portfolio = portfolio
+                    subscriber.version = -1
+            self.portfolios[portfolio_id] = portfolio
+            for asset_ids in self._portfolios_by_asset.values():
+                asset_ids.discard(portfolio_id)
+            for asset_id in portfolio.positions:
+                self._portfolios_by_asset.setdefault(asset_id, set()).add(portfolio_id)
+        self._listen()
+        # Subscribers of the previous holdings start again with a snapshot
+        for subscriber in list(portfolio.subscribers):
+            subscriber.wake()
+        return portfolio
+
+    async def _check_ledger(self, portfolio: LivePortfolio, engine) -> LivePortfolio:
+        """Reload a portfolio whose transactions changed since its holdings were replayed"""
+        generation = caching.current_generation()
+
+        def ledger_version():
+            with Session(engine) as session:
+                return LivePortfolio.ledger_version(session, portfolio.portfolio_id)
+
+        if await run_in_threadpool(ledger_version) != portfolio.ledger:
+            return await self._load(portfolio.portfolio_id, engine)
+        portfolio.generation = generation
+        return portfolio
+
+    async def subscribe(self, portfolio_id: int, engine) -> Subscriber:
+        portfolio = self.portfolios.get(portfolio_id)
+        if portfolio is None:
+            portfolio = await self._load(portfolio_id, engine)
+        subscriber = Subscriber(portfolio)
+        with self._lock:
+            subscriber.portfolio.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Remove a subscriber, and the portfolio with its last subscriber"""
+        with self._lock:
+            portfolio = subscriber.portfolio
+            portfolio.subscribers.discard(subscriber)
+            if not portfolio.subscribers and self.portfolios.get(portfolio.portfolio_id) is portfolio:
+                del self.portfolios[portfolio.portfolio_id]
+                for asset_ids in self._portfolios_by_asset.values():
+                    asset_ids.discard(portfolio.portfolio_id)
+
+    async def stream(self, subscriber: Subscriber, engine, min_interval: float = 0.25, heartbeat: float = 15.0):
+        """Yield a snapshot, then deltas at most every min_interval seconds, and heartbeats when idle"""
+        while True:
+            # Cleared before reading, so that a price arriving meanwhile wakes the next wait
+            subscriber.changed.clear()
+            portfolio = subscriber.portfolio
+            if portfolio.generation != caching.current_generation() and portfolio.portfolio_id not in self._loading:
+                # Something was written: replay the holdings again if it was a transaction of this portfolio
+                portfolio = await self._check_ledger(portfolio, engine)
+
+            message = None if subscriber.version < 0 else portfolio.delta_since(subscriber.version)
+            if message is None:
+                message = portfolio.snapshot()
+            if message["version"] != subscriber.version:
+                subscriber.version = message["version"]
+                yield message
+                # Bursts of prices arriving meanwhile are sent as one delta
+                await asyncio.sleep(min_interval)
+                continue
+
+            try:
+                await asyncio.wait_for(subscriber.changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield {"type": "heartbeat", "portfolio_id": portfolio.portfolio_id, "version": subscriber.version}
+
+
+hub = LiveValuationHub()
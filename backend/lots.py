@@ -0,0 +1,450 @@
+"""
+Tax-lot accounting with FIFO, LIFO and specific-ID matching.
+
+Positions only keep an average cost, so they cannot tell which purchase a sale
+closed. Here every buy opens a lot and every sell closes lots in the order of
+the matching method, realizing the gain of each closed part:
+
+- fifo: the oldest open lots first
+- lifo: the newest open lots first
+- specific: the lots listed in the notes of the sell transaction, e.g.
+  "lots=3,5" (lot ids as reported by /portfolios/{id}/lots), then FIFO for the rest
+
+The open lots of an asset are parallel arrays (LotQueue) rather than objects or
+rows per lot, so ledgers with tens of thousands of partial fills replay in one
+pass with little memory. The state is saved as a LotSnapshot at every year end
+crossed by a replay, so later queries replay from the nearest checkpoint. A
+snapshot records the number of transactions and the last transaction id up to
+its date, and is discarded when the ledger no longer matches.
+
+Amounts are in the currency of the transactions. Lots use float64 quantities and
+costs; quantities below LOT_EPSILON are treated as closed.
+"""
+
+import json
+import re
+from array import array
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from backend import instrumentation, logger
+from backend.models import Asset, LotSnapshot, Transaction, utcnow
+
+LOT_METHODS = ("fifo", "lifo", "specific")
+LOT_EPSILON = 1e-9
+# Holding period from which a realized gain is long term
+LONG_TERM_DAYS = 365
+
+_LOT_IDS_PATTERN = re.compile(r"\blots\s*=\s*([\d,\s]+)")
+
+
+def validate_method(method: str) -> None:
+    if method not in LOT_METHODS:
+        raise ValueError(f"Invalid lot method: {method}. Must be one of {', '.join(LOT_METHODS)}")
+
+
+def parse_lot_ids(notes: str | None) -> list[int]:
+    """Lot ids selected by the notes of a sell transaction, e.g. "lots=3,5" """
+    match = _LOT_IDS_PATTERN.search(notes or "")
+    if not match:
+        return []
+    return [int(lot_id) for lot_id in match.group(1).replace(" ", "").split(",") if lot_id]
+
+
+@dataclass(frozen=True)
+class RealizedLot:
+    """The part of a lot closed by a sale"""
+    asset_id: int
+    lot_id: int | None  # None for quantity sold beyond the open lots
+    acquired_date: date | None
+    sell_date: date
+    quantity: float
+    proceeds: float
+    cost_basis: float
+
+    @property
+    def gain(self) -> float:
+        return self.proceeds - self.cost_basis
+
+    @property
+    def holding_days(self) -> int | None:
+        return (self.sell_date - self.acquired_date).days if self.acquired_date else None
+
+    @property
+    def term(self) -> str:
+        return "long" if (self.holding_days or 0) >= LONG_TERM_DAYS else "short"
+
+
+class LotQueue:
+    """Open lots of one asset in acquisition order, as parallel arrays.
+
+    Closed lots keep their slot with a zero quantity until the queue is compacted,
+    and the head skips the closed lots at the front, so FIFO sales are O(1) per
+    closed lot.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.dates = array("l")  # date.toordinal()
+        self.quantities = array("d")
+        self.unit_costs = array("d")
+        self.head = 0
+        self.next_id = 1
+
+    def add(self, acquired_date: date, quantity: float, unit_cost: float, lot_id: int | None = None) -> int:
+        if lot_id is None:
+            lot_id = self.next_id
+        self.next_id = max(self.next_id, lot_id + 1)
+        self.ids.append(lot_id)
+        self.dates.append(acquired_date.toordinal())
+        self.quantities.append(quantity)
+        self.unit_costs.append(unit_cost)
+        return lot_id
+
+    def _take(self, index: int, quantity: float) -> tuple[int, int, float, float]:
+        taken = min(quantity, self.quantities[index])
+        self.quantities[index] -= taken
+        if self.quantities[index] <= LOT_EPSILON:
+            self.quantities[index] = 0.0
+        return self.ids[index], self.dates[index], taken, self.unit_costs[index]
+
+    def remove(self, quantity: float, method: str, lot_ids: list[int] | None = None) -> list[tuple]:
+        """Close quantity from the open lots.
+
+        Returns:
+            A list of (lot_id, acquired ordinal, quantity, unit_cost) of the closed parts.
+            Their quantities add up to less than quantity when the lots run out.
+        """
+        closed = []
+        remaining = quantity
+        if method == "specific" and lot_ids:
+            for lot_id in lot_ids:
+                if remaining <= LOT_EPSILON:
+                    break
+                for index in range(self.head, len(self.ids)):
+                    if self.ids[index] == lot_id and self.quantities[index] > LOT_EPSILON:
+                        closed.append(self._take(index, remaining))
+                        remaining -= closed[-1][2]
+                        break
+
+        if method == "lifo":
+            indexes = range(len(self.ids) - 1, self.head - 1, -1)
+        else:
+            indexes = range(self.head, len(self.ids))
+        for index in indexes:
+            if remaining <= LOT_EPSILON:
+                break
+            if self.quantities[index] > LOT_EPSILON:
+                closed.append(self._take(index, remaining))
+                remaining -= closed[-1][2]
+
+        self._trim()
+        return closed
+
+    def split(self, ratio: float) -> None:
+        for index in range(self.head, len(self.ids)):
+            self.quantities[index] *= ratio
+            self.unit_costs[index] /= ratio
+
+    def _trim(self) -> None:
+        """Skip closed lots at both ends and compact the arrays once mostly closed"""
+        while self.head < len(self.ids) and self.quantities[self.head] <= LOT_EPSILON:
+            self.head += 1
+        while len(self.ids) > self.head and self.quantities[-1] <= LOT_EPSILON:
+            for column in (self.ids, self.dates, self.quantities, self.unit_costs):
+                column.pop()
+        if self.head > 64 and self.head * 2 > len(self.ids):
+            keep = [index for index in range(self.head, len(self.ids)) if self.quantities[index] > LOT_EPSILON]
+            self.ids = array("q", (self.ids[index] for index in keep))
+            self.dates = array("l", (self.dates[index] for index in keep))
+            self.quantities = array("d", (self.quantities[index] for index in keep))
+            self.unit_costs = array("d", (self.unit_costs[index] for index in keep))
+            self.head = 0
+
+    def open_lots(self) -> list[tuple[int, date, float, float]]:
+        """(lot_id, acquired_date, quantity, unit_cost) of the open lots"""
+        return [
+            (self.ids[index], date.fromordinal(self.dates[index]), self.quantities[index], self.unit_costs[index])
+            for index in range(self.head, len(self.ids))
+            if self.quantities[index] > LOT_EPSILON
+        ]
+
+    def to_dict(self) -> dict:
+        lots = self.open_lots()
+        return {
+            "next_id": self.next_id,
+            "ids": [lot[0] for lot in lots],
+            "dates": [lot[1].toordinal() for lot in lots],
+            "quantities": [lot[2] for lot in lots],
+            "unit_costs": [lot[3] for lot in lots],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LotQueue":
+        queue = cls()
+        queue.ids = array("q", data["ids"])
+        queue.dates = array("l", data["dates"])
+        queue.quantities = array("d", data["quantities"])
+        queue.unit_costs = array("d", data["unit_costs"])
+        queue.next_id = data["next_id"]
+        return queue
+
+
+class LotEngine:
+    """Replays a ledger into open lots per asset and the gains realized by sales"""
+
+    def __init__(self, method: str = "fifo"):
+        validate_method(method)
+        self.method = method
+        self.queues: dict[int, LotQueue] = {}
+        self.realized: list[RealizedLot] = []
+        # Sales before this date close lots without recording the realized gains
+        self.realized_from: date | None = None
+
+    def apply(self, transaction) -> None:
+        """Apply a Transaction, or a row with its columns, in ledger order"""
+        action = transaction.action
+        if action not in ("buy", "sell", "split") or not transaction.quantity:
+            return
+        quantity = float(transaction.quantity)
+        fees = float(transaction.fees or 0)
+        queue = self.queues.get(transaction.asset_id)
+        if queue is None:
+            queue = self.queues[transaction.asset_id] = LotQueue()
+
+        if action == "buy":
+            queue.add(transaction.trade_date, quantity, (float(transaction.amount) + fees) / quantity)
+        elif action == "split":
+            queue.split(quantity)
+        else:
+            lot_ids = parse_lot_ids(transaction.notes) if self.method == "specific" else None
+            closed = queue.remove(quantity, self.method, lot_ids)
+            if self.realized_from is not None and transaction.trade_date < self.realized_from:
+                return
+            proceeds_per_unit = (float(transaction.amount) - fees) / quantity
+            unmatched = quantity - sum(part[2] for part in closed)
+            for lot_id, acquired, closed_quantity, unit_cost in closed:
+                self.realized.append(RealizedLot(
+                    asset_id=transaction.asset_id,
+                    lot_id=lot_id,
+                    acquired_date=date.fromordinal(acquired),
+                    sell_date=transaction.trade_date,
+                    quantity=closed_quantity,
+                    proceeds=closed_quantity * proceeds_per_unit,
+                    cost_basis=closed_quantity * unit_cost,
+                ))
+            if unmatched > LOT_EPSILON:
+                logger.warning(
+                    f"Sale of {quantity} of asset {transaction.asset_id} on {transaction.trade_date} "
+                    f"exceeds the open lots by {unmatched}"
+                )
+                self.realized.append(RealizedLot(
+                    asset_id=transaction.asset_id,
+                    lot_id=None,
+                    acquired_date=None,
+                    sell_date=transaction.trade_date,
+                    quantity=unmatched,
+                    proceeds=unmatched * proceeds_per_unit,
+                    cost_basis=0.0,
+                ))
+
+    def open_lots(self) -> list[tuple[int, int, date, float, float]]:
+        """(asset_id, lot_id, acquired_date, quantity, unit_cost) of all open lots"""
+        return [
+            (asset_id, *lot)
+            for asset_id, queue in sorted(self.queues.items())
+            for lot in queue.open_lots()
+        ]
+
+    def to_json(self) -> str:
+        return json.dumps({str(asset_id): queue.to_dict() for asset_id, queue in self.queues.items()})
+
+    @classmethod
+    def from_json(cls, method: str, data: str) -> "LotEngine":
+        engine = cls(method)
+        engine.queues = {int(asset_id): LotQueue.from_dict(queue) for asset_id, queue in json.loads(data).items()}
+        return engine
+
+
+class LotService:
+    """Service for tax lots and realized gains, replayed from year end checkpoints"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _ledger_fingerprint(self, portfolio_id: int, on_date: date) -> tuple[int, int | None]:
+        """Number of transactions and last transaction id up to on_date"""
+        return self.session.exec(
+            select(func.count(Transaction.id), func.max(Transaction.id))
+            .where(Transaction.portfolio_id == portfolio_id)
+            .where(Transaction.trade_date <= on_date)
+        ).one()
+
+    def _latest_snapshot(self, portfolio_id: int, method: str, on_date: date) -> LotSnapshot | None:
+        """The latest snapshot on or before on_date still matching the ledger"""
+        snapshot = self.session.exec(
+            select(LotSnapshot)
+            .where(LotSnapshot.portfolio_id == portfolio_id)
+            .where(LotSnapshot.method == method)
+            .where(LotSnapshot.snapshot_date <= on_date)
+            .order_by(LotSnapshot.snapshot_date.desc())
+        ).first()
+        while snapshot is not None:
+            stale_date = snapshot.snapshot_date
+            count, last_id = self._ledger_fingerprint(portfolio_id, stale_date)
+            if (count, last_id) == (snapshot.transaction_count, snapshot.last_transaction_id):
+                return snapshot
+            # Transactions were added or removed before the snapshot: it and all later ones are stale
+            self.session.exec(
+                delete(LotSnapshot)
+                .where(LotSnapshot.portfolio_id == portfolio_id)
+                .where(LotSnapshot.snapshot_date >= stale_date)
+            )
+            self.session.commit()
+            snapshot = self.session.exec(
+                select(LotSnapshot)
+                .where(LotSnapshot.portfolio_id == portfolio_id)
+                .where(LotSnapshot.method == method)
+                .where(LotSnapshot.snapshot_date < stale_date)
+                .order_by(LotSnapshot.snapshot_date.desc())
+            ).first()
+        return None
+
+    def _save_snapshot(self, portfolio_id: int, engine: LotEngine, snapshot_date: date) -> None:
+        count, last_id = self._ledger_fingerprint(portfolio_id, snapshot_date)
+        # A snapshot saved meanwhile by an earlier or concurrent replay is kept
+        self.session.exec(
+            sqlite_insert(LotSnapshot)
+            .values(
+                portfolio_id=portfolio_id,
+                method=engine.method,
+                snapshot_date=snapshot_date,
+                transaction_count=count,
+                last_transaction_id=last_id,
+                lots=engine.to_json(),
+                created_at=utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=["portfolio_id", "method", "snapshot_date"])
+        )
+        self.session.commit()
+
+    def replay(
+        self, portfolio_id: int, end_date: date, method: str = "fifo", realized_from: date | None = None
+    ) -> LotEngine:
+        """
+        The lots of a portfolio after the transactions up to end_date.
+        The replay starts from the nearest valid snapshot, before realized_from when
+        given so that the gains realized from that date are recorded, and saves a
+        snapshot at each year end it crosses.
+        """
+        validate_method(method)
+        start_limit = realized_from - timedelta(days=1) if realized_from else end_date
+        with instrumentation.stage("load_ledger"):
+            snapshot = self._latest_snapshot(portfolio_id, method, start_limit)
+        if snapshot is not None:
+            engine = LotEngine.from_json(method, snapshot.lots)
+            checkpoint_date = snapshot.snapshot_date
+        else:
+            engine = LotEngine(method)
+            checkpoint_date = None
+        engine.realized_from = realized_from
+
+        statement = (
+            select(
+                Transaction.trade_date,
+                Transaction.action,
+                Transaction.asset_id,
+                Transaction.quantity,
+                Transaction.amount,
+                Transaction.fees,
+                Transaction.notes,
+            )
+            .where(Transaction.portfolio_id == portfolio_id)
+            .where(Transaction.action.in_(("buy", "sell", "split")))
+            .where(Transaction.trade_date <= end_date)
+            .order_by(Transaction.trade_date, Transaction.id)
+        )
+        if checkpoint_date is not None:
+            statement = statement.where(Transaction.trade_date > checkpoint_date)
+        with instrumentation.stage("load_ledger"):
+            transactions = self.session.exec(statement).all()
+
+        today = date.today()
+        with instrumentation.stage("replay"):
+            for transaction in transactions:
+                year_end = date(transaction.trade_date.year - 1, 12, 31)
+                if checkpoint_date is None or year_end > checkpoint_date:
+                    if checkpoint_date is not None or engine.queues:
+                        self._save_snapshot(portfolio_id, engine, year_end)
+                    checkpoint_date = year_end
+                engine.apply(transaction)
+
+        # The last year end covered by the replay
+        year_end = end_date if (end_date.month, end_date.day) == (12, 31) else date(end_date.year - 1, 12, 31)
+        if engine.queues and year_end < today and (checkpoint_date is None or year_end > checkpoint_date):
+            self._save_snapshot(portfolio_id, engine, year_end)
+        return engine
+
+    def get_lots(self, portfolio_id: int, as_of_date: date, method: str = "fifo") -> list[dict]:
+        """Open lots on as_of_date with their unrealized gains at the latest prices"""
+        from backend.services import PriceService
+
+        open_lots = self.replay(portfolio_id, as_of_date, method).open_lots()
+        asset_ids = sorted({lot[0] for lot in open_lots})
+        symbols = dict(self.session.exec(select(Asset.id, Asset.symbol).where(Asset.id.in_(asset_ids))).all())
+        price_service = PriceService(self.session)
+        prices = {}
+        for asset_id in asset_ids:
+            price = price_service.get_latest_price(asset_id, as_of_date)
+            prices[asset_id] = float(price.price) if price else None
+
+        lots = []
+        for asset_id, lot_id, acquired_date, quantity, unit_cost in open_lots:
+            price = prices[asset_id]
+            market_value = quantity * price if price is not None else None
+            lots.append({
+                "asset_id": asset_id,
+                "symbol": symbols.get(asset_id),
+                "lot_id": lot_id,
+                "acquired_date": acquired_date.isoformat(),
+                "quantity": quantity,
+                "unit_cost": unit_cost,
+                "cost_basis": quantity * unit_cost,
+                "current_price": price,
+                "market_value": market_value,
+                "unrealized_gain": market_value - quantity * unit_cost if market_value is not None else None,
+                "holding_days": (as_of_date - acquired_date).days,
+            })
+        return lots
+
+    def get_realized_gains(self, portfolio_id: int, year: int, method: str = "fifo") -> dict:
+        """Gains realized by the sales of a calendar year, per closed lot"""
+        engine = self.replay(portfolio_id, date(year, 12, 31), method, realized_from=date(year, 1, 1))
+        asset_ids = sorted({realized.asset_id for realized in engine.realized})
+        symbols = dict(self.session.exec(select(Asset.id, Asset.symbol).where(Asset.id.in_(asset_ids))).all())
+        sales = [
+            {
+                "asset_id": realized.asset_id,
+                "symbol": symbols.get(realized.asset_id),
+                "lot_id": realized.lot_id,
+                "acquired_date": realized.acquired_date.isoformat() if realized.acquired_date else None,
+                "sell_date": realized.sell_date.isoformat(),
+                "quantity": realized.quantity,
+                "proceeds": realized.proceeds,
+                "cost_basis": realized.cost_basis,
+                "gain": realized.gain,
+                "holding_days": realized.holding_days,
+                "term": realized.term,
+            }
+            for realized in engine.realized
+        ]
+        return {
+            "total_gain": sum(sale["gain"] for sale in sales),
+            "short_term_gain": sum(sale["gain"] for sale in sales if sale["term"] == "short"),
+            "long_term_gain": sum(sale["gain"] for sale in sales if sale["term"] == "long"),
+            "sales": sales,
+        }
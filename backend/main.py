@@ -1,27 +1,51 @@
-import pandas as pd
+import asyncio
 import io
-import numpy as np
-import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+import json
+import math
+import re
+import time
+from typing import TYPE_CHECKING, Literal
+from fastapi import (
+    FastAPI, HTTPException, Depends, UploadFile, File, Request, Query, WebSocket, WebSocketDisconnect,
+    WebSocketException, status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlmodel import Session, select
+from sqlalchemy import Float, cast
 from datetime import datetime, date, timedelta, timezone
 from decimal import Decimal
 from contextlib import asynccontextmanager
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from backend.models import (
     Currency,
     ExchangeRate,
     Asset,
     Transaction,
     Price,
+    CorporateAction,
     Portfolio,
-    Position,
     Settings,
+    Job,
+    PortfolioGroup,
+    PortfolioGroupMember,
+    get_engine,
     get_session,
     create_db_and_tables,
 )
-from backend.services import PortfolioService, PositionService, CurrencyService
+from backend.services import (
+    PortfolioService,
+    PositionService,
+    CurrencyService,
+    DailyValueService,
+    PortfolioGroupService,
+)
+from backend import caching, corporate_actions, instrumentation, interchange, jobs, live, lots, realtime, streaming
+
+# pandas is slow to import and only needed by the CSV endpoints, so it is imported
+# inside them to keep the cold start of the API fast.
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 # Response models for API endpoints
@@ -48,7 +72,7 @@ class TransactionResponse(BaseModel):
     currency: CurrencyResponse | None
 
 class PositionResponse(BaseModel):
-    id: int
+    id: int | None  # None for positions resolved in memory
     portfolio_id: int
     asset_id: int
     symbol: str
@@ -78,14 +102,103 @@ class SettingsResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class BatchNavRequest(BaseModel):
+    portfolio_ids: list[int] | None = None  # None means all portfolios
+    start_date: date
+    end_date: date
+    numeric_mode: Literal["decimal", "float"] = "decimal"
+
+class PortfolioGroupRequest(BaseModel):
+    name: str
+    description: str | None = None
+    portfolio_ids: list[int] = []
+
+class CorporateActionRequest(BaseModel):
+    asset_id: int
+    ex_date: date
+    action_type: Literal["split", "dividend"]
+    ratio: Decimal | None = None  # Shares after a split per share before
+    amount: Decimal | None = None  # Dividend per share
+    notes: str | None = None
+
+class ShockRequest(BaseModel):
+    target: Literal["asset", "type", "sector", "currency"]
+    key: str  # Symbol, asset type, sector or currency code
+    change: float  # Relative change, e.g. -0.2 for a fall of 20%
+
+class ScenarioRequest(BaseModel):
+    name: str
+    shocks: list[ShockRequest] = []
+
+class HistoricalScenarioRequest(BaseModel):
+    name: str
+    start_date: date | None = None  # Defaults to the window of the scenario library
+    end_date: date | None = None
+
+class StressTestRequest(BaseModel):
+    as_of_date: date | None = None  # Defaults to today
+    scenarios: list[ScenarioRequest] = []
+    historical: list[HistoricalScenarioRequest] = []
+    include_library: bool = False  # Replay every scenario of the library too
+
+class WeightBoundsRequest(BaseModel):
+    min_weight: float = 0.0
+    max_weight: float = 1.0
+
+class OptimizeRequest(BaseModel):
+    as_of_date: date | None = None  # Defaults to today
+    objective: str = "min_variance"  # min_variance, max_sharpe or risk_parity
+    bounds: dict[str, WeightBoundsRequest] = {}  # Weight bounds of each asset of a type
+    asset_ids: list[int] = []  # Assets to consider besides the holdings
+    cash_weight: float | None = None  # Defaults to the current share of cash
+    allow_fx: bool = True
+    method: str = "ledoit_wolf"
+    window: int = Field(250, ge=2)
+
+class BacktestVariantRequest(BaseModel):
+    name: str
+    weights: dict[int, float] | None = None  # Target weight per asset id, defaults to the backtest weights
+    rule: str = "periodic"  # none, periodic or threshold
+    frequency: str = "monthly"  # daily, weekly, monthly, quarterly or yearly
+    threshold: float = 0.05  # Largest drift of a weight before a threshold rebalance
+    fee_rate: float = 0.0
+
+class BacktestRequest(BaseModel):
+    start_date: date
+    end_date: date
+    initial_cash: Decimal = Decimal("1000000")  # In primary currency
+    weights: dict[int, float] = {}
+    variants: list[BacktestVariantRequest]
+    workers: int = Field(1, ge=1, le=32)
+    numeric_mode: Literal["decimal", "float"] = "decimal"
+
+class TickRequest(BaseModel):
+    symbol: str
+    price: Decimal
+    timestamp: datetime | None = None  # Defaults to the time the tick is received
+
+    def to_tick(self) -> realtime.Tick:
+        if self.timestamp is None:
+            return realtime.Tick(self.symbol, self.price)
+        return realtime.Tick(self.symbol, self.price, self.timestamp)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan manager for the FastAPI application."""
     create_db_and_tables()
+    # Queue the background jobs interrupted by the last shutdown
+    jobs.manager.resume(get_engine())
+    realtime.feed.bind(get_engine())
+    realtime.start_replay_from_environment(get_engine())
     yield
+    jobs.manager.shutdown(wait=False)
+    # Persist the closes of the day received so far
+    realtime.feed.flush()
 
 app = FastAPI(title="Portfolio Tracker API", version="1.0.0", lifespan=lifespan)
 
+instrumentation.configure_from_environment()
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -93,7 +206,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Server-Timing", "ETag"],
+)
+
+# Write routes that leave the database unchanged: price ticks only update memory
+# and batch NAV series, stress tests, optimizations and backtests are calculations
+# too large for a query string
+UNVERSIONED_WRITES = (
+    "/prices/ticks",
+    "/portfolios/nav-batch",
+    "/portfolios/{portfolio_id}/stress-test",
+    "/portfolios/{portfolio_id}/optimize",
+    "/backtests/",
 )
+_unversioned_paths = re.compile("|".join(
+    re.escape(route).replace(re.escape("{portfolio_id}"), r"\d+") for route in UNVERSIONED_WRITES
+))
+
+@app.middleware("http")
+async def write_generation_middleware(request: Request, call_next):
+    """Invalidate the ETags of the portfolio endpoints around every write request"""
+    if request.method in caching.SAFE_METHODS or _unversioned_paths.fullmatch(request.url.path):
+        return await call_next(request)
+    caching.bump_generation()
+    try:
+        return await call_next(request)
+    finally:
+        caching.bump_generation()
+        # Live valuation subscribers reload their holdings
+        live.hub.wake_all()
+
+@app.middleware("http")
+async def instrumentation_middleware(request: Request, call_next):
+    """Collect per-request metrics and add the X-Server-Timing header when enabled"""
+    if not instrumentation.is_enabled():
+        return await call_next(request)
+
+    metrics, token = instrumentation.begin_request()
+    try:
+        response = await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        instrumentation.end_request(metrics, token, route.path if route else "unmatched")
+    if instrumentation.server_timing_enabled():
+        response.headers["X-Server-Timing"] = metrics.server_timing()
+    return response
 
 # Currency endpoints
 @app.get("/currencies/", response_model=list[Currency])
@@ -131,6 +288,7 @@ def create_exchange_rate(rate: ExchangeRate, session: Session = Depends(get_sess
     session.add(rate)
     session.commit()
     session.refresh(rate)
+    DailyValueService(session).invalidate(rate.rate_date)
     return rate
 
 # Asset endpoints
@@ -193,6 +351,52 @@ def delete_asset(asset_id: int, session: Session = Depends(get_session)):
     session.commit()
     return {"message": "Asset deleted successfully"}
 
+@app.get("/assets/{asset_id}/prices")
+def get_asset_prices(
+    asset_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    adjust: str = "none",
+    session: Session = Depends(get_session),
+):
+    """Get the closes of an asset with the closes adjusted for splits (adjust=split)
+    or for splits and reinvested dividends (adjust=total_return)"""
+    asset = session.get(Asset, asset_id)
+    if not asset:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    try:
+        prices = corporate_actions.CorporateActionService(session).get_adjusted_prices(
+            asset_id, start_date, end_date, adjust
+        )
+        return {"asset_id": asset_id, "symbol": asset.symbol, "adjust": adjust, "prices": prices}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error getting prices: {str(e)}")
+
+# Corporate action endpoints
+@app.get("/corporate-actions/", response_model=list[CorporateAction])
+def get_corporate_actions(asset_id: int | None = None, session: Session = Depends(get_session)):
+    """Get the splits and dividends of all assets or of one asset"""
+    return corporate_actions.CorporateActionService(session).get_actions(asset_id)
+
+@app.post("/corporate-actions/", response_model=CorporateAction)
+def create_corporate_action(request: CorporateActionRequest, session: Session = Depends(get_session)):
+    """Record a split or a dividend; adjusted price series of the asset are rebuilt on their next read"""
+    try:
+        return corporate_actions.CorporateActionService(session).create_action(**request.model_dump())
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=f"Error creating corporate action: {str(e)}")
+
+@app.delete("/corporate-actions/{action_id}")
+def delete_corporate_action(action_id: int, session: Session = Depends(get_session)):
+    """Delete a corporate action"""
+    action = session.get(CorporateAction, action_id)
+    if not action:
+        raise HTTPException(status_code=404, detail="Corporate action not found")
+    session.delete(action)
+    session.commit()
+    return {"message": "Corporate action deleted successfully"}
+
 # Transaction endpoints
 @app.get("/transactions/", response_model=list[TransactionResponse])
 def get_transactions(portfolio_id: int | None = None, session: Session = Depends(get_session)):
@@ -257,9 +461,77 @@ def create_transaction(transaction: Transaction, session: Session = Depends(get_
     session.add(transaction)
     session.commit()
     session.refresh(transaction)
+    DailyValueService(session).invalidate(transaction.trade_date, transaction.portfolio_id)
+    PositionService(session).invalidate(transaction.trade_date, transaction.portfolio_id)
         
     return transaction
 
+def _streaming_export(rows, columns: list[tuple[str, str]], export_format: str, filename: str) -> StreamingResponse:
+    """Stream rows as an attachment in the requested export format"""
+    return StreamingResponse(
+        streaming.encode_rows(rows, columns, export_format),
+        media_type=streaming.MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{streaming.FILE_EXTENSIONS[export_format]}"'
+        },
+    )
+
+LEDGER_EXPORT_COLUMNS = [
+    ("id", "int"),
+    ("portfolio_id", "int"),
+    ("trade_date", "date"),
+    ("action", "str"),
+    ("symbol", "str"),
+    ("quantity", "decimal"),
+    ("price", "decimal"),
+    ("amount", "decimal"),
+    ("fees", "decimal"),
+    ("currency", "str"),
+    ("notes", "str"),
+]
+
+@app.get("/transactions/export")
+def export_transactions(
+    portfolio_id: int | None = None,
+    export_format: str = Query("ndjson", alias="format"),
+    session: Session = Depends(get_session),
+):
+    """Stream the transaction ledger as NDJSON, CSV or Arrow IPC"""
+    try:
+        streaming.validate_export_format(export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The response outlives the request session, so the rows are read with a session of their own
+    engine = session.get_bind()
+
+    def ledger_rows():
+        with Session(engine) as stream_session:
+            statement = (
+                select(
+                    Transaction.id,
+                    Transaction.portfolio_id,
+                    Transaction.trade_date,
+                    Transaction.action,
+                    Asset.symbol,
+                    Transaction.quantity,
+                    Transaction.price,
+                    Transaction.amount,
+                    Transaction.fees,
+                    Currency.code,
+                    Transaction.notes,
+                )
+                .join(Asset, Transaction.asset_id == Asset.id)
+                .join(Currency, Transaction.currency_id == Currency.id)
+                .order_by(Transaction.trade_date, Transaction.id)
+                .execution_options(yield_per=streaming.DEFAULT_BATCH_SIZE)
+            )
+            if portfolio_id is not None:
+                statement = statement.where(Transaction.portfolio_id == portfolio_id)
+            yield from stream_session.exec(statement)
+
+    return _streaming_export(ledger_rows(), LEDGER_EXPORT_COLUMNS, export_format, "transactions")
+
 @app.get("/transactions/{transaction_id}", response_model=Transaction)
 def get_transaction(transaction_id: int, session: Session = Depends(get_session)):
     """Get a specific transaction"""
@@ -268,8 +540,14 @@ def get_transaction(transaction_id: int, session: Session = Depends(get_session)
         raise HTTPException(status_code=404, detail="Transaction not found")
     return transaction
 
-def _import_transactions_from_dataframe(df: pd.DataFrame, session: Session) -> list[Transaction]:
-    """Core logic for importing transactions from a pandas DataFrame"""
+def _import_transactions_from_dataframe(
+    df: "pd.DataFrame", session: Session, progress=None, portfolio_id: int | None = None
+) -> list[Transaction]:
+    """Core logic for importing transactions from a pandas DataFrame into a portfolio,
+    by default the first portfolio.
+    progress is an optional callable(current, total, message) reporting the rows processed."""
+    import pandas as pd
+
     # Validate required columns
     required_columns = ['trade_date', 'action', 'amount']
     missing_columns = [col for col in required_columns if col not in df.columns]
@@ -277,61 +555,28 @@ def _import_transactions_from_dataframe(df: pd.DataFrame, session: Session) -> l
         raise ValueError(f"Missing required columns: {missing_columns}")
     
     transactions = []
+    portfolio = interchange.resolve_import_portfolio(session, portfolio_id)
     
     # Get all currencies for mapping
     currencies = session.exec(select(Currency)).all()
     currency_map = {curr.code: curr.id for curr in currencies}
     
-    for _, row in df.iterrows():
+    for index, (_, row) in enumerate(df.iterrows(), start=1):
+        if progress and index % 100 == 0:
+            progress(index, len(df), "rows processed")
         asset = None
         currency_id = 1  # Default to CNY
         
         # Handle symbol and asset lookup
         if 'symbol' in row and pd.notna(row['symbol']):
-            symbol = str(row['symbol']).strip()
-            
-            # Check if this is a cash transaction with currency code
-            if row['action'] in ['cash_in', 'cash_out', 'interest', 'tax'] and symbol in currency_map:
-                # Convert currency code to cash asset symbol
-                symbol = f"{symbol}_CASH"
-                currency_id = currency_map[str(row['symbol']).strip()]
-            
-            # Look up asset by symbol
-            asset = session.exec(select(Asset).where(Asset.symbol == symbol)).first()
-            
-            if not asset:
-                # Determine asset type and currency
-                if symbol.endswith('_CASH'):
-                    type = 'cash'
-                    curr_code = symbol.replace('_CASH', '')
-                    currency_id = currency_map.get(curr_code, 1)
-                elif symbol.endswith('.SH') or symbol.endswith('.SZ'):
-                    type = 'stock'
-                    currency_id = currency_map.get('CNY', 1)
-                elif symbol in ['AAPL', 'GOOGL', 'MSFT', 'TSLA']:  # US stocks
-                    type = 'stock'
-                    currency_id = currency_map.get('USD', 1)
-                elif 'ETF' in str(row.get('name', '')).upper():
-                    type = 'etf'
-                    currency_id = currency_map.get('CNY', 1)
-                else:
-                    type = 'stock'  # Default
-                    currency_id = currency_map.get('CNY', 1)
-                
-                # Create new asset
-                asset = Asset(
-                    symbol=symbol,
-                    name=row.get('name', symbol),
-                    isin=row.get('isin'),
-                    type=type,
-                    currency_id=currency_id
-                )
-                session.add(asset)
-                session.commit()
-                session.refresh(asset)
-            else:
-                # Use the asset's currency
-                currency_id = asset.currency_id
+            asset, currency_id = interchange.resolve_import_asset(
+                session,
+                str(row['symbol']).strip(),
+                row['action'],
+                row['name'] if 'name' in row and pd.notna(row['name']) else None,
+                row['isin'] if 'isin' in row and pd.notna(row['isin']) else None,
+                currency_map,
+            )
         
         # Handle quantity for cash transactions
         quantity = None
@@ -349,11 +594,6 @@ def _import_transactions_from_dataframe(df: pd.DataFrame, session: Session) -> l
                 # Cash assets always have a price of 1.0
                 price = Decimal('1.0')
         
-        # Get the first portfolio (or create logic to determine which portfolio)
-        portfolio = session.exec(select(Portfolio)).first()
-        if not portfolio:
-            raise ValueError("No portfolio available. Please create a portfolio first.")
-        
         # Create transaction
         transaction = Transaction(
             portfolio_id=portfolio.id,
@@ -371,63 +611,331 @@ def _import_transactions_from_dataframe(df: pd.DataFrame, session: Session) -> l
     
     return transactions
 
+def _accepted_job(job: Job) -> JSONResponse:
+    """202 response pointing to a background job"""
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+            "events_url": f"/jobs/{job.id}/events",
+        },
+    )
+
+def _run_transactions_import(
+    session: Session, contents: bytes, progress=None, portfolio_id: int | None = None
+) -> dict:
+    """Import a transactions CSV file"""
+    import pandas as pd
+
+    df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+    
+    transactions = _import_transactions_from_dataframe(df, session, progress, portfolio_id)
+    
+    session.add_all(transactions)
+    session.commit()
+    if progress:
+        progress(len(df), len(df), "rows processed")
+
+    # Recalculate the daily values from the earliest imported trade of each portfolio
+    first_trade_dates = {}
+    for transaction in transactions:
+        first_trade_dates[transaction.portfolio_id] = min(
+            transaction.trade_date, first_trade_dates.get(transaction.portfolio_id, transaction.trade_date)
+        )
+    daily_value_service = DailyValueService(session)
+    position_service = PositionService(session)
+    for portfolio_id, first_trade_date in first_trade_dates.items():
+        daily_value_service.invalidate(first_trade_date, portfolio_id)
+        position_service.invalidate(first_trade_date, portfolio_id)
+            
+    return {"message": f"Successfully imported {len(transactions)} transactions"}
+
+def _run_prices_import(session: Session, contents: bytes, progress=None) -> dict:
+    """Import a prices CSV file"""
+    import pandas as pd
+
+    df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+    
+    # Validate required columns
+    required_columns = ['symbol', 'price_date', 'price']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+    
+    prices = []
+    for index, (_, row) in enumerate(df.iterrows(), start=1):
+        if progress and index % 100 == 0:
+            progress(index, len(df), "rows processed")
+        # Find asset
+        asset = session.exec(select(Asset).where(Asset.symbol == row['symbol'])).first()
+        if not asset:
+            continue  # Skip if asset not found
+        
+        # Create price
+        price = Price(
+            asset_id=asset.id,
+            price_date=pd.to_datetime(row['price_date']).date(),
+            price=Decimal(str(row['price'])),
+            price_type='historical',
+            source='csv_import'
+        )
+        prices.append(price)
+    
+    session.add_all(prices)
+    session.commit()
+    if progress:
+        progress(len(df), len(df), "rows processed")
+    if prices:
+        DailyValueService(session).invalidate(min(price.price_date for price in prices))
+    
+    return {"message": f"Successfully imported {len(prices)} prices"}
+
 # CSV Import endpoints
 @app.post("/import/transactions/")
-async def import_transactions(file: UploadFile = File(...), session: Session = Depends(get_session)):
-    """Import transactions from CSV file"""
+async def import_transactions(
+    file: UploadFile = File(...),
+    portfolio_id: int | None = None,
+    background: bool = False,
+    session: Session = Depends(get_session),
+):
+    """Import transactions from CSV file into a portfolio, by default the first portfolio,
+    or queue the import as a job when background is true"""
     try:
         contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        
-        transactions = _import_transactions_from_dataframe(df, session)
-        
-        session.add_all(transactions)
-        session.commit()
-                
-        return {"message": f"Successfully imported {len(transactions)} transactions"}
+        if background:
+            return _accepted_job(jobs.manager.submit(
+                session,
+                "import_transactions",
+                {"filename": file.filename, "portfolio_id": portfolio_id},
+                data=contents,
+            ))
+        return _run_transactions_import(session, contents, portfolio_id=portfolio_id)
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error importing CSV: {str(e)}")
 
 @app.post("/import/prices/")
-async def import_prices(file: UploadFile = File(...), session: Session = Depends(get_session)):
-    """Import prices from CSV file"""
+async def import_prices(
+    file: UploadFile = File(...), background: bool = False, session: Session = Depends(get_session)
+):
+    """Import prices from CSV file, or queue the import as a job when background is true"""
     try:
         contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        
-        # Validate required columns
-        required_columns = ['symbol', 'price_date', 'price']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise HTTPException(status_code=400, detail=f"Missing required columns: {missing_columns}")
-        
-        prices = []
-        for _, row in df.iterrows():
-            # Find asset
-            asset = session.exec(select(Asset).where(Asset.symbol == row['symbol'])).first()
-            if not asset:
-                continue  # Skip if asset not found
-            
-            # Create price
-            price = Price(
-                asset_id=asset.id,
-                price_date=pd.to_datetime(row['price_date']).date(),
-                price=Decimal(str(row['price'])),
-                price_type='historical',
-                source='csv_import'
-            )
-            prices.append(price)
-        
-        session.add_all(prices)
-        session.commit()
-        
-        return {"message": f"Successfully imported {len(prices)} prices"}
+        if background:
+            return _accepted_job(jobs.manager.submit(
+                session, "import_prices", {"filename": file.filename}, data=contents
+            ))
+        return _run_prices_import(session, contents)
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error importing CSV: {str(e)}")
 
+# Arrow / Parquet bulk interchange endpoints
+def _read_bulk_table(contents: bytes, file_format: str):
+    streaming.validate_export_format(file_format)
+    if file_format not in interchange.IMPORT_FORMATS:
+        raise ValueError(f"Invalid import format: {file_format}. Must be one of {', '.join(interchange.IMPORT_FORMATS)}")
+    return interchange.read_table(contents, file_format)
+
+@app.post("/import/transactions/bulk")
+async def import_transactions_bulk(
+    file: UploadFile = File(...),
+    file_format: str = Query("parquet", alias="format"),
+    portfolio_id: int | None = None,
+    session: Session = Depends(get_session),
+):
+    """Import transactions from an Arrow IPC or Parquet file with the columns of the transactions CSV
+    into a portfolio, by default the first portfolio"""
+    try:
+        table = _read_bulk_table(await file.read(), file_format)
+        portfolio = interchange.resolve_import_portfolio(session, portfolio_id)
+        count, first_trade_date = interchange.import_transactions_table(table, session, portfolio.id)
+        if first_trade_date is not None:
+            DailyValueService(session).invalidate(first_trade_date, portfolio.id)
+            PositionService(session).invalidate(first_trade_date, portfolio.id)
+        return {"message": f"Successfully imported {count} transactions"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error importing {file_format}: {str(e)}")
+
+@app.post("/import/prices/bulk")
+async def import_prices_bulk(
+    file: UploadFile = File(...),
+    file_format: str = Query("parquet", alias="format"),
+    session: Session = Depends(get_session),
+):
+    """Upsert prices from an Arrow IPC or Parquet file with symbol, price_date and price columns"""
+    try:
+        table = _read_bulk_table(await file.read(), file_format)
+        count, first_price_date = interchange.import_prices_table(table, session)
+        if first_price_date is not None:
+            DailyValueService(session).invalidate(first_price_date)
+        return {"message": f"Successfully imported {count} prices"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error importing {file_format}: {str(e)}")
+
+PRICE_EXPORT_COLUMNS = {
+    "symbol": (Asset.symbol, "category"),
+    "price_date": (Price.price_date, "date"),
+    "price": (cast(Price.price, Float), "float"),
+    "price_type": (Price.price_type, "category"),
+    "source": (Price.source, "category"),
+}
+
+@app.get("/prices/export")
+def export_prices(
+    start_date: date | None = None,
+    end_date: date | None = None,
+    symbols: str | None = None,
+    columns: str = "symbol,price_date,price",
+    export_format: str = Query("parquet", alias="format"),
+    session: Session = Depends(get_session),
+):
+    """Stream price history filtered by date range and symbols (comma separated),
+    with only the requested columns (comma separated)"""
+    selected_columns = [column.strip() for column in columns.split(",") if column.strip()]
+    unknown_columns = [column for column in selected_columns if column not in PRICE_EXPORT_COLUMNS]
+    if unknown_columns or not selected_columns:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid columns: {unknown_columns}. Must be some of {', '.join(PRICE_EXPORT_COLUMNS)}",
+        )
+    try:
+        streaming.validate_export_format(export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Only the requested columns are read, and the filters run in SQL
+    statement = select(*[PRICE_EXPORT_COLUMNS[column][0] for column in selected_columns]).select_from(Price)
+    if "symbol" in selected_columns or symbols:
+        statement = statement.join(Asset, Price.asset_id == Asset.id)
+    if symbols:
+        statement = statement.where(Asset.symbol.in_([symbol.strip() for symbol in symbols.split(",")]))
+    if start_date:
+        statement = statement.where(Price.price_date >= start_date)
+    if end_date:
+        statement = statement.where(Price.price_date <= end_date)
+    statement = statement.order_by(Price.asset_id, Price.price_date).execution_options(
+        yield_per=streaming.DEFAULT_BATCH_SIZE
+    )
+
+    engine = session.get_bind()
+
+    def price_rows():
+        with Session(engine) as stream_session:
+            yield from stream_session.exec(statement)
+
+    return _streaming_export(
+        price_rows(),
+        [(column, PRICE_EXPORT_COLUMNS[column][1]) for column in selected_columns],
+        export_format,
+        "prices",
+    )
+
+# Real-time price feed endpoints
+@app.post("/prices/ticks")
+def ingest_price_ticks(ticks: list[TickRequest], session: Session = Depends(get_session)):
+    """Apply intraday price ticks to the in-memory latest-price table"""
+    applied, unknown_symbols = realtime.feed.ingest([tick.to_tick() for tick in ticks], session)
+    return {"accepted": applied, "unknown_symbols": unknown_symbols}
+
+@app.websocket("/prices/ticks/ws")
+async def ingest_price_ticks_ws(websocket: WebSocket, session: Session = Depends(get_session)):
+    """Receive ticks as JSON messages (one tick or a list) and acknowledge each message"""
+    await websocket.accept()
+    engine = session.get_bind()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                ticks = [TickRequest.model_validate(tick).to_tick() for tick in (
+                    message if isinstance(message, list) else [message]
+                )]
+                with Session(engine) as tick_session:
+                    applied, unknown_symbols = realtime.feed.ingest(ticks, tick_session)
+                await websocket.send_json({"accepted": applied, "unknown_symbols": unknown_symbols})
+            except ValueError as e:
+                await websocket.send_json({"error": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/prices/latest")
+def get_latest_prices(symbols: str | None = None, session: Session = Depends(get_session)):
+    """Get the latest prices received by the feed, for all or some (comma separated) symbols"""
+    statement = select(Asset.id, Asset.symbol)
+    if symbols:
+        statement = statement.where(Asset.symbol.in_([symbol.strip() for symbol in symbols.split(",")]))
+    latest_prices = realtime.feed.table.snapshot()
+    return [
+        {
+            "symbol": symbol,
+            "asset_id": asset_id,
+            "price": float(latest_prices[asset_id].price),
+            "timestamp": latest_prices[asset_id].timestamp.isoformat(),
+        }
+        for asset_id, symbol in session.exec(statement).all()
+        if asset_id in latest_prices
+    ]
+
+@app.post("/prices/feed/flush")
+def flush_price_feed(session: Session = Depends(get_session)):
+    """Write the closes received by the feed to the price table now"""
+    return {"flushed": realtime.feed.flush(session)}
+
 # Portfolio endpoints
+@app.get("/portfolios/{portfolio_id}/live")
+async def stream_live_valuation(
+    portfolio_id: int, min_interval: float = Query(0.25, ge=0.05), session: Session = Depends(get_session)
+):
+    """Stream the live valuation of a portfolio as server-sent events: a snapshot of all
+    positions, then deltas of the positions revalued by new prices, at most every min_interval seconds"""
+    if not session.get(Portfolio, portfolio_id):
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    engine = session.get_bind()
+    subscriber = await live.hub.subscribe(portfolio_id, engine)
+
+    async def valuation_events():
+        try:
+            async for message in live.hub.stream(subscriber, engine, min_interval):
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n".encode("utf-8")
+        finally:
+            live.hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        valuation_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+@app.websocket("/portfolios/{portfolio_id}/live/ws")
+async def live_valuation_ws(
+    websocket: WebSocket,
+    portfolio_id: int,
+    min_interval: float = Query(0.25, ge=0.05),
+    session: Session = Depends(get_session),
+):
+    """Send the live valuation of a portfolio as JSON messages, like /portfolios/{portfolio_id}/live"""
+    if not session.get(Portfolio, portfolio_id):
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Portfolio not found")
+    await websocket.accept()
+    engine = session.get_bind()
+    subscriber = await live.hub.subscribe(portfolio_id, engine)
+
+    async def send_valuations():
+        async for message in live.hub.stream(subscriber, engine, min_interval):
+            await websocket.send_json(message)
+
+    async def wait_for_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_valuations()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        live.hub.unsubscribe(subscriber)
+
 @app.get("/portfolios/", response_model=list[Portfolio])
 def get_portfolios(session: Session = Depends(get_session)):
     """Get all portfolios"""
@@ -442,20 +950,73 @@ def create_portfolio(portfolio: Portfolio, session: Session = Depends(get_sessio
     session.refresh(portfolio)
     return portfolio
 
+@app.post("/portfolios/nav-batch")
+def get_batch_nav_series(request: BatchNavRequest, session: Session = Depends(get_session)):
+    """Get the NAV series of many portfolios, sharing one market data snapshot"""
+    if request.start_date > request.end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be later than end_date")
+
+    portfolio_service = PortfolioService(session)
+    results = portfolio_service.batch_nav_series(
+        request.portfolio_ids, request.start_date, request.end_date, numeric_mode=request.numeric_mode
+    )
+    return [
+        {
+            "portfolio_id": portfolio_id,
+            "twr": result["twr"],
+            "annualized_return": result["annualized_return"],
+            "history": [
+                {"date": nav_date.isoformat(), "value": value, "nav": nav}
+                for nav_date, value, nav in zip(result["dates"], result["values"], result["nav_history"])
+            ],
+        }
+        for portfolio_id, result in results.items()
+    ]
+
+@app.post("/backtests/")
+def run_backtests(request: BacktestRequest, session: Session = Depends(get_session)):
+    """Replay periodic and threshold rebalancing of target weights on the stored prices and
+    exchange rates, and get the NAV series and statistics of every variant. Nothing is recorded."""
+    from backend import backtest
+
+    try:
+        strategies = [
+            backtest.Strategy(
+                name=variant.name,
+                weights=variant.weights if variant.weights is not None else request.weights,
+                rule=variant.rule,
+                frequency=variant.frequency,
+                threshold=variant.threshold,
+                fee_rate=variant.fee_rate,
+            )
+            for variant in request.variants
+        ]
+        return backtest.BacktestService(session).run(
+            strategies, request.start_date, request.end_date, initial_cash=request.initial_cash,
+            workers=request.workers, numeric_mode=request.numeric_mode,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error running backtest: {str(e)}")
+
 @app.get("/portfolios/{portfolio_id}/positions")
-def get_portfolio_positions(portfolio_id: int, as_of_date: str | None = None, session: Session = Depends(get_session)):
-    """Get portfolio positions for a specific date or latest positions"""
+@caching.coalesce
+def get_portfolio_positions(
+    portfolio_id: int,
+    as_of_date: str | None = None,
+    write_back: bool = False,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get portfolio positions for a specific date or latest positions.
+    Dates without stored positions are resolved from the nearest earlier snapshot,
+    and saved as a snapshot when write_back is true."""
     try:
         position_service = PositionService(session)
         
         if as_of_date:
             # Parse the date string
             target_date = datetime.strptime(as_of_date, "%Y-%m-%d").date()
-            positions = session.exec(
-                select(Position)
-                .where(Position.portfolio_id == portfolio_id)
-                .where(Position.position_date == target_date)
-            ).all()
+            positions = position_service.get_positions_as_of(portfolio_id, target_date, write_back)
         else:
             # Get latest positions
             positions = position_service.get_latest_positions(portfolio_id)
@@ -500,8 +1061,17 @@ def get_portfolio_positions(portfolio_id: int, as_of_date: str | None = None, se
         raise HTTPException(status_code=400, detail=f"Error retrieving positions: {str(e)}")
 
 @app.get("/portfolios/{portfolio_id}/summary", response_model=PortfolioSummaryResponse)
-def get_portfolio_summary(portfolio_id: int, as_of_date: str | None = None, session: Session = Depends(get_session)):
-    """Get portfolio summary with total market value and total P&L converted to primary currency"""
+@caching.coalesce
+def get_portfolio_summary(
+    portfolio_id: int,
+    as_of_date: str | None = None,
+    write_back: bool | None = None,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get portfolio summary with total market value and total P&L converted to primary currency.
+    Positions are resolved from the nearest earlier snapshot. They are saved as a snapshot when
+    write_back is true, which defaults to true for today only, keeping the latest positions current."""
     try:
         # Initialize services
         currency_service = CurrencyService(session)
@@ -517,19 +1087,9 @@ def get_portfolio_summary(portfolio_id: int, as_of_date: str | None = None, sess
             target_date = date.today()
         
         # Get positions for the target date
-        positions = session.exec(
-                select(Position)
-                .where(Position.portfolio_id == portfolio_id)
-                .where(Position.position_date == target_date)
-        ).all()
-        if not positions: # Recalculate positions
-            positions_dict = position_service.update_positions_for_period(
-                portfolio_id=portfolio_id,
-                start_date=date(1982, 1, 1),
-                end_date=target_date,
-                save_to_db=True,
-            )
-            positions = list(positions_dict.values())
+        if write_back is None:
+            write_back = not as_of_date
+        positions = position_service.get_positions_as_of(portfolio_id, target_date, write_back)
         
         # Calculate totals converted to primary currency
         total_market_value_primary = Decimal('0')
@@ -568,11 +1128,12 @@ def get_portfolio_summary(portfolio_id: int, as_of_date: str | None = None, sess
 
 
 @app.get("/portfolios/{portfolio_id}/recent-returns")
-def get_recent_returns(portfolio_id: int, session: Session = Depends(get_session)):
+@caching.coalesce
+def get_recent_returns(
+    portfolio_id: int, session: Session = Depends(get_session), etag: str = Depends(caching.portfolio_etag)
+):
     """Get recent returns for a portfolio (1 month, 3 months, 6 months, 1 year, and since inception)"""
     try:
-        portfolio_service = PortfolioService(session)
-        
         # Get all transactions for the portfolio
         transactions = session.exec(
             select(Transaction)
@@ -587,8 +1148,8 @@ def get_recent_returns(portfolio_id: int, session: Session = Depends(get_session
         inception_date = transactions[0].trade_date
         current_date = date.today()
         
-        # Calculate TWR data for the full period
-        twr_result = portfolio_service.twr(portfolio_id, inception_date, current_date)
+        # Read the NAV series since inception from the materialized daily values
+        twr_result = DailyValueService(session).twr(portfolio_id, inception_date, current_date)
         nav_data = {date_val: nav for date_val, nav in zip(twr_result["dates"], twr_result["nav_history"])}
         
         # Define periods to calculate
@@ -629,7 +1190,14 @@ def get_recent_returns(portfolio_id: int, session: Session = Depends(get_session
         raise HTTPException(status_code=400, detail=f"Error calculating recent returns: {str(e)}")
 
 @app.get("/portfolios/{portfolio_id}/allocation")
-def get_portfolio_allocation(portfolio_id: int, as_of_date: str | None = None, by: str = 'type', session: Session = Depends(get_session)):
+@caching.coalesce
+def get_portfolio_allocation(
+    portfolio_id: int,
+    as_of_date: str | None = None,
+    by: str = 'type',
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
     """Get portfolio asset allocation"""
     try:
         portfolio_service = PortfolioService(session)
@@ -663,16 +1231,19 @@ def safe_round(value, decimals=2):
     try:
         if value is None:
             return 0.0
-        # Convert to float and ensure it's real
+        # Convert to float and ensure it's finite
         val = float(value)
-        if np.iscomplex(val) or np.isnan(val) or np.isinf(val):
+        if math.isnan(val) or math.isinf(val):
             return 0.0
-        return round(float(np.real(val)), decimals)
+        return round(val, decimals)
     except (TypeError, ValueError, AttributeError):
         return 0.0
 
 @app.get("/portfolios/{portfolio_id}/performance-metrics")
-def get_performance_metrics(portfolio_id: int, session: Session = Depends(get_session)):
+@caching.coalesce
+def get_performance_metrics(
+    portfolio_id: int, session: Session = Depends(get_session), etag: str = Depends(caching.portfolio_etag)
+):
     """Get portfolio performance metrics"""
     try:
         portfolio_service = PortfolioService(session)
@@ -699,8 +1270,11 @@ def get_performance_metrics(portfolio_id: int, session: Session = Depends(get_se
         start_date = transactions[0].trade_date
         end_date = date.today()
         
-        # Calculate portfolio statistics
-        stats = portfolio_service.calculate_portfolio_statistics(portfolio_id, start_date, end_date)
+        # Calculate portfolio statistics on the materialized daily values
+        twr_data = DailyValueService(session).twr(portfolio_id, start_date, end_date)
+        stats = portfolio_service.calculate_portfolio_statistics(
+            portfolio_id, start_date, end_date, twr_data=twr_data
+        )
         
         return {
             "total_return": safe_round(stats.get("time_weighted_return", 0), 6),
@@ -732,66 +1306,335 @@ def get_performance_metrics(portfolio_id: int, session: Session = Depends(get_se
             "message": f"Error calculating performance metrics: {str(e)}"
         }
 
+@app.get("/portfolios/{portfolio_id}/irr")
+@caching.coalesce
+def get_money_weighted_returns(
+    portfolio_id: int,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the money-weighted return (XIRR) of the portfolio and of each asset it held,
+    since inception or since start_date, up to end_date (default today)"""
+    end_date = end_date or date.today()
+    if start_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be later than end_date")
+    try:
+        result = PortfolioService(session).money_weighted_returns(portfolio_id, end_date, start_date)
+        symbols = dict(session.exec(
+            select(Asset.id, Asset.symbol).where(Asset.id.in_(list(result["assets"])))
+        ).all())
+        return {
+            "portfolio_id": portfolio_id,
+            "start_date": start_date.isoformat() if start_date else None,
+            "end_date": end_date.isoformat(),
+            "irr": result["irr"],
+            "assets": [
+                {"asset_id": asset_id, "symbol": symbols.get(asset_id), "irr": rate}
+                for asset_id, rate in result["assets"].items()
+            ],
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating money-weighted returns: {str(e)}")
+
+def _split_list(value: str, parse=str) -> list:
+    """Parse a comma separated query parameter"""
+    return [parse(item.strip()) for item in value.split(",") if item.strip()]
+
+@app.get("/portfolios/{portfolio_id}/var")
+@caching.coalesce
+def get_value_at_risk(
+    portfolio_id: int,
+    as_of_date: date | None = None,
+    methods: str = "historical,parametric,monte_carlo",
+    confidence: str = "0.95,0.99",
+    horizons: str = "1,10",
+    window: int = 250,
+    simulations: int = Query(100_000, ge=1000, le=1_000_000),
+    seed: int = 42,
+    workers: int = Query(1, ge=1, le=32),
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the Value-at-Risk and expected shortfall (CVaR) of the holdings on as_of_date (default today)
+    per method, confidence level and horizon in days (comma separated), from the daily returns
+    of the last window price dates. Monte Carlo scenarios are reproducible for a given seed."""
+    from backend import risk
+
+    target_date = as_of_date or date.today()
+    try:
+        return risk.RiskService(session).value_at_risk(
+            portfolio_id,
+            target_date,
+            methods=_split_list(methods),
+            confidence_levels=_split_list(confidence, float),
+            horizons=_split_list(horizons, int),
+            window=window,
+            simulations=simulations,
+            seed=seed,
+            workers=workers,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating value at risk: {str(e)}")
+
+@app.get("/portfolios/{portfolio_id}/correlation")
+@caching.coalesce
+def get_correlation(
+    portfolio_id: int,
+    as_of_date: date | None = None,
+    method: str = "ledoit_wolf",
+    window: int = Query(250, ge=2),
+    decay: float = 0.94,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the correlation and daily covariance of the returns of the holdings on as_of_date
+    (default today) over the last window price dates. method is sample, ewma (with decay)
+    or ledoit_wolf (sample covariance shrunk towards a scaled identity)."""
+    from backend import covariance
+
+    target_date = as_of_date or date.today()
+    try:
+        return covariance.CovarianceService(session).portfolio_correlation(
+            portfolio_id, target_date, window=window, method=method, decay=decay
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating correlation: {str(e)}")
+
+@app.get("/portfolios/{portfolio_id}/risk-decomposition")
+@caching.coalesce
+def get_risk_decomposition(
+    portfolio_id: int,
+    as_of_date: date | None = None,
+    confidence: float = 0.99,
+    horizon: int = 1,
+    method: str = "ledoit_wolf",
+    window: int = Query(250, ge=2),
+    decay: float = 0.94,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the marginal and component contributions of the holdings on as_of_date (default today)
+    to the annualized volatility and the delta-normal VaR of the portfolio, per position and
+    per type, sector and currency, from the covariance of the last window price dates."""
+    from backend import decomposition
+
+    target_date = as_of_date or date.today()
+    try:
+        return decomposition.DecompositionService(session).decomposition(
+            portfolio_id, target_date, confidence=confidence, horizon=horizon,
+            window=window, method=method, decay=decay,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating risk decomposition: {str(e)}")
+
+@app.get("/stress-scenarios/")
+def get_stress_scenarios():
+    """Get the library of historical stress scenarios"""
+    from backend import stress
+
+    return [
+        {"name": name, "start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+        for name, (start_date, end_date) in stress.HISTORICAL_SCENARIOS.items()
+    ]
+
+@app.post("/portfolios/{portfolio_id}/stress-test")
+def run_stress_test(portfolio_id: int, request: StressTestRequest, session: Session = Depends(get_session)):
+    """Revalue the holdings on as_of_date under hypothetical shocks of asset, type, sector
+    and currency, and under historical windows replayed from the stored prices and rates."""
+    from backend import stress
+
+    target_date = request.as_of_date or date.today()
+    try:
+        scenarios = [
+            stress.Scenario(scenario.name, tuple(
+                stress.Shock(shock.target, shock.key, shock.change) for shock in scenario.shocks
+            ))
+            for scenario in request.scenarios
+        ]
+        historical = []
+        for scenario in request.historical:
+            start_date, end_date = stress.HISTORICAL_SCENARIOS.get(scenario.name, (None, None))
+            start_date, end_date = scenario.start_date or start_date, scenario.end_date or end_date
+            if start_date is None or end_date is None:
+                raise ValueError(f"Unknown historical scenario {scenario.name}, give its start_date and end_date")
+            historical.append((scenario.name, start_date, end_date))
+        if request.include_library:
+            historical.extend((name, *window) for name, window in stress.HISTORICAL_SCENARIOS.items())
+        return stress.StressTestService(session).run(portfolio_id, target_date, scenarios, historical)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error running stress test: {str(e)}")
+
+@app.post("/portfolios/{portfolio_id}/optimize")
+def optimize_portfolio(portfolio_id: int, request: OptimizeRequest, session: Session = Depends(get_session)):
+    """Optimize the weights of the holdings and the requested assets on as_of_date for the
+    lowest variance, the highest Sharpe ratio or equal risk contributions, and list the
+    trades and currency exchanges reaching them. Nothing is recorded."""
+    from backend import optimizer
+
+    target_date = request.as_of_date or date.today()
+    try:
+        return optimizer.OptimizerService(session).optimize(
+            portfolio_id,
+            target_date,
+            objective=request.objective,
+            bounds={
+                asset_type: (bound.min_weight, bound.max_weight) for asset_type, bound in request.bounds.items()
+            },
+            asset_ids=request.asset_ids,
+            cash_weight=request.cash_weight,
+            allow_fx=request.allow_fx,
+            window=request.window,
+            method=request.method,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error optimizing portfolio: {str(e)}")
+
+@app.get("/portfolios/{portfolio_id}/lots")
+@caching.coalesce
+def get_tax_lots(
+    portfolio_id: int,
+    as_of_date: date | None = None,
+    method: str = "fifo",
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the open tax lots of a portfolio with their unrealized gains.
+    method is fifo, lifo or specific (lots named by "lots=<id>,..." in the notes of a sale)."""
+    target_date = as_of_date or date.today()
+    try:
+        return {
+            "portfolio_id": portfolio_id,
+            "method": method,
+            "as_of_date": target_date.isoformat(),
+            "lots": lots.LotService(session).get_lots(portfolio_id, target_date, method),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating tax lots: {str(e)}")
+
+@app.get("/portfolios/{portfolio_id}/realized-gains")
+@caching.coalesce
+def get_realized_gains(
+    portfolio_id: int,
+    year: int | None = None,
+    method: str = "fifo",
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the gains realized by the sales of a year (default this year), per closed lot"""
+    year = year or date.today().year
+    try:
+        gains = lots.LotService(session).get_realized_gains(portfolio_id, year, method)
+        return {"portfolio_id": portfolio_id, "method": method, "year": year, **gains}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating realized gains: {str(e)}")
+
+def _run_performance_history(
+    session: Session, portfolio_id: int, start_date: date, end_date: date, progress=None
+) -> list[dict]:
+    """Performance history of a date range, materializing the missing days first"""
+    # The materialized rows start on the first transaction date,
+    # so the series never starts earlier than the first transaction
+    daily_values = DailyValueService(session).get_daily_values(portfolio_id, start_date, end_date, progress)
+    if not daily_values:
+        return []
+    
+    # NAV is rebased to 1.0 on the first day of the range
+    nav_start = float(daily_values[0].nav)
+    return [
+        {
+            "date": daily_value.value_date.isoformat(),
+            "value": float(daily_value.total_value),
+            "nav": float(daily_value.nav) / nav_start,
+        }
+        for daily_value in daily_values
+    ]
+
 @app.get("/portfolios/{portfolio_id}/performance-history")
 def get_performance_history(
     portfolio_id: int, 
     start_date: str,
     end_date: str,
+    background: bool = False,
     session: Session = Depends(get_session)
 ):
-    """Get portfolio performance history for charting"""
+    """Get portfolio performance history for charting.
+    With background=true the missing days are materialized by a job and the history is its result."""
     # Raise exception if either start_date or end_date is null
     if not start_date or not end_date:
         raise HTTPException(status_code=400, detail="Both start_date and end_date are required")
     
     try:
-        portfolio_service = PortfolioService(session)
-        
         # Parse date parameters
         start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
         
-        # Get all transactions to determine actual date range
-        transactions = session.exec(
-            select(Transaction)
-            .where(Transaction.portfolio_id == portfolio_id)
-            .order_by(Transaction.trade_date)
-        ).all()
-        
-        if not transactions:
-            return []
-        
-        # Ensure start_date is not earlier than the first transaction
-        start_date = max(start_date, transactions[0].trade_date)
-        
-        # Generate performance data points with NAV
-        performance_data = []
-        current_date = start_date
-        
-        # Calculate TWR to get NAV data
-        twr_result = portfolio_service.twr(portfolio_id, start_date, end_date)
-        nav_data = {date: nav for date, nav in zip(twr_result["dates"], twr_result["nav_history"])}
-
-        # Calculate value and store the positions for each day 
-        while current_date <= end_date:
-            portfolio_value = portfolio_service.calculate_portfolio_value(portfolio_id, current_date)
-            nav_value = nav_data.get(current_date, 1.0)  # Default to 1.0 if NAV not available
-            
-            performance_data.append({
-                "date": current_date.isoformat(),
-                "value": float(portfolio_value["total_value"]),
-                "nav": float(nav_value)
-            })
-            current_date += timedelta(days=1)
-        
-        return performance_data
+        if background:
+            return _accepted_job(jobs.manager.submit(session, "performance_history", {
+                "portfolio_id": portfolio_id,
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+            }))
+        return _run_performance_history(session, portfolio_id, start_date, end_date)
         
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error calculating performance history: {str(e)}")
 
+PERFORMANCE_EXPORT_COLUMNS = [
+    ("date", "date"),
+    ("value", "float"),
+    ("nav", "float"),
+    ("net_cash_flow", "float"),
+    ("shares", "float"),
+]
+
+@app.get("/portfolios/{portfolio_id}/performance-history/export")
+def export_performance_history(
+    portfolio_id: int,
+    start_date: date,
+    end_date: date,
+    export_format: str = Query("ndjson", alias="format"),
+    session: Session = Depends(get_session),
+):
+    """Stream the daily performance history as NDJSON, CSV or Arrow IPC"""
+    try:
+        streaming.validate_export_format(export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    engine = session.get_bind()
+
+    def history_rows():
+        # Missing days are materialized a chunk at a time while the rows stream
+        with Session(engine) as stream_session:
+            yield from DailyValueService(stream_session).iter_daily_values(portfolio_id, start_date, end_date)
+
+    return _streaming_export(
+        history_rows(), PERFORMANCE_EXPORT_COLUMNS, export_format, f"portfolio_{portfolio_id}_performance"
+    )
+
+def _run_recalculate_positions(session: Session, portfolio_id: int, target_date: date, progress=None) -> dict:
+    """Recalculate and save the positions of a portfolio up to target_date"""
+    position_service = PositionService(session)
+    
+    # Calculate positions for the period up to the target date
+    position_service.update_positions_for_period(
+        portfolio_id=portfolio_id,
+        start_date=date(1982, 1, 1),
+        end_date=target_date,
+        save_to_db=True,
+        progress=progress,
+    )
+    
+    return {"message": f"Successfully recalculated positions up to {target_date.strftime('%Y-%m-%d')} "}
+
 @app.post("/portfolios/{portfolio_id}/recalculate-positions")
-def recalculate_positions(portfolio_id: int, as_of_date: str | None = None, session: Session = Depends(get_session)):
-    """Recalculate positions from existing transactions up to a specific date"""
+def recalculate_positions(
+    portfolio_id: int, as_of_date: str | None = None, background: bool = False, session: Session = Depends(get_session)
+):
+    """Recalculate positions from existing transactions up to a specific date,
+    or queue the recalculation as a job when background is true"""
     try:
         # Parse the date if provided, otherwise use today
         if as_of_date:
@@ -799,22 +1642,234 @@ def recalculate_positions(portfolio_id: int, as_of_date: str | None = None, sess
         else:
             target_date = date.today()
         
-        position_service = PositionService(session)
-        
-        # Calculate positions for the period up to the target date
-        position_service.update_positions_for_period(
-            portfolio_id=portfolio_id,
-            start_date=date(1982, 1, 1),
-            end_date=target_date,
-            save_to_db=True
-        )
-        
-        return {"message": f"Successfully recalculated positions up to {target_date.strftime('%Y-%m-%d')} "}
+        if background:
+            return _accepted_job(jobs.manager.submit(session, "recalculate_positions", {
+                "portfolio_id": portfolio_id,
+                "as_of_date": target_date.isoformat(),
+            }))
+        return _run_recalculate_positions(session, portfolio_id, target_date)
     
     except Exception as e:
         print(e)
         raise HTTPException(status_code=400, detail=f"Error recalculating positions: {str(e)}")
 
+# Portfolio group endpoints
+def _portfolio_group_to_dict(session: Session, group: PortfolioGroup) -> dict:
+    return {
+        "id": group.id,
+        "name": group.name,
+        "description": group.description,
+        "portfolio_ids": PortfolioGroupService(session).get_member_ids(group.id),
+    }
+
+def _get_portfolio_group(session: Session, group_id: int) -> PortfolioGroup:
+    group = session.get(PortfolioGroup, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Portfolio group not found")
+    return group
+
+def _set_group_members(session: Session, group: PortfolioGroup, portfolio_ids: list[int]):
+    portfolio_ids = sorted(set(portfolio_ids))
+    existing_ids = set(session.exec(select(Portfolio.id).where(Portfolio.id.in_(portfolio_ids))).all())
+    missing_ids = [portfolio_id for portfolio_id in portfolio_ids if portfolio_id not in existing_ids]
+    if missing_ids:
+        raise HTTPException(status_code=400, detail=f"Portfolios not found: {missing_ids}")
+    for member in session.exec(select(PortfolioGroupMember).where(PortfolioGroupMember.group_id == group.id)).all():
+        session.delete(member)
+    session.flush()
+    session.add_all([
+        PortfolioGroupMember(group_id=group.id, portfolio_id=portfolio_id) for portfolio_id in portfolio_ids
+    ])
+
+@app.get("/portfolio-groups/")
+def get_portfolio_groups(session: Session = Depends(get_session)):
+    """Get all portfolio groups with their member portfolios"""
+    groups = session.exec(select(PortfolioGroup).order_by(PortfolioGroup.id)).all()
+    return [_portfolio_group_to_dict(session, group) for group in groups]
+
+@app.post("/portfolio-groups/")
+def create_portfolio_group(request: PortfolioGroupRequest, session: Session = Depends(get_session)):
+    """Create a portfolio group, e.g. the portfolios of a household"""
+    group = PortfolioGroup(name=request.name, description=request.description)
+    session.add(group)
+    session.flush()
+    _set_group_members(session, group, request.portfolio_ids)
+    session.commit()
+    session.refresh(group)
+    return _portfolio_group_to_dict(session, group)
+
+@app.get("/portfolio-groups/{group_id}")
+def get_portfolio_group(group_id: int, session: Session = Depends(get_session)):
+    """Get a portfolio group"""
+    return _portfolio_group_to_dict(session, _get_portfolio_group(session, group_id))
+
+@app.put("/portfolio-groups/{group_id}")
+def update_portfolio_group(group_id: int, request: PortfolioGroupRequest, session: Session = Depends(get_session)):
+    """Update a portfolio group, replacing its member portfolios"""
+    group = _get_portfolio_group(session, group_id)
+    group.name = request.name
+    group.description = request.description
+    _set_group_members(session, group, request.portfolio_ids)
+    session.commit()
+    session.refresh(group)
+    return _portfolio_group_to_dict(session, group)
+
+@app.delete("/portfolio-groups/{group_id}")
+def delete_portfolio_group(group_id: int, session: Session = Depends(get_session)):
+    """Delete a portfolio group. Its member portfolios are kept."""
+    group = _get_portfolio_group(session, group_id)
+    _set_group_members(session, group, [])
+    session.delete(group)
+    session.commit()
+    return {"message": "Portfolio group deleted successfully"}
+
+@app.get("/portfolio-groups/{group_id}/summary")
+@caching.coalesce
+def get_portfolio_group_summary(
+    group_id: int,
+    as_of_date: date | None = None,
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the consolidated holdings, market value, P&L and net contributions of all member
+    portfolios, replaying their merged ledger once"""
+    _get_portfolio_group(session, group_id)
+    try:
+        primary_currency = CurrencyService(session).get_primary_currency()
+        summary = PortfolioGroupService(session).get_summary(group_id, as_of_date or date.today())
+        return summary | {
+            "primary_currency_code": primary_currency.code,
+            "primary_currency_symbol": primary_currency.symbol,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating portfolio group summary: {str(e)}")
+
+@app.get("/portfolio-groups/{group_id}/allocation")
+@caching.coalesce
+def get_portfolio_group_allocation(
+    group_id: int,
+    as_of_date: date | None = None,
+    by: str = 'type',
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the asset allocation of the consolidated holdings of all member portfolios"""
+    _get_portfolio_group(session, group_id)
+    try:
+        target_date = as_of_date or date.today()
+        allocation = PortfolioGroupService(session).get_asset_allocation(group_id, target_date, by=by)
+        return {
+            "asset_allocation": allocation["allocation_pct"],
+            "total_value": allocation["total_value"],
+            "calculation_date": target_date.isoformat(),
+            "group_id": group_id,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating portfolio group allocation: {str(e)}")
+
+@app.get("/portfolio-groups/{group_id}/performance")
+@caching.coalesce
+def get_portfolio_group_performance(
+    group_id: int,
+    start_date: date,
+    end_date: date,
+    numeric_mode: Literal["decimal", "float"] = "decimal",
+    session: Session = Depends(get_session),
+    etag: str = Depends(caching.portfolio_etag),
+):
+    """Get the TWR and daily NAV history of all member portfolios as if they were one portfolio"""
+    _get_portfolio_group(session, group_id)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be later than end_date")
+    try:
+        result = PortfolioGroupService(session).nav_series(group_id, start_date, end_date, numeric_mode)
+        return {
+            "group_id": group_id,
+            "twr": result["twr"],
+            "annualized_return": result["annualized_return"],
+            "history": [
+                {"date": nav_date.isoformat(), "value": value, "nav": nav, "net_cash_flow": cash_flow}
+                for nav_date, value, nav, cash_flow in zip(
+                    result["dates"], result["values"], result["nav_history"], result["cash_flows"]
+                )
+            ],
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error calculating portfolio group performance: {str(e)}")
+
+# Background job endpoints
+jobs.manager.register(
+    "import_transactions",
+    caching.invalidates(
+        lambda session, parameters, data, progress: _run_transactions_import(
+            session, data, progress, parameters.get("portfolio_id")
+        )
+    ),
+)
+jobs.manager.register(
+    "import_prices",
+    caching.invalidates(
+        lambda session, parameters, data, progress: _run_prices_import(session, data, progress)
+    ),
+)
+jobs.manager.register(
+    "recalculate_positions",
+    caching.invalidates(lambda session, parameters, data, progress: _run_recalculate_positions(
+        session, parameters["portfolio_id"], date.fromisoformat(parameters["as_of_date"]), progress
+    )),
+)
+jobs.manager.register(
+    "performance_history",
+    lambda session, parameters, data, progress: _run_performance_history(
+        session,
+        parameters["portfolio_id"],
+        date.fromisoformat(parameters["start_date"]),
+        date.fromisoformat(parameters["end_date"]),
+        progress,
+    ),
+)
+
+@app.get("/jobs/")
+def get_jobs(limit: int = 50, session: Session = Depends(get_session)):
+    """Get the most recent background jobs, without their results"""
+    recent_jobs = session.exec(select(Job).order_by(Job.id.desc()).limit(limit)).all()
+    return [jobs.job_to_dict(job, include_result=False) for job in recent_jobs]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, session: Session = Depends(get_session)):
+    """Get the status, progress and result of a background job"""
+    job = session.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_to_dict(job)
+
+@app.get("/jobs/{job_id}/events")
+def get_job_events(job_id: int, poll_interval: float = 0.5, session: Session = Depends(get_session)):
+    """Stream the progress of a background job as server-sent events.
+    A progress event is sent whenever the job changes, and the stream ends with the finished job."""
+    if not session.get(Job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    engine = session.get_bind()
+
+    def job_events():
+        last_event = None
+        while True:
+            with Session(engine) as event_session:
+                job = event_session.get(Job, job_id)
+                finished = job.status in jobs.FINISHED_STATUSES
+                data = json.dumps(jobs.job_to_dict(job, include_result=finished))
+            if data != last_event:
+                event = job.status if finished else "progress"
+                yield f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+                last_event = data
+            if finished:
+                return
+            time.sleep(poll_interval)
+
+    return StreamingResponse(
+        job_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
 # Settings endpoints
 @app.get("/settings/{key}", response_model=SettingsResponse)
 def get_setting(key: str, session: Session = Depends(get_session)):
@@ -854,6 +1909,12 @@ def get_all_settings(session: Session = Depends(get_session)):
     settings = session.exec(select(Settings)).all()
     return settings
 
+# Metrics
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Instrumentation metrics in the Prometheus text format"""
+    return instrumentation.registry.render_prometheus()
+
 # Health check
 @app.get("/health")
 def health_check():
@@ -861,4 +1922,6 @@ def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc)}
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
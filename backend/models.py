@@ -1,7 +1,7 @@
 from sqlmodel import SQLModel, Field, Relationship, create_engine, Session
 from datetime import datetime, date, timezone
 from decimal import Decimal
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint
 import os
 
 # Database setup
@@ -19,8 +19,13 @@ def get_engine():
     return _engine
 
 def create_db_and_tables():
-    """Create database and tables"""
-    SQLModel.metadata.create_all(get_engine())
+    """Create database and tables, and the indexes added to existing tables"""
+    engine = get_engine()
+    SQLModel.metadata.create_all(engine)
+    # create_all() skips the new indexes of tables that already exist
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 def drop_db_and_tables():
     """Drop database and tables"""
@@ -143,6 +148,22 @@ class Price(SQLModel, table=True):
     asset: Asset = Relationship(back_populates="prices")
 
 
+class CorporateAction(SQLModel, table=True):
+    """Split or cash dividend of an asset, from which adjusted price series are derived"""
+    id: int = Field(unique=True, primary_key=True)
+    asset_id: int = Field(foreign_key="asset.id", index=True)
+    ex_date: date
+    action_type: str  # split, dividend
+    ratio: Decimal | None = None  # Shares after the split per share before, e.g. 2 for 2-for-1
+    amount: Decimal | None = None  # Cash dividend per share, in the currency of the asset
+    notes: str | None = None
+    created_at: datetime = Field(default_factory=utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('asset_id', 'ex_date', 'action_type', name='uq_corporate_action_asset_date_type'),
+    )
+
+
 class Portfolio(SQLModel, table=True):
     """Portfolio model for portfolio statistics"""
     id: int = Field(primary_key=True)
@@ -157,6 +178,29 @@ class Portfolio(SQLModel, table=True):
     positions: list["Position"] = Relationship(back_populates="portfolio")
 
 
+class PortfolioGroup(SQLModel, table=True):
+    """Group of portfolios, e.g. a household, reported as one consolidated portfolio"""
+    id: int = Field(primary_key=True)
+    name: str
+    description: str | None = None
+    created_at: datetime = Field(default_factory=utcnow)
+
+    # Relationships
+    members: list["PortfolioGroupMember"] = Relationship(back_populates="group")
+
+
+class PortfolioGroupMember(SQLModel, table=True):
+    """Membership of a portfolio in a portfolio group"""
+    id: int = Field(unique=True, primary_key=True)
+    group_id: int = Field(foreign_key="portfoliogroup.id", index=True)
+    portfolio_id: int = Field(foreign_key="portfolio.id")
+
+    __table_args__ = (UniqueConstraint('group_id', 'portfolio_id', name='uq_group_member'),)
+
+    # Relationships
+    group: PortfolioGroup = Relationship(back_populates="members")
+
+
 class Position(SQLModel, table=True):
     """Asset Position model for a portfolio on a specific date"""
     id: int = Field(unique=True, primary_key=True)
@@ -169,14 +213,67 @@ class Position(SQLModel, table=True):
     market_value: Decimal | None = None
     total_pnl: Decimal | None = None  # market_value + cash_received_on_sale + dividends_received - cash_paid_on_bought
     
-    # Add unique constraint for portfolio_id, position_date and asset_id
-    __table_args__ = (UniqueConstraint('portfolio_id', 'position_date', 'asset_id', name='uq_position_date_asset'),)
+    # Add unique constraint for portfolio_id, position_date and asset_id,
+    # and an index finding the latest position of each asset
+    __table_args__ = (
+        UniqueConstraint('portfolio_id', 'position_date', 'asset_id', name='uq_position_date_asset'),
+        Index('ix_position_portfolio_asset_date', 'portfolio_id', 'asset_id', 'position_date'),
+    )
 
     # Relationships
     portfolio: Portfolio = Relationship(back_populates="positions")
     asset: Asset = Relationship(back_populates="positions")
 
 
+class PortfolioDailyValue(SQLModel, table=True):
+    """Materialized daily value and NAV of a portfolio since its first transaction"""
+    id: int = Field(unique=True, primary_key=True)
+    portfolio_id: int = Field(foreign_key="portfolio.id")
+    value_date: date
+    total_value: Decimal  # Market value in primary currency at the end of the day
+    net_cash_flow: Decimal  # External cash_in - cash_out of the day in primary currency
+    nav: Decimal  # NAV per share, 1.0 on the first transaction date
+    shares: Decimal
+    created_at: datetime = Field(default_factory=utcnow)
+
+    # One row per portfolio and day, also serving range scans by portfolio and date
+    __table_args__ = (UniqueConstraint('portfolio_id', 'value_date', name='uq_daily_value_portfolio_date'),)
+
+
+class LotSnapshot(SQLModel, table=True):
+    """Open tax lots of a portfolio at a year end, the checkpoint of lot replays"""
+    id: int = Field(unique=True, primary_key=True)
+    portfolio_id: int = Field(foreign_key="portfolio.id")
+    method: str  # fifo, lifo, specific
+    snapshot_date: date
+    transaction_count: int  # Transactions up to snapshot_date, to detect later changes to the ledger
+    last_transaction_id: int | None = None
+    lots: str  # JSON string of the open lots per asset
+    created_at: datetime = Field(default_factory=utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('portfolio_id', 'method', 'snapshot_date', name='uq_lot_snapshot_portfolio_method_date'),
+    )
+
+
+class Job(SQLModel, table=True):
+    """Background job, persisted so that pending jobs survive restarts"""
+    id: int = Field(unique=True, primary_key=True)
+    kind: str  # recalculate_positions, import_transactions, import_prices, performance_history
+    status: str = Field(default="pending", index=True)  # pending, running, succeeded, failed
+    dedupe_key: str = Field(index=True)  # Identical pending or running jobs share the same key
+    parameters: str = "{}"  # JSON string of the job parameters
+    data: bytes | None = None  # Uploaded file contents, cleared when the job finishes
+    progress_current: int = 0
+    progress_total: int | None = None
+    progress_message: str | None = None
+    result: str | None = None  # JSON string of the job result
+    error: str | None = None
+    created_at: datetime = Field(default_factory=utcnow)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
 class Settings(SQLModel, table=True):
     """Settings model for storing application configuration"""
     id: int = Field(unique=True, primary_key=True)
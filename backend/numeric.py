@@ -0,0 +1,209 @@
+"""
+Float64 numeric core for ledger replay, valuation and NAV series.
+
+The default calculations use Decimal end to end, although their results are
+converted to float for the API and NumPy anyway. This module runs the same
+calculations on float64 arrays:
+
+1. Replay: the ledger is applied to a float quantity vector (one slot per asset)
+   with the same rules as PositionService.apply_transaction(), keeping one row of
+   quantities per day with transactions.
+2. Valuation: prices and exchange rates from a MarketDataSnapshot are forward
+   filled into (valuation days x assets) matrices, so daily values are one matrix
+   product, forward filled to the calendar days without trading.
+3. NAV: r = (V - CF) / V_prev - 1, NAV = cumprod(1 + r) and the shares follow
+   the cash flows, which is _advance_nav() without the per-day Python loop.
+
+Exact Decimal values stay at the persistence boundaries: positions saved to the
+database are still calculated by PositionService in Decimal. Results agree with
+the Decimal mode within float rounding (see tests/test_numeric_mode.py).
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from backend import instrumentation, trading_calendar
+from backend.models import Transaction
+
+
+def _as_float(value) -> float:
+    return float(value) if value is not None else 0.0
+
+
+def day_range(start_date: date, end_date: date) -> list[date]:
+    """All calendar days from start_date to end_date, inclusive"""
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def _forward_filled(series: dict, keys: list[int], days: list[date]) -> np.ndarray:
+    """Point-in-time values of series for every day and key, NaN before the first value"""
+    matrix = np.full((len(days), len(keys)), np.nan)
+    day_numbers = np.array([day.toordinal() for day in days])
+    for column, key in enumerate(keys):
+        if key not in series:
+            continue
+        series_dates, series_values = series[key]
+        positions = np.searchsorted(
+            np.array([series_date.toordinal() for series_date in series_dates]), day_numbers, side="right"
+        )
+        values = np.array([_as_float(value) for value in series_values])
+        known = positions > 0
+        matrix[known, column] = values[positions[known] - 1]
+    return matrix
+
+
+def valuation_matrix(snapshot, asset_ids: list[int], days: list[date]) -> np.ndarray:
+    """Price of one unit of each asset in primary currency, per day.
+
+    Cash is priced at 1.0 and missing exchange rates at 1.0, like MarketDataSnapshot.
+    Days without any known price are 0, so that the holding is valued at 0.
+    """
+    prices = _forward_filled(snapshot._prices, asset_ids, days)
+    for column, asset_id in enumerate(asset_ids):
+        if snapshot.assets[asset_id].type == "cash":
+            prices[:, column] = 1.0
+
+    currency_ids = sorted({snapshot.assets[asset_id].currency_id for asset_id in asset_ids})
+    rates = _forward_filled(snapshot._rates, currency_ids, days)
+    rates[np.isnan(rates)] = 1.0
+    for column, currency_id in enumerate(currency_ids):
+        if currency_id == snapshot.primary_currency_id:
+            rates[:, column] = 1.0
+    currency_columns = np.array(
+        [currency_ids.index(snapshot.assets[asset_id].currency_id) for asset_id in asset_ids], dtype=np.intp
+    )
+
+    unit_values = prices * rates[:, currency_columns] if asset_ids else prices
+    unit_values[np.isnan(unit_values)] = 0.0
+    instrumentation.count_ops(float_=unit_values.size)
+    return unit_values
+
+
+def replay_quantities(
+    transactions: list[Transaction],
+    snapshot,
+    asset_ids: dict[int, int],
+    days: list[date],
+) -> np.ndarray:
+    """End-of-day quantities of every asset for every day.
+
+    Args:
+        transactions: the ledger sorted by trade date
+        snapshot: the MarketDataSnapshot giving the cash asset of each currency
+        asset_ids: a dictionary of asset_id to column index
+        days: consecutive calendar days; transactions before days[0] form the opening holdings
+    Returns:
+        A (days x assets) float64 matrix of quantities.
+    """
+    quantities = np.zeros((len(days), len(asset_ids)))
+    current = np.zeros(len(asset_ids))
+    first_day = days[0].toordinal()
+    last_row = 0
+
+    with instrumentation.stage("replay"):
+        for transaction in transactions:
+            row = max(transaction.trade_date.toordinal() - first_day, 0)
+            if row >= len(days):
+                break
+            if row != last_row:
+                # Carry the holdings forward to the days without transactions
+                quantities[last_row:row] = current
+                last_row = row
+
+            column = asset_ids[transaction.asset_id]
+            cash_column = asset_ids[snapshot.get_cash_asset_id(transaction.currency_id)]
+            action = transaction.action
+            fees = _as_float(transaction.fees)
+            if action == "buy":
+                current[column] += _as_float(transaction.quantity)
+                current[cash_column] -= _as_float(transaction.amount) + fees
+            elif action == "sell":
+                current[column] = max(current[column] - _as_float(transaction.quantity), 0.0)
+                current[cash_column] += _as_float(transaction.amount) - fees
+            elif action == "dividends":
+                current[cash_column] += _as_float(transaction.amount) - fees
+            elif action == "split":
+                current[column] *= _as_float(transaction.quantity)
+            elif action == "cash_in":
+                current[cash_column] += _as_float(transaction.quantity)
+            elif action == "cash_out":
+                current[cash_column] -= _as_float(transaction.quantity)
+            instrumentation.count_ops(float_=2)
+        quantities[last_row:] = current
+    return quantities
+
+
+def external_cash_flows(
+    transactions: list[Transaction], snapshot, days: list[date]
+) -> np.ndarray:
+    """Daily net external cash flow (cash_in - cash_out) in primary currency"""
+    cash_flows = np.zeros(len(days))
+    first_day = days[0].toordinal()
+    for transaction in transactions:
+        if transaction.action not in ("cash_in", "cash_out"):
+            continue
+        row = transaction.trade_date.toordinal() - first_day
+        if row < 0 or row >= len(days):
+            continue
+        amount = _as_float(transaction.amount) * float(
+            snapshot.get_exchange_rate(transaction.currency_id, transaction.trade_date)
+        )
+        cash_flows[row] += amount if transaction.action == "cash_in" else -amount
+    return cash_flows
+
+
+def nav_from_values(values: np.ndarray, cash_flows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized PortfolioService._advance_nav() over a whole series.
+
+    Args:
+        values: portfolio value per day, including the cash flows of that day
+        cash_flows: external net cash flow per day; the first day is ignored
+    Returns:
+        A tuple of (nav, shares, daily_returns) arrays. daily_returns has one
+        element less than values, as the first day only initializes NAV and shares.
+    """
+    v_prev = values[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.where(v_prev > 0, (values[1:] - cash_flows[1:]) / v_prev - 1.0, 0.0)
+    nav = np.concatenate(([1.0], np.cumprod(1.0 + returns)))
+    # shares_today = shares_prev + delta_cf / nav_today, starting with the first value
+    shares = values[0] + np.concatenate(([0.0], np.cumsum(cash_flows[1:] / nav[1:])))
+    instrumentation.count_ops(float_=6 * len(returns))
+    return nav, shares, returns
+
+
+def nav_series_from_ledger(
+    transactions: list[Transaction],
+    snapshot,
+    start_date: date,
+    end_date: date,
+) -> dict:
+    """Float64 version of PortfolioService._nav_series_from_ledger()"""
+    from backend.services import PortfolioService
+
+    days = day_range(start_date, end_date)
+    asset_ids = {}
+    for transaction in transactions:
+        if transaction.trade_date > end_date:
+            break
+        for asset_id in (transaction.asset_id, snapshot.get_cash_asset_id(transaction.currency_id)):
+            asset_ids.setdefault(asset_id, len(asset_ids))
+
+    quantities = replay_quantities(transactions, snapshot, asset_ids, days)
+    # Values are calculated on the valuation days and forward filled to the others
+    valuation_days = snapshot.valuation_days(transactions, start_date, end_date)
+    valuation_rows = np.array([day.toordinal() - days[0].toordinal() for day in valuation_days], dtype=np.intp)
+    with instrumentation.stage("valuation"):
+        unit_values = valuation_matrix(snapshot, list(asset_ids), valuation_days)
+        values = (quantities[valuation_rows] * unit_values).sum(axis=1)
+        values = values[trading_calendar.forward_fill_index(valuation_days, days)]
+    cash_flows = external_cash_flows(transactions, snapshot, days)
+    nav, shares, returns = nav_from_values(values, cash_flows)
+
+    result = PortfolioService._summarize_twr(
+        start_date, end_date, returns.tolist(), nav.tolist(), shares.tolist(), days
+    )
+    result["values"] = values.tolist()
+    result["cash_flows"] = cash_flows.tolist()
+    return result
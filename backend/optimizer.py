@@ -0,0 +1,393 @@
+"""
+Target weights from the stored history and the trades reaching them.
+
+The weights w of the risky assets (the non-cash holdings and any extra assets)
+sum to 1 within per asset type bounds and follow one of the OBJECTIVES:
+
+- min_variance: the lowest variance w' C w
+- max_sharpe: the highest (mu' w - rf) / sqrt(w' C w), rf the risk_free_rate
+  setting and mu the annualized mean log return of the window
+- risk_parity: equal risk contributions w_i (C w)_i / w' C w
+
+C is the cached covariance of covariance.CovarianceService, annualized with
+the trading days of the portfolio calendar. Every objective is solved as a
+convex problem with analytical gradients, by scipy's SLSQP:
+
+- min_variance directly
+- max_sharpe as the lowest variance of y with (mu - rf)' y = 1, w = y / sum(y)
+- risk_parity as the minimum of y' C y / 2 - sum(log y) / n, w = y / sum(y)
+  (Spinu 2013), by Newton's method without binding bounds
+
+The bounds of w are linear constraints on y. The solver starts from the last
+solution for the same assets and objective when there is one, otherwise from
+the current weights, which cuts the iterations of repeated optimizations.
+
+The trades move the holdings to the target: sells first, then buys paid from
+the cash of their currency. A currency short of cash is funded by exchanging
+the surplus cash of the others, the primary currency first, or with
+allow_fx=False its buys are scaled down to its cash. Quantities are whole
+units rounded down, so cash_weight is a floor of the cash kept.
+"""
+
+import math
+from datetime import date
+
+import numpy as np
+from scipy.optimize import minimize
+from sqlmodel import Session, select
+
+from backend import caching, instrumentation, logger, trading_calendar
+from backend.covariance import DEFAULT_METHOD, CovarianceService
+from backend.models import Currency
+from backend.risk import DEFAULT_WINDOW, classify_assets
+from backend.services import CurrencyService, PortfolioService, PositionService, PriceService
+
+OBJECTIVES = ("min_variance", "max_sharpe", "risk_parity")
+DEFAULT_BOUNDS = (0.0, 1.0)
+MAX_ITERATIONS = 500
+TOLERANCE = 1e-10
+
+# Last solution per database, objective and asset set, the starting point of the next one
+_solutions = caching.ResponseCache(maxsize=64)
+
+
+def validate(objective: str) -> None:
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Invalid objective: {objective}. Must be one of {', '.join(OBJECTIVES)}")
+
+
+def project(weights: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """The closest weights summing to 1 within the bounds, by bisection on a common shift"""
+    if lower.sum() > 1 + 1e-9 or upper.sum() < 1 - 1e-9:
+        raise ValueError("The bounds cannot hold weights summing to 1")
+    low, high = float(np.min(weights - upper)), float(np.max(weights - lower))
+    for _ in range(100):
+        shift = (low + high) / 2
+        if np.clip(weights - shift, lower, upper).sum() > 1:
+            low = shift
+        else:
+            high = shift
+    return np.clip(weights - (low + high) / 2, lower, upper)
+
+
+def _variance(covariance: np.ndarray):
+    def variance(weights):
+        exposure = covariance @ weights
+        return float(weights @ exposure), 2 * exposure
+    return variance
+
+
+def risk_parity(covariance: np.ndarray, max_iterations: int = 100) -> tuple[np.ndarray, int]:
+    """
+    Equal risk contribution weights without bounds and the Newton iterations:
+    the minimum y of y' C y / 2 - sum(log y) / n is unique and has equal risk
+    contributions, y / sum(y) are the weights (Spinu 2013).
+    """
+    size = len(covariance)
+    y = 1 / np.sqrt(np.clip(np.diag(covariance), 1e-18, None) * size)
+    for iteration in range(1, max_iterations + 1):
+        gradient = covariance @ y - 1 / (size * y)
+        hessian = covariance + np.diag(1 / (size * y ** 2))
+        step = np.linalg.solve(hessian, gradient)
+        # Stay within y > 0
+        scale = 1.0
+        while np.any(y - scale * step <= 0):
+            scale /= 2
+        y = y - scale * step
+        instrumentation.count_ops(float_=size ** 3 // 3 + 4 * covariance.size)
+        if float(gradient @ step) < 1e-20:
+            break
+    return y / y.sum(), iteration
+
+
+def _bound_constraints(lower: np.ndarray, upper: np.ndarray) -> list[dict]:
+    """Weight bounds as linear constraints on y, the weights being y / sum(y):
+    upper_i * sum(y) - y_i >= 0 and y_i - lower_i * sum(y) >= 0"""
+    capped, floored = np.flatnonzero(upper < 1), np.flatnonzero(lower > 0)
+    if not capped.size and not floored.size:
+        return []
+    identity = np.eye(len(lower))
+    jacobian = np.vstack([upper[capped, None] - identity[capped], identity[floored] - lower[floored, None]])
+    return [{"type": "ineq", "fun": lambda y: jacobian @ y, "jac": lambda y: jacobian}]
+
+
+def _solve(function, initial, lower, upper, constraints) -> tuple[np.ndarray, dict]:
+    with instrumentation.stage("optimization"):
+        result = minimize(
+            function, initial, jac=True, method="SLSQP", bounds=list(zip(lower, upper)), constraints=constraints,
+            options={"maxiter": MAX_ITERATIONS, "ftol": TOLERANCE},
+        )
+        instrumentation.count_ops(float_=int(result.nfev) * 2 * len(initial) ** 2)
+    return result.x, {"iterations": int(result.nit), "converged": bool(result.success), "message": str(result.message)}
+
+
+def optimize_weights(
+    objective: str,
+    covariance: np.ndarray,
+    expected_returns: np.ndarray | None = None,
+    risk_free_rate: float = 0.0,
+    lower: np.ndarray | None = None,
+    upper: np.ndarray | None = None,
+    initial: np.ndarray | None = None,
+) -> tuple[np.ndarray, dict]:
+    """Optimal weights summing to 1 within the bounds, and the solver statistics"""
+    validate(objective)
+    size = len(covariance)
+    lower = np.full(size, DEFAULT_BOUNDS[0]) if lower is None else lower
+    upper = np.full(size, DEFAULT_BOUNDS[1]) if upper is None else upper
+    warm = initial is not None
+    initial = project(initial if warm else np.full(size, 1 / size), lower, upper)
+    budget = {"type": "eq", "fun": lambda weights: weights.sum() - 1, "jac": lambda weights: np.ones(size)}
+
+    if objective == "min_variance":
+        weights, solver = _solve(_variance(covariance), initial, lower, upper, [budget])
+
+    elif objective == "max_sharpe":
+        # The maximum Sharpe ratio is the minimum variance of y with (mu - rf)' y = 1,
+        # the weights y / sum(y); the weight bounds become linear in y
+        excess = (np.zeros(size) if expected_returns is None else expected_returns) - risk_free_rate
+        if np.all(excess <= 0):
+            raise ValueError("No asset has an expected return above the risk-free rate")
+        if excess @ initial <= 0:
+            initial = project(np.where(excess > 0, 1.0, 0.0), lower, upper)
+        constraints = [{"type": "eq", "fun": lambda y: excess @ y - 1, "jac": lambda y: excess}]
+        y, solver = _solve(
+            _variance(covariance), initial / max(float(excess @ initial), 1e-12),
+            np.zeros(size), np.full(size, None), constraints + _bound_constraints(lower, upper),
+        )
+        weights = y / y.sum()
+
+    else:
+        weights, iterations = risk_parity(covariance)
+        solver = {"iterations": iterations, "converged": True, "message": "Unbounded risk parity"}
+        if np.any(weights < lower - 1e-9) or np.any(weights > upper + 1e-9):
+            # The same convex problem with the bounds as linear constraints on y
+            def barrier(y):
+                exposure = covariance @ y
+                return 0.5 * float(y @ exposure) - float(np.log(y).sum()) / size, exposure - 1 / (size * y)
+
+            start = initial if warm else project(weights, lower, upper)
+            y, solver = _solve(
+                barrier, start / math.sqrt(float(start @ covariance @ start)),
+                np.full(size, 1e-12), np.full(size, None), _bound_constraints(lower, upper),
+            )
+            weights = y / y.sum()
+
+    if not solver["converged"]:
+        logger.warning(f"The {objective} optimization stopped early: {solver['message']}")
+    return project(weights, lower, upper), solver
+
+
+class OptimizerService:
+    """Service computing target weights for a portfolio and the trades reaching them"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def optimize(
+        self,
+        portfolio_id: int,
+        as_of_date: date,
+        objective: str = "min_variance",
+        bounds: dict[str, tuple[float, float]] | None = None,
+        asset_ids: list[int] = (),
+        cash_weight: float | None = None,
+        allow_fx: bool = True,
+        window: int = DEFAULT_WINDOW,
+        method: str = DEFAULT_METHOD,
+    ) -> dict:
+        """
+        Target weights of the risky assets on as_of_date and the trades reaching them.
+
+        Args:
+            bounds: (min, max) weight of each asset of a type among the risky assets, default (0, 1)
+            asset_ids: assets to consider besides the holdings
+            cash_weight: share of the portfolio kept in cash, default the current one
+            allow_fx: whether to exchange cash between currencies to pay for the buys
+        """
+        validate(objective)
+        bounds = bounds or {}
+        for asset_type, (low, high) in bounds.items():
+            if not 0 <= low <= high <= 1:
+                raise ValueError(f"Invalid bounds for {asset_type}: ({low}, {high})")
+        if cash_weight is not None and not 0 <= cash_weight < 1:
+            raise ValueError(f"The cash weight must be at least 0 and below 1, got {cash_weight}")
+
+        currency_service = CurrencyService(self.session)
+        price_service = PriceService(self.session)
+        primary_currency = currency_service.get_primary_currency()
+        positions = {
+            position.asset_id: position
+            for position in PositionService(self.session).get_positions_as_of(portfolio_id, as_of_date)
+            if position.quantity
+        }
+        universe = sorted(set(positions) | set(asset_ids))
+        classes = classify_assets(self.session, universe)
+        universe = [asset_id for asset_id in universe if asset_id in classes]
+        codes = {classes[asset_id]["currency"] for asset_id in universe} | {primary_currency.code}
+        currencies = {
+            currency.code: currency
+            for currency in self.session.exec(select(Currency).where(Currency.code.in_(codes))).all()
+        }
+        rates = {
+            code: float(currency_service.get_exchange_rate(currency.id, as_of_date)) for code, currency in currencies.items()
+        }
+
+        cash = {code: 0.0 for code in currencies}
+        quantities, prices = {}, {}
+        for asset_id in universe:
+            position = positions.get(asset_id)
+            if classes[asset_id]["type"] == "cash":
+                cash[classes[asset_id]["currency"]] += float(position.quantity) if position else 0.0
+                continue
+            price = position.current_price if position and position.current_price else None
+            if price is None:
+                latest = price_service.get_latest_price(asset_id, as_of_date)
+                price = latest.price if latest else None
+            if price is None or price <= 0:
+                raise ValueError(f"No price of {classes[asset_id]['symbol']} on {as_of_date}")
+            quantities[asset_id] = float(position.quantity) if position else 0.0
+            prices[asset_id] = float(price)
+
+        def value_of(asset_id: int, quantity: float) -> float:
+            return quantity * prices[asset_id] * rates[classes[asset_id]["currency"]]
+
+        cash_value = sum(amount * rates[code] for code, amount in cash.items())
+        risky_value = sum(value_of(asset_id, quantity) for asset_id, quantity in quantities.items())
+        total_value = cash_value + risky_value
+        if total_value <= 0:
+            raise ValueError("The portfolio has no value to allocate")
+        if cash_weight is None:
+            cash_weight = cash_value / total_value
+
+        estimate = CovarianceService(self.session).estimate(list(quantities), as_of_date, window, method)
+        optimized = estimate.asset_ids
+        # Assets without enough history keep their holdings
+        fixed_value = sum(value_of(asset_id, quantities[asset_id]) for asset_id in quantities if asset_id not in optimized)
+        invested = total_value * (1 - cash_weight) - fixed_value
+        if invested <= 0:
+            raise ValueError("Nothing left to invest after the cash and the assets without enough history")
+
+        calendar = trading_calendar.calendar_for_portfolio(self.session, portfolio_id)
+        periods = calendar.trading_days_per_year(estimate.dates[0], estimate.dates[-1])
+        covariance = estimate.covariance * periods
+        expected_returns = estimate.returns.mean(axis=0) * periods
+        risk_free_rate = PortfolioService(self.session)._get_risk_free_rate()
+        lower, upper = (
+            np.array([bounds.get(classes[asset_id]["type"], DEFAULT_BOUNDS)[side] for asset_id in optimized])
+            for side in (0, 1)
+        )
+        current = np.array([value_of(asset_id, quantities[asset_id]) for asset_id in optimized])
+        key = f"{self.session.get_bind().url}:{objective}:{optimized}"
+        initial = _solutions.get(key)
+        if initial is None and current.sum() > 0 and objective != "risk_parity":
+            initial = current / current.sum()
+        weights, solver = optimize_weights(
+            objective, covariance, expected_returns, risk_free_rate, lower, upper, initial
+        )
+        _solutions.put(key, weights)
+
+        targets = dict(quantities)
+        for asset_id, weight in zip(optimized, weights):
+            targets[asset_id] = math.floor(weight * invested / value_of(asset_id, 1.0))
+        trades, conversions, cash_after = self._trades(
+            classes, quantities, targets, prices, rates, cash, primary_currency.code, allow_fx
+        )
+
+        exposure = covariance @ weights
+        volatility = math.sqrt(max(float(weights @ exposure), 0.0))
+        expected_return = float(expected_returns @ weights)
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of_date": as_of_date.isoformat(),
+            "objective": objective,
+            "observations": len(estimate.dates),
+            "excluded_asset_ids": estimate.excluded_asset_ids,
+            "total_value": total_value,
+            "cash_weight": cash_weight,
+            "risk_free_rate": risk_free_rate,
+            "expected_return": expected_return,
+            "volatility": volatility,
+            "sharpe_ratio": (expected_return - risk_free_rate) / volatility if volatility > 0 else None,
+            **solver,
+            "assets": [
+                {
+                    "asset_id": asset_id,
+                    "symbol": classes[asset_id]["symbol"],
+                    "type": classes[asset_id]["type"],
+                    "current_weight": float(current[column] / current.sum()) if current.sum() > 0 else 0.0,
+                    "target_weight": float(weights[column]),
+                    "risk_contribution": (
+                        float(weights[column] * exposure[column]) / volatility ** 2 if volatility > 0 else 0.0
+                    ),
+                }
+                for column, asset_id in enumerate(optimized)
+            ],
+            "trades": trades,
+            "fx_conversions": conversions,
+            "cash": [
+                {"currency": code, "before": cash[code], "after": cash_after[code]} for code in sorted(cash)
+            ],
+        }
+
+    @staticmethod
+    def _trades(classes, quantities, targets, prices, rates, cash, primary_code, allow_fx):
+        """Sells, then buys paid from the cash of their currency, funded by exchanges if allowed"""
+        orders = {
+            asset_id: targets[asset_id] - quantity
+            for asset_id, quantity in quantities.items() if targets[asset_id] != quantity
+        }
+        # Cash after the sells, and the cost of the buys, per currency
+        available, needs = dict(cash), dict.fromkeys(cash, 0.0)
+        for asset_id, change in orders.items():
+            code = classes[asset_id]["currency"]
+            if change < 0:
+                available[code] -= change * prices[asset_id]
+            else:
+                needs[code] += change * prices[asset_id]
+
+        conversions = []
+        if allow_fx:
+            # Surplus cash in primary currency, spent from the primary currency first
+            surplus = {code: (available[code] - needs[code]) * rates[code] for code in cash}
+            sources = sorted(cash, key=lambda code: (code != primary_code, -surplus[code]))
+            for code in sorted(cash):
+                for source in sources:
+                    amount = min(-surplus[code], surplus[source])
+                    if amount <= 1e-9:
+                        continue
+                    surplus[source] -= amount
+                    surplus[code] += amount
+                    available[source] -= amount / rates[source]
+                    available[code] += amount / rates[code]
+                    conversions.append({
+                        "from_currency": source, "to_currency": code,
+                        "amount": amount / rates[source], "converted_amount": amount / rates[code],
+                    })
+        for code in cash:
+            if needs[code] > available[code] + 1e-9:
+                # Scale the buys of a currency short of cash down to its cash
+                scale = max(available[code], 0.0) / needs[code]
+                for asset_id, change in orders.items():
+                    if change > 0 and classes[asset_id]["currency"] == code:
+                        orders[asset_id] = math.floor(change * scale)
+
+        trades = []
+        for asset_id, change in sorted(orders.items(), key=lambda order: order[1] > 0):
+            if change == 0:
+                continue
+            code = classes[asset_id]["currency"]
+            amount = abs(change) * prices[asset_id]
+            if change > 0:
+                available[code] -= amount
+            trades.append({
+                "asset_id": asset_id,
+                "symbol": classes[asset_id]["symbol"],
+                "action": "buy" if change > 0 else "sell",
+                "quantity": abs(change),
+                "price": prices[asset_id],
+                "currency": code,
+                "amount": amount,
+                "value": amount * rates[code],
+            })
+        return trades, conversions, available
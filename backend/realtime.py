@@ -0,0 +1,305 @@
+"""
+Intraday price feed with an in-memory latest-price table.
+
+Ticks (symbol, price, timestamp) arrive over HTTP, a WebSocket or a replay file
+and update LatestPriceTable, a dictionary of the last price of each asset. Reads
+are a dictionary lookup without any query, so PriceService answers today's price
+from memory when the feed has one.
+
+The last tick of each asset and day is its close. Closes are written to the Price
+table in batches (price_type "real_time"), when the feed sees the first tick of a
+new day, when flush() is called and when the API shuts down. Historical prices
+loaded from a provider are never overwritten by a close.
+
+Example:
+    feed.ingest([Tick("600036.SH", 35.2)])
+    feed.table.get(asset_id).price
+    feed.flush(session)
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from backend import logger
+from backend.models import Asset, Price, utcnow
+
+# Rows written per executemany call
+FLUSH_BATCH_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class Tick:
+    """A trade or quote price of a symbol"""
+    symbol: str
+    price: float | Decimal
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+@dataclass(frozen=True)
+class LatestPrice:
+    asset_id: int
+    price: Decimal
+    timestamp: datetime
+
+    @property
+    def price_date(self) -> date:
+        return self.timestamp.date()
+
+
+class LatestPriceTable:
+    """Last price of every asset, updated by the feed and read without locking.
+
+    Updates replace whole LatestPrice entries, so readers never see a partial
+    update. Ticks older than the stored one are ignored. Listeners are called
+    with every stored LatestPrice, on the thread that ingested the tick.
+    """
+
+    def __init__(self):
+        self._prices: dict[int, LatestPrice] = {}
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[LatestPrice], None]] = []
+        # Incremented on every change, so readers can tell whether prices moved
+        self.version = 0
+
+    def add_listener(self, listener: Callable[[LatestPrice], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[LatestPrice], None]) -> None:
+        self._listeners.remove(listener)
+
+    def update(self, asset_id: int, price: Decimal, timestamp: datetime) -> bool:
+        """Store a price, unless a newer one is already known. Returns whether it was stored."""
+        with self._lock:
+            current = self._prices.get(asset_id)
+            if current is not None and current.timestamp > timestamp:
+                return False
+            latest = self._prices[asset_id] = LatestPrice(asset_id, price, timestamp)
+            self.version += 1
+        for listener in self._listeners:
+            listener(latest)
+        return True
+
+    def get(self, asset_id: int) -> LatestPrice | None:
+        return self._prices.get(asset_id)
+
+    def get_price(self, asset_id: int, price_date: date) -> Decimal | None:
+        """The latest price of an asset if it was received on price_date"""
+        latest = self._prices.get(asset_id)
+        if latest is None or latest.price_date != price_date:
+            return None
+        return latest.price
+
+    def snapshot(self) -> dict[int, LatestPrice]:
+        return dict(self._prices)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._prices.clear()
+            self.version += 1
+
+
+class PriceFeed:
+    """Ingests ticks into a LatestPriceTable and persists the daily closes"""
+
+    def __init__(self):
+        self.table = LatestPriceTable()
+        self._engine = None
+        self._symbols: dict[str, int] = {}
+        self._closes: dict[tuple[int, date], Decimal] = {}  # Unflushed closes by (asset_id, date)
+        self._current_date: date | None = None
+        self._lock = threading.Lock()
+
+    def bind(self, engine) -> None:
+        """Set the database the feed resolves symbols in and flushes closes to"""
+        if engine is not self._engine:
+            self._engine = engine
+            self._symbols = {}
+
+    def live_price(self, engine, asset_id: int, price_date: date) -> Decimal | None:
+        """Price of an asset received on price_date, when the feed serves the database of engine"""
+        if engine is not self._engine:
+            return None
+        return self.table.get_price(asset_id, price_date)
+
+    def _resolve_symbols(self, session: Session, symbols: set[str]) -> None:
+        missing = symbols - self._symbols.keys()
+        if missing:
+            self._symbols.update(session.exec(
+                select(Asset.symbol, Asset.id).where(Asset.symbol.in_(missing))
+            ).all())
+
+    def ingest(self, ticks: Iterable[Tick], session: Session | None = None) -> tuple[int, list[str]]:
+        """Apply ticks to the latest-price table.
+
+        Stored positions of the portfolios holding an asset with a new price are
+        deleted from the day of the price, so they are valued again with it.
+
+        Returns:
+            A tuple of (number of ticks applied, symbols without an asset).
+        """
+        ticks = list(ticks)
+        if session is not None:
+            self.bind(session.get_bind())
+        if self._engine is None:
+            raise RuntimeError("The price feed is not bound to a database")
+        with Session(self._engine) as lookup_session:
+            self._resolve_symbols(lookup_session, {tick.symbol for tick in ticks})
+
+        applied, unknown, rollover = 0, [], False
+        moved: dict[date, set[int]] = {}  # Assets with a new price by day
+        with self._lock:
+            for tick in ticks:
+                asset_id = self._symbols.get(tick.symbol)
+                if asset_id is None:
+                    unknown.append(tick.symbol)
+                    continue
+                price = Decimal(str(tick.price))
+                timestamp = tick.timestamp
+                if timestamp.tzinfo is not None:
+                    # Trading days follow the local time of the server, like date.today()
+                    timestamp = timestamp.astimezone().replace(tzinfo=None)
+                if not self.table.update(asset_id, price, timestamp):
+                    continue
+                applied += 1
+                self._closes[(asset_id, timestamp.date())] = price
+                moved.setdefault(timestamp.date(), set()).add(asset_id)
+                if self._current_date is None or timestamp.date() > self._current_date:
+                    rollover = self._current_date is not None
+                    self._current_date = timestamp.date()
+
+        if moved:
+            from backend.services import PositionService
+
+            # Stored positions of the holders were valued before these prices
+            with Session(self._engine) as invalidate_session:
+                position_service = PositionService(invalidate_session)
+                for price_date, asset_ids in moved.items():
+                    position_service.invalidate_holders(sorted(asset_ids), price_date)
+
+        if rollover:
+            # The first tick of a new day closes the previous one
+            self.flush(before=self._current_date)
+        return applied, sorted(set(unknown))
+
+    def flush(self, session: Session | None = None, before: date | None = None) -> int:
+        """Upsert the unflushed closes (of the days before `before`) into the Price table.
+
+        Returns:
+            The number of closes written.
+        """
+        with self._lock:
+            closes = {key: price for key, price in self._closes.items() if before is None or key[1] < before}
+            for key in closes:
+                del self._closes[key]
+        if not closes:
+            return 0
+
+        statement = sqlite_insert(Price.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=["asset_id", "price_date"],
+            set_={
+                "price": statement.excluded.price,
+                "price_type": statement.excluded.price_type,
+                "source": statement.excluded.source,
+                "created_at": statement.excluded.created_at,
+            },
+            # Closes from the feed never replace historical prices
+            where=Price.__table__.c.price_type != "historical",
+        )
+        rows = [
+            {
+                "asset_id": asset_id,
+                "price_date": price_date,
+                "price": price,
+                "price_type": "real_time",
+                "source": "feed",
+                "created_at": utcnow(),
+            }
+            for (asset_id, price_date), price in closes.items()
+        ]
+        with Session(session.get_bind() if session is not None else self._engine) as flush_session:
+            connection = flush_session.connection()
+            for start in range(0, len(rows), FLUSH_BATCH_SIZE):
+                connection.execute(statement, rows[start:start + FLUSH_BATCH_SIZE])
+            flush_session.commit()
+
+            from backend.services import DailyValueService
+
+            DailyValueService(flush_session).invalidate(min(price_date for _, price_date in closes))
+        logger.info(f"Flushed {len(rows)} closes from the price feed")
+        return len(rows)
+
+    def reset(self) -> None:
+        """Drop all prices and unflushed closes"""
+        with self._lock:
+            self.table.clear()
+            self._closes.clear()
+            self._current_date = None
+
+    def replay(self, path: str, speed: float = 0.0, batch_size: int = 500) -> int:
+        """Ingest the ticks of a CSV or NDJSON file with symbol, price and timestamp columns.
+
+        With a speed above 0, ticks are delayed to follow their timestamps, speed
+        times faster than real time; otherwise the file is ingested as fast as possible.
+
+        Returns:
+            The number of ticks applied.
+        """
+        applied, batch, previous = 0, [], None
+        for tick in read_ticks(path):
+            if speed > 0 and previous is not None:
+                delay = (tick.timestamp - previous).total_seconds() / speed
+                if delay > 0:
+                    applied += self.ingest(batch)[0]
+                    batch = []
+                    time.sleep(delay)
+            previous = tick.timestamp
+            batch.append(tick)
+            if len(batch) >= batch_size:
+                applied += self.ingest(batch)[0]
+                batch = []
+        if batch:
+            applied += self.ingest(batch)[0]
+        return applied
+
+
+def read_ticks(path: str) -> Iterator[Tick]:
+    """Read the ticks of a CSV file or, for a .ndjson/.jsonl file, of JSON lines"""
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith((".ndjson", ".jsonl")):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = csv.DictReader(file)
+        for record in records:
+            yield Tick(
+                symbol=record["symbol"],
+                price=Decimal(str(record["price"])),
+                timestamp=datetime.fromisoformat(record["timestamp"]),
+            )
+
+
+def start_replay_from_environment(engine) -> threading.Thread | None:
+    """Replay NICEAMS_PRICE_REPLAY in a background thread, at NICEAMS_PRICE_REPLAY_SPEED"""
+    path = os.environ.get("NICEAMS_PRICE_REPLAY")
+    if not path:
+        return None
+    speed = float(os.environ.get("NICEAMS_PRICE_REPLAY_SPEED", "0"))
+    feed.bind(engine)
+    thread = threading.Thread(
+        target=feed.replay, args=(path, speed), name="niceams-price-replay", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+feed = PriceFeed()
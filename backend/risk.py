@@ -0,0 +1,366 @@
+"""
+Value-at-Risk (VaR) and expected shortfall (CVaR) of current holdings.
+
+The holdings of a portfolio are its exposures w: the market values of its
+positions in primary currency. Their risk comes from the daily log returns of
+the assets in primary currency (total-return adjusted closes times exchange
+rates, see backend/corporate_actions.py), aligned on the union of their price
+dates. Over a horizon of h days the loss is -sum(w * (exp(r_h) - 1)), and:
+
+- historical: r_h are the overlapping h-day returns of the return window
+- parametric: the daily P&L is normal, with the mean and standard deviation of
+  the historical daily P&L, scaled by h and sqrt(h)
+- monte_carlo: r_h ~ N(h * mean, h * covariance) of the daily returns, simulated
+  in blocks of SIMULATION_BLOCK scenarios as (scenarios x assets) matrices
+
+VaR is the loss quantile at the confidence level and CVaR the mean loss beyond
+it, both positive amounts in primary currency. Simulations use numpy's PCG64
+generator, one independent stream per block spawned from the seed, so results
+depend on the seed only and not on the number of worker processes.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from statistics import NormalDist
+
+import numpy as np
+from sqlmodel import Session, select
+
+from backend import instrumentation
+from backend.corporate_actions import CorporateActionService
+from backend.models import Asset, AssetMetadata, Currency, ExchangeRate
+from backend.services import CurrencyService, PositionService
+
+VAR_METHODS = ("historical", "parametric", "monte_carlo")
+DEFAULT_CONFIDENCE_LEVELS = (0.95, 0.99)
+DEFAULT_HORIZONS = (1, 10)
+# Daily returns used by default, about one year of trading days
+DEFAULT_WINDOW = 250
+DEFAULT_SIMULATIONS = 100_000
+DEFAULT_SEED = 42
+# Scenarios simulated at once, bounding the memory of a block to SIMULATION_BLOCK x assets floats
+SIMULATION_BLOCK = 10_000
+# Assets with fewer daily returns in the window are left out of the risk
+MIN_OBSERVATIONS = 20
+
+
+@dataclass
+class ReturnMatrix:
+    """Aligned daily log returns in primary currency"""
+    dates: list[date]  # The day each row of returns ends on
+    asset_ids: list[int]
+    returns: np.ndarray  # (days x assets)
+    excluded_asset_ids: list[int] = field(default_factory=list)  # Assets without enough history
+
+
+def forward_fill(series_dates: list[date], values, days: np.ndarray) -> np.ndarray:
+    """Values of a series on or before each day (ordinals), NaN before its first date"""
+    positions = np.searchsorted(np.array([day.toordinal() for day in series_dates]), days, side="right")
+    filled = np.full(len(days), np.nan)
+    known = positions > 0
+    filled[known] = np.asarray(values, dtype=float)[positions[known] - 1]
+    return filled
+
+
+def exchange_rate_history(session: Session, currency_ids, end_date: date) -> dict[int, tuple[list, list]]:
+    """(dates, rates to primary) of the currencies up to end_date, none for the primary currency"""
+    primary_currency_id = CurrencyService(session).get_primary_currency().id
+    rates = {}
+    for currency_id, rate_date, rate in session.exec(
+        select(ExchangeRate.currency_id, ExchangeRate.rate_date, ExchangeRate.rate_to_primary)
+        .where(ExchangeRate.currency_id.in_(set(currency_ids) - {primary_currency_id}))
+        .where(ExchangeRate.rate_date <= end_date)
+        .order_by(ExchangeRate.currency_id, ExchangeRate.rate_date)
+    ).all():
+        rate_dates, rate_values = rates.setdefault(currency_id, ([], []))
+        rate_dates.append(rate_date)
+        rate_values.append(float(rate))
+    return rates
+
+
+def load_returns(
+    session: Session,
+    asset_ids: list[int],
+    end_date: date,
+    window: int = DEFAULT_WINDOW,
+    adjust: str = "total_return",
+) -> ReturnMatrix:
+    """
+    Daily log returns in primary currency of the assets over the last window days up to end_date.
+
+    The days are the union of the price dates of the assets. Prices and exchange
+    rates are forward filled to them; cash is priced at 1.0 and a missing exchange
+    rate is 1.0, like MarketDataSnapshot. Assets with fewer than MIN_OBSERVATIONS
+    returns in the window are excluded, and the window starts on the first day all
+    the others have a price.
+    """
+    assets = {asset.id: asset for asset in session.exec(select(Asset).where(Asset.id.in_(asset_ids))).all()}
+    asset_ids = [asset_id for asset_id in asset_ids if asset_id in assets]
+    series = CorporateActionService(session).adjusted_series(
+        [asset_id for asset_id in asset_ids if assets[asset_id].type != "cash"]
+    )
+    with instrumentation.stage("risk_returns"):
+        all_days = sorted({day for asset_series in series.values() for day in asset_series.dates if day <= end_date})
+        days = all_days[-(window + 1):]
+        if len(days) < 2:
+            return ReturnMatrix([], [], np.zeros((0, 0)), asset_ids)
+        ordinals = np.array([day.toordinal() for day in days])
+
+        rates = exchange_rate_history(session, {assets[asset_id].currency_id for asset_id in asset_ids}, end_date)
+
+        values = np.full((len(days), len(asset_ids)), np.nan)
+        for column, asset_id in enumerate(asset_ids):
+            asset = assets[asset_id]
+            if asset.type == "cash":
+                values[:, column] = 1.0
+            elif asset_id in series:
+                values[:, column] = forward_fill(series[asset_id].dates, series[asset_id].values(adjust), ordinals)
+            if asset.currency_id in rates:
+                fx = forward_fill(*rates[asset.currency_id], ordinals)
+                values[:, column] *= np.where(np.isnan(fx), 1.0, fx)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            valid = np.isfinite(values) & (values > 0)
+        # An asset has a return on every row after its first valid price
+        enough = valid.sum(axis=0) - 1 >= MIN_OBSERVATIONS
+        kept = np.flatnonzero(enough)
+        excluded = [asset_ids[column] for column in np.flatnonzero(~enough)]
+        if kept.size == 0:
+            return ReturnMatrix([], [], np.zeros((0, 0)), excluded)
+        first_row = int(np.argmax(valid[:, kept].all(axis=1)))
+        values = values[first_row:, kept]
+        returns = np.diff(np.log(values), axis=0)
+        instrumentation.count_ops(float_=returns.size * 2)
+    return ReturnMatrix(days[first_row + 1:], [asset_ids[column] for column in kept], returns, excluded)
+
+
+def classify_assets(session: Session, asset_ids: list[int]) -> dict[int, dict]:
+    """Symbol, type, sector (AssetMetadata "sector", else "Unknown") and currency code of each asset"""
+    rows = session.exec(
+        select(Asset.id, Asset.symbol, Asset.type, Currency.code)
+        .join(Currency, Currency.id == Asset.currency_id)
+        .where(Asset.id.in_(asset_ids))
+    ).all()
+    sectors = dict(session.exec(
+        select(AssetMetadata.asset_id, AssetMetadata.attribute_value)
+        .where(AssetMetadata.asset_id.in_(asset_ids))
+        .where(AssetMetadata.attribute_name == "sector")
+    ).all())
+    return {
+        asset_id: {"symbol": symbol, "type": asset_type, "sector": sectors.get(asset_id, "Unknown"), "currency": code}
+        for asset_id, symbol, asset_type, code in rows
+    }
+
+
+def _tail(losses: np.ndarray, confidence: float) -> tuple[float, float]:
+    """VaR and CVaR of a loss distribution"""
+    var = float(np.quantile(losses, confidence))
+    tail = losses[losses >= var]
+    return var, float(tail.mean()) if tail.size else var
+
+
+def historical_var(
+    returns: np.ndarray, exposures: np.ndarray, confidence_levels, horizons
+) -> dict[tuple[float, int], tuple[float, float]]:
+    """VaR and CVaR per (confidence, horizon) from the overlapping h-day returns of the window"""
+    cumulative = np.vstack([np.zeros(returns.shape[1]), np.cumsum(returns, axis=0)])
+    results = {}
+    for horizon in horizons:
+        if horizon >= len(cumulative):
+            continue
+        losses = -(np.expm1(cumulative[horizon:] - cumulative[:-horizon]) @ exposures)
+        for confidence in confidence_levels:
+            results[confidence, horizon] = _tail(losses, confidence)
+    return results
+
+
+def parametric_var(
+    returns: np.ndarray, exposures: np.ndarray, confidence_levels, horizons
+) -> dict[tuple[float, int], tuple[float, float]]:
+    """VaR and CVaR per (confidence, horizon) of a normal P&L with the moments of the daily P&L"""
+    daily_pnl = np.expm1(returns) @ exposures
+    mean = float(daily_pnl.mean())
+    std = float(daily_pnl.std(ddof=1)) if len(daily_pnl) > 1 else 0.0
+    normal = NormalDist()
+    results = {}
+    for horizon in horizons:
+        for confidence in confidence_levels:
+            z = normal.inv_cdf(confidence)
+            scale = std * np.sqrt(horizon)
+            results[confidence, horizon] = (
+                -mean * horizon + z * scale,
+                -mean * horizon + scale * normal.pdf(z) / (1 - confidence),
+            )
+    return results
+
+
+def covariance_factor(covariance: np.ndarray) -> np.ndarray:
+    """
+    A (assets x rank) matrix F with F @ F.T == covariance.
+
+    Singular covariances are common: cash has no variance, and a window of T days
+    gives a sample covariance of rank T - 1 at most. Only the directions with
+    variance are kept, so scenarios need one normal draw per rank, not per asset.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    keep = eigenvalues > max(eigenvalues.max(initial=0.0), 0.0) * 1e-12
+    return eigenvectors[:, keep] * np.sqrt(eigenvalues[keep])
+
+
+def _simulate_block(arguments) -> np.ndarray:
+    """Losses of one block of scenarios for every horizon, as a (horizons x scenarios) array"""
+    seed, scenarios, mean, factor, exposures, horizons = arguments
+    generator = np.random.default_rng(seed)
+    shocks = generator.standard_normal((scenarios, factor.shape[1])) @ factor.T
+    losses = np.empty((len(horizons), scenarios))
+    returns = np.empty_like(shocks)
+    for row, horizon in enumerate(horizons):
+        np.multiply(shocks, np.sqrt(horizon), out=returns)
+        returns += horizon * mean
+        np.expm1(returns, out=returns)
+        losses[row] = -(returns @ exposures)
+    return losses
+
+
+def monte_carlo_var(
+    returns: np.ndarray,
+    exposures: np.ndarray,
+    confidence_levels,
+    horizons,
+    simulations: int = DEFAULT_SIMULATIONS,
+    seed: int = DEFAULT_SEED,
+    workers: int = 1,
+    covariance: np.ndarray | None = None,
+) -> dict[tuple[float, int], tuple[float, float]]:
+    """
+    VaR and CVaR per (confidence, horizon) of simulated multivariate normal log returns.
+
+    Args:
+        returns: (days x assets) daily log returns, giving the mean and, unless given, the covariance
+        exposures: market value of each asset in primary currency
+        simulations: number of scenarios, shared by all horizons
+        seed: seed of the generator; the same seed gives the same scenarios
+        workers: processes simulating the blocks; 1 simulates in this process
+        covariance: a covariance matrix of the daily returns, e.g. a shrinkage estimate
+    """
+    mean = returns.mean(axis=0)
+    if covariance is None:
+        covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+    factor = covariance_factor(covariance)
+    horizons = list(horizons)
+
+    block_sizes = [SIMULATION_BLOCK] * (simulations // SIMULATION_BLOCK)
+    if simulations % SIMULATION_BLOCK:
+        block_sizes.append(simulations % SIMULATION_BLOCK)
+    seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+    blocks = [(block_seed, size, mean, factor, exposures, horizons) for block_seed, size in zip(seeds, block_sizes)]
+
+    with instrumentation.stage("simulation"):
+        if workers > 1 and len(blocks) > 1:
+            # The API serves requests from threads, which fork() does not carry safely into children
+            context = multiprocessing.get_context("forkserver")
+            with ProcessPoolExecutor(max_workers=min(workers, len(blocks)), mp_context=context) as executor:
+                losses = np.hstack(list(executor.map(_simulate_block, blocks)))
+        else:
+            losses = np.hstack([_simulate_block(block) for block in blocks])
+        instrumentation.count_ops(float_=simulations * factor.shape[0] * (factor.shape[1] + 2 * len(horizons)))
+
+    return {
+        (confidence, horizon): _tail(losses[row], confidence)
+        for row, horizon in enumerate(horizons)
+        for confidence in confidence_levels
+    }
+
+
+def validate(methods, confidence_levels, horizons) -> None:
+    for method in methods:
+        if method not in VAR_METHODS:
+            raise ValueError(f"Invalid VaR method: {method}. Must be one of {', '.join(VAR_METHODS)}")
+    for confidence in confidence_levels:
+        if not 0 < confidence < 1:
+            raise ValueError(f"Confidence levels must be between 0 and 1, got {confidence}")
+    for horizon in horizons:
+        if horizon < 1:
+            raise ValueError(f"Horizons must be at least 1 day, got {horizon}")
+
+
+def value_at_risk(
+    returns: np.ndarray,
+    exposures: np.ndarray,
+    methods=VAR_METHODS,
+    confidence_levels=DEFAULT_CONFIDENCE_LEVELS,
+    horizons=DEFAULT_HORIZONS,
+    simulations: int = DEFAULT_SIMULATIONS,
+    seed: int = DEFAULT_SEED,
+    workers: int = 1,
+) -> list[dict]:
+    """VaR and CVaR of the exposures for every method, confidence level and horizon"""
+    validate(methods, confidence_levels, horizons)
+    calculations = {
+        "historical": lambda: historical_var(returns, exposures, confidence_levels, horizons),
+        "parametric": lambda: parametric_var(returns, exposures, confidence_levels, horizons),
+        "monte_carlo": lambda: monte_carlo_var(
+            returns, exposures, confidence_levels, horizons, simulations, seed, workers
+        ),
+    }
+    rows = []
+    for method in methods:
+        results = calculations[method]() if len(returns) > 1 else {}
+        for confidence in confidence_levels:
+            for horizon in horizons:
+                var, cvar = results.get((confidence, horizon), (None, None))
+                rows.append({
+                    "method": method, "confidence": confidence, "horizon_days": horizon, "var": var, "cvar": cvar,
+                })
+    return rows
+
+
+class RiskService:
+    """Service for the market risk of portfolio holdings"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def exposures(self, portfolio_id: int, as_of_date: date) -> dict[int, float]:
+        """Market value in primary currency of each position held on as_of_date"""
+        currency_service = CurrencyService(self.session)
+        exposures = {}
+        for position in PositionService(self.session).get_positions_as_of(portfolio_id, as_of_date):
+            if not position.quantity or not position.market_value:
+                continue
+            asset = self.session.get(Asset, position.asset_id)
+            exposures[position.asset_id] = float(
+                currency_service.convert_to_primary_currency(position.market_value, asset.currency_id, as_of_date)
+            )
+        return exposures
+
+    def value_at_risk(
+        self,
+        portfolio_id: int,
+        as_of_date: date,
+        methods=VAR_METHODS,
+        confidence_levels=DEFAULT_CONFIDENCE_LEVELS,
+        horizons=DEFAULT_HORIZONS,
+        window: int = DEFAULT_WINDOW,
+        simulations: int = DEFAULT_SIMULATIONS,
+        seed: int = DEFAULT_SEED,
+        workers: int = 1,
+    ) -> dict:
+        """VaR and CVaR of the holdings on as_of_date from the returns of the window before it"""
+        validate(methods, confidence_levels, horizons)
+        exposures = self.exposures(portfolio_id, as_of_date)
+        matrix = load_returns(self.session, list(exposures), as_of_date, window)
+        weights = np.array([exposures[asset_id] for asset_id in matrix.asset_ids])
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of_date": as_of_date.isoformat(),
+            "total_value": sum(exposures.values()),
+            "observations": len(matrix.dates),
+            "start_date": matrix.dates[0].isoformat() if matrix.dates else None,
+            "excluded_asset_ids": matrix.excluded_asset_ids,
+            "results": value_at_risk(
+                matrix.returns, weights, methods, confidence_levels, horizons, simulations, seed, workers
+            ),
+        }
@@ -1,11 +1,14 @@
-import numpy as np
 import csv
+from bisect import bisect_right
 from sqlmodel import Session, select
+from sqlalchemy import func, delete
+from sqlalchemy.exc import IntegrityError
 from datetime import date, timedelta
 from decimal import Decimal
 from pathlib import Path
 
 from collections import defaultdict
+from itertools import chain
 
 from backend.models import (
     Currency,
@@ -14,10 +17,28 @@ from backend.models import (
     AssetMetadata,
     Transaction,
     Price,
+    Portfolio,
     Position,
+    PortfolioDailyValue,
+    PortfolioGroup,
+    PortfolioGroupMember,
     Settings,
 )
-from backend import logger, f_logger
+from backend import logger, f_logger, instrumentation, realtime, trading_calendar
+
+# Approximate number of Decimal arithmetic operations per transaction action,
+# reported to the instrumentation by PositionService.apply_transaction()
+_DECIMAL_OPS_PER_ACTION = {
+    "buy": 7,
+    "sell": 5,
+    "dividends": 4,
+    "split": 2,
+    "cash_in": 1,
+    "cash_out": 1,
+}
+
+# Arithmetic of the NAV calculations: exact Decimal or the float64 engine of backend/numeric.py
+NUMERIC_MODES = ("decimal", "float")
 
 
 class CurrencyService:
@@ -47,12 +68,13 @@ class CurrencyService:
             return Decimal("1.0")
 
         # Get the most recent exchange rate before or on the date
-        rate = self.session.exec(
-            select(ExchangeRate)
-            .where(ExchangeRate.currency_id == currency_id)
-            .where(ExchangeRate.rate_date <= rate_date)
-            .order_by(ExchangeRate.rate_date.desc())
-        ).first()
+        with instrumentation.stage("load_prices"):
+            rate = self.session.exec(
+                select(ExchangeRate)
+                .where(ExchangeRate.currency_id == currency_id)
+                .where(ExchangeRate.rate_date <= rate_date)
+                .order_by(ExchangeRate.rate_date.desc())
+            ).first()
 
         return rate.rate_to_primary if rate else Decimal("1.0")
 
@@ -77,6 +99,17 @@ class PriceService:
         if as_of_date is None:
             as_of_date = date.today()
 
+        # Prices received from the intraday feed today are read from memory
+        live_price = realtime.feed.live_price(self.session.get_bind(), asset_id, as_of_date)
+        if live_price is not None:
+            return Price(
+                asset_id=asset_id,
+                price_date=as_of_date,
+                price=live_price,
+                price_type="real_time",
+                source="feed",
+            )
+
         # Check if this is a cash asset
         asset = self.session.get(Asset, asset_id)
         if asset and asset.type == "cash":
@@ -89,12 +122,13 @@ class PriceService:
                 source="system",
             )
 
-        price = self.session.exec(
-            select(Price)
-            .where(Price.asset_id == asset_id)
-            .where(Price.price_date <= as_of_date)
-            .order_by(Price.price_date.desc())
-        ).first()
+        with instrumentation.stage("load_prices"):
+            price = self.session.exec(
+                select(Price)
+                .where(Price.asset_id == asset_id)
+                .where(Price.price_date <= as_of_date)
+                .order_by(Price.price_date.desc())
+            ).first()
 
         return price
 
@@ -113,6 +147,149 @@ class PriceService:
         return prices
 
 
+class MarketDataSnapshot:
+    """In-memory snapshot of prices and exchange rates for a date range.
+
+    Batch calculations value many holdings on many days. Instead of one query per
+    position and per day, the snapshot loads the last price and exchange rate on or
+    before start_date plus every row up to end_date, and answers point-in-time
+    lookups with a binary search. Lookups follow the same rules as PriceService and
+    CurrencyService: cash is always priced at 1.0, and a missing exchange rate is 1.0.
+    """
+
+    def __init__(self, session: Session, start_date: date, end_date: date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.primary_currency_id = CurrencyService(session).get_primary_currency().id
+
+        self.assets = {asset.id: asset for asset in session.exec(select(Asset)).all()}
+        currency_codes = {
+            currency.id: currency.code for currency in session.exec(select(Currency)).all()
+        }
+        cash_asset_ids = {
+            asset.symbol: asset.id for asset in self.assets.values() if asset.type == "cash"
+        }
+        self.cash_asset_ids = {
+            currency_id: cash_asset_ids[f"{code}_CASH"]
+            for currency_id, code in currency_codes.items()
+            if f"{code}_CASH" in cash_asset_ids
+        }
+
+        with instrumentation.stage("load_prices"):
+            self._prices = self._load_series(
+                session, Price, Price.asset_id, Price.price_date, Price.price
+            )
+            self._rates = self._load_series(
+                session,
+                ExchangeRate,
+                ExchangeRate.currency_id,
+                ExchangeRate.rate_date,
+                ExchangeRate.rate_to_primary,
+            )
+        self.calendars = trading_calendar.load_calendars(session)
+
+    def _load_series(self, session: Session, model, key_column, date_column, value_column) -> dict:
+        """Load a point-in-time series per key as sorted (dates, values) lists"""
+        # The latest row on or before start_date anchors each series
+        anchor_dates = (
+            select(key_column.label("key"), func.max(date_column).label("anchor_date"))
+            .where(date_column <= self.start_date)
+            .group_by(key_column)
+            .subquery()
+        )
+        anchor_rows = session.exec(
+            select(key_column, date_column, value_column).join(
+                anchor_dates,
+                (key_column == anchor_dates.c.key)
+                & (date_column == anchor_dates.c.anchor_date),
+            )
+        ).all()
+        range_rows = session.exec(
+            select(key_column, date_column, value_column)
+            .where(date_column > self.start_date)
+            .where(date_column <= self.end_date)
+            .order_by(key_column, date_column)
+        ).all()
+
+        instrumentation.count_rows(len(anchor_rows) + len(range_rows))
+        series = defaultdict(lambda: ([], []))
+        for key, row_date, value in [*anchor_rows, *range_rows]:
+            dates, values = series[key]
+            dates.append(row_date)
+            values.append(value)
+        return dict(series)
+
+    @staticmethod
+    def _lookup(series: dict, key: int, on_date: date) -> Decimal | None:
+        """Get the latest value of a series on or before on_date"""
+        if key not in series:
+            return None
+        dates, values = series[key]
+        index = bisect_right(dates, on_date)
+        return values[index - 1] if index else None
+
+    def valuation_days(self, transactions: list[Transaction], start_date: date, end_date: date) -> list[date]:
+        """The days from start_date to end_date on which the value of a ledger can change.
+
+        These are the trading days of the exchanges listing its assets and the days of
+        its transactions and of the exchange rates of its currencies. On the other days
+        no price, rate or holding changes, so the value is the one of the day before.
+        """
+        assets = [self.assets[asset_id] for asset_id in {transaction.asset_id for transaction in transactions}]
+        calendar = trading_calendar.calendar_for_assets(self.calendars, assets)
+        currency_ids = {asset.currency_id for asset in assets} | {transaction.currency_id for transaction in transactions}
+        rate_dates = [
+            rate_date for currency_id in currency_ids if currency_id in self._rates
+            for rate_date in self._rates[currency_id][0]
+        ]
+        return calendar.valuation_days(
+            start_date, end_date, [*(transaction.trade_date for transaction in transactions), *rate_dates]
+        )
+
+    def get_cash_asset_id(self, currency_id: int) -> int:
+        """Get the cash asset id for a currency"""
+        if currency_id not in self.cash_asset_ids:
+            raise ValueError(f"Cash asset not found for currency {currency_id}")
+        return self.cash_asset_ids[currency_id]
+
+    def get_price(self, asset_id: int, on_date: date) -> Decimal | None:
+        """Get the latest price of an asset on or before on_date"""
+        asset = self.assets.get(asset_id)
+        if asset and asset.type == "cash":
+            return Decimal("1.0")
+        return self._lookup(self._prices, asset_id, on_date)
+
+    def get_exchange_rate(self, currency_id: int, on_date: date) -> Decimal:
+        """Get the exchange rate to primary currency on or before on_date"""
+        if currency_id == self.primary_currency_id:
+            return Decimal("1.0")
+        rate = self._lookup(self._rates, currency_id, on_date)
+        return rate if rate is not None else Decimal("1.0")
+
+    def convert_to_primary_currency(
+        self, amount: Decimal, currency_id: int, on_date: date
+    ) -> Decimal:
+        """Convert amount to primary currency"""
+        return amount * self.get_exchange_rate(currency_id, on_date)
+
+    def value_positions(self, positions: dict[int, Position], on_date: date) -> Decimal:
+        """Total market value in primary currency of in-memory positions on a date.
+
+        Positions without any price are valued at 0, like a full replay in
+        PositionService.update_positions_for_period().
+        """
+        total_value = Decimal("0")
+        for asset_id, position in positions.items():
+            price = self.get_price(asset_id, on_date)
+            if price is None or not position.quantity:
+                continue
+            total_value += self.convert_to_primary_currency(
+                position.quantity * price, self.assets[asset_id].currency_id, on_date
+            )
+            instrumentation.count_ops(decimal=3)
+        return total_value
+
+
 class PortfolioService:
     """Service for portfolio calculations and statistics"""
 
@@ -128,23 +305,10 @@ class PortfolioService:
         if as_of_date is None:
             as_of_date = date.today()
 
-        # Try to get positions for the exact date
-        positions = self.session.exec(
-            select(Position)
-            .where(Position.portfolio_id == portfolio_id)
-            .where(Position.position_date == as_of_date)
-        ).all()
-
-        # If no positions found for the exact date, calculate positions up to the date
-        if not positions:
-            position_service = PositionService(self.session)
-            positions_dict = position_service.update_positions_for_period(
-                portfolio_id=portfolio_id,
-                start_date=date(1982, 1, 1),
-                end_date=as_of_date,
-                save_to_db=True,
-            )
-            positions = list(positions_dict.values())
+        # Positions of the exact date, or resolved from the nearest earlier snapshot
+        positions = PositionService(self.session).get_positions_as_of(
+            portfolio_id, as_of_date, write_back=True
+        )
 
         if not positions:
             return {
@@ -156,38 +320,40 @@ class PortfolioService:
         total_value = Decimal("0")
         positions_value = []
 
-        for position in positions:
-            # Convert to primary currency
-            asset = self.session.get(Asset, position.asset_id)
-            if asset:
-                market_value_primary = (
-                    self.currency_service.convert_to_primary_currency(
-                        position.market_value, asset.currency_id, as_of_date
+        with instrumentation.stage("valuation"):
+            for position in positions:
+                # Convert to primary currency
+                asset = self.session.get(Asset, position.asset_id)
+                if asset:
+                    market_value_primary = (
+                        self.currency_service.convert_to_primary_currency(
+                            position.market_value, asset.currency_id, as_of_date
+                        )
                     )
-                )
-                total_pnl_primary = (
-                    self.currency_service.convert_to_primary_currency(
-                        position.total_pnl, asset.currency_id, as_of_date
+                    total_pnl_primary = (
+                        self.currency_service.convert_to_primary_currency(
+                            position.total_pnl, asset.currency_id, as_of_date
+                        )
                     )
+                else:
+                    raise ValueError(f"Asset {position.asset_id} not found")
+
+                total_value += market_value_primary
+
+                positions_value.append(
+                    {
+                        "asset_id": position.asset_id,
+                        "symbol": asset.symbol if asset else "Unknown",
+                        "name": asset.name if asset else "Unknown",
+                        "quantity": position.quantity,
+                        "current_price": position.current_price,
+                        "market_value": position.market_value,
+                        "market_value_primary": market_value_primary,
+                        "total_pnl": position.total_pnl,
+                        "total_pnl_primary": total_pnl_primary,
+                    }
                 )
-            else:
-                raise ValueError(f"Asset {position.asset_id} not found")
-
-            total_value += market_value_primary
-
-            positions_value.append(
-                {
-                    "asset_id": position.asset_id,
-                    "symbol": asset.symbol if asset else "Unknown",
-                    "name": asset.name if asset else "Unknown",
-                    "quantity": position.quantity,
-                    "current_price": position.current_price,
-                    "market_value": position.market_value,
-                    "market_value_primary": market_value_primary,
-                    "total_pnl": position.total_pnl,
-                    "total_pnl_primary": total_pnl_primary,
-                }
-            )
+                instrumentation.count_ops(decimal=3)
 
         return {
             "total_value": total_value,
@@ -204,22 +370,53 @@ class PortfolioService:
             writer.writerows(data_rows)
 
     def twr(
-        self, portfolio_id: int, start_date: date, end_date: date
+        self, portfolio_id: int, start_date: date, end_date: date, numeric_mode: str = "decimal"
     ) -> dict:
-        """Calculate Time-Weighted Return (TWR) for portfolio"""
+        """Calculate Time-Weighted Return (TWR) for portfolio.
+
+        With numeric_mode="float" the NAV series is calculated in memory on float64
+        arrays (see backend/numeric.py) and no positions are written to the database.
+        """
+        # Unknown modes raise like in batch_nav_series()
+        self.nav_series_engine(numeric_mode)
+        if numeric_mode == "float":
+            result = self.batch_nav_series([portfolio_id], start_date, end_date, numeric_mode=numeric_mode)
+            result = result[portfolio_id]
+            result.pop("values")
+            result.pop("cash_flows")
+            return result
+
         try:
-            transactions = self.session.exec(
-                select(Transaction)
-                .where(Transaction.trade_date >= start_date)
-                .where(Transaction.trade_date <= end_date)
-                .order_by(Transaction.trade_date)
-            ).all()
+            if self.session.get(Portfolio, portfolio_id) is None:
+                raise ValueError(f"Portfolio {portfolio_id} not found")
+
+            with instrumentation.stage("load_ledger"):
+                transactions = self.session.exec(
+                    select(Transaction)
+                    .where(Transaction.portfolio_id == portfolio_id)
+                    .where(Transaction.trade_date >= start_date)
+                    .where(Transaction.trade_date <= end_date)
+                    .order_by(Transaction.trade_date)
+                ).all()
 
             # Group transactions by date
             daily_transactions = defaultdict(list)
             for transaction in transactions:
                 daily_transactions[transaction.trade_date].append(transaction)
 
+            # Only the days on which the value can change are revalued, see MarketDataSnapshot.valuation_days()
+            rate_dates = self.session.exec(
+                select(ExchangeRate.rate_date)
+                .where(ExchangeRate.rate_date > start_date)
+                .where(ExchangeRate.rate_date <= end_date)
+                .distinct()
+            ).all()
+            valuation_days = set(
+                trading_calendar.calendar_for_portfolio(self.session, portfolio_id).valuation_days(
+                    start_date, end_date, [*daily_transactions, *rate_dates, date.today()]
+                )
+            )
+
             # Initialize variables for TWR calculation
             daily_returns = [] 
             nav_history = []  
@@ -245,7 +442,11 @@ class PortfolioService:
 
             while current_date <= end_date:
                 # Step 1. Prepare data for today
-                v_today = self.calculate_portfolio_value(portfolio_id, current_date)["total_value"]
+                if current_date in valuation_days:
+                    v_today = self.calculate_portfolio_value(portfolio_id, current_date)["total_value"]
+                else:
+                    # Nothing trades or changes hands, so the value is the one of the day before
+                    v_today = v_prev
 
                 # Step 2. Calculate external net cash flow in primary currency
                 delta_cf = Decimal("0")
@@ -261,29 +462,10 @@ class PortfolioService:
                         )
                         delta_cf -= amount
                 
-                # Step 3. Calculate the nav for current day by 2 methods
-
-                # The first method: nav_today = (v_today - delta_cf) / shares_prev
-                if shares_prev > 0:   # Handle division by zero for shares calculation
-                    nav_today = (v_today - delta_cf) / shares_prev
-                else:
-                    nav_today = nav_prev
-
-                # The second method: nav_today = nav_prev * (1 + r)
-                if v_prev > 0:  # Handle division by zero for shares calculation
-                    r = (v_today - delta_cf) / v_prev - 1
-                else:
-                    r = Decimal("0")
-                nav_ref_today = nav_prev * (1 + r)
-                
-                # Nav calculated by 2 methods should be the same
-                nav_diff = nav_today - nav_ref_today
-                if abs(nav_diff) > 0.0001:
-                    raise ValueError(f"NAV calculation error on {current_date}. nav_ref:{nav_ref_today}, nav:{nav_today}, diff:{nav_diff}")
-
-                # Step 4. Modify shares for today
-                delta_shares = delta_cf / nav_today
-                shares_today = shares_prev + delta_shares
+                # Step 3 and 4. Calculate the nav for current day and modify shares
+                nav_today, shares_today, r = self._advance_nav(
+                    current_date, v_today, delta_cf, v_prev, nav_prev, shares_prev
+                )
                 
                 # Store daily data
                 daily_returns.append(float(r))
@@ -302,60 +484,285 @@ class PortfolioService:
                 nav_prev = nav_today
                 current_date += timedelta(days=1)
             
-            # Calculate cumulative TWR
-            if len(daily_returns) > 0:
-                # TWR = (1 + r1) * (1 + r2) * ... * (1 + rn) - 1
-                cumulative_return = 1.0
-                for r in daily_returns:
-                    cumulative_return *= (1 + r)
-                
-                twr = cumulative_return - 1
-                period_return = twr
-            else:
-                twr = 0.0
-                period_return = 0.0
-            
-            # Annualize return
-            days = (end_date - start_date).days
-            if days > 0 and len(daily_returns) > 0:
-                annualized_return = (1 + twr) ** (365 / days) - 1
-            else:
-                annualized_return = 0.0
-            
-            # Calculate beginning and ending values
-            beginning_value = float(nav_history[0]) if nav_history else 0.0
-            ending_value = float(nav_history[-1]) if nav_history else 0.0
-            result = {
-                "twr": float(twr),
-                "period_return": float(period_return),
-                "annualized_return": annualized_return,
-                "beginning_value": beginning_value,
-                "ending_value": ending_value,
-                "daily_returns": daily_returns,
-                "nav_history": nav_history,
-                "shares_history": shares_history,
-                "dates": dates_history,
-            }
-            
-            return result
+            return self._summarize_twr(
+                start_date, end_date, daily_returns, nav_history, shares_history, dates_history
+            )
             
         except Exception as e:
             logger.exception("Error in PortfolioService.twr()")
 
-            return {
-                "twr": 0.0,
-                "period_return": 0.0,
-                "annualized_return": 0.0,
-                "beginning_value": 0.0,
-                "ending_value": 0.0,
-                "daily_returns": [],
-                "nav_history": [],
-                "shares_history": [],
-                "dates": [],
-            }
+            return self._empty_twr_result()
+
+    @staticmethod
+    def _advance_nav(
+        current_date: date,
+        v_today: Decimal,
+        delta_cf: Decimal,
+        v_prev: Decimal,
+        nav_prev: Decimal,
+        shares_prev: Decimal,
+    ) -> tuple[Decimal, Decimal, Decimal]:
+        """Advance the fund NAV by one day.
+
+        Args:
+            current_date: the day being calculated, only used in error messages
+            v_today: portfolio value at the end of the day, including today's cash flows
+            delta_cf: external net cash flow of the day in primary currency
+            v_prev: portfolio value at the end of the previous day
+            nav_prev: NAV per share at the end of the previous day
+            shares_prev: total shares at the end of the previous day
+        Returns:
+            A tuple of (nav_today, shares_today, r) where r is the daily return.
+        """
+        # The first method: nav_today = (v_today - delta_cf) / shares_prev
+        if shares_prev > 0:   # Handle division by zero for shares calculation
+            nav_today = (v_today - delta_cf) / shares_prev
+        else:
+            nav_today = nav_prev
+
+        # The second method: nav_today = nav_prev * (1 + r)
+        if v_prev > 0:  # Handle division by zero for shares calculation
+            r = (v_today - delta_cf) / v_prev - 1
+        else:
+            r = Decimal("0")
+        nav_ref_today = nav_prev * (1 + r)
+
+        # Nav calculated by 2 methods should be the same
+        nav_diff = nav_today - nav_ref_today
+        if abs(nav_diff) > 0.0001:
+            raise ValueError(f"NAV calculation error on {current_date}. nav_ref:{nav_ref_today}, nav:{nav_today}, diff:{nav_diff}")
+
+        # Modify shares for today
+        delta_shares = delta_cf / nav_today
+        shares_today = shares_prev + delta_shares
+        instrumentation.count_ops(decimal=10)
+        return nav_today, shares_today, r
+
+    @staticmethod
+    def _summarize_twr(
+        start_date: date,
+        end_date: date,
+        daily_returns: list[float],
+        nav_history: list[float],
+        shares_history: list[float],
+        dates_history: list[date],
+    ) -> dict:
+        """Build the twr() result dictionary from the daily NAV series"""
+        # Calculate cumulative TWR
+        if len(daily_returns) > 0:
+            # TWR = (1 + r1) * (1 + r2) * ... * (1 + rn) - 1
+            cumulative_return = 1.0
+            for r in daily_returns:
+                cumulative_return *= (1 + r)
+            instrumentation.count_ops(float_=2 * len(daily_returns))
+
+            twr = cumulative_return - 1
+            period_return = twr
+        else:
+            twr = 0.0
+            period_return = 0.0
+
+        # Annualize return
+        days = (end_date - start_date).days
+        if days > 0 and len(daily_returns) > 0:
+            annualized_return = (1 + twr) ** (365 / days) - 1
+        else:
+            annualized_return = 0.0
+
+        # Calculate beginning and ending values
+        beginning_value = float(nav_history[0]) if nav_history else 0.0
+        ending_value = float(nav_history[-1]) if nav_history else 0.0
+        return {
+            "twr": float(twr),
+            "period_return": float(period_return),
+            "annualized_return": annualized_return,
+            "beginning_value": beginning_value,
+            "ending_value": ending_value,
+            "daily_returns": daily_returns,
+            "nav_history": nav_history,
+            "shares_history": shares_history,
+            "dates": dates_history,
+        }
+
+    @staticmethod
+    def _empty_twr_result() -> dict:
+        """The twr() result returned when the calculation fails"""
+        return {
+            "twr": 0.0,
+            "period_return": 0.0,
+            "annualized_return": 0.0,
+            "beginning_value": 0.0,
+            "ending_value": 0.0,
+            "daily_returns": [],
+            "nav_history": [],
+            "shares_history": [],
+            "dates": [],
+        }
+
+    def batch_nav_series(
+        self,
+        portfolio_ids: list[int] | None,
+        start_date: date,
+        end_date: date,
+        snapshot: "MarketDataSnapshot | None" = None,
+        numeric_mode: str = "decimal",
+    ) -> dict[int, dict]:
+        """Calculate the TWR NAV series of many portfolios in one pass.
+
+        Prices and exchange rates are loaded once into a MarketDataSnapshot and the
+        transactions of all portfolios are loaded with a single query. Every ledger
+        is then replayed in memory with the same rules as update_positions_for_period()
+        and valued daily against the shared snapshot. Nothing is written to the database.
+
+        Args:
+            portfolio_ids: the portfolios to calculate, or None for all portfolios
+            start_date: the first day of the NAV series (NAV is 1.0 on this day)
+            end_date: the last day of the NAV series
+            snapshot: an already loaded snapshot covering start_date to end_date
+            numeric_mode: "decimal" for exact Decimal arithmetic or "float" for the
+                float64 engine of backend/numeric.py
+        Returns:
+            A dictionary of portfolio_id to a twr() style result, with extra "values"
+            and "cash_flows" lists holding the daily portfolio value and external net
+            cash flow in primary currency.
+        """
+        nav_series_from_ledger = self.nav_series_engine(numeric_mode)
+
+        if portfolio_ids is None:
+            portfolio_ids = list(self.session.exec(select(Portfolio.id)).all())
+        if snapshot is None:
+            snapshot = MarketDataSnapshot(self.session, start_date, end_date)
+
+        with instrumentation.stage("load_ledger"):
+            transactions = self.session.exec(
+                select(Transaction)
+                .where(Transaction.portfolio_id.in_(portfolio_ids))
+                .where(Transaction.trade_date <= end_date)
+                .order_by(Transaction.portfolio_id, Transaction.trade_date, Transaction.id)
+            ).all()
+        ledgers = defaultdict(list)
+        for transaction in transactions:
+            ledgers[transaction.portfolio_id].append(transaction)
+
+        existing_ids = set(
+            self.session.exec(select(Portfolio.id).where(Portfolio.id.in_(portfolio_ids))).all()
+        )
+        results = {}
+        for portfolio_id in portfolio_ids:
+            try:
+                if portfolio_id not in existing_ids:
+                    raise ValueError(f"Portfolio {portfolio_id} not found")
+                results[portfolio_id] = nav_series_from_ledger(
+                    ledgers.get(portfolio_id, []), snapshot, start_date, end_date
+                )
+            except Exception:
+                logger.exception(f"Error calculating NAV series for portfolio {portfolio_id}")
+                results[portfolio_id] = self._empty_twr_result() | {"values": [], "cash_flows": []}
+        return results
+
+    def nav_series_engine(self, numeric_mode: str):
+        """The function replaying a sorted ledger into a NAV series in the given numeric mode"""
+        if numeric_mode == "float":
+            from backend import numeric
+
+            return numeric.nav_series_from_ledger
+        if numeric_mode == "decimal":
+            return self._nav_series_from_ledger
+        raise ValueError(f"Invalid numeric mode: {numeric_mode}. Must be one of {', '.join(NUMERIC_MODES)}")
+
+    def _nav_series_from_ledger(
+        self,
+        transactions: list[Transaction],
+        snapshot: "MarketDataSnapshot",
+        start_date: date,
+        end_date: date,
+    ) -> dict:
+        """Replay a sorted ledger in memory and calculate its daily NAV series"""
+        positions: dict[int, Position] = {}
+        next_index = 0
+
+        def replay_until(day: date) -> list[Transaction]:
+            nonlocal next_index
+            applied = []
+            with instrumentation.stage("replay"):
+                while next_index < len(transactions) and transactions[next_index].trade_date <= day:
+                    transaction = transactions[next_index]
+                    PositionService.apply_transaction(
+                        positions,
+                        transaction,
+                        snapshot.get_cash_asset_id(transaction.currency_id),
+                        day,
+                    )
+                    applied.append(transaction)
+                    next_index += 1
+            return applied
+
+        def net_cash_flow(applied: list[Transaction], day: date) -> Decimal:
+            delta_cf = Decimal("0")
+            for transaction in applied:
+                if transaction.trade_date != day:
+                    continue
+                if transaction.action == "cash_in":
+                    delta_cf += snapshot.convert_to_primary_currency(
+                        transaction.amount, transaction.currency_id, day
+                    )
+                elif transaction.action == "cash_out":
+                    delta_cf -= snapshot.convert_to_primary_currency(
+                        transaction.amount, transaction.currency_id, day
+                    )
+            return delta_cf
+
+        # The first day is only for initialization of navs and shares.
+        # Its cash flow is reported but already part of the initial shares.
+        first_cash_flow = net_cash_flow(replay_until(start_date), start_date)
+        with instrumentation.stage("valuation"):
+            v_prev = snapshot.value_positions(positions, start_date)
+        nav_prev = Decimal("1.0")
+        shares_prev = v_prev / nav_prev
+        daily_returns = []
+        nav_history = [float(nav_prev)]
+        shares_history = [float(shares_prev)]
+        values = [float(v_prev)]
+        cash_flows = [float(first_cash_flow)]
+        dates_history = [start_date]
+
+        valuation_days = set(snapshot.valuation_days(transactions, start_date, end_date))
+        current_date = start_date + timedelta(days=1)
+        while current_date <= end_date:
+            delta_cf = net_cash_flow(replay_until(current_date), current_date)
+            if current_date in valuation_days:
+                with instrumentation.stage("valuation"):
+                    v_today = snapshot.value_positions(positions, current_date)
+            else:
+                # Forward fill the days without trading, transactions or exchange rates
+                v_today = v_prev
+            nav_today, shares_today, r = self._advance_nav(
+                current_date, v_today, delta_cf, v_prev, nav_prev, shares_prev
+            )
+
+            daily_returns.append(float(r))
+            nav_history.append(float(nav_today))
+            shares_history.append(float(shares_today))
+            values.append(float(v_today))
+            cash_flows.append(float(delta_cf))
+            dates_history.append(current_date)
+
+            v_prev = v_today
+            shares_prev = shares_today
+            nav_prev = nav_today
+            current_date += timedelta(days=1)
+
+        result = self._summarize_twr(
+            start_date, end_date, daily_returns, nav_history, shares_history, dates_history
+        )
+        result["values"] = values
+        result["cash_flows"] = cash_flows
+        return result
 
     def _validate_numeric_value(self, value, default=0.0):
         """Helper function to validate numeric values"""
+        import numpy as np
+
         if np.iscomplex(value) or np.isnan(value) or np.isinf(value):
             return default
         return float(np.real(value))
@@ -374,9 +781,19 @@ class PortfolioService:
             return 0.0
 
     def calculate_portfolio_statistics(
-        self, portfolio_id: int, start_date: date, end_date: date
+        self,
+        portfolio_id: int,
+        start_date: date,
+        end_date: date,
+        twr_data: dict | None = None,
+        calendar: "trading_calendar.TradingCalendar | None" = None,
     ) -> dict:
         """Calculate portfolio performance statistics during a period.
+        Args:
+            twr_data: an already calculated twr() result for the period, e.g. from
+                DailyValueService.twr(); twr() is called when it is None
+            calendar: the trading calendar of the returns, by default the one of
+                the exchanges the portfolio traded on
         Returns:
             A dictionary containing the calculated statistics.
             "time_weighted_return": calculated by twr()
@@ -388,9 +805,12 @@ class PortfolioService:
             "sharpe_ratio": 
             "period_days": days between start_date and end_date
         """
+        import numpy as np
+
         period_days = (end_date - start_date).days
         try:
-            twr_data = self.twr(portfolio_id, start_date, end_date)
+            if twr_data is None:
+                twr_data = self.twr(portfolio_id, start_date, end_date)
         except Exception as e:
             logger.exception(f"Error calculating twr: {e}")
             return {
@@ -411,11 +831,24 @@ class PortfolioService:
         if len(daily_returns) > 1:
             # Convert to numpy array and ensure it's real
             returns_array = np.array(daily_returns, dtype=float)
+            instrumentation.count_ops(float_=3 * len(returns_array))
 
             # Calculate volatility
             try:
                 years = period_days / 365.25  # Account for leap years
-                trading_days_per_year = 240  # Use 240 trading days per year to calculate annualized volatility
+                # Returns between trading days; the forward-filled days in between add nothing
+                if calendar is None:
+                    calendar = trading_calendar.calendar_for_portfolio(self.session, portfolio_id)
+                dates = twr_data.get("dates", [])
+                nav_history = twr_data.get("nav_history", [])
+                if len(dates) == len(nav_history) == len(returns_array) + 1:
+                    trading_navs = np.array([
+                        nav for index, (day, nav) in enumerate(zip(dates, nav_history))
+                        if index == 0 or calendar.is_trading_day(day)
+                    ], dtype=float)
+                    if len(trading_navs) > 2:
+                        returns_array = trading_navs[1:] / trading_navs[:-1] - 1
+                trading_days_per_year = calendar.trading_days_per_year(start_date, end_date)
                 volatility = np.std(returns_array, ddof=1) * np.sqrt(trading_days_per_year * years)
                 volatility = self._validate_numeric_value(volatility, 0.0)
             except Exception as e:
@@ -464,6 +897,8 @@ class PortfolioService:
 
     def _calculate_max_drawdown(self, nav_history: list[float]) -> float:
         """Calculate maximum drawdown using NAV history"""
+        import numpy as np
+
         if not nav_history or len(nav_history) < 2:
             return 0.0
 
@@ -491,6 +926,85 @@ class PortfolioService:
             logger.exception(f"Error calculating max drawdown: {e}")
             return 0.0
 
+    def money_weighted_returns(
+        self, portfolio_id: int, end_date: date, start_date: date | None = None
+    ) -> dict:
+        """
+        Money-weighted return (XIRR) of a portfolio and of each asset it held.
+
+        The cash flows of the portfolio are its cash_in (negative) and cash_out
+        (positive) transactions, those of an asset its purchases (negative), sales
+        and dividends (positive). Both end with the market value on end_date, and
+        with a start_date they begin with the negative market value of the day
+        before. Amounts are converted to primary currency on their dates, and the
+        series of the portfolio and of all its assets are solved together.
+
+        Returns:
+            A dictionary with "irr", the XIRR of the portfolio, and "assets", a
+            dictionary of asset_id to XIRR. Each is None when it does not exist.
+        """
+        from backend import irr
+
+        statement = (
+            select(Transaction)
+            .where(Transaction.portfolio_id == portfolio_id)
+            .where(Transaction.trade_date <= end_date)
+            .order_by(Transaction.trade_date, Transaction.id)
+        )
+        if start_date is not None:
+            statement = statement.where(Transaction.trade_date >= start_date)
+        with instrumentation.stage("load_ledger"):
+            transactions = self.session.exec(statement).all()
+
+        # Exchange rates of all flow dates are loaded at once
+        if start_date is not None:
+            first_date = start_date - timedelta(days=1)
+        else:
+            first_date = transactions[0].trade_date if transactions else end_date
+        snapshot = MarketDataSnapshot(self.session, first_date, end_date)
+        position_service = PositionService(self.session)
+
+        def to_primary(amount: Decimal, currency_id: int, on_date: date) -> float:
+            return float(snapshot.convert_to_primary_currency(amount, currency_id, on_date))
+
+        portfolio_flows = []
+        asset_flows = defaultdict(list)
+
+        def add_market_values(positions: list[Position], on_date: date, sign: int):
+            total_value = 0.0
+            for position in positions:
+                if not position.market_value:
+                    continue
+                asset = snapshot.assets[position.asset_id]
+                value = to_primary(position.market_value, asset.currency_id, on_date)
+                total_value += value
+                if asset.type != "cash":
+                    asset_flows[asset.id].append((on_date, sign * value))
+            portfolio_flows.append((on_date, sign * total_value))
+
+        if start_date is not None:
+            add_market_values(position_service.get_positions_as_of(portfolio_id, first_date), first_date, -1)
+
+        for transaction in transactions:
+            trade_date = transaction.trade_date
+            amount = to_primary(transaction.amount, transaction.currency_id, trade_date)
+            fees = to_primary(transaction.fees or Decimal("0"), transaction.currency_id, trade_date)
+            if transaction.action == "cash_in":
+                portfolio_flows.append((trade_date, -amount))
+            elif transaction.action == "cash_out":
+                portfolio_flows.append((trade_date, amount))
+            elif transaction.action == "buy":
+                asset_flows[transaction.asset_id].append((trade_date, -(amount + fees)))
+            elif transaction.action in ("sell", "dividends"):
+                asset_flows[transaction.asset_id].append((trade_date, amount - fees))
+
+        add_market_values(position_service.get_positions_as_of(portfolio_id, end_date), end_date, 1)
+
+        asset_ids = list(asset_flows)
+        with instrumentation.stage("irr"):
+            rates = irr.xirr_many([portfolio_flows] + [asset_flows[asset_id] for asset_id in asset_ids])
+        return {"irr": rates[0], "assets": dict(zip(asset_ids, rates[1:]))}
+
     def get_asset_allocation(self, portfolio_id: int, as_of_date: date = None, by: str = 'type') -> dict:
         """Get asset allocation by type or sector based on 'by' parameter"""
         if as_of_date is None:
@@ -501,60 +1015,59 @@ class PortfolioService:
             raise ValueError('Invalid "by" parameter. Must be "type" or "sector".')
 
         try:
-            positions = self.session.exec(
-                select(Position)
-                .where(Position.portfolio_id == portfolio_id)
-                .where(Position.position_date == as_of_date)
-            ).all()
+            positions = PositionService(self.session).get_positions_as_of(portfolio_id, as_of_date)
 
             if not positions:
                 return {by: {}, "total_value": 0}
-
-            allocation = defaultdict(Decimal)
-            total_value = Decimal("0")
-
-            for position in positions:
-                if position.market_value and position.market_value > 0:
-                    asset = self.session.get(Asset, position.asset_id)
-                    if asset:
-                        # Convert market value to primary currency
-                        market_value_primary = (
-                            self.currency_service.convert_to_primary_currency(
-                                position.market_value, asset.currency_id, as_of_date
-                            )
-                        )
-                        total_value += market_value_primary
-                        
-                        if by == 'type':
-                            allocation[asset.type] += market_value_primary
-                        else:  # by 'sector'
-                            # Get sector from asset metadata
-                            sector_meta = self.session.exec(
-                                select(AssetMetadata)
-                                .where(AssetMetadata.asset_id == asset.id)
-                                .where(AssetMetadata.attribute_name == "sector")
-                            ).first()
-
-                            if sector_meta:
-                                allocation[sector_meta.attribute_value] += market_value_primary
-                            else:
-                                allocation["Unknown"] += market_value_primary
-            # Convert to percentages
-            percentages = {}
-            if total_value > 0:
-                percentages = {
-                    key: float(value / total_value)
-                    for key, value in allocation.items()
-                }
-            return {
-                "allocation_pct": percentages,
-                "total_value": float(total_value)
-            }
+            return self.allocate_positions(positions, as_of_date, by)
 
         except Exception as e:
             logger.exception(f"Error calculating asset allocation: {e}")
             return {"allocation_pct": {}, "total_value": 0}
 
+    def allocate_positions(self, positions: list[Position], as_of_date: date, by: str = 'type') -> dict:
+        """Allocation percentages of positions by asset type or sector, in primary currency"""
+        allocation = defaultdict(Decimal)
+        total_value = Decimal("0")
+
+        for position in positions:
+            if position.market_value and position.market_value > 0:
+                asset = self.session.get(Asset, position.asset_id)
+                if asset:
+                    # Convert market value to primary currency
+                    market_value_primary = (
+                        self.currency_service.convert_to_primary_currency(
+                            position.market_value, asset.currency_id, as_of_date
+                        )
+                    )
+                    total_value += market_value_primary
+                    
+                    if by == 'type':
+                        allocation[asset.type] += market_value_primary
+                    else:  # by 'sector'
+                        # Get sector from asset metadata
+                        sector_meta = self.session.exec(
+                            select(AssetMetadata)
+                            .where(AssetMetadata.asset_id == asset.id)
+                            .where(AssetMetadata.attribute_name == "sector")
+                        ).first()
+
+                        if sector_meta:
+                            allocation[sector_meta.attribute_value] += market_value_primary
+                        else:
+                            allocation["Unknown"] += market_value_primary
+        # Convert to percentages
+        percentages = {}
+        if total_value > 0:
+            percentages = {
+                key: float(value / total_value)
+                for key, value in allocation.items()
+            }
+        return {
+            "allocation_pct": percentages,
+            "total_value": float(total_value)
+        }
+
 
 class PositionService:
     """Service for position calculations and management"""
@@ -563,6 +1076,8 @@ class PositionService:
         self.session = session
         self.currency_service = CurrencyService(session)
         self.price_service = PriceService(session)
+        # Cash asset per currency id, looked up once per service
+        self._cash_assets: dict[int, Asset | None] = {}
 
     def get_initial_positions(
         self, portfolio_id: int, on_date: date
@@ -578,8 +1093,45 @@ class PositionService:
 
 
 
+    def get_positions_as_of(
+        self, portfolio_id: int, as_of_date: date, write_back: bool = False
+    ) -> list[Position]:
+        """
+        Get the positions of a portfolio on any date from the nearest stored snapshot.
+        Stored positions of as_of_date are returned as they are. Otherwise the latest
+        snapshot before as_of_date is the starting point, and only the transactions
+        after it are replayed in memory and valued at the prices of as_of_date.
+
+        Args:
+            portfolio_id: the portfolio ID
+            as_of_date: the date of the positions
+            write_back: whether to save the resolved positions as a snapshot of as_of_date
+        Returns:
+            A list of Position objects on as_of_date, not saved unless write_back is set.
+        """
+        with instrumentation.stage("load_ledger"):
+            snapshot_date = self.session.exec(
+                select(func.max(Position.position_date))
+                .where(Position.portfolio_id == portfolio_id)
+                .where(Position.position_date <= as_of_date)
+            ).one()
+        if snapshot_date == as_of_date:
+            with instrumentation.stage("load_ledger"):
+                return list(self.get_initial_positions(portfolio_id, as_of_date))
+
+        start_date = snapshot_date + timedelta(days=1) if snapshot_date else date(1982, 1, 1)
+        positions = self.update_positions_for_period(
+            portfolio_id=portfolio_id,
+            start_date=start_date,
+            end_date=as_of_date,
+            save_to_db=write_back,
+        )
+        return list(positions.values())
+
     def _get_cash_asset(self, currency_id: int) -> Asset | None:
         """Get the cash asset for a given currency"""
+        if currency_id in self._cash_assets:
+            return self._cash_assets[currency_id]
         # Get currency code
         currency = self.session.get(Currency, currency_id)
         if not currency:
@@ -593,10 +1145,42 @@ class PositionService:
             .where(Asset.type == "cash")
         ).first()
 
+        self._cash_assets[currency_id] = cash_asset
         return cash_asset
 
+    def invalidate(self, from_date: date, portfolio_id: int | None = None):
+        """Delete the stored positions on or after from_date, for one portfolio or for all of them.
+
+        get_positions_as_of() replays only the transactions after the nearest stored
+        snapshot, so writes of transactions dated on or before a snapshot must call this.
+        """
+        statement = delete(Position).where(Position.position_date >= from_date)
+        if portfolio_id is not None:
+            statement = statement.where(Position.portfolio_id == portfolio_id)
+        self.session.exec(statement)
+        self.session.commit()
+
+    def invalidate_holders(self, asset_ids: list[int], from_date: date):
+        """Delete the stored positions on or after from_date of the portfolios holding any of the assets.
+
+        Stored positions keep the price they were valued at, so new intraday prices must call this.
+        """
+        holders = (
+            select(Position.portfolio_id)
+            .where(Position.asset_id.in_(asset_ids))
+            .where(Position.position_date >= from_date)
+        )
+        self.session.exec(
+            delete(Position).where(Position.position_date >= from_date).where(Position.portfolio_id.in_(holders))
+        )
+        self.session.commit()
+
     def save_positions(self, positions: dict[int, Position]):
         """Save calculated positions to database"""
+        with instrumentation.stage("persist"):
+            self._save_positions(positions)
+
+    def _save_positions(self, positions: dict[int, Position]):
         for position in positions.values():
             # Check if position already exists for this date
             existing_position = self.session.exec(
@@ -619,22 +1203,196 @@ class PositionService:
 
         self.session.commit()
 
-    def get_latest_positions(self, portfolio_id: int) -> list[Position]:
-        """Get the latest positions for a portfolio"""
-        # Get all positions for the portfolio
-        positions = self.session.exec(
-            select(Position)
+    def get_latest_positions(self, portfolio_id: int, as_of_date: date | None = None) -> list[Position]:
+        """Get the latest stored position of each asset, on or before as_of_date if given.
+
+        The latest date per asset is a grouped max served by the
+        (portfolio_id, asset_id, position_date) index, so only one row per asset is loaded.
+        """
+        latest_dates = (
+            select(Position.asset_id, func.max(Position.position_date).label("position_date"))
             .where(Position.portfolio_id == portfolio_id)
-            .order_by(Position.position_date.desc())
-        ).all()
+            .group_by(Position.asset_id)
+        )
+        if as_of_date is not None:
+            latest_dates = latest_dates.where(Position.position_date <= as_of_date)
+        latest_dates = latest_dates.subquery()
 
-        # Get the latest position for each asset
-        latest_positions = {}
-        for position in positions:
-            if position.asset_id not in latest_positions:
-                latest_positions[position.asset_id] = position
+        with instrumentation.stage("load_ledger"):
+            return self.session.exec(
+                select(Position)
+                .join(
+                    latest_dates,
+                    (Position.asset_id == latest_dates.c.asset_id)
+                    & (Position.position_date == latest_dates.c.position_date),
+                )
+                .where(Position.portfolio_id == portfolio_id)
+                .order_by(Position.asset_id)
+            ).all()
 
-        return list(latest_positions.values())
+    @staticmethod
+    def apply_transaction(
+        positions: dict[int, Position],
+        transaction: Transaction,
+        cash_asset_id: int,
+        position_date: date,
+        cash_flows: dict[int, dict[str, Decimal]] | None = None,
+    ) -> None:
+        """
+        Apply one transaction to in-memory positions.
+        This holds the accounting rules of every transaction action, so that
+        update_positions_for_period() and in-memory replays stay consistent.
+
+        Args:
+            positions: a dictionary of asset_id to Position objects, updated in place
+            transaction: the transaction to apply
+            cash_asset_id: the cash asset of the transaction currency
+            position_date: the position_date of positions created by this transaction
+            cash_flows: optional per-asset cash flows tracked for total P&L calculation
+        """
+        asset_id = transaction.asset_id
+        portfolio_id = transaction.portfolio_id
+        if cash_flows is None:
+            cash_flows = defaultdict(lambda: defaultdict(Decimal))
+
+        # Initialize position if it doesn't exist
+        if asset_id not in positions:
+            positions[asset_id] = Position(
+                portfolio_id=portfolio_id,
+                asset_id=asset_id,
+                position_date=position_date,
+                quantity=Decimal("0"),
+                average_cost=Decimal("0"),
+                current_price=Decimal("0"),
+                market_value=Decimal("0"),
+                total_pnl=Decimal("0"),
+            )
+
+        position = positions[asset_id]
+
+        # Initialize cash position if it doesn't exist
+        if cash_asset_id not in positions:
+            positions[cash_asset_id] = Position(
+                portfolio_id=portfolio_id,
+                asset_id=cash_asset_id,
+                position_date=position_date,
+                quantity=Decimal("0"),
+                average_cost=Decimal("1.0"),  # Cash always has cost of 1.0
+                current_price=Decimal("1.0"),
+                market_value=Decimal("0"),
+                total_pnl=Decimal("0"),
+            )
+
+        cash_position = positions[cash_asset_id]
+        instrumentation.count_ops(decimal=_DECIMAL_OPS_PER_ACTION.get(transaction.action, 0))
+
+        if transaction.action == "buy":
+            # Update average cost and quantity for the asset
+            total_cost = position.average_cost * position.quantity
+            position.quantity += transaction.quantity
+            position.average_cost = (
+                total_cost + transaction.amount + (transaction.fees or Decimal("0"))
+            ) / position.quantity
+
+            # Track cash paid for P&L calculation
+            cash_flows[asset_id]["cash_paid_on_bought"] += transaction.amount + (
+                transaction.fees or Decimal("0")
+            )
+
+            # Reduce cash position
+            cash_position.quantity -= transaction.amount + (
+                transaction.fees or Decimal("0")
+            )
+
+        elif transaction.action == "sell":
+            # Reduce quantity for the asset
+            position.quantity -= transaction.quantity
+            if position.quantity < 0:
+                position.quantity = Decimal("0")
+
+            # Track cash received for P&L calculation
+            cash_flows[asset_id]["cash_received_on_sale"] += transaction.amount - (
+                transaction.fees or Decimal("0")
+            )
+            # Increase cash position
+            cash_position.quantity += transaction.amount - (
+                transaction.fees or Decimal("0")
+            )
+
+        elif transaction.action == "dividends":
+            # Track dividends received for P&L calculation
+            cash_flows[asset_id]["dividends_received"] += transaction.amount - (
+                transaction.fees or Decimal("0")
+            )
+
+            # Add dividends to cash position
+            cash_position.quantity += transaction.amount - (
+                transaction.fees or Decimal("0")
+            )
+
+        elif transaction.action == "split":
+            # Handle stock splits
+            split_ratio = transaction.quantity
+            position.quantity *= split_ratio
+            if position.average_cost > 0:
+                position.average_cost /= split_ratio
+
+        elif transaction.action == "cash_in":
+            # Add cash to position
+            cash_position.quantity += transaction.quantity
+            cash_position.average_cost = Decimal("1.0")  # Cash always has cost of 1.0
+
+        elif transaction.action == "cash_out":
+            # Remove cash from position
+            cash_position.quantity -= transaction.quantity
+            cash_position.average_cost = Decimal("1.0")  # Cash always has cost of 1.0
+
+    def value_positions(
+        self,
+        positions: dict[int, Position],
+        on_date: date,
+        cash_flows: dict[int, dict[str, Decimal]],
+        initial_positions: dict[int, Position] | None = None,
+    ) -> None:
+        """
+        Value replayed positions at the latest prices of on_date, in place.
+        The total P&L of an asset continues from its initial position, if any,
+        with the cash flows tracked by apply_transaction() since then.
+        """
+        with instrumentation.stage("valuation"):
+            for asset_id, position in positions.items():
+                # Get current price
+                latest_price = self.price_service.get_latest_price(asset_id, on_date)
+                if latest_price:
+                    position.current_price = latest_price.price
+                elif position.current_price is None:
+                    position.current_price = position.average_cost
+
+                # Calculate market value
+                position.market_value = position.quantity * position.current_price
+
+                # Calculate total P&L
+                asset = self.session.get(Asset, asset_id)
+                # If the asset is cash, set total_pnl to 0
+                if asset.type == "cash":  
+                    position.total_pnl = Decimal("0")
+                else:
+                # Profit_1 = Profit_0 + MarketValue_1 - MarketValue_0 + change of cashflow
+                    if initial_positions and asset_id in initial_positions:
+                        profit_0 = initial_positions[asset_id].total_pnl
+                        market_value_0 = initial_positions[asset_id].market_value
+                    else:
+                        profit_0 = Decimal("0")
+                        market_value_0 = Decimal("0")
+                    position.total_pnl = (
+                        profit_0
+                        + position.market_value
+                        - market_value_0
+                        + cash_flows[asset_id]["cash_received_on_sale"]
+                        + cash_flows[asset_id]["dividends_received"]
+                        - cash_flows[asset_id]["cash_paid_on_bought"]
+                    )
+                instrumentation.count_ops(decimal=6)
 
     def update_positions_for_period(
         self,
@@ -642,6 +1400,7 @@ class PositionService:
         start_date: date,
         end_date: date,
         save_to_db: bool = True,
+        progress=None,
     ) -> dict[int, Position]:
         """
         Calculate positions generated by transactions during a given period.
@@ -655,23 +1414,26 @@ class PositionService:
             start_date: including transactions on start_date
             end_date: including transactions on end_date
             save_to_db: whether to save the calculated positions to the database
+            progress: optional callable(current, total, message) reporting replayed transactions
         Returns:
             A dictionary of asset_id to Position objects, representing the final positions at the end_date.
         """
         # Get all transactions between start_date and end_date for the portfolio
-        transactions = self.session.exec(
-            select(Transaction)
-            .where(Transaction.portfolio_id == portfolio_id)
-            .where(Transaction.trade_date >= start_date)
-            .where(Transaction.trade_date <= end_date)
-            .order_by(Transaction.trade_date)
-        ).all()
+        with instrumentation.stage("load_ledger"):
+            transactions = self.session.exec(
+                select(Transaction)
+                .where(Transaction.portfolio_id == portfolio_id)
+                .where(Transaction.trade_date >= start_date)
+                .where(Transaction.trade_date <= end_date)
+                .order_by(Transaction.trade_date)
+            ).all()
 
         # Calculate positions for the period based on initial positions and transactions
         # The returned positions are the final positions at the end_date.
         
         # Get initial positions the day before start_date
-        initial_positions = self.get_initial_positions(portfolio_id, start_date - timedelta(days=1))
+        with instrumentation.stage("load_ledger"):
+            initial_positions = self.get_initial_positions(portfolio_id, start_date - timedelta(days=1))
         # Initially start with empty positions if no initial positions
         final_positions = {}
         init_positions_dict = {}
@@ -699,143 +1461,357 @@ class PositionService:
         )
 
         # Process transactions
-        for transaction in transactions:
-            asset_id = transaction.asset_id
-
-            # Initialize position if it doesn't exist
-            if asset_id not in final_positions:
-                final_positions[asset_id] = Position(
-                    portfolio_id=portfolio_id,
-                    asset_id=asset_id,
-                    position_date=end_date,
-                    quantity=Decimal("0"),
-                    average_cost=Decimal("0"),
-                    current_price=Decimal("0"),
-                    market_value=Decimal("0"),
-                    total_pnl=Decimal("0"),
+        with instrumentation.stage("replay"):
+            for index, transaction in enumerate(transactions, start=1):
+                # Get cash asset for the transaction currency
+                cash_asset = self._get_cash_asset(transaction.currency_id)
+                if not cash_asset:
+                    raise ValueError(
+                        f"Cash asset not found for currency {transaction.currency_id}"
+                    )
+                self.apply_transaction(
+                    final_positions, transaction, cash_asset.id, end_date, cash_flows
                 )
+                if progress and (index % 100 == 0 or index == len(transactions)):
+                    progress(index, len(transactions), "transactions replayed")
 
-            position = final_positions[asset_id]
+        # Calculate current prices, market values and total P&L
+        self.value_positions(final_positions, end_date, cash_flows, init_positions_dict)
 
-            # Get cash asset for the transaction currency
-            cash_asset = self._get_cash_asset(transaction.currency_id)
-            if not cash_asset:
-                raise ValueError(
-                    f"Cash asset not found for currency {transaction.currency_id}"
-                )
+        # Save to database if requested
+        if save_to_db:
+            self.save_positions(final_positions)
 
-            # Initialize cash position if it doesn't exist
-            if cash_asset.id not in final_positions:
-                final_positions[cash_asset.id] = Position(
-                    portfolio_id=portfolio_id,
-                    asset_id=cash_asset.id,
-                    position_date=end_date,
-                    quantity=Decimal("0"),
-                    average_cost=Decimal("1.0"),  # Cash always has cost of 1.0
-                    current_price=Decimal("1.0"),
-                    market_value=Decimal("0"),
-                    total_pnl=Decimal("0"),
-                )
-            
-            cash_position = final_positions[cash_asset.id]
-
-            if transaction.action == "buy":
-                # Update average cost and quantity for the asset
-                total_cost = position.average_cost * position.quantity
-                position.quantity += transaction.quantity
-                position.average_cost = (
-                    total_cost + transaction.amount + (transaction.fees or Decimal("0"))
-                ) / position.quantity
-
-                # Track cash paid for P&L calculation
-                cash_flows[asset_id]["cash_paid_on_bought"] += transaction.amount + (
-                    transaction.fees or Decimal("0")
-                )
+        return final_positions
 
-                # Reduce cash position
-                cash_position.quantity -= transaction.amount + (
-                    transaction.fees or Decimal("0")
-                )
 
-            elif transaction.action == "sell":
-                # Reduce quantity for the asset
-                position.quantity -= transaction.quantity
-                if position.quantity < 0:
-                    position.quantity = Decimal("0")
+class DailyValueService:
+    """Service maintaining the materialized PortfolioDailyValue table.
+
+    Rows run from the first transaction date of a portfolio (NAV 1.0) without gaps.
+    refresh() only appends the days after the last stored row, continuing its NAV and
+    shares. Writes of transactions, prices or exchange rates must call invalidate()
+    so that the rows from the first affected date are recalculated on the next read.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def invalidate(self, from_date: date, portfolio_id: int | None = None):
+        """Delete the rows on or after from_date, for one portfolio or for all of them"""
+        statement = delete(PortfolioDailyValue).where(PortfolioDailyValue.value_date >= from_date)
+        if portfolio_id is not None:
+            statement = statement.where(PortfolioDailyValue.portfolio_id == portfolio_id)
+        self.session.exec(statement)
+        self.session.commit()
+
+    def refresh(self, portfolio_id: int, end_date: date, progress=None, chunk_days: int = 90):
+        """Materialize the missing days of a portfolio up to end_date.
 
-                # Track cash received for P&L calculation
-                cash_flows[asset_id]["cash_received_on_sale"] += transaction.amount - (
-                    transaction.fees or Decimal("0")
+        With a progress callable(current, total, message), the days are materialized
+        chunk_days at a time and the number of days replayed is reported after each chunk.
+        """
+        if progress is None:
+            self._refresh(portfolio_id, end_date)
+            return
+
+        first_date = self._first_missing_date(portfolio_id)
+        for chunk_end in self._refresh_chunks(portfolio_id, end_date, chunk_days):
+            progress((chunk_end - first_date).days + 1, (end_date - first_date).days + 1, "days replayed")
+
+    def _first_missing_date(self, portfolio_id: int) -> date | None:
+        last_date = self._last_materialized_date(portfolio_id)
+        return last_date + timedelta(days=1) if last_date else self.session.exec(
+            select(func.min(Transaction.trade_date)).where(Transaction.portfolio_id == portfolio_id)
+        ).one()
+
+    def _refresh_chunks(self, portfolio_id: int, end_date: date, chunk_days: int):
+        """Materialize the missing days up to end_date chunk_days at a time, yielding the last day of each chunk"""
+        first_date = self._first_missing_date(portfolio_id)
+        if first_date is None or first_date > end_date:
+            return
+        chunk_end = first_date
+        while True:
+            chunk_end = min(chunk_end + timedelta(days=chunk_days), end_date)
+            self._refresh(portfolio_id, chunk_end)
+            yield chunk_end
+            if chunk_end >= end_date:
+                return
+
+    def _last_materialized_date(self, portfolio_id: int) -> date | None:
+        return self.session.exec(
+            select(func.max(PortfolioDailyValue.value_date)).where(PortfolioDailyValue.portfolio_id == portfolio_id)
+        ).one()
+
+    def _refresh(self, portfolio_id: int, end_date: date):
+        with instrumentation.stage("load_ledger"):
+            inception_date = self.session.exec(
+                select(func.min(Transaction.trade_date)).where(Transaction.portfolio_id == portfolio_id)
+            ).one()
+            last_row = self.session.exec(
+                select(PortfolioDailyValue)
+                .where(PortfolioDailyValue.portfolio_id == portfolio_id)
+                .order_by(PortfolioDailyValue.value_date.desc())
+                .limit(1)
+            ).first()
+        if inception_date is None:
+            return
+        if last_row is not None and last_row.value_date >= end_date:
+            return
+
+        # Appending starts on the last stored day, which anchors NAV and shares
+        start_date = last_row.value_date if last_row else inception_date
+        if end_date <= start_date:
+            return
+
+        with instrumentation.stage("load_ledger"):
+            transactions = self.session.exec(
+                select(Transaction)
+                .where(Transaction.portfolio_id == portfolio_id)
+                .where(Transaction.trade_date <= end_date)
+                .order_by(Transaction.trade_date, Transaction.id)
+            ).all()
+        snapshot = MarketDataSnapshot(self.session, start_date, end_date)
+        series = PortfolioService(self.session)._nav_series_from_ledger(
+            transactions, snapshot, start_date, end_date
+        )
+
+        nav_base = float(last_row.nav) if last_row else 1.0
+        shares_base = float(last_row.shares) if last_row else series["shares_history"][0]
+        rows = []
+        for index, value_date in enumerate(series["dates"]):
+            if last_row is not None and index == 0:
+                continue
+            # Rebase the NAV of this run (1.0 on start_date) onto the stored NAV
+            rows.append(PortfolioDailyValue(
+                portfolio_id=portfolio_id,
+                value_date=value_date,
+                total_value=Decimal(str(series["values"][index])),
+                net_cash_flow=Decimal(str(series["cash_flows"][index])),
+                nav=Decimal(str(nav_base * series["nav_history"][index])),
+                shares=Decimal(str(
+                    shares_base + (series["shares_history"][index] - series["shares_history"][0]) / nav_base
+                )),
+            ))
+
+        with instrumentation.stage("persist"):
+            self.session.add_all(rows)
+            try:
+                self.session.commit()
+            except IntegrityError:
+                # Another request materialized the same days first
+                self.session.rollback()
+
+    def get_daily_values(
+        self, portfolio_id: int, start_date: date, end_date: date, progress=None
+    ) -> list[PortfolioDailyValue]:
+        """Get the materialized rows of a date range, refreshing them first if needed"""
+        self.refresh(portfolio_id, end_date, progress)
+        with instrumentation.stage("load_ledger"):
+            return self.session.exec(
+                select(PortfolioDailyValue)
+                .where(PortfolioDailyValue.portfolio_id == portfolio_id)
+                .where(PortfolioDailyValue.value_date >= start_date)
+                .where(PortfolioDailyValue.value_date <= end_date)
+                .order_by(PortfolioDailyValue.value_date)
+            ).all()
+
+    def iter_daily_values(
+        self, portfolio_id: int, start_date: date, end_date: date, batch_size: int = 1000, chunk_days: int = 90
+    ):
+        """Yield (date, value, nav, net_cash_flow, shares) tuples of the rows of a date range.
+
+        Missing days are materialized chunk_days at a time, and the rows of each chunk
+        are yielded before the next one is replayed, so a cold range is never held in
+        memory at once. Rows are fetched from the cursor batch_size at a time. NAV and
+        shares are rebased to a NAV of 1.0 on the first row, like get_performance_history().
+        """
+        nav_start = None
+        streamed_until = start_date - timedelta(days=1)
+        for chunk_end in chain(self._refresh_chunks(portfolio_id, end_date, chunk_days), [end_date]):
+            if chunk_end <= streamed_until:
+                continue
+            rows = self.session.exec(
+                select(
+                    PortfolioDailyValue.value_date,
+                    PortfolioDailyValue.total_value,
+                    PortfolioDailyValue.nav,
+                    PortfolioDailyValue.net_cash_flow,
+                    PortfolioDailyValue.shares,
                 )
-                # Increase cash position
-                cash_position.quantity += transaction.amount - (
-                    transaction.fees or Decimal("0")
+                .where(PortfolioDailyValue.portfolio_id == portfolio_id)
+                .where(PortfolioDailyValue.value_date > streamed_until)
+                .where(PortfolioDailyValue.value_date <= chunk_end)
+                .order_by(PortfolioDailyValue.value_date)
+                .execution_options(yield_per=batch_size)
+            )
+            for value_date, total_value, nav, net_cash_flow, shares in rows:
+                if nav_start is None:
+                    nav_start = float(nav)
+                yield (
+                    value_date,
+                    float(total_value),
+                    float(nav) / nav_start,
+                    float(net_cash_flow),
+                    float(shares) * nav_start,
                 )
+            streamed_until = chunk_end
+
+    def twr(self, portfolio_id: int, start_date: date, end_date: date) -> dict:
+        """A PortfolioService.twr() style result built from the materialized rows.
+
+        NAV is rebased to 1.0 on the first row in range, so the result equals
+        twr() over the same period without recalculating any day.
+        """
+        rows = self.get_daily_values(portfolio_id, start_date, end_date)
+        if not rows:
+            return PortfolioService._empty_twr_result()
+
+        nav_start = float(rows[0].nav)
+        nav_history = [float(row.nav) / nav_start for row in rows]
+        shares_history = [float(row.shares) * nav_start for row in rows]
+        daily_returns = [
+            nav_today / nav_prev - 1 for nav_prev, nav_today in zip(nav_history, nav_history[1:])
+        ]
+        instrumentation.count_ops(float_=3 * len(rows))
+        return PortfolioService._summarize_twr(
+            rows[0].value_date,
+            end_date,
+            daily_returns,
+            nav_history,
+            shares_history,
+            [row.value_date for row in rows],
+        )
 
-            elif transaction.action == "dividends":
-                # Track dividends received for P&L calculation
-                cash_flows[asset_id]["dividends_received"] += transaction.amount - (
-                    transaction.fees or Decimal("0")
-                )
 
-                # Add dividends to cash position
-                cash_position.quantity += transaction.amount - (
-                    transaction.fees or Decimal("0")
+class PortfolioGroupService:
+    """
+    Service for consolidated views of a portfolio group, e.g. a household.
+    The transactions of all member portfolios are loaded with one query and
+    replayed once as a single merged ledger, so the combined holdings, cash
+    flows and NAV series do not need a calculation per member.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.currency_service = CurrencyService(session)
+
+    def get_member_ids(self, group_id: int) -> list[int]:
+        """Get the portfolio ids of a group"""
+        if self.session.get(PortfolioGroup, group_id) is None:
+            raise ValueError(f"Portfolio group {group_id} not found")
+        return list(self.session.exec(
+            select(PortfolioGroupMember.portfolio_id)
+            .where(PortfolioGroupMember.group_id == group_id)
+            .order_by(PortfolioGroupMember.portfolio_id)
+        ).all())
+
+    def _load_ledger(self, portfolio_ids: list[int], end_date: date) -> list[Transaction]:
+        """The transactions of all portfolios up to end_date, merged in trade order"""
+        with instrumentation.stage("load_ledger"):
+            return list(self.session.exec(
+                select(Transaction)
+                .where(Transaction.portfolio_id.in_(portfolio_ids))
+                .where(Transaction.trade_date <= end_date)
+                .order_by(Transaction.trade_date, Transaction.id)
+            ).all())
+
+    def consolidated_positions(self, group_id: int, as_of_date: date) -> tuple[dict[int, Position], Decimal]:
+        """
+        Replay the merged ledger of a group and value the combined holdings on as_of_date.
+
+        Returns:
+            A tuple of (asset_id to Position objects, which are not saved, and the net
+            external cash flow cash_in - cash_out of all members in primary currency).
+        """
+        transactions = self._load_ledger(self.get_member_ids(group_id), as_of_date)
+        position_service = PositionService(self.session)
+        positions = {}
+        cash_flows = defaultdict(lambda: defaultdict(Decimal))
+        cash_asset_ids = {}
+        net_contributions = Decimal("0")
+
+        with instrumentation.stage("replay"):
+            for transaction in transactions:
+                if transaction.currency_id not in cash_asset_ids:
+                    cash_asset = position_service._get_cash_asset(transaction.currency_id)
+                    if not cash_asset:
+                        raise ValueError(f"Cash asset not found for currency {transaction.currency_id}")
+                    cash_asset_ids[transaction.currency_id] = cash_asset.id
+                PositionService.apply_transaction(
+                    positions, transaction, cash_asset_ids[transaction.currency_id], as_of_date, cash_flows
                 )
+                if transaction.action in ("cash_in", "cash_out"):
+                    amount = self.currency_service.convert_to_primary_currency(
+                        transaction.amount, transaction.currency_id, transaction.trade_date
+                    )
+                    net_contributions += amount if transaction.action == "cash_in" else -amount
 
-            elif transaction.action == "split":
-                # Handle stock splits
-                split_ratio = transaction.quantity
-                position.quantity *= split_ratio
-                if position.average_cost > 0:
-                    position.average_cost /= split_ratio
+        position_service.value_positions(positions, as_of_date, cash_flows)
+        return positions, net_contributions
 
-            elif transaction.action == "cash_in":
-                # Add cash to position
-                cash_position.quantity += transaction.quantity
-                cash_position.average_cost = Decimal("1.0")  # Cash always has cost of 1.0
+    def get_summary(self, group_id: int, as_of_date: date) -> dict:
+        """Combined market value, P&L and holdings of a group in primary currency"""
+        positions, net_contributions = self.consolidated_positions(group_id, as_of_date)
+        assets = {
+            asset.id: asset
+            for asset in self.session.exec(select(Asset).where(Asset.id.in_(list(positions)))).all()
+        }
 
-            elif transaction.action == "cash_out":
-                # Remove cash from position
-                cash_position.quantity -= transaction.quantity
-                cash_position.average_cost = Decimal("1.0")  # Cash always has cost of 1.0
-
-        # Calculate current prices and market values
-        for asset_id, position in final_positions.items():
-            # Get current price
-            latest_price = self.price_service.get_latest_price(asset_id, end_date)
-            if latest_price:
-                position.current_price = latest_price.price
-            elif position.current_price is None:
-                position.current_price = position.average_cost
-
-            # Calculate market value
-            position.market_value = position.quantity * position.current_price
-
-            # Calculate total P&L
-            asset = self.session.get(Asset, asset_id)
-            # If the asset is cash, set total_pnl to 0
-            if asset.type == "cash":  
-                position.total_pnl = Decimal("0")
-            else:
-            # Profit_1 = Profit_0 + MarketValue_1 - MarketValue_0 + change of cashflow
-                if asset_id in init_positions_dict:
-                    profit_0 = init_positions_dict[asset_id].total_pnl
-                    market_value_0 = init_positions_dict[asset_id].market_value
-                else:
-                    profit_0 = Decimal("0")
-                    market_value_0 = Decimal("0")
-                position.total_pnl = (
-                    profit_0
-                    + position.market_value
-                    - market_value_0
-                    + cash_flows[asset_id]["cash_received_on_sale"]
-                    + cash_flows[asset_id]["dividends_received"]
-                    - cash_flows[asset_id]["cash_paid_on_bought"]
+        total_market_value = Decimal("0")
+        total_pnl = Decimal("0")
+        holdings = []
+        with instrumentation.stage("valuation"):
+            for asset_id, position in positions.items():
+                asset = assets[asset_id]
+                market_value_primary = self.currency_service.convert_to_primary_currency(
+                    position.market_value, asset.currency_id, as_of_date
+                )
+                total_pnl_primary = self.currency_service.convert_to_primary_currency(
+                    position.total_pnl, asset.currency_id, as_of_date
                 )
+                total_market_value += market_value_primary
+                total_pnl += total_pnl_primary
+                holdings.append({
+                    "asset_id": asset_id,
+                    "symbol": asset.symbol,
+                    "name": asset.name,
+                    "quantity": float(position.quantity),
+                    "current_price": float(position.current_price),
+                    "market_value": float(position.market_value),
+                    "market_value_primary": float(market_value_primary),
+                    "total_pnl_primary": float(total_pnl_primary),
+                })
 
-        # Save to database if requested
-        if save_to_db:
-            self.save_positions(final_positions)
+        return {
+            "group_id": group_id,
+            "total_market_value_primary": float(total_market_value),
+            "total_pnl_primary": float(total_pnl),
+            "net_contributions_primary": float(net_contributions),
+            "position_count": len(positions),
+            "positions": holdings,
+            "calculation_date": as_of_date,
+        }
 
-        return final_positions
+    def get_asset_allocation(self, group_id: int, as_of_date: date, by: str = 'type') -> dict:
+        """Allocation of the combined holdings of a group by type or sector"""
+        if by not in ['type', 'sector']:
+            raise ValueError('Invalid "by" parameter. Must be "type" or "sector".')
+        positions, _ = self.consolidated_positions(group_id, as_of_date)
+        return PortfolioService(self.session).allocate_positions(list(positions.values()), as_of_date, by)
+
+    def nav_series(self, group_id: int, start_date: date, end_date: date, numeric_mode: str = "decimal") -> dict:
+        """
+        The TWR NAV series of a group, as if its members were one portfolio.
+        A cash_out of one member and the cash_in of another on the same day net
+        out, so transfers between members are not cash flows of the group.
+
+        Returns:
+            A twr() style result with "values" and "cash_flows" lists, like
+            PortfolioService.batch_nav_series().
+        """
+        portfolio_service = PortfolioService(self.session)
+        nav_series_from_ledger = portfolio_service.nav_series_engine(numeric_mode)
+        transactions = self._load_ledger(self.get_member_ids(group_id), end_date)
+        snapshot = MarketDataSnapshot(self.session, start_date, end_date)
+        return nav_series_from_ledger(transactions, snapshot, start_date, end_date)
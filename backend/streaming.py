@@ -0,0 +1,186 @@
+"""
+Streaming serialization of large row sets as NDJSON, CSV, Arrow IPC or Parquet.
+
+Export endpoints pass a generator of row tuples and a column specification.
+Rows are encoded in batches and yielded as bytes, so a StreamingResponse sends
+the first rows while later ones are still being read from a database cursor,
+and memory stays constant whatever the number of rows.
+
+Example:
+    columns = [("date", "date"), ("value", "float")]
+    return StreamingResponse(
+        encode_rows(rows, columns, "ndjson"), media_type=MEDIA_TYPES["ndjson"]
+    )
+"""
+
+import csv
+import io
+import json
+from collections.abc import Iterable, Iterator
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+FILE_EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+ARROW_FORMATS = ("arrow", "parquet")
+
+# Column kinds: int, str, category (dictionary encoded str), date, float and decimal
+Columns = list[tuple[str, str]]
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _batches(rows: Iterable[tuple], batch_size: int) -> Iterator[list[tuple]]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def _json_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # Keep the exact digits, like the JSON responses of the API
+        return str(value)
+    return value
+
+
+def _encode_ndjson(rows: Iterable[tuple], columns: Columns, batch_size: int) -> Iterator[bytes]:
+    names = [name for name, _ in columns]
+    for batch in _batches(rows, batch_size):
+        yield "".join(
+            json.dumps(dict(zip(names, map(_json_value, row))), ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode("utf-8")
+
+
+def _encode_csv(rows: Iterable[tuple], columns: Columns, batch_size: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in _batches(rows, batch_size):
+        writer.writerows([_json_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Only the header when there are no rows
+        yield buffer.getvalue().encode("utf-8")
+
+
+def arrow_schema(columns: Columns):
+    """The Arrow schema of a column specification"""
+    import pyarrow as pa
+
+    types = {
+        "int": pa.int64(),
+        "str": pa.string(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+        "date": pa.date32(),
+        "float": pa.float64(),
+        "decimal": pa.decimal128(38, 10),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+class _ChunkSink:
+    """Write-only file collecting the bytes written since the last drain().
+
+    Parquet footers hold absolute offsets, so tell() keeps counting the bytes
+    already handed out instead of restarting at 0 like a truncated BytesIO.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _encode_arrow(
+    rows: Iterable[tuple], columns: Columns, batch_size: int, export_format: str
+) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = arrow_schema(columns)
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    with writer:
+        for batch in _batches(rows, batch_size):
+            arrays = [
+                pa.array([row[index] for row in batch], type=schema.field(index).type)
+                for index in range(len(columns))
+            ]
+            # One record batch, or one Parquet row group, per batch of rows
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.drain()
+    # The end-of-stream marker or the Parquet footer
+    yield sink.drain()
+
+
+def validate_export_format(export_format: str) -> str:
+    """Check the format before streaming starts, when an error can still be returned"""
+    if export_format not in MEDIA_TYPES:
+        raise ValueError(f"Invalid export format: {export_format}. Must be one of {', '.join(MEDIA_TYPES)}")
+    if export_format in ARROW_FORMATS:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"The {export_format} format requires the pyarrow package")
+    return export_format
+
+
+def encode_rows(
+    rows: Iterable[tuple],
+    columns: Columns,
+    export_format: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """Encode rows lazily in the given format.
+
+    Args:
+        rows: tuples with one value per column, typically from a generator
+        columns: (name, kind) pairs, where kind is int, str, category, date, float or decimal
+        export_format: one of ndjson, csv, arrow or parquet
+        batch_size: number of rows encoded per yielded chunk
+    """
+    if export_format == "ndjson":
+        return _encode_ndjson(rows, columns, batch_size)
+    if export_format == "csv":
+        return _encode_csv(rows, columns, batch_size)
+    if export_format in ARROW_FORMATS:
+        return _encode_arrow(rows, columns, batch_size, export_format)
+    raise ValueError(f"Invalid export format: {export_format}. Must be one of {', '.join(MEDIA_TYPES)}")
@@ -0,0 +1,205 @@
+"""
+Scenario and stress-test revaluation of current holdings.
+
+A hypothetical scenario is a list of shocks, relative changes of prices or
+exchange rates, e.g. "HKD falls 10% and bank stocks fall 20%":
+
+- asset: the price of one asset, by symbol
+- type: the prices of an asset type (stock, etf, ...)
+- sector: the prices of the assets with that "sector" AssetMetadata
+- currency: the exchange rate of a currency to the primary currency, which
+  moves every asset priced in it, cash included
+
+Several price shocks matching an asset do not compound: the most specific one
+(asset, then sector, then type) applies. A currency shock applies on top.
+
+A historical scenario replays a past window of the stored history: every asset
+moves by the change of its total-return adjusted price between the last prices
+on or before the start and end dates, and every currency by the change of its
+exchange rate. HISTORICAL_SCENARIOS is a library of market stress windows;
+assets without a price at the start of a window are reported and left unchanged.
+
+All scenarios are revalued at once: with the exposures w (market values in
+primary currency) and the (scenarios x assets) price and exchange rate changes
+p and f, the P&L of every scenario and asset is w * ((1 + p) * (1 + f) - 1).
+"""
+
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+from sqlmodel import Session, select
+
+from backend import instrumentation
+from backend.corporate_actions import CorporateActionService
+from backend.models import Asset
+from backend.risk import RiskService, classify_assets, exchange_rate_history, forward_fill
+
+SHOCK_TARGETS = ("asset", "type", "sector", "currency")
+# Price shocks from the most general to the most specific, later ones override earlier ones
+_PRICE_TARGETS = ("type", "sector", "asset")
+
+HISTORICAL_SCENARIOS = {
+    "2008 global financial crisis": (date(2008, 9, 12), date(2008, 11, 20)),
+    "2015 China stock market crash": (date(2015, 6, 12), date(2015, 8, 26)),
+    "2016 China circuit breaker": (date(2016, 1, 4), date(2016, 1, 28)),
+    "2018 US-China trade war": (date(2018, 1, 26), date(2018, 12, 24)),
+    "2020 COVID-19 crash": (date(2020, 2, 19), date(2020, 3, 23)),
+    "2022 Hong Kong tech selloff": (date(2022, 2, 17), date(2022, 3, 15)),
+}
+
+
+@dataclass(frozen=True)
+class Shock:
+    target: str  # asset, type, sector or currency
+    key: str  # The symbol, type, sector or currency code
+    change: float  # Relative change, e.g. -0.2 for a fall of 20%
+
+    def __post_init__(self):
+        if self.target not in SHOCK_TARGETS:
+            raise ValueError(f"Invalid shock target: {self.target}. Must be one of {', '.join(SHOCK_TARGETS)}")
+        if self.change < -1:
+            raise ValueError(f"A shock cannot fall by more than 100%, got {self.change}")
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    shocks: tuple[Shock, ...] = ()
+
+
+def shock_matrices(
+    scenarios: list[Scenario], asset_ids: list[int], classes: dict[int, dict]
+) -> tuple[np.ndarray, np.ndarray]:
+    """The (scenarios x assets) price and exchange rate changes of hypothetical scenarios"""
+    keys = {
+        target: np.array([classes[asset_id]["symbol" if target == "asset" else target] for asset_id in asset_ids])
+        for target in SHOCK_TARGETS
+    }
+    price_changes = np.zeros((len(scenarios), len(asset_ids)))
+    fx_changes = np.zeros((len(scenarios), len(asset_ids)))
+    for row, scenario in enumerate(scenarios):
+        for target in (*_PRICE_TARGETS, "currency"):
+            changes = fx_changes if target == "currency" else price_changes
+            for shock in scenario.shocks:
+                if shock.target == target:
+                    changes[row, keys[target] == shock.key] = shock.change
+    return price_changes, fx_changes
+
+
+def historical_changes(
+    session: Session, windows: list[tuple[date, date]], asset_ids: list[int], classes: dict[int, dict]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The (windows x assets) price and exchange rate changes over past windows, and
+    a mask of the assets without a price at the start of each window.
+    """
+    price_changes = np.zeros((len(windows), len(asset_ids)))
+    fx_changes = np.zeros((len(windows), len(asset_ids)))
+    missing = np.zeros((len(windows), len(asset_ids)), dtype=bool)
+    if not windows:
+        return price_changes, fx_changes, missing
+    starts = np.array([start.toordinal() for start, _ in windows])
+    ends = np.array([end.toordinal() for _, end in windows])
+
+    currency_ids = dict(session.exec(select(Asset.id, Asset.currency_id).where(Asset.id.in_(asset_ids))).all())
+    rates = exchange_rate_history(session, set(currency_ids.values()), max(end for _, end in windows))
+    series = CorporateActionService(session).adjusted_series(
+        [asset_id for asset_id in asset_ids if classes[asset_id]["type"] != "cash"]
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for column, asset_id in enumerate(asset_ids):
+            if currency_ids[asset_id] in rates:
+                history = rates[currency_ids[asset_id]]
+                change = forward_fill(*history, ends) / forward_fill(*history, starts) - 1
+                fx_changes[:, column] = np.where(np.isfinite(change), change, 0.0)
+            if classes[asset_id]["type"] == "cash":
+                continue
+            if asset_id not in series:
+                missing[:, column] = True
+                continue
+            dates, prices = series[asset_id].dates, series[asset_id].values("total_return")
+            change = forward_fill(dates, prices, ends) / forward_fill(dates, prices, starts) - 1
+            missing[:, column] = ~np.isfinite(change)
+            price_changes[:, column] = np.where(missing[:, column], 0.0, change)
+    return price_changes, fx_changes, missing
+
+
+def revalue(exposures: np.ndarray, price_changes: np.ndarray, fx_changes: np.ndarray) -> np.ndarray:
+    """P&L of every scenario (row) and asset (column) in primary currency"""
+    pnl = exposures * ((1.0 + price_changes) * (1.0 + fx_changes) - 1.0)
+    instrumentation.count_ops(float_=4 * pnl.size)
+    return pnl
+
+
+class StressTestService:
+    """Service revaluing the holdings of a portfolio under stress scenarios"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def run(
+        self,
+        portfolio_id: int,
+        as_of_date: date,
+        scenarios: list[Scenario] = (),
+        historical: list[tuple[str, date, date]] = (),
+    ) -> dict:
+        """
+        P&L of the holdings on as_of_date under hypothetical scenarios and
+        historical (name, start_date, end_date) windows, in one revaluation.
+        """
+        for name, start_date, end_date in historical:
+            if start_date >= end_date:
+                raise ValueError(f"The window of scenario {name} must start before it ends")
+
+        exposures = RiskService(self.session).exposures(portfolio_id, as_of_date)
+        asset_ids = list(exposures)
+        classes = classify_assets(self.session, asset_ids)
+        values = np.array([exposures[asset_id] for asset_id in asset_ids])
+
+        with instrumentation.stage("stress_test"):
+            price_changes, fx_changes = shock_matrices(list(scenarios), asset_ids, classes)
+            replay_price_changes, replay_fx_changes, missing = historical_changes(
+                self.session, [(start_date, end_date) for _, start_date, end_date in historical], asset_ids, classes
+            )
+            pnl = revalue(
+                values,
+                np.vstack([price_changes, replay_price_changes]),
+                np.vstack([fx_changes, replay_fx_changes]),
+            )
+
+        total_value = float(values.sum())
+        descriptions = [{"name": scenario.name, "kind": "hypothetical"} for scenario in scenarios] + [
+            {"name": name, "kind": "historical", "start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+            for name, start_date, end_date in historical
+        ]
+        results = []
+        for row, description in enumerate(descriptions):
+            scenario_pnl = float(pnl[row].sum())
+            historical_row = row - len(scenarios)
+            results.append({
+                **description,
+                "pnl": scenario_pnl,
+                "pnl_pct": scenario_pnl / total_value if total_value else 0.0,
+                "value_after": total_value + scenario_pnl,
+                "missing_asset_ids": (
+                    [asset_ids[column] for column in np.flatnonzero(missing[historical_row])]
+                    if historical_row >= 0 else []
+                ),
+                "assets": [
+                    {
+                        "asset_id": asset_id,
+                        "symbol": classes[asset_id]["symbol"],
+                        "value": float(values[column]),
+                        "pnl": float(pnl[row, column]),
+                    }
+                    for column, asset_id in enumerate(asset_ids)
+                ],
+            })
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of_date": as_of_date.isoformat(),
+            "total_value": total_value,
+            "scenarios": results,
+        }
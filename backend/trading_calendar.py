@@ -0,0 +1,182 @@
+"""
+Trading calendars per exchange.
+
+Prices only change on the trading days of the exchange listing an asset, so
+valuing a portfolio on a weekend or a holiday repeats the previous day. An
+ExchangeCalendar knows the trading days of one exchange:
+
+- within the price history of the exchange, the days with a price of any of its
+  assets; the weekdays without one are its holidays
+- outside of it, the weekdays that are not listed in its holiday file
+
+Holiday files are read from the NICEAMS_CALENDAR_DIR directory, one file per
+exchange named after it (e.g. XHKG.csv) with one ISO date per line. Extra
+comma-separated columns, blank lines and lines starting with # are ignored.
+
+The valuation loops value a portfolio on the trading days of the exchanges it
+holds plus the days of its transactions and exchange rates only, and forward
+fill the other calendar days, which cannot differ from the day before. Daily
+returns are annualized with the number of trading days of the same calendar.
+"""
+
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+
+from backend import caching, logger
+from backend.models import Asset, Price, Transaction
+
+# Exchange of the symbol suffixes used by the price sources, as ISO 10383 MIC codes
+EXCHANGE_SUFFIXES = {
+    "SH": "XSHG",
+    "SZ": "XSHE",
+    "BJ": "BJSE",
+    "HK": "XHKG",
+}
+# Exchange of symbols without a known suffix, e.g. US tickers
+DEFAULT_EXCHANGE = "DEFAULT"
+# Annualization factor of periods without any trading day
+DEFAULT_TRADING_DAYS_PER_YEAR = 240
+DAYS_PER_YEAR = 365.25
+
+_calendars = caching.ResponseCache(maxsize=16)
+
+
+def exchange_of(symbol: str) -> str:
+    """The exchange listing a symbol, from its suffix"""
+    _, _, suffix = symbol.rpartition(".")
+    return EXCHANGE_SUFFIXES.get(suffix.upper(), DEFAULT_EXCHANGE) if "." in symbol else DEFAULT_EXCHANGE
+
+
+def load_holidays(path: Path) -> frozenset[date]:
+    """Holidays listed in a file, one ISO date per line"""
+    holidays = set()
+    for line in path.read_text(encoding="utf-8").splitlines():
+        value = line.split(",")[0].strip()
+        if not value or value.startswith("#"):
+            continue
+        try:
+            holidays.add(date.fromisoformat(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid holiday {value!r} in {path}")
+    return frozenset(holidays)
+
+
+@dataclass(frozen=True)
+class ExchangeCalendar:
+    """Trading days of one exchange, from its price history and its holiday file"""
+    exchange: str
+    trading_dates: frozenset[date] = frozenset()
+    holidays: frozenset[date] = frozenset()
+    first_date: date | None = None  # Span of the price history
+    last_date: date | None = None
+
+    def is_trading_day(self, day: date) -> bool:
+        if day in self.trading_dates:
+            return True
+        if self.first_date is not None and self.first_date <= day <= self.last_date:
+            return False
+        return day.weekday() < 5 and day not in self.holidays
+
+
+class TradingCalendar:
+    """Trading days of a set of exchanges: the days on which any of them trades"""
+
+    def __init__(self, exchanges: list[ExchangeCalendar]):
+        self.exchanges = exchanges
+
+    def is_trading_day(self, day: date) -> bool:
+        return any(exchange.is_trading_day(day) for exchange in self.exchanges)
+
+    def trading_days(self, start_date: date, end_date: date) -> list[date]:
+        """The trading days from start_date to end_date, inclusive"""
+        days = (start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1))
+        return [day for day in days if self.is_trading_day(day)]
+
+    def valuation_days(self, start_date: date, end_date: date, extra_days=()) -> list[date]:
+        """The days on which a valuation can change: start_date, the trading days
+        and extra_days (e.g. transaction and exchange rate dates) up to end_date"""
+        days = {start_date, *self.trading_days(start_date, end_date)}
+        days.update(day for day in extra_days if start_date <= day <= end_date)
+        return sorted(days)
+
+    def trading_days_per_year(self, start_date: date, end_date: date) -> float:
+        """Trading days per year over a period, to annualize returns between trading days"""
+        period_days = (end_date - start_date).days
+        trading_days = len(self.trading_days(start_date + timedelta(days=1), end_date))
+        if period_days <= 0 or trading_days == 0:
+            return DEFAULT_TRADING_DAYS_PER_YEAR
+        return trading_days * DAYS_PER_YEAR / period_days
+
+
+def forward_fill_index(valuation_days: list[date], days: list[date]) -> list[int]:
+    """Index of the valuation day carried to each calendar day, the last one on or before it"""
+    return [max(bisect_right(valuation_days, day) - 1, 0) for day in days]
+
+
+def _calendar_dir() -> Path | None:
+    directory = os.environ.get("NICEAMS_CALENDAR_DIR")
+    return Path(directory) if directory else None
+
+
+def load_calendars(session: Session) -> dict[str, ExchangeCalendar]:
+    """Calendars of the exchanges with price history or a holiday file, cached until prices are added"""
+    directory = _calendar_dir()
+    version = session.exec(select(func.count(Price.id), func.max(Price.id))).one()
+    key = f"{session.get_bind().url}:{version}:{directory}"
+    calendars = _calendars.get(key)
+    if calendars is not None:
+        return calendars
+
+    exchange = case(
+        *((Asset.symbol.like(f"%.{suffix}"), code) for suffix, code in EXCHANGE_SUFFIXES.items()),
+        else_=DEFAULT_EXCHANGE,
+    )
+    trading_dates: dict[str, set[date]] = {}
+    for code, price_date in session.exec(
+        select(exchange, Price.price_date).join(Asset, Asset.id == Price.asset_id)
+        .where(Asset.type != "cash")
+        .distinct()
+    ).all():
+        trading_dates.setdefault(code, set()).add(price_date)
+
+    holidays = {}
+    if directory is not None and directory.is_dir():
+        for path in directory.iterdir():
+            if path.is_file() and path.suffix in (".csv", ".txt"):
+                holidays[path.stem.upper()] = load_holidays(path)
+
+    calendars = {
+        code: ExchangeCalendar(
+            code,
+            frozenset(trading_dates.get(code, ())),
+            holidays.get(code, frozenset()),
+            min(trading_dates[code]) if code in trading_dates else None,
+            max(trading_dates[code]) if code in trading_dates else None,
+        )
+        for code in {*trading_dates, *holidays}
+    }
+    _calendars.put(key, calendars)
+    return calendars
+
+
+def calendar_for_assets(calendars: dict[str, ExchangeCalendar], assets) -> TradingCalendar:
+    """Calendar of the exchanges listing the assets; cash has none"""
+    exchanges = sorted({exchange_of(asset.symbol) for asset in assets if asset.type != "cash"})
+    return TradingCalendar([calendars.get(code, ExchangeCalendar(code)) for code in exchanges])
+
+
+def calendar_for_portfolio(session: Session, portfolio_id: int) -> TradingCalendar:
+    """Calendar of the exchanges a portfolio traded on, weekdays for a portfolio of cash only"""
+    assets = session.exec(
+        select(Asset).where(Asset.id.in_(
+            select(Transaction.asset_id).where(Transaction.portfolio_id == portfolio_id).distinct()
+        ))
+    ).all()
+    calendar = calendar_for_assets(load_calendars(session), assets)
+    return calendar if calendar.exchanges else TradingCalendar([ExchangeCalendar(DEFAULT_EXCHANGE)])
@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the backend.
+They are not collected by pytest; run them as modules, e.g. python -m benchmarks.import_time
+"""
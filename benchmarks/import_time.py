@@ -0,0 +1,99 @@
+"""
+Startup benchmark: measure the cold import cost of backend.main with python -X importtime.
+
+Usage:
+    python -m benchmarks.import_time [--runs 5] [--top 15] [--max-ms 1500] [--output result.json]
+
+Each run imports backend.main in a fresh interpreter. The reported cost is the median
+cumulative import time of backend.main over all runs, so that one noisy run does not
+decide the result.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+TARGET_MODULE = "backend.main"
+# Modules that must only be imported on demand, never at startup
+DEFERRED_MODULES = ("pandas", "numpy", "scipy", "uvicorn", "akshare", "pyarrow")
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """Parse -X importtime output into {module: (self_us, cumulative_us)}"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        timings[module.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure_once(module: str = TARGET_MODULE) -> dict[str, tuple[int, int]]:
+    """Import a module in a fresh interpreter and return its import timings"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(completed.stderr)
+
+
+def run_benchmark(runs: int = 5, top: int = 15, module: str = TARGET_MODULE) -> dict:
+    """Measure the import cost of a module over several runs"""
+    samples = [measure_once(module) for _ in range(runs)]
+    cumulative_ms = [sample[module][1] / 1000 for sample in samples]
+    median_sample = samples[cumulative_ms.index(statistics.median_low(cumulative_ms))]
+    slowest = sorted(median_sample.items(), key=lambda item: item[1][0], reverse=True)[:top]
+
+    return {
+        "module": module,
+        "runs": runs,
+        "cumulative_ms": statistics.median(cumulative_ms),
+        "min_ms": min(cumulative_ms),
+        "max_ms": max(cumulative_ms),
+        "deferred_modules_imported": [
+            name for name in DEFERRED_MODULES if name in median_sample
+        ],
+        "slowest_modules": [
+            {"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+            for name, (self_us, cumulative_us) in slowest
+        ],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreter runs")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to report")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median import time exceeds this")
+    parser.add_argument("--output", type=Path, default=None, help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    result = run_benchmark(runs=args.runs, top=args.top)
+
+    print(f"{result['module']}: {result['cumulative_ms']:.1f} ms median "
+          f"(min {result['min_ms']:.1f} ms, max {result['max_ms']:.1f} ms, {result['runs']} runs)")
+    for entry in result["slowest_modules"]:
+        print(f"  {entry['self_ms']:8.1f} ms self {entry['cumulative_ms']:8.1f} ms cumulative  {entry['module']}")
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+    failed = False
+    if result["deferred_modules_imported"]:
+        print(f"FAIL: modules imported at startup: {result['deferred_modules_imported']}")
+        failed = True
+    if args.max_ms is not None and result["cumulative_ms"] > args.max_ms:
+        print(f"FAIL: import time {result['cumulative_ms']:.1f} ms exceeds {args.max_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
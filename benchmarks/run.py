@@ -0,0 +1,354 @@
+"""
+Benchmark suite for the services and API endpoints.
+
+It generates a deterministic synthetic dataset (see benchmarks/synthetic.py) in a
+temporary SQLite database, times the services and the endpoints (through the
+FastAPI TestClient), writes the results as JSON and compares them against a
+stored baseline. The run fails when any benchmark is slower than the baseline by
+more than the threshold ratio.
+
+Usage:
+    python -m benchmarks.run [--scale small] [--repeat 3] [--output results.json]
+                             [--baseline benchmarks/baseline.json] [--threshold 1.5]
+                             [--update-baseline] [--only twr summary ...]
+
+Timings are the median of --repeat runs, in milliseconds. Baselines depend on the
+machine, so refresh them with --update-baseline when the hardware changes.
+"""
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from benchmarks import import_time
+from benchmarks.synthetic import SCALES, generate_dataset, prices_csv, transactions_csv
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+
+class BenchmarkContext:
+    """A temporary database filled with synthetic data, plus an API client on it"""
+
+    def __init__(self, scale: str):
+        from fastapi.testclient import TestClient
+        from backend.main import app
+        from backend.models import get_session
+
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        self.engine = create_engine(f"sqlite:///{self.db_path}")
+        SQLModel.metadata.create_all(self.engine)
+
+        started_at = time.perf_counter()
+        self.dataset = generate_dataset(self.engine, SCALES[scale])
+        self.generation_ms = (time.perf_counter() - started_at) * 1000
+
+        def override_get_session():
+            with Session(self.engine) as session:
+                yield session
+
+        self.app = app
+        self.app.dependency_overrides[get_session] = override_get_session
+        self.client = TestClient(app)
+
+    def session(self) -> Session:
+        return Session(self.engine)
+
+    def close(self) -> None:
+        self.app.dependency_overrides.clear()
+        self.engine.dispose()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+
+def _time(function, repeat: int) -> dict:
+    """Run a function repeat times and summarize the timings in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples), "runs": repeat}
+
+
+def _check_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.url} returned {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def _benchmarks(context: BenchmarkContext) -> dict:
+    """All benchmarks by name. Each value is a function running one iteration."""
+    from sqlmodel import select
+    from backend import realtime
+    from backend.models import Asset
+    from backend.services import PortfolioService, PositionService, PriceService
+
+    dataset = context.dataset
+    portfolio_id = dataset.portfolio_id
+    end_date = dataset.end_date
+    twr_start = end_date - timedelta(days=30)
+
+    def twr():
+        with context.session() as session:
+            PortfolioService(session).twr(portfolio_id, twr_start, end_date)
+
+    def batch_nav_series():
+        with context.session() as session:
+            PortfolioService(session).batch_nav_series([portfolio_id], dataset.start_date, end_date)
+
+    def batch_nav_series_float():
+        with context.session() as session:
+            PortfolioService(session).batch_nav_series(
+                [portfolio_id], dataset.start_date, end_date, numeric_mode="float"
+            )
+
+    def update_positions_for_period():
+        with context.session() as session:
+            PositionService(session).update_positions_for_period(
+                portfolio_id, dataset.start_date, end_date, save_to_db=False
+            )
+
+    def calculate_portfolio_value():
+        with context.session() as session:
+            PortfolioService(session).calculate_portfolio_value(portfolio_id, end_date)
+
+    def money_weighted_returns():
+        with context.session() as session:
+            PortfolioService(session).money_weighted_returns(portfolio_id, end_date)
+
+    def value_at_risk():
+        from backend import risk
+
+        with context.session() as session:
+            risk.RiskService(session).value_at_risk(portfolio_id, end_date)
+
+    def risk_decomposition():
+        from backend import decomposition
+
+        with context.session() as session:
+            decomposition.DecompositionService(session).decomposition(portfolio_id, end_date)
+
+    def monte_carlo_var_500_assets():
+        # 100k scenarios of 500 assets with one year of correlated returns
+        from backend import risk
+
+        risk.monte_carlo_var(var_returns, var_exposures, risk.DEFAULT_CONFIDENCE_LEVELS, risk.DEFAULT_HORIZONS)
+
+    def covariance_update_500_assets():
+        # The next day of a 500-asset Ledoit-Wolf estimate, updating the cached sums
+        from backend import covariance
+
+        covariance.estimate(
+            "ledoit_wolf", covariance_assets, covariance_days[1:], var_returns[1:], previous=covariance_base
+        )
+
+    def risk_parity_500_assets():
+        # Equal risk contributions of 500 assets from their Ledoit-Wolf covariance
+        from backend import optimizer
+
+        optimizer.optimize_weights("risk_parity", covariance_base.covariance * 250)
+
+    def backtest_variants():
+        # Eight rebalancing variants of ten assets over the whole dataset, in this process
+        from backend import backtest
+
+        strategies = [
+            backtest.Strategy(f"{rule} {frequency} {fee_rate}", backtest_weights, rule, frequency, fee_rate=fee_rate)
+            for rule, frequency in (("none", "monthly"), ("periodic", "weekly"), ("periodic", "monthly"),
+                                    ("threshold", "monthly"))
+            for fee_rate in (0.0, 0.001)
+        ]
+        with context.session() as session:
+            backtest.BacktestService(session).run(strategies, dataset.start_date, end_date)
+
+    def summary_endpoint():
+        _check_response(context.client.get(
+            f"/portfolios/{portfolio_id}/summary", params={"as_of_date": end_date.isoformat()}
+        ))
+
+    def performance_history_endpoint():
+        _check_response(context.client.get(
+            f"/portfolios/{portfolio_id}/performance-history",
+            params={"start_date": (end_date - timedelta(days=7)).isoformat(), "end_date": end_date.isoformat()},
+        ))
+
+    def live_price_lookups():
+        # 1000 lookups of today's price, served by the in-memory table of the price feed
+        with context.session() as session:
+            price_service = PriceService(session)
+            for _ in range(1000 // len(live_asset_ids) + 1):
+                for asset_id in live_asset_ids:
+                    price_service.get_latest_price(asset_id)
+
+    with context.session() as session:
+        live_symbols = dict(session.exec(select(Asset.id, Asset.symbol).where(Asset.type != "cash")).all())
+        realtime.feed.ingest([realtime.Tick(symbol, 10.0) for symbol in live_symbols.values()], session)
+    live_asset_ids = list(live_symbols)
+
+    import numpy as np
+
+    var_rng = np.random.default_rng(0)
+    var_returns = (
+        var_rng.normal(0, 0.01, (250, 5)) @ var_rng.normal(0, 1, (5, 500)) + var_rng.normal(0, 0.01, (250, 500))
+    )
+    var_exposures = var_rng.uniform(1e3, 1e5, 500)
+
+    from backend import covariance
+
+    covariance_assets = list(range(500))
+    covariance_days = [end_date - timedelta(days=len(var_returns) - offset) for offset in range(len(var_returns))]
+    covariance_base = covariance.estimate("ledoit_wolf", covariance_assets, covariance_days[:-1], var_returns[:-1])
+
+    with context.session() as session:
+        backtest_assets = session.exec(select(Asset.id).where(Asset.type != "cash").order_by(Asset.id).limit(10)).all()
+    backtest_weights = {asset_id: 1 / len(backtest_assets) for asset_id in backtest_assets}
+
+    # The importers write to the database, so every iteration imports new dates
+    import_offsets = iter(range(1, 10_000))
+
+    def import_transactions_endpoint():
+        content = transactions_csv(dataset.config, 200, end_date + timedelta(days=next(import_offsets)))
+        _check_response(context.client.post(
+            "/import/transactions/", files={"file": ("transactions.csv", content, "text/csv")}
+        ))
+
+    def import_prices_endpoint():
+        content = prices_csv(dataset.config, end_date + timedelta(days=30 * next(import_offsets)), 10)
+        _check_response(context.client.post(
+            "/import/prices/", files={"file": ("prices.csv", content, "text/csv")}
+        ))
+
+    def import_prices_bulk_endpoint():
+        import pyarrow.csv
+        import pyarrow.parquet
+
+        content = prices_csv(dataset.config, end_date + timedelta(days=30 * next(import_offsets)), 10)
+        sink = io.BytesIO()
+        pyarrow.parquet.write_table(pyarrow.csv.read_csv(io.BytesIO(content.encode("utf-8"))), sink)
+        _check_response(context.client.post(
+            "/import/prices/bulk", files={"file": ("prices.parquet", sink.getvalue(), "application/octet-stream")}
+        ))
+
+    benchmarks = {
+        "update_positions_for_period": update_positions_for_period,
+        "calculate_portfolio_value": calculate_portfolio_value,
+        "twr": twr,
+        "batch_nav_series": batch_nav_series,
+        "batch_nav_series_float": batch_nav_series_float,
+        "money_weighted_returns": money_weighted_returns,
+        "value_at_risk": value_at_risk,
+        "risk_decomposition": risk_decomposition,
+        "monte_carlo_var_500_assets": monte_carlo_var_500_assets,
+        "covariance_update_500_assets": covariance_update_500_assets,
+        "risk_parity_500_assets": risk_parity_500_assets,
+        "backtest_variants": backtest_variants,
+        "summary_endpoint": summary_endpoint,
+        "performance_history_endpoint": performance_history_endpoint,
+        "live_price_lookups": live_price_lookups,
+        "import_transactions_endpoint": import_transactions_endpoint,
+        "import_prices_endpoint": import_prices_endpoint,
+    }
+    if importlib.util.find_spec("pyarrow") is not None:
+        benchmarks["import_prices_bulk_endpoint"] = import_prices_bulk_endpoint
+    return benchmarks
+
+
+def run_suite(scale: str = "small", repeat: int = 3, only: list[str] | None = None) -> dict:
+    """Generate the dataset, run the benchmarks and return the results"""
+    context = BenchmarkContext(scale)
+    try:
+        results = {}
+        for name, function in _benchmarks(context).items():
+            if only and name not in only:
+                continue
+            results[name] = _time(function, repeat)
+            print(f"  {name:32s} {results[name]['median_ms']:10.1f} ms", flush=True)
+        if not only or "import_backend_main" in only:
+            startup = import_time.run_benchmark(runs=repeat)
+            results["import_backend_main"] = {
+                "median_ms": startup["cumulative_ms"], "min_ms": startup["min_ms"], "runs": repeat
+            }
+            print(f"  {'import_backend_main':32s} {startup['cumulative_ms']:10.1f} ms", flush=True)
+        dataset = context.dataset
+        return {
+            "scale": scale,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "dataset": {
+                "assets": dataset.config.n_assets,
+                "years": dataset.config.years,
+                "transactions": dataset.transaction_count,
+                "prices": dataset.price_count,
+                "exchange_rates": dataset.exchange_rate_count,
+                "generation_ms": context.generation_ms,
+            },
+            "results": results,
+        }
+    finally:
+        context.close()
+
+
+def compare_to_baseline(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """List the benchmarks that regressed beyond threshold times the baseline"""
+    regressions = []
+    baseline_results = baseline.get(report["scale"], {}).get("results", {})
+    for name, result in report["results"].items():
+        if name not in baseline_results:
+            continue
+        ratio = result["median_ms"] / baseline_results[name]["median_ms"]
+        if ratio > threshold:
+            regressions.append(
+                f"{name}: {result['median_ms']:.1f} ms vs baseline "
+                f"{baseline_results[name]['median_ms']:.1f} ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=None, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed slowdown ratio against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--only", nargs="*", default=None, help="run only these benchmarks")
+    args = parser.parse_args()
+
+    print(f"Running {args.scale} benchmarks ({args.repeat} runs each)...")
+    report = run_suite(args.scale, args.repeat, args.only)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    if args.update_baseline:
+        # Benchmarks left out with --only keep their baseline
+        previous_results = baseline.get(args.scale, {}).get("results", {})
+        baseline[args.scale] = report | {"results": previous_results | report["results"]}
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    regressions = compare_to_baseline(report, baseline, args.threshold)
+    if regressions:
+        print(f"FAIL: regressions beyond {args.threshold}x baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("OK: no regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
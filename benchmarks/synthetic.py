@@ -0,0 +1,270 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+generate_dataset() fills an empty database with a large portfolio: N assets in
+several currencies, M years of business-day prices and exchange rates, K
+transactions (deposits, withdrawals, buys, sells, dividends) and a number of
+stock splits. The same config and seed always produce the same rows, so timings
+from different runs and machines compare like for like.
+
+Example:
+    engine = create_engine("sqlite:///bench.db")
+    SQLModel.metadata.create_all(engine)
+    dataset = generate_dataset(engine, SyntheticConfig(n_assets=50, years=2))
+"""
+
+import csv
+import io
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from backend.models import (
+    Asset,
+    AssetMetadata,
+    Currency,
+    ExchangeRate,
+    Portfolio,
+    Price,
+    Transaction,
+)
+
+CURRENCIES = {
+    "CNY": ("Chinese Yuan", "¥", Decimal("1")),
+    "USD": ("US Dollar", "$", Decimal("7.2")),
+    "HKD": ("Hong Kong Dollar", "HK$", Decimal("0.92")),
+    "EUR": ("Euro", "€", Decimal("7.8")),
+}
+SYMBOL_SUFFIXES = {"CNY": ".SH", "USD": ".US", "HKD": ".HK", "EUR": ".DE"}
+ASSET_TYPES = ("stock", "stock", "stock", "etf", "fund", "bond")
+SECTORS = ("Financials", "Technology", "Consumer", "Energy", "Healthcare", "Industrials")
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    """Size and shape of a synthetic dataset"""
+
+    n_assets: int = 20
+    years: int = 1
+    n_transactions: int = 500
+    n_splits: int = 3
+    currencies: tuple[str, ...] = ("CNY", "USD", "HKD")
+    start_date: date = date(2020, 1, 1)
+    seed: int = 42
+
+
+SCALES = {
+    "small": SyntheticConfig(),
+    "medium": SyntheticConfig(n_assets=100, years=3, n_transactions=5_000, n_splits=10),
+    "large": SyntheticConfig(n_assets=500, years=10, n_transactions=50_000, n_splits=50),
+}
+
+
+@dataclass
+class SyntheticDataset:
+    """Identifiers and summary of a generated dataset"""
+
+    config: SyntheticConfig
+    portfolio_id: int
+    start_date: date
+    end_date: date
+    asset_ids: dict[str, int] = field(default_factory=dict)
+    currency_ids: dict[str, int] = field(default_factory=dict)
+    price_count: int = 0
+    exchange_rate_count: int = 0
+    transaction_count: int = 0
+
+
+def business_days(start_date: date, end_date: date) -> list[date]:
+    """All Monday to Friday dates between start_date and end_date, inclusive"""
+    days = []
+    current_date = start_date
+    while current_date <= end_date:
+        if current_date.weekday() < 5:
+            days.append(current_date)
+        current_date += timedelta(days=1)
+    return days
+
+
+def _money(value: float, places: str = "0.01") -> Decimal:
+    return Decimal(str(value)).quantize(Decimal(places))
+
+
+def generate_dataset(engine, config: SyntheticConfig = SyntheticConfig()) -> SyntheticDataset:
+    """Fill an empty database with a deterministic synthetic portfolio"""
+    rng = random.Random(config.seed)
+    end_date = config.start_date + timedelta(days=365 * config.years - 1)
+    trading_days = business_days(config.start_date, end_date)
+
+    with Session(engine) as session:
+        currencies = {}
+        for code in config.currencies:
+            name, symbol, _ = CURRENCIES[code]
+            currencies[code] = Currency(code=code, name=name, symbol=symbol, is_primary=(code == config.currencies[0]))
+        session.add_all(currencies.values())
+        session.flush()
+
+        portfolio = Portfolio(name="Synthetic Portfolio", base_currency_id=currencies[config.currencies[0]].id)
+        session.add(portfolio)
+
+        cash_assets = {
+            code: Asset(symbol=f"{code}_CASH", name=f"{code} Cash", type="cash", currency_id=currency.id)
+            for code, currency in currencies.items()
+        }
+        assets = []
+        for index in range(config.n_assets):
+            code = config.currencies[index % len(config.currencies)]
+            assets.append(Asset(
+                symbol=f"SYN{index:04d}{SYMBOL_SUFFIXES[code]}",
+                name=f"Synthetic Asset {index}",
+                type=rng.choice(ASSET_TYPES),
+                currency_id=currencies[code].id,
+            ))
+        session.add_all([*cash_assets.values(), *assets])
+        session.flush()
+
+        session.add_all(
+            AssetMetadata(asset_id=asset.id, attribute_name="sector", attribute_value=rng.choice(SECTORS))
+            for asset in assets
+        )
+
+        # Split dates per asset: the raw price drops by the split ratio on that day
+        splits = {}
+        for asset in rng.sample(assets, min(config.n_splits, len(assets))):
+            splits[asset.id] = (rng.choice(trading_days[1:]), rng.choice((2, 3, 10)))
+
+        # Geometric random walk prices
+        price_rows = []
+        last_prices = {}
+        price_by_day = {}
+        for asset in assets:
+            price = rng.uniform(5, 500)
+            split_date, split_ratio = splits.get(asset.id, (None, 1))
+            for trading_day in trading_days:
+                price *= 1 + rng.gauss(0.0003, 0.018)
+                if trading_day == split_date:
+                    price /= split_ratio
+                rounded_price = _money(price, "0.0001")
+                price_rows.append({
+                    "asset_id": asset.id,
+                    "price_date": trading_day,
+                    "price": rounded_price,
+                    "price_type": "historical",
+                    "source": "synthetic",
+                })
+                price_by_day[(asset.id, trading_day)] = rounded_price
+            last_prices[asset.id] = price
+
+        rate_rows = []
+        for code in config.currencies[1:]:
+            rate = float(CURRENCIES[code][2])
+            for trading_day in trading_days:
+                rate *= 1 + rng.gauss(0, 0.003)
+                rate_rows.append({
+                    "currency_id": currencies[code].id,
+                    "rate_date": trading_day,
+                    "rate_to_primary": _money(rate, "0.000001"),
+                })
+
+        transaction_rows = []
+
+        def add_transaction(trade_date, action, asset, quantity, price, amount, fees=Decimal("0")):
+            transaction_rows.append({
+                "portfolio_id": portfolio.id,
+                "trade_date": trade_date,
+                "action": action,
+                "asset_id": asset.id,
+                "quantity": quantity,
+                "price": price,
+                "amount": amount,
+                "fees": fees,
+                "currency_id": asset.currency_id,
+                "notes": "synthetic",
+            })
+
+        # Initial deposits in every currency, then random activity on trading days
+        for cash_asset in cash_assets.values():
+            deposit = Decimal("10000000")
+            add_transaction(trading_days[0], "cash_in", cash_asset, deposit, Decimal("1"), deposit)
+
+        holdings = {asset.id: Decimal("0") for asset in assets}
+        activity_days = sorted(rng.choice(trading_days) for _ in range(config.n_transactions))
+        for trade_date in activity_days:
+            asset = rng.choice(assets)
+            price = price_by_day[(asset.id, trade_date)]
+            roll = rng.random()
+            if roll < 0.5 or holdings[asset.id] == 0:
+                quantity = Decimal(rng.randint(1, 20) * 100)
+                add_transaction(trade_date, "buy", asset, quantity, price, price * quantity, _money(rng.uniform(0, 20)))
+                holdings[asset.id] += quantity
+            elif roll < 0.8:
+                quantity = min(holdings[asset.id], Decimal(rng.randint(1, 20) * 100))
+                add_transaction(trade_date, "sell", asset, quantity, price, price * quantity, _money(rng.uniform(0, 20)))
+                holdings[asset.id] -= quantity
+            elif roll < 0.9:
+                amount = _money(float(holdings[asset.id] * price) * rng.uniform(0.005, 0.02))
+                add_transaction(trade_date, "dividends", asset, None, None, amount)
+            else:
+                cash_asset = cash_assets[rng.choice(config.currencies)]
+                action = rng.choice(("cash_in", "cash_out"))
+                amount = Decimal(rng.randint(1, 100) * 1000)
+                add_transaction(trade_date, action, cash_asset, amount, Decimal("1"), amount)
+
+        for asset_id, (split_date, split_ratio) in splits.items():
+            asset = next(asset for asset in assets if asset.id == asset_id)
+            add_transaction(split_date, "split", asset, Decimal(split_ratio), None, Decimal("0"))
+        transaction_rows.sort(key=lambda row: row["trade_date"])
+
+        session.execute(insert(Price), price_rows)
+        if rate_rows:
+            session.execute(insert(ExchangeRate), rate_rows)
+        session.execute(insert(Transaction), transaction_rows)
+        session.commit()
+
+        return SyntheticDataset(
+            config=config,
+            portfolio_id=portfolio.id,
+            start_date=config.start_date,
+            end_date=end_date,
+            asset_ids={asset.symbol: asset.id for asset in [*cash_assets.values(), *assets]},
+            currency_ids={code: currency.id for code, currency in currencies.items()},
+            price_count=len(price_rows),
+            exchange_rate_count=len(rate_rows),
+            transaction_count=len(transaction_rows),
+        )
+
+
+def transactions_csv(config: SyntheticConfig, n_rows: int, trade_date: date) -> str:
+    """A transactions CSV file for the import endpoint, using the dataset's symbols"""
+    rng = random.Random(config.seed + 1)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["trade_date", "action", "symbol", "name", "quantity", "price", "amount", "fees", "notes"])
+    for _ in range(n_rows):
+        index = rng.randrange(config.n_assets)
+        code = config.currencies[index % len(config.currencies)]
+        quantity = rng.randint(1, 10) * 100
+        price = round(rng.uniform(5, 500), 2)
+        writer.writerow([
+            trade_date.isoformat(), "buy", f"SYN{index:04d}{SYMBOL_SUFFIXES[code]}", f"Synthetic Asset {index}",
+            quantity, price, round(quantity * price, 2), 5, "synthetic import",
+        ])
+    return buffer.getvalue()
+
+
+def prices_csv(config: SyntheticConfig, start_date: date, n_days: int) -> str:
+    """A prices CSV file for the import endpoint covering n_days business days from start_date"""
+    rng = random.Random(config.seed + 2)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["symbol", "price_date", "price"])
+    days = business_days(start_date, start_date + timedelta(days=n_days * 2))[:n_days]
+    for index in range(config.n_assets):
+        code = config.currencies[index % len(config.currencies)]
+        for price_date in days:
+            writer.writerow([f"SYN{index:04d}{SYMBOL_SUFFIXES[code]}", price_date.isoformat(), round(rng.uniform(5, 500), 4)])
+    return buffer.getvalue()
@@ -5,6 +5,22 @@ import tempfile
 import os
 from sqlmodel import create_engine, SQLModel, Session
 from backend.models import Currency, Portfolio, Asset
+from benchmarks.synthetic import SyntheticConfig, generate_dataset
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--numeric-tolerance",
+        type=float,
+        default=1e-9,
+        help="relative tolerance between the decimal and float numeric modes",
+    )
+
+
+@pytest.fixture
+def numeric_tolerance(request) -> float:
+    """Relative tolerance allowed between the decimal and float numeric modes"""
+    return request.config.getoption("--numeric-tolerance")
 
 
 @pytest.fixture
@@ -60,4 +76,46 @@ def test_db():
         # Clean up - close the engine and remove the temporary file
         engine.dispose()
         os.close(db_fd)
-        os.unlink(db_path)
\ No newline at end of file
+        os.unlink(db_path)
+
+
+@pytest.fixture
+def client(test_db):
+    """API test client whose requests use the test database"""
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.models import get_session
+
+    def override_get_session():
+        with Session(test_db.get_bind()) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def synthetic_engine(request, tmp_path):
+    """A database with a synthetic portfolio in several currencies and with stock splits
+
+    Tests change the dataset by parametrizing the fixture indirectly with SyntheticConfig fields.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'synthetic.db'}")
+    SQLModel.metadata.create_all(engine)
+    config = {"n_assets": 6, "n_transactions": 120, "n_splits": 2, **getattr(request, "param", {})}
+    dataset = generate_dataset(engine, SyntheticConfig(**config))
+    try:
+        yield engine, dataset
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def synthetic_session(synthetic_engine):
+    """A session on the synthetic database"""
+    engine, dataset = synthetic_engine
+    with Session(engine) as session:
+        yield session, dataset
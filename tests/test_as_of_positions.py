@@ -0,0 +1,119 @@
+"""Tests for resolving positions on dates without a stored snapshot"""
+
+from datetime import date, timedelta
+
+import pytest
+from sqlmodel import Session, func, select
+
+from backend.models import Position, Transaction
+from backend.services import PositionService
+
+LONGER_LEDGER = pytest.mark.parametrize("synthetic_engine", [{"n_transactions": 150}], indirect=True)
+
+
+def _by_asset(positions: list[Position]) -> dict[int, tuple]:
+    return {
+        position.asset_id: (
+            float(position.quantity),
+            float(position.market_value),
+            float(position.total_pnl),
+        )
+        for position in positions
+    }
+
+
+def _position_count(session: Session) -> int:
+    return session.exec(select(func.count(Position.id))).one()
+
+
+@LONGER_LEDGER
+def test_resolved_positions_match_a_full_replay(synthetic_session, monkeypatch):
+    session, dataset = synthetic_session
+    service = PositionService(session)
+    snapshot_date = dataset.start_date + timedelta(days=60)
+    as_of_date = dataset.start_date + timedelta(days=100)
+    service.update_positions_for_period(dataset.portfolio_id, date(1982, 1, 1), snapshot_date, save_to_db=True)
+    stored = _position_count(session)
+
+    full_replay = service.update_positions_for_period(
+        dataset.portfolio_id, date(1982, 1, 1), as_of_date, save_to_db=False
+    )
+
+    replayed_periods = []
+    update_positions_for_period = PositionService.update_positions_for_period
+
+    def recording_update(self, portfolio_id, start_date, end_date, *args, **kwargs):
+        replayed_periods.append((start_date, end_date))
+        return update_positions_for_period(self, portfolio_id, start_date, end_date, *args, **kwargs)
+
+    monkeypatch.setattr(PositionService, "update_positions_for_period", recording_update)
+    resolved = service.get_positions_as_of(dataset.portfolio_id, as_of_date)
+
+    # Only the transactions after the snapshot are replayed
+    assert replayed_periods == [(snapshot_date + timedelta(days=1), as_of_date)]
+    expected = _by_asset(list(full_replay.values()))
+    actual = _by_asset(resolved)
+    assert actual.keys() == expected.keys()
+    for asset_id, values in expected.items():
+        assert actual[asset_id] == pytest.approx(values, rel=1e-9, abs=1e-6)
+    assert all(position.position_date == as_of_date for position in resolved)
+    assert _position_count(session) == stored
+
+
+@LONGER_LEDGER
+def test_write_back_stores_a_snapshot(synthetic_session):
+    session, dataset = synthetic_session
+    service = PositionService(session)
+    as_of_date = dataset.start_date + timedelta(days=45)
+
+    resolved = service.get_positions_as_of(dataset.portfolio_id, as_of_date, write_back=True)
+    assert _position_count(session) == len(resolved)
+
+    # The stored rows of the date are returned as they are
+    stored = service.get_positions_as_of(dataset.portfolio_id, as_of_date)
+    assert all(position.id is not None for position in stored)
+    assert _by_asset(stored) == pytest.approx(_by_asset(resolved))
+
+
+def test_positions_endpoint_resolves_any_date(client, test_db):
+    client.post("/import/transactions/", files={"file": (
+        "transactions.csv",
+        "trade_date,action,symbol,quantity,price,amount,fees\n"
+        "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+        "2024-01-03,buy,600036.SH,1000,35,35000,0\n"
+        "2024-03-01,sell,600036.SH,400,37,14800,0\n",
+        "text/csv",
+    )})
+    url = f"/portfolios/{test_db._test_portfolio.id}/positions"
+
+    positions = {row["symbol"]: row for row in client.get(url, params={"as_of_date": "2024-02-15"}).json()}
+    assert positions["600036.SH"]["quantity"] == 1000
+    assert positions["600036.SH"]["id"] is None
+    assert _position_count(test_db) == 0
+
+    client.get(url, params={"as_of_date": "2024-02-15", "write_back": "true"})
+    positions = {row["symbol"]: row for row in client.get(url, params={"as_of_date": "2024-03-15"}).json()}
+    assert positions["600036.SH"]["quantity"] == 600
+    assert positions["CNY_CASH"]["quantity"] == 100000 - 35000 + 14800
+    assert test_db.exec(select(func.count(Transaction.id))).one() == 3
+
+
+def test_backdated_transactions_drop_later_snapshots(client, test_db):
+    def import_csv(rows: str):
+        client.post("/import/transactions/", files={"file": (
+            "transactions.csv", "trade_date,action,symbol,quantity,price,amount,fees\n" + rows, "text/csv",
+        )})
+
+    import_csv("2024-01-01,cash_in,CNY,100000,1,100000,0\n2024-01-02,buy,600036.SH,100,35,3500,0\n")
+    url = f"/portfolios/{test_db._test_portfolio.id}"
+    client.get(f"{url}/summary", params={"as_of_date": "2024-02-01", "write_back": "true"})
+    assert _position_count(test_db) > 0
+
+    # A trade dated before the snapshot makes it stale
+    import_csv("2024-01-10,buy,600036.SH,100,36,3600,0\n")
+    assert test_db.exec(
+        select(func.count(Position.id)).where(Position.position_date >= date(2024, 1, 10))
+    ).one() == 0
+    positions = {row["symbol"]: row for row in client.get(f"{url}/positions", params={"as_of_date": "2024-03-01"}).json()}
+    assert positions["600036.SH"]["quantity"] == 200
+    assert positions["CNY_CASH"]["quantity"] == 100000 - 3500 - 3600
@@ -0,0 +1,148 @@
+"""Tests for the backtests of rebalancing strategies"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlmodel import select
+
+from backend import backtest
+from backend.models import CorporateAction, ExchangeRate, Position, Price, Transaction
+
+START, END = date(2024, 1, 1), date(2024, 3, 31)
+
+
+@pytest.fixture
+def market(test_db):
+    """Daily closes of two yuan assets moving apart and a Hong Kong stock, and a HKD rate"""
+    assets = test_db._test_assets
+    days = [START + timedelta(days=offset) for offset in range((END - START).days + 1)]
+    for offset, day in enumerate(days):
+        test_db.add_all([
+            Price(asset_id=assets["600036.SH"].id, price_date=day, price=Decimal("30") + Decimal(offset) / 10,
+                  price_type="historical"),
+            Price(asset_id=assets["510300.SH"].id, price_date=day, price=Decimal("4") - Decimal(offset) / 100,
+                  price_type="historical"),
+            Price(asset_id=assets["00700.HK"].id, price_date=day, price=Decimal("300"), price_type="historical"),
+            ExchangeRate(currency_id=test_db._test_hkd.id, rate_date=day, rate_to_primary=Decimal("0.9")),
+        ])
+    test_db.commit()
+    return assets
+
+
+def _run(test_db, *strategies, **options):
+    return {
+        result["name"]: result
+        for result in backtest.BacktestService(test_db).run(list(strategies), START, END, **options)
+    }
+
+
+def test_buy_and_hold_and_rebalancing_rules(test_db, market):
+    cmb, etf = market["600036.SH"].id, market["510300.SH"].id
+    weights = {cmb: 0.5, etf: 0.5}
+    results = _run(
+        test_db,
+        backtest.Strategy("hold", weights, rule="none"),
+        backtest.Strategy("monthly", weights, rule="periodic", frequency="monthly"),
+        backtest.Strategy("drift", weights, rule="threshold", threshold=0.02),
+    )
+
+    # 500000 yuan buy 16666 shares at 30 and 125000 shares at 4, the rest stays in cash
+    hold = results["hold"]
+    assert hold["rebalances"] == 1 and hold["trades"] == 2
+    cash = 1_000_000 - 16666 * 30 - 125000 * 4
+    ending_value = cash + 16666 * (30 + 90 / 10) + 125000 * (4 - 90 / 100)
+    assert hold["history"][-1]["value"] == pytest.approx(ending_value)
+    assert hold["statistics"]["time_weighted_return"] == pytest.approx(ending_value / 1_000_000 - 1)
+    assert hold["history"][-1]["nav"] == pytest.approx(ending_value / 1_000_000)
+
+    # January, February and March
+    assert results["monthly"]["rebalances"] == 3
+    assert results["monthly"]["trades"] == 6
+    drift = results["drift"]
+    assert drift["rebalances"] > 3
+    assert drift["turnover"] > 0
+    # Selling the winner for the loser loses to holding in this market
+    assert drift["statistics"]["time_weighted_return"] < hold["statistics"]["time_weighted_return"]
+
+    # Nothing is recorded
+    assert test_db.exec(select(Transaction)).all() == []
+    assert test_db.exec(select(Position)).all() == []
+
+
+def test_fees_exchanges_and_dividends(test_db, market):
+    cmb, tencent = market["600036.SH"].id, market["00700.HK"].id
+    test_db.add(CorporateAction(asset_id=tencent, ex_date=date(2024, 2, 15), action_type="dividend", amount=Decimal("3")))
+    test_db.commit()
+    weights = {cmb: 0.4, tencent: 0.6}
+    results = _run(
+        test_db,
+        backtest.Strategy("free", weights, rule="none"),
+        backtest.Strategy("fees", weights, rule="none", fee_rate=0.001),
+    )
+
+    # 600000 yuan exchanged into Hong Kong dollars buy 2222 shares at 300 at a rate of 0.9,
+    # and the exchanges are no flows of the NAV
+    free = results["free"]
+    shares = 2222
+    assert free["history"][0]["value"] == pytest.approx(1_000_000)
+    assert free["history"][-1]["value"] == pytest.approx(
+        free["history"][0]["value"] + 13333 * 9 + shares * 3 * 0.9
+    )
+    assert free["history"][-1]["nav"] == pytest.approx(free["history"][-1]["value"] / 1_000_000)
+    # The dividend is paid on its ex-date
+    values = {row["date"]: row["value"] for row in free["history"]}
+    assert values["2024-02-15"] - values["2024-02-14"] == pytest.approx(0.1 * 13333 + shares * 3 * 0.9)
+
+    # Fees keep the buys within the cash and are the only loss of the first day
+    fees = results["fees"]
+    assert fees["fees"] == pytest.approx(0.001 * (13320 * 30 + 2220 * 300 * 0.9))
+    assert fees["history"][0]["value"] == pytest.approx(1_000_000 - fees["fees"])
+
+
+def test_parallel_variants_match_serial(test_db, market):
+    cmb, etf, tencent = market["600036.SH"].id, market["510300.SH"].id, market["00700.HK"].id
+    strategies = [
+        backtest.Strategy(f"{frequency} {fee_rate}", {cmb: 0.3, etf: 0.3, tencent: 0.3}, frequency=frequency,
+                          fee_rate=fee_rate)
+        for frequency in ("weekly", "monthly") for fee_rate in (0.0, 0.002)
+    ]
+    serial = _run(test_db, *strategies)
+    parallel = _run(test_db, *strategies, workers=2)
+    assert parallel == serial
+    floats = _run(test_db, *strategies, numeric_mode="float")
+    for name, result in serial.items():
+        assert floats[name]["history"][-1]["nav"] == pytest.approx(result["history"][-1]["nav"], rel=1e-9)
+
+    with pytest.raises(ValueError):
+        backtest.Strategy("leveraged", {cmb: 0.8, etf: 0.8})
+    with pytest.raises(ValueError):
+        backtest.Strategy("hourly", {cmb: 1.0}, frequency="hourly")
+
+
+def test_backtests_endpoint(client, test_db, market):
+    cmb, etf = market["600036.SH"].id, market["510300.SH"].id
+    response = client.post("/backtests/", json={
+        "start_date": START.isoformat(), "end_date": END.isoformat(), "weights": {cmb: 0.6, etf: 0.4},
+        "variants": [
+            {"name": "quarterly", "frequency": "quarterly"},
+            {"name": "banks", "weights": {cmb: 1.0}, "rule": "none"},
+        ],
+    })
+    assert response.status_code == 200
+    quarterly, banks = response.json()
+    assert quarterly["weights"] == {str(cmb): 0.6, str(etf): 0.4}
+    assert quarterly["rebalances"] == 1
+    assert len(quarterly["history"]) == (END - START).days + 1
+    assert banks["statistics"]["time_weighted_return"] == pytest.approx(
+        (1_000_000 - 33333 * 30 + 33333 * 39) / 1_000_000 - 1
+    )
+    assert set(quarterly["statistics"]) >= {"volatility", "max_drawdown", "sharpe_ratio"}
+
+    assert client.post("/backtests/", json={
+        "start_date": START.isoformat(), "end_date": END.isoformat(), "variants": [{"name": "empty"}],
+    }).status_code == 400
+    assert client.post("/backtests/", json={
+        "start_date": START.isoformat(), "end_date": END.isoformat(), "weights": {cmb: 1.0},
+        "variants": [{"name": "hold"}], "workers": 33,
+    }).status_code == 422
@@ -0,0 +1,159 @@
+"""Tests for the ETag caching and request coalescing of the portfolio endpoints"""
+
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+from sqlmodel import update
+
+from backend import caching
+from backend.models import Price, utcnow
+from backend.services import PortfolioService
+
+TRANSACTIONS_CSV = (
+    "trade_date,action,symbol,quantity,price,amount,fees\n"
+    "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+    "2024-01-03,buy,600036.SH,1000,35,35000,5\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    caching.response_cache.clear()
+    yield
+    caching.response_cache.clear()
+
+
+@pytest.fixture
+def portfolio_url(client, test_db):
+    client.post("/import/transactions/", files={"file": ("transactions.csv", TRANSACTIONS_CSV, "text/csv")})
+    return f"/portfolios/{test_db._test_portfolio.id}"
+
+
+@pytest.mark.parametrize("endpoint", ["summary", "positions", "allocation", "recent-returns", "performance-metrics"])
+def test_matching_etag_returns_304(client, portfolio_url, endpoint):
+    response = client.get(f"{portfolio_url}/{endpoint}")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith('W/')
+
+    cached = client.get(f"{portfolio_url}/{endpoint}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    # Another query is another representation
+    other = client.get(f"{portfolio_url}/{endpoint}", params={"as_of_date": "2024-01-31"})
+    assert other.headers["etag"] != etag
+
+
+def test_writes_change_the_etag(client, test_db, portfolio_url):
+    etag = client.get(f"{portfolio_url}/summary").headers["etag"]
+
+    client.post(
+        "/import/prices/",
+        files={"file": ("prices.csv", "symbol,price_date,price\n600036.SH,2024-01-03,36\n", "text/csv")},
+    )
+    response = client.get(f"{portfolio_url}/summary", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # An upsert that keeps all ids, like one of another worker process, still changes the ETag
+    etag = response.headers["etag"]
+    test_db.exec(update(Price).values(price=Decimal("36.5"), created_at=utcnow()))
+    test_db.commit()
+    assert client.get(f"{portfolio_url}/summary", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_etag_is_per_portfolio(client, test_db, portfolio_url):
+    etag = client.get(f"{portfolio_url}/summary").headers["etag"]
+
+    # Transactions of another portfolio, prices and ticks of assets not held keep the ETag
+    other = client.post("/portfolios/", json={"name": "Other", "base_currency_id": test_db._test_cny.id}).json()
+    client.post(
+        "/import/transactions/",
+        params={"portfolio_id": other["id"]},
+        files={"file": ("transactions.csv", TRANSACTIONS_CSV, "text/csv")},
+    )
+    client.post(
+        "/import/prices/",
+        files={"file": ("prices.csv", "symbol,price_date,price\n510300.SH,2024-01-03,4\n", "text/csv")},
+    )
+    client.post("/prices/ticks", json=[{"symbol": "00700.HK", "price": 300}])
+    assert client.get(f"{portfolio_url}/summary", headers={"If-None-Match": etag}).status_code == 304
+    # Not even the write generation of this process matters
+    caching.bump_generation()
+    assert client.get(f"{portfolio_url}/summary", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/prices/ticks", json=[{"symbol": "600036.SH", "price": 36}])
+    assert client.get(f"{portfolio_url}/summary", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_read_only_posts_keep_the_write_generation(client, portfolio_url):
+    generation = caching.current_generation()
+    response = client.post("/portfolios/nav-batch", json={"start_date": "2024-01-02", "end_date": "2024-01-31"})
+    assert response.status_code == 200
+    assert caching.current_generation() == generation
+
+    # Only the exact routes are exempt
+    client.post(f"{portfolio_url}/not-optimize")
+    assert caching.current_generation() != generation
+
+
+def test_results_are_cached_per_etag(client, portfolio_url, monkeypatch):
+    calls = []
+    get_asset_allocation = PortfolioService.get_asset_allocation
+
+    def counting_allocation(self, *args, **kwargs):
+        calls.append(args)
+        return get_asset_allocation(self, *args, **kwargs)
+
+    monkeypatch.setattr(PortfolioService, "get_asset_allocation", counting_allocation)
+    first = client.get(f"{portfolio_url}/allocation")
+    second = client.get(f"{portfolio_url}/allocation")
+    assert second.json() == first.json()
+    assert len(calls) == 1
+
+    client.post(
+        "/import/prices/",
+        files={"file": ("prices.csv", "symbol,price_date,price\n600036.SH,2024-01-03,36\n", "text/csv")},
+    )
+    client.get(f"{portfolio_url}/allocation")
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_one_computation():
+    flights = caching.SingleFlight()
+    calls = []
+
+    def slow_computation():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return {"value": 42}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flights.do("key", slow_computation)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"value": 42}] * 8
+    # Finished calls are not reused
+    assert flights.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_propagates_errors():
+    flights = caching.SingleFlight()
+
+    def failing():
+        raise ValueError("no prices")
+
+    with pytest.raises(ValueError):
+        flights.do("key", failing)
+    assert flights.do("key", lambda: 1) == 1
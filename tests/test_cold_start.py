@@ -0,0 +1,33 @@
+"""Tests that importing the backend stays cheap"""
+
+import json
+import logging
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).parent.parent
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    """Importing backend.main must not load pandas, numpy, uvicorn, akshare or pyarrow"""
+    code = (
+        "import json, sys, backend.main; "
+        "print(json.dumps([m for m in ('pandas', 'numpy', 'scipy', 'uvicorn', 'akshare', 'pyarrow') if m in sys.modules]))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT_PATH, capture_output=True, text=True, check=True
+    )
+    assert json.loads(completed.stdout) == []
+
+
+def test_file_logger_does_not_open_file_at_import():
+    """The debug file handler should only open its file when something is logged"""
+    import backend  # noqa: F401
+
+    file_handlers = [
+        handler for handler in logging.getLogger("file_logger").handlers
+        if isinstance(handler, logging.FileHandler)
+    ]
+    assert file_handlers
+    assert all(handler.stream is None for handler in file_handlers)
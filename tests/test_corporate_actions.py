@@ -0,0 +1,99 @@
+"""Tests for corporate actions and adjusted price series"""
+
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlmodel import select
+
+from backend import corporate_actions
+from backend.corporate_actions import CorporateActionService
+from backend.models import Price
+
+DATES = [date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4), date(2024, 1, 5)]
+CLOSES = [40.0, 42.0, 21.5, 20.5]
+
+
+def _action(ex_date: date, action_type: str, ratio=None, amount=None):
+    return SimpleNamespace(asset_id=1, ex_date=ex_date, action_type=action_type, ratio=ratio, amount=amount)
+
+
+def test_backward_adjustment_factors():
+    actions = [
+        _action(date(2024, 1, 4), "split", ratio=Decimal("2")),
+        # Paid from the close of 21.5 before the ex-date
+        _action(date(2024, 1, 5), "dividend", amount=Decimal("0.43")),
+    ]
+    series = corporate_actions.adjust_series(1, DATES, CLOSES, actions)
+    assert series.close == tuple(CLOSES)
+    assert series.split == pytest.approx([20.0, 21.0, 21.5, 20.5])
+    assert series.total_return == pytest.approx([20.0 * 0.98, 21.0 * 0.98, 21.5 * 0.98, 20.5])
+    # Split-adjusted growth to the last close before the ex-date, then from the close net of the dividend
+    assert series.total_return[-1] / series.total_return[0] == pytest.approx(21.5 / 20 * 20.5 / (21.5 - 0.43))
+    assert series.values("none")[series.window(date(2024, 1, 3), date(2024, 1, 4))] == (42.0, 21.5)
+    with pytest.raises(ValueError):
+        series.values("dividend")
+
+    # A dividend without a close before it cannot be expressed as a factor
+    ignored = corporate_actions.adjust_series(1, DATES, CLOSES, [_action(date(2024, 1, 2), "dividend", amount=Decimal("1"))])
+    assert ignored.total_return == tuple(CLOSES)
+
+
+def test_adjusted_series_are_cached_until_the_rows_change(test_db):
+    cmb = test_db._test_assets["600036.SH"].id
+    test_db.add_all([
+        Price(asset_id=cmb, price_date=price_date, price=Decimal(str(close)), price_type="historical")
+        for price_date, close in zip(DATES, CLOSES)
+    ])
+    test_db.commit()
+    service = CorporateActionService(test_db)
+
+    first = service.adjusted_series([cmb])[cmb]
+    assert first.split == tuple(CLOSES)
+    assert service.adjusted_series([cmb])[cmb] is first
+
+    split = service.create_action(cmb, date(2024, 1, 4), "split", ratio=Decimal("2"))
+    assert service.adjusted_series([cmb])[cmb].split == pytest.approx([20.0, 21.0, 21.5, 20.5])
+
+    # An upserted close keeps the ids but changes the series
+    price = test_db.exec(select(Price).where(Price.price_date == date(2024, 1, 5))).one()
+    price.price = Decimal("22")
+    test_db.commit()
+    assert service.adjusted_series([cmb])[cmb].close[-1] == 22.0
+
+    test_db.delete(split)
+    test_db.commit()
+    assert service.adjusted_series([cmb])[cmb].split == (40.0, 42.0, 21.5, 22.0)
+    with pytest.raises(ValueError):
+        service.create_action(cmb, date(2024, 1, 4), "split")
+
+
+def test_corporate_action_endpoints(client, test_db):
+    cmb = test_db._test_assets["600036.SH"].id
+    test_db.add_all([
+        Price(asset_id=cmb, price_date=price_date, price=Decimal(str(close)), price_type="historical")
+        for price_date, close in zip(DATES, CLOSES)
+    ])
+    test_db.commit()
+
+    response = client.post("/corporate-actions/", json={
+        "asset_id": cmb, "ex_date": "2024-01-04", "action_type": "split", "ratio": "2",
+    })
+    assert response.status_code == 200
+    assert client.post("/corporate-actions/", json={
+        "asset_id": cmb, "ex_date": "2024-01-05", "action_type": "dividend",
+    }).status_code == 400
+    assert [action["ex_date"] for action in client.get("/corporate-actions/", params={"asset_id": cmb}).json()] == [
+        "2024-01-04"
+    ]
+
+    prices = client.get(f"/assets/{cmb}/prices", params={
+        "start_date": "2024-01-03", "adjust": "split",
+    }).json()["prices"]
+    assert [(row["date"], row["close"], row["adjusted_close"]) for row in prices] == [
+        ("2024-01-03", 42.0, 21.0), ("2024-01-04", 21.5, 21.5), ("2024-01-05", 20.5, 20.5),
+    ]
+    assert client.get(f"/assets/{cmb}/prices", params={"adjust": "bad"}).status_code == 400
+    assert client.delete(f"/corporate-actions/{response.json()['id']}").status_code == 200
+    assert client.get("/corporate-actions/").json() == []
@@ -0,0 +1,122 @@
+"""Tests for covariance and correlation estimates"""
+
+from dataclasses import replace
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from backend import covariance
+from backend.models import Price, Transaction
+
+
+@pytest.fixture
+def returns():
+    rng = np.random.default_rng(7)
+    matrix = np.array([[4.0, 1.5, 0.5, 0.0], [1.5, 2.0, 0.3, 0.0], [0.5, 0.3, 1.0, 0.2], [0.0, 0.0, 0.2, 3.0]])
+    return rng.multivariate_normal(np.full(4, 1e-4), matrix * 1e-4, size=300)
+
+
+def _days(count: int) -> list[date]:
+    return [date(2024, 1, 1) + timedelta(days=offset) for offset in range(count)]
+
+
+def test_estimators(returns):
+    asset_ids, days = [1, 2, 3, 4], _days(len(returns))
+
+    sample = covariance.estimate("sample", asset_ids, days, returns)
+    assert sample.covariance == pytest.approx(np.cov(returns, rowvar=False))
+    assert sample.correlation == pytest.approx(np.corrcoef(returns, rowvar=False))
+
+    weights = 0.9 ** np.arange(len(returns) - 1, -1, -1)
+    ewma = covariance.estimate("ewma", asset_ids, days, returns, decay=0.9)
+    assert ewma.covariance == pytest.approx((returns * weights[:, None]).T @ returns / weights.sum())
+
+    # Ledoit-Wolf (2004) with a scaled identity target, term by term
+    lw = covariance.estimate("ledoit_wolf", asset_ids, days, returns)
+    centered = returns - returns.mean(axis=0)
+    biased = centered.T @ centered / len(returns)
+    target = np.trace(biased) / 4 * np.eye(4)
+    spread = sum(np.sum((np.outer(row, row) - biased) ** 2) for row in centered) / len(returns) ** 2
+    shrinkage = min(spread, np.sum((biased - target) ** 2)) / np.sum((biased - target) ** 2)
+    assert lw.shrinkage == pytest.approx(shrinkage)
+    assert 0 < lw.shrinkage < 1
+    assert lw.covariance == pytest.approx(shrinkage * target + (1 - shrinkage) * biased)
+
+    # Cash has no variance
+    assert covariance.correlation(np.diag([1e-4, 0.0])) == pytest.approx(np.eye(2))
+    with pytest.raises(ValueError):
+        covariance.validate("garch")
+
+
+@pytest.mark.parametrize("method", covariance.METHODS)
+def test_incremental_update_equals_rebuild(returns, method):
+    asset_ids, days = [1, 2, 3, 4], _days(len(returns))
+    previous = covariance.estimate(method, asset_ids, days[:200], returns[:200], decay=0.97)
+
+    shifted = covariance.estimate(method, asset_ids, days[5:210], returns[5:210], decay=0.97, previous=previous)
+    rebuilt = covariance.estimate(method, asset_ids, days[5:210], returns[5:210], decay=0.97)
+    assert shifted.updates == 10
+    assert shifted.covariance == pytest.approx(rebuilt.covariance, rel=1e-9)
+    assert shifted.shrinkage == pytest.approx(rebuilt.shrinkage, rel=1e-9)
+
+    # A changed return in the overlap (e.g. a new dividend) rebuilds the sums
+    changed = returns[5:210].copy()
+    changed[50, 0] += 0.01
+    assert covariance.estimate(method, asset_ids, days[5:210], changed, decay=0.97, previous=previous).updates == 0
+    # So does a whole window of updates
+    worn = replace(shifted, updates=len(shifted.dates) - 1)
+    assert covariance.estimate(method, asset_ids, days[6:211], returns[6:211], decay=0.97, previous=worn).updates == 0
+
+
+def test_correlation_endpoint_updates_with_new_prices(client, test_db):
+    portfolio_id = test_db._test_portfolio.id
+    assets = test_db._test_assets
+    cmb, etf = assets["600036.SH"].id, assets["510300.SH"].id
+    for symbol, quantity, price in [("CNY_CASH", "100000", "1"), ("600036.SH", "1000", "30"), ("510300.SH", "5000", "4")]:
+        test_db.add(Transaction(
+            portfolio_id=portfolio_id, trade_date=date(2024, 1, 1), action="cash_in" if symbol == "CNY_CASH" else "buy",
+            asset_id=assets[symbol].id, quantity=Decimal(quantity), price=Decimal(price),
+            amount=Decimal(quantity) * Decimal(price), fees=Decimal("0"), currency_id=assets[symbol].currency_id,
+        ))
+    rng = np.random.default_rng(1)
+    common = rng.normal(0, 0.01, 61)
+    closes = {
+        cmb: 30 * np.exp(np.cumsum(common + rng.normal(0, 0.005, 61))),
+        etf: 4 * np.exp(np.cumsum(common + rng.normal(0, 0.005, 61))),
+    }
+    days = _days(61)
+    test_db.add_all([
+        Price(asset_id=asset_id, price_date=day, price=Decimal(f"{close:.4f}"), price_type="historical")
+        for asset_id, series in closes.items() for day, close in zip(days[:60], series)
+    ])
+    test_db.commit()
+
+    url = f"/portfolios/{portfolio_id}/correlation"
+    response = client.get(url, params={"as_of_date": "2024-03-01", "window": 40, "method": "sample"})
+    assert response.status_code == 200
+    result = response.json()
+    assert [asset["asset_id"] for asset in result["assets"]] == sorted([assets["CNY_CASH"].id, cmb, etf])
+    assert result["observations"] == 40
+    position = {asset["asset_id"]: index for index, asset in enumerate(result["assets"])}
+    assert result["correlation"][position[cmb]][position[etf]] > 0.5
+    assert result["volatilities"][position[assets["CNY_CASH"].id]] == 0
+
+    # The next daily prices update the cached sums
+    test_db.add_all([
+        Price(asset_id=asset_id, price_date=days[60], price=Decimal(f"{series[60]:.4f}"), price_type="historical")
+        for asset_id, series in closes.items()
+    ])
+    test_db.commit()
+    service = covariance.CovarianceService(test_db)
+    updated = service.estimate([assets["CNY_CASH"].id, cmb, etf], date(2024, 3, 1), window=40, method="sample")
+    assert updated.updates == 1
+    assert updated.dates[-1] == days[60]
+    assert service.estimate([cmb, etf, assets["CNY_CASH"].id], date(2024, 3, 1), window=40, method="sample") is updated
+    covariance._estimates.clear()
+    rebuilt = service.estimate([assets["CNY_CASH"].id, cmb, etf], date(2024, 3, 1), window=40, method="sample")
+    assert rebuilt.updates == 0
+    assert updated.covariance == pytest.approx(rebuilt.covariance)
+
+    assert client.get(url, params={"method": "garch"}).status_code == 400
@@ -0,0 +1,126 @@
+"""Tests for the materialized daily portfolio values"""
+
+import pytest
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlmodel import Session, select
+
+from backend.models import PortfolioDailyValue, Price, Transaction
+from backend.services import DailyValueService, PortfolioService
+
+
+def _stored_rows(session: Session, portfolio_id: int) -> list[tuple]:
+    rows = session.exec(
+        select(PortfolioDailyValue)
+        .where(PortfolioDailyValue.portfolio_id == portfolio_id)
+        .order_by(PortfolioDailyValue.value_date)
+    ).all()
+    return [(row.value_date, float(row.total_value), float(row.nav), float(row.shares)) for row in rows]
+
+
+def test_materialized_values_match_nav_series(synthetic_session):
+    """Rows run from inception without gaps and agree with batch_nav_series()"""
+    session, dataset = synthetic_session
+    end_date = dataset.start_date + timedelta(days=90)
+    service = DailyValueService(session)
+    rows = service.get_daily_values(dataset.portfolio_id, dataset.start_date, end_date)
+
+    expected = PortfolioService(session).batch_nav_series([dataset.portfolio_id], dataset.start_date, end_date)
+    expected = expected[dataset.portfolio_id]
+    assert [row.value_date for row in rows] == expected["dates"]
+    assert [float(row.total_value) for row in rows] == pytest.approx(expected["values"], rel=1e-9)
+    assert [float(row.nav) for row in rows] == pytest.approx(expected["nav_history"], rel=1e-9)
+    assert [float(row.net_cash_flow) for row in rows] == pytest.approx(expected["cash_flows"], rel=1e-9)
+
+
+def test_incremental_refresh_matches_full_refresh(synthetic_session):
+    """Appending days continues NAV and shares exactly like a single refresh"""
+    session, dataset = synthetic_session
+    middle_date = dataset.start_date + timedelta(days=40)
+    end_date = dataset.start_date + timedelta(days=100)
+    service = DailyValueService(session)
+
+    service.refresh(dataset.portfolio_id, middle_date)
+    service.refresh(dataset.portfolio_id, end_date)
+    incremental = _stored_rows(session, dataset.portfolio_id)
+
+    service.invalidate(dataset.start_date, dataset.portfolio_id)
+    assert _stored_rows(session, dataset.portfolio_id) == []
+    service.refresh(dataset.portfolio_id, end_date)
+    full = _stored_rows(session, dataset.portfolio_id)
+
+    assert [row[0] for row in incremental] == [row[0] for row in full]
+    for incremental_row, full_row in zip(incremental, full):
+        assert incremental_row[1:] == pytest.approx(full_row[1:], rel=1e-9)
+
+
+def test_streamed_rows_are_materialized_chunk_by_chunk(synthetic_session):
+    """iter_daily_values() yields the first rows before the whole range is replayed"""
+    session, dataset = synthetic_session
+    start_date = dataset.start_date + timedelta(days=30)
+    end_date = dataset.start_date + timedelta(days=120)
+    service = DailyValueService(session)
+
+    rows = service.iter_daily_values(dataset.portfolio_id, start_date, end_date, chunk_days=20)
+    first = next(rows)
+    assert service._last_materialized_date(dataset.portfolio_id) < start_date + timedelta(days=20)
+    streamed = [first, *rows]
+
+    expected = DailyValueService(session).twr(dataset.portfolio_id, start_date, end_date)
+    assert [row[0] for row in streamed] == expected["dates"]
+    assert [row[2] for row in streamed] == pytest.approx(expected["nav_history"], rel=1e-9)
+    assert list(service.iter_daily_values(dataset.portfolio_id, start_date, end_date)) == streamed
+
+
+def test_rebased_twr_matches_twr(synthetic_session):
+    """DailyValueService.twr() over a sub-period equals PortfolioService.twr()"""
+    session, dataset = synthetic_session
+    start_date = dataset.start_date + timedelta(days=60)
+    end_date = start_date + timedelta(days=10)
+
+    expected = PortfolioService(session).twr(dataset.portfolio_id, start_date, end_date)
+    result = DailyValueService(session).twr(dataset.portfolio_id, start_date, end_date)
+
+    assert result["dates"] == expected["dates"]
+    assert result["nav_history"] == pytest.approx(expected["nav_history"], rel=1e-9)
+    # Stored NAVs keep 10 decimal places
+    assert result["daily_returns"] == pytest.approx(expected["daily_returns"], abs=1e-9)
+    assert result["twr"] == pytest.approx(expected["twr"], abs=1e-9)
+
+
+def test_performance_history_follows_new_transactions(client, test_db: Session):
+    """Writing through the API invalidates the materialized rows from the trade date"""
+    portfolio = test_db._test_portfolio
+    cny = test_db._test_cny
+    assets = test_db._test_assets
+    test_db.add_all([
+        Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 1), action="cash_in",
+                    asset_id=assets["CNY_CASH"].id, quantity=Decimal("10000"), price=Decimal("1"),
+                    amount=Decimal("10000"), currency_id=cny.id),
+        Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 2), action="buy",
+                    asset_id=assets["600036.SH"].id, quantity=Decimal("100"), price=Decimal("40"),
+                    amount=Decimal("4000"), fees=Decimal("0"), currency_id=cny.id),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, 2), price=Decimal("40"), price_type="historical"),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, 4), price=Decimal("44"), price_type="historical"),
+    ])
+    test_db.commit()
+    params = {"start_date": "2024-12-01", "end_date": "2025-01-05"}
+
+    history = client.get(f"/portfolios/{portfolio.id}/performance-history", params=params).json()
+    assert [point["date"] for point in history][0] == "2025-01-01"
+    assert len(history) == 5
+    assert history[0]["nav"] == 1.0
+    assert history[-1]["value"] == pytest.approx(10400.0)
+    assert history[-1]["nav"] == pytest.approx(1.04)
+
+    content = "trade_date,action,symbol,name,quantity,price,amount,fees,notes\n2025-01-03,cash_in,CNY,Deposit,5000,1,5000,0,\n"
+    response = client.post(
+        "/import/transactions/", files={"file": ("transactions.csv", content, "text/csv")}
+    )
+    assert response.status_code == 200
+
+    history = client.get(f"/portfolios/{portfolio.id}/performance-history", params=params).json()
+    assert history[-1]["value"] == pytest.approx(15400.0)
+    # The deposit on 2025-01-03 is invested when the price rises on 2025-01-04
+    assert history[2]["nav"] == pytest.approx(1.0)
+    assert history[-1]["nav"] == pytest.approx(1 + 400 / 15000)
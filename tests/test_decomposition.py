@@ -0,0 +1,100 @@
+"""Tests for the marginal and component risk decomposition"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from backend import decomposition
+from backend.models import AssetMetadata, ExchangeRate, Price, Transaction
+
+
+def test_components_add_up_to_the_portfolio_volatility():
+    rng = np.random.default_rng(2)
+    factor = rng.normal(0, 0.01, (6, 6))
+    covariance = factor @ factor.T
+    exposures = np.array([40.0, 25.0, 15.0, 10.0, 15.0, -5.0])
+    result = decomposition.decompose(covariance, exposures)
+
+    weights = exposures / exposures.sum()
+    volatility = np.sqrt(weights @ covariance @ weights)
+    assert result["volatility"] == pytest.approx(volatility)
+    assert result["component"].sum() == pytest.approx(volatility)
+    assert result["contribution"].sum() == pytest.approx(1.0)
+    # The marginal volatility is the gradient of the volatility in the weights
+    step = 1e-7
+    for index in range(len(weights)):
+        bumped = weights.copy()
+        bumped[index] += step
+        assert result["marginal"][index] == pytest.approx(
+            (np.sqrt(bumped @ covariance @ bumped) - volatility) / step, rel=1e-4
+        )
+
+    keys, sums = decomposition.aggregate(["b", "a", "b", "c", "a", "b"], np.column_stack([exposures, weights]))
+    assert keys == ["a", "b", "c"]
+    assert sums == pytest.approx(np.array([[40.0, 0.4], [50.0, 0.5], [10.0, 0.1]]))
+
+
+def test_risk_decomposition_endpoint(client, test_db):
+    portfolio_id = test_db._test_portfolio.id
+    assets = test_db._test_assets
+    cmb, tencent, etf = assets["600036.SH"].id, assets["00700.HK"].id, assets["510300.SH"].id
+    for symbol, quantity, price in [
+        ("CNY_CASH", "100000", "1"), ("600036.SH", "1000", "30"), ("510300.SH", "5000", "4"),
+        ("HKD_CASH", "20000", "1"), ("00700.HK", "50", "300"),
+    ]:
+        test_db.add(Transaction(
+            portfolio_id=portfolio_id, trade_date=date(2024, 1, 1), action="cash_in" if "CASH" in symbol else "buy",
+            asset_id=assets[symbol].id, quantity=Decimal(quantity), price=Decimal(price),
+            amount=Decimal(quantity) * Decimal(price), fees=Decimal("0"), currency_id=assets[symbol].currency_id,
+        ))
+    rng = np.random.default_rng(4)
+    days = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(60)]
+    closes = {
+        cmb: 30 * np.exp(np.cumsum(rng.normal(0, 0.02, 60))),
+        etf: 4 * np.exp(np.cumsum(rng.normal(0, 0.01, 60))),
+        tencent: 300 * np.exp(np.cumsum(rng.normal(0, 0.02, 60))),
+    }
+    rates = 0.9 * np.exp(np.cumsum(rng.normal(0, 0.003, 60)))
+    test_db.add_all(
+        [Price(asset_id=asset_id, price_date=day, price=Decimal(f"{close:.4f}"), price_type="historical")
+         for asset_id, series in closes.items() for day, close in zip(days, series)]
+        + [ExchangeRate(currency_id=test_db._test_hkd.id, rate_date=day, rate_to_primary=Decimal(f"{rate:.6f}"))
+           for day, rate in zip(days, rates)]
+        + [AssetMetadata(asset_id=cmb, attribute_name="sector", attribute_value="Banks")]
+    )
+    test_db.commit()
+
+    url = f"/portfolios/{portfolio_id}/risk-decomposition"
+    response = client.get(url, params={"as_of_date": days[-1].isoformat(), "method": "sample", "confidence": 0.95})
+    assert response.status_code == 200
+    result = response.json()
+    rows = {row["asset_id"]: row for row in result["assets"]}
+    assert len(rows) == 5
+    assert sum(row["component_volatility"] for row in rows.values()) == pytest.approx(result["volatility"])
+    assert sum(row["component_var"] for row in rows.values()) == pytest.approx(result["var"])
+    # Delta-normal VaR over the square root of the horizon
+    four_days = client.get(url, params={
+        "as_of_date": days[-1].isoformat(), "method": "sample", "confidence": 0.95, "horizon": 4,
+    }).json()
+    assert four_days["var"] == pytest.approx(2 * result["var"])
+    assert sum(row["weight"] * row["marginal_var"] for row in rows.values()) * result["total_value"] == pytest.approx(
+        result["var"]
+    )
+    assert rows[assets["CNY_CASH"].id]["component_volatility"] == 0
+    # Foreign cash carries the currency risk
+    assert rows[assets["HKD_CASH"].id]["component_volatility"] != 0
+    assert rows[cmb]["sector"] == "Banks"
+
+    groups = {
+        grouping: {group["key"]: group for group in result["groups"][grouping]} for grouping in decomposition.GROUPINGS
+    }
+    assert set(groups["currency"]) == {"CNY", "HKD"}
+    assert groups["currency"]["HKD"]["component_var"] == pytest.approx(
+        rows[tencent]["component_var"] + rows[assets["HKD_CASH"].id]["component_var"]
+    )
+    assert groups["sector"]["Banks"]["contribution"] == pytest.approx(rows[cmb]["contribution"])
+    assert sum(group["contribution"] for group in groups["type"].values()) == pytest.approx(1.0)
+
+    assert client.get(url, params={"confidence": 2}).status_code == 400
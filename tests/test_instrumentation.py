@@ -0,0 +1,76 @@
+"""Tests for the instrumentation of the services"""
+
+import pytest
+from datetime import date
+from decimal import Decimal
+from sqlmodel import Session
+
+from backend import instrumentation
+from backend.models import Transaction, Price
+from backend.services import PortfolioService
+
+
+@pytest.fixture
+def enabled_instrumentation():
+    """Enable instrumentation with fresh counters for one test"""
+    instrumentation.registry.reset()
+    instrumentation.enable(server_timing=True)
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.disable()
+        instrumentation.registry.reset()
+
+
+@pytest.fixture
+def small_portfolio(test_db: Session):
+    """A portfolio with a deposit and one stock purchase"""
+    portfolio = test_db._test_portfolio
+    assets = test_db._test_assets
+    test_db.add(Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, 1),
+                      price=Decimal("35"), price_type="historical"))
+    test_db.add(Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 1), action="cash_in",
+                            asset_id=assets["CNY_CASH"].id, quantity=Decimal("10000"), price=Decimal("1"),
+                            amount=Decimal("10000"), fees=Decimal("0"), currency_id=test_db._test_cny.id))
+    test_db.add(Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 2), action="buy",
+                            asset_id=assets["600036.SH"].id, quantity=Decimal("100"), price=Decimal("35"),
+                            amount=Decimal("3500"), fees=Decimal("5"), currency_id=test_db._test_cny.id))
+    test_db.commit()
+    return portfolio
+
+
+def test_disabled_instrumentation_records_nothing(test_db: Session, small_portfolio):
+    """Nothing is recorded while instrumentation is disabled"""
+    instrumentation.registry.reset()
+    PortfolioService(test_db).twr(small_portfolio.id, date(2025, 1, 1), date(2025, 1, 5))
+
+    assert instrumentation.stage("replay") is instrumentation.stage("valuation")
+    assert instrumentation.registry.stage_calls == {}
+    assert instrumentation.registry.sql_queries == 0
+
+
+def test_stages_and_counters_are_recorded(test_db: Session, small_portfolio, enabled_instrumentation):
+    """twr() reports stage timers, SQL counts and Decimal operations"""
+    PortfolioService(test_db).twr(small_portfolio.id, date(2025, 1, 1), date(2025, 1, 5))
+
+    registry = enabled_instrumentation.registry
+    for stage in ("load_ledger", "load_prices", "replay", "valuation", "persist"):
+        assert registry.stage_calls.get(stage, 0) > 0, stage
+    assert registry.sql_queries > 0
+    assert registry.rows_fetched > 0
+    assert registry.decimal_ops > 0
+    assert registry.float_ops > 0
+
+
+def test_metrics_endpoint_and_server_timing_header(client, small_portfolio, enabled_instrumentation):
+    """The API exposes Prometheus metrics and the X-Server-Timing header"""
+    response = client.get(f"/portfolios/{small_portfolio.id}/summary", params={"as_of_date": "2025-01-05"})
+    assert response.status_code == 200
+    server_timing = response.headers["X-Server-Timing"]
+    assert "replay;dur=" in server_timing
+    assert "sql;desc=" in server_timing
+
+    metrics = client.get("/metrics").text
+    assert 'niceams_stage_seconds_total{stage="replay"}' in metrics
+    assert "niceams_sql_queries_total" in metrics
+    assert 'niceams_requests_total{route="/portfolios/{portfolio_id}/summary"} 1' in metrics
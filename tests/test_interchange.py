@@ -0,0 +1,153 @@
+"""Tests for the Arrow IPC and Parquet bulk import and export"""
+
+import io
+import pytest
+from datetime import date
+from decimal import Decimal
+from sqlmodel import Session, select
+
+from backend.models import Asset, Portfolio, PortfolioDailyValue, Price, Transaction
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _parquet(table) -> bytes:
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def _arrow_stream(table) -> bytes:
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _upload(client, path: str, content: bytes, file_format: str):
+    return client.post(
+        path, params={"format": file_format}, files={"file": (f"data.{file_format}", content, "application/octet-stream")}
+    )
+
+
+def test_bulk_price_import_upserts(client, test_db: Session):
+    prices = pa.table({
+        "symbol": ["600036.SH", "600036.SH", "00700.HK", "UNKNOWN"],
+        "price_date": pa.array([date(2025, 1, 2), date(2025, 1, 3), date(2025, 1, 2), date(2025, 1, 2)]),
+        "price": [40.5, 41.0, 380.2, 1.0],
+    })
+    response = _upload(client, "/import/prices/bulk", _parquet(prices), "parquet")
+    assert response.status_code == 200
+    assert response.json()["message"] == "Successfully imported 3 prices"
+
+    # Loading a correction again updates the existing row instead of failing
+    correction = pa.table({"symbol": ["600036.SH"], "price_date": ["2025-01-03"], "price": [41.5]})
+    response = _upload(client, "/import/prices/bulk", _arrow_stream(correction), "arrow")
+    assert response.status_code == 200
+
+    stored = test_db.exec(select(Price).order_by(Price.asset_id, Price.price_date)).all()
+    assert len(stored) == 3
+    cmb = test_db._test_assets["600036.SH"]
+    assert [(price.price_date, price.price) for price in stored if price.asset_id == cmb.id] == [
+        (date(2025, 1, 2), Decimal("40.5")),
+        (date(2025, 1, 3), Decimal("41.5")),
+    ]
+    assert all(price.source == "bulk_import" for price in stored)
+
+
+def test_bulk_transaction_import(client, test_db: Session):
+    transactions = pa.table({
+        "trade_date": ["2025-01-01", "2025-01-02", "2025-01-02"],
+        "action": ["cash_in", "buy", "buy"],
+        "symbol": ["CNY", "600036.SH", "601398.SH"],
+        "name": ["Deposit", "China Merchants Bank", "ICBC"],
+        "quantity": [None, 100.0, 200.0],
+        "price": [None, 40.5, 5.5],
+        "amount": [10000.0, 4050.0, 1100.0],
+        "fees": [None, 5.0, 1.0],
+    })
+    response = _upload(client, "/import/transactions/bulk", _parquet(transactions), "parquet")
+    assert response.status_code == 200, response.text
+    assert response.json()["message"] == "Successfully imported 3 transactions"
+
+    stored = test_db.exec(select(Transaction).order_by(Transaction.id)).all()
+    assets = test_db._test_assets
+    assert stored[0].asset_id == assets["CNY_CASH"].id
+    assert stored[0].quantity == Decimal("10000")
+    assert stored[0].price == Decimal("1")
+    assert stored[1].asset_id == assets["600036.SH"].id
+    assert stored[1].fees == Decimal("5")
+    new_asset = test_db.exec(select(Asset).where(Asset.symbol == "601398.SH")).one()
+    assert new_asset.type == "stock"
+    assert stored[2].asset_id == new_asset.id
+
+
+def test_bulk_transaction_import_invalidates_its_portfolio_only(client, test_db: Session):
+    other = Portfolio(name="Other Portfolio", base_currency_id=test_db._test_cny.id)
+    test_db.add(other)
+    test_db.commit()
+    portfolio_ids = [test_db._test_portfolio.id, other.id]
+    test_db.add_all([
+        PortfolioDailyValue(
+            portfolio_id=portfolio_id, value_date=date(2025, 1, day), total_value=Decimal("100"),
+            net_cash_flow=Decimal("0"), nav=Decimal("1"), shares=Decimal("100"),
+        )
+        for portfolio_id in portfolio_ids for day in range(1, 6)
+    ])
+    test_db.commit()
+
+    transactions = pa.table({"trade_date": ["2025-01-03"], "action": ["cash_in"], "symbol": ["CNY"], "amount": [500.0]})
+    response = _upload(client, "/import/transactions/bulk", _parquet(transactions), "parquet")
+    assert response.status_code == 200, response.text
+
+    remaining = {
+        portfolio_id: len(test_db.exec(
+            select(PortfolioDailyValue).where(PortfolioDailyValue.portfolio_id == portfolio_id)
+        ).all())
+        for portfolio_id in portfolio_ids
+    }
+    assert remaining == {test_db._test_portfolio.id: 2, other.id: 5}
+
+
+def test_price_export_is_pruned_and_filtered(client, test_db: Session):
+    assets = test_db._test_assets
+    test_db.add_all([
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, day), price=Decimal(40 + day), price_type="historical")
+        for day in range(1, 6)
+    ] + [
+        Price(asset_id=assets["00700.HK"].id, price_date=date(2025, 1, 3), price=Decimal("380"), price_type="historical")
+    ])
+    test_db.commit()
+
+    response = client.get("/prices/export", params={
+        "start_date": "2025-01-02", "end_date": "2025-01-04", "symbols": "600036.SH", "columns": "price_date,price",
+    })
+    assert response.status_code == 200
+    table = pq.read_table(pa.BufferReader(response.content))
+    assert table.column_names == ["price_date", "price"]
+    assert table.column("price_date").to_pylist() == [date(2025, 1, 2), date(2025, 1, 3), date(2025, 1, 4)]
+    assert table.column("price").to_pylist() == [42.0, 43.0, 44.0]
+
+    response = client.get("/prices/export", params={"format": "arrow"})
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert pa.types.is_dictionary(table.schema.field("symbol").type)
+    assert table.num_rows == 6
+
+    response = client.get("/prices/export", params={"columns": "price,volume"})
+    assert response.status_code == 400
+
+
+def test_transaction_export_parquet(client, test_db: Session):
+    test_db.add(Transaction(
+        portfolio_id=test_db._test_portfolio.id, trade_date=date(2025, 1, 1), action="cash_in",
+        asset_id=test_db._test_assets["CNY_CASH"].id, quantity=Decimal("10000"), price=Decimal("1"),
+        amount=Decimal("10000"), currency_id=test_db._test_cny.id,
+    ))
+    test_db.commit()
+
+    response = client.get("/transactions/export", params={"format": "parquet"})
+    assert response.status_code == 200
+    table = pq.read_table(pa.BufferReader(response.content))
+    assert table.column("symbol").to_pylist() == ["CNY_CASH"]
+    assert table.column("amount").to_pylist() == [Decimal("10000")]
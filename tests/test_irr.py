@@ -0,0 +1,86 @@
+"""Tests for the money-weighted return (XIRR) solver"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from scipy.optimize import brentq
+
+from backend import irr
+from backend.models import Price
+
+
+def _npv(cash_flows: list[tuple[date, float]], rate: float) -> float:
+    first = cash_flows[0][0]
+    return sum(amount * (1 + rate) ** (-(flow_date - first).days / 365) for flow_date, amount in cash_flows)
+
+
+def test_known_rates():
+    assert irr.xirr([(date(2023, 1, 1), -1000), (date(2024, 1, 1), 1100)]) == pytest.approx(0.1)
+    # A 10% gain in a quarter compounds to an annual rate
+    assert irr.xirr([(date(2024, 1, 1), -1000), (date(2024, 4, 1), 1100)]) == pytest.approx(1.1 ** (365 / 91) - 1)
+    assert irr.xirr([(date(2023, 1, 1), -1000), (date(2024, 1, 1), 10)]) == pytest.approx(-0.99)
+    # Without a sign change, or a second flow, there is no rate
+    assert irr.xirr_many([
+        [(date(2023, 1, 1), -1000), (date(2024, 1, 1), -10)],
+        [(date(2023, 1, 1), -1000)],
+        [],
+    ]) == [None, None, None]
+
+
+def test_many_series_match_a_scalar_root_finder():
+    rng = np.random.default_rng(7)
+    series = []
+    for _ in range(300):
+        n_flows = int(rng.integers(2, 40))
+        days = np.sort(rng.integers(0, 3000, n_flows))
+        amounts = -rng.uniform(100, 10000, n_flows)
+        # The last flow ends anywhere between a large loss and a large gain
+        amounts[-1] = -amounts[:-1].sum() * rng.uniform(0.3, 3.0)
+        series.append([
+            (date(2015, 1, 1) + timedelta(days=int(day)), float(amount)) for day, amount in zip(days, amounts)
+        ])
+
+    rates = irr.xirr_many(series)
+    for cash_flows, rate in zip(series, rates):
+        expected = brentq(lambda r: _npv(cash_flows, r), -0.9999, 1e6, xtol=1e-14)
+        assert rate == pytest.approx(expected, rel=1e-8, abs=1e-10)
+
+
+def test_irr_endpoint(client, test_db):
+    client.post("/import/transactions/", files={"file": (
+        "transactions.csv",
+        "trade_date,action,symbol,quantity,price,amount,fees\n"
+        "2023-01-02,cash_in,CNY,100000,1,100000,0\n"
+        "2023-01-02,buy,600036.SH,1000,30,30000,0\n"
+        "2023-07-03,buy,600036.SH,1000,35,35000,0\n"
+        "2023-10-09,dividends,600036.SH,,,2000,0\n"
+        "2023-11-01,cash_out,CNY,5000,1,5000,0\n",
+        "text/csv",
+    )})
+    cmb = test_db._test_assets["600036.SH"].id
+    test_db.add(Price(asset_id=cmb, price_date=date(2024, 1, 2), price=Decimal("36"), price_type="historical"))
+    test_db.commit()
+
+    response = client.get(f"/portfolios/{test_db._test_portfolio.id}/irr", params={"end_date": "2024-01-02"})
+    assert response.status_code == 200
+    result = response.json()
+    end_value = 100000 - 65000 + 2000 - 5000 + 72000
+    assert result["irr"] == pytest.approx(irr.xirr([
+        (date(2023, 1, 2), -100000), (date(2023, 11, 1), 5000), (date(2024, 1, 2), end_value),
+    ]))
+    assets = {row["symbol"]: row["irr"] for row in result["assets"]}
+    assert list(assets) == ["600036.SH"]
+    assert assets["600036.SH"] == pytest.approx(irr.xirr([
+        (date(2023, 1, 2), -30000), (date(2023, 7, 3), -35000), (date(2023, 10, 9), 2000), (date(2024, 1, 2), 72000),
+    ]))
+
+    # Since a start date, the market value of the day before is invested
+    result = client.get(f"/portfolios/{test_db._test_portfolio.id}/irr", params={
+        "start_date": "2023-12-01", "end_date": "2024-01-02",
+    }).json()
+    assert result["irr"] is not None
+    assert client.get(f"/portfolios/{test_db._test_portfolio.id}/irr", params={
+        "start_date": "2024-02-01", "end_date": "2024-01-02",
+    }).status_code == 400
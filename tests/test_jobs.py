@@ -0,0 +1,164 @@
+"""Tests for the background job queue"""
+
+import threading
+from datetime import date
+
+import pytest
+from sqlmodel import Session, select
+
+from backend import jobs
+from backend.models import Job, Position
+
+TRANSACTIONS_CSV = (
+    "trade_date,action,symbol,quantity,price,amount,fees\n"
+    "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+    "2024-01-03,buy,600036.SH,1000,35,35000,5\n"
+    "2024-01-10,sell,600036.SH,400,37,14800,5\n"
+)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """A fresh job manager replacing the one used by the API"""
+    job_manager = jobs.JobManager(max_workers=1)
+    job_manager.handlers = dict(jobs.manager.handlers)
+    monkeypatch.setattr(jobs, "manager", job_manager)
+    try:
+        yield job_manager
+    finally:
+        job_manager.shutdown(wait=True)
+
+
+def _blocking_handler(release: threading.Event):
+    def handler(session, parameters, data, progress):
+        progress(1, 2, "waiting")
+        release.wait(5)
+        return {"parameters": parameters}
+    return handler
+
+
+def test_background_import_and_recalculation(client, test_db, manager):
+    """Imports and recalculations run as jobs, report progress and store their result"""
+    response = client.post(
+        "/import/transactions/",
+        params={"background": "true"},
+        files={"file": ("transactions.csv", TRANSACTIONS_CSV, "text/csv")},
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.json()["status_url"] == f"/jobs/{job_id}"
+    manager.wait(job_id, timeout=30)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"message": "Successfully imported 3 transactions"}
+    assert job["progress"] == {"current": 3, "total": 3, "message": "rows processed"}
+
+    response = client.post(
+        f"/portfolios/{test_db._test_portfolio.id}/recalculate-positions",
+        params={"as_of_date": "2024-01-31", "background": "true"},
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    manager.wait(job_id, timeout=30)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded"
+    assert job["progress"]["message"] == "transactions replayed"
+    assert job["progress"]["current"] == job["progress"]["total"] == 3
+    with Session(test_db.get_bind()) as session:
+        assert session.exec(select(Position).where(Position.position_date == date(2024, 1, 31))).all()
+        # The uploaded file is dropped once the job finished
+        assert session.get(Job, response.json()["job_id"]).data is None
+
+
+def test_background_performance_history_matches_inline(client, test_db, manager):
+    client.post(
+        "/import/transactions/",
+        files={"file": ("transactions.csv", TRANSACTIONS_CSV, "text/csv")},
+    )
+    params = {"start_date": "2024-01-02", "end_date": "2024-02-29"}
+    url = f"/portfolios/{test_db._test_portfolio.id}/performance-history"
+
+    response = client.get(url, params=params | {"background": "true"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    manager.wait(job_id, timeout=30)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded"
+    assert job["progress"]["message"] == "days replayed"
+    assert job["result"] == client.get(url, params=params).json()
+
+
+def test_identical_active_jobs_are_deduplicated(test_db, manager):
+    release = threading.Event()
+    manager.register("blocking", _blocking_handler(release))
+
+    first = manager.submit(test_db, "blocking", {"portfolio_id": 1})
+    second = manager.submit(test_db, "blocking", {"portfolio_id": 1})
+    other = manager.submit(test_db, "blocking", {"portfolio_id": 2})
+    assert second.id == first.id
+    assert other.id != first.id
+
+    release.set()
+    manager.wait(first.id, timeout=10)
+    manager.wait(other.id, timeout=10)
+    test_db.expire_all()
+    assert test_db.get(Job, first.id).status == "succeeded"
+
+    # A finished job is not reused
+    again = manager.submit(test_db, "blocking", {"portfolio_id": 1})
+    assert again.id != first.id
+    manager.wait(again.id, timeout=10)
+
+
+def test_failed_job_records_error(test_db, manager):
+    def failing(session, parameters, data, progress):
+        raise ValueError("no prices")
+
+    manager.register("failing", failing)
+    job = manager.submit(test_db, "failing", {})
+    manager.wait(job.id, timeout=10)
+    test_db.expire_all()
+    job = test_db.get(Job, job.id)
+    assert job.status == "failed"
+    assert job.error == "no prices"
+    assert job.finished_at is not None
+
+    # Finished jobs are not kept by the manager
+    manager._executor.shutdown(wait=True)
+    assert manager._futures == {}
+    manager.wait(job.id, timeout=10)
+
+
+def test_resume_requeues_interrupted_jobs(test_db, manager):
+    manager.register("echo", lambda session, parameters, data, progress: parameters)
+    interrupted = Job(kind="echo", status="running", dedupe_key="a", parameters='{"n": 1}')
+    queued = Job(kind="echo", dedupe_key="b", parameters='{"n": 2}')
+    test_db.add_all([interrupted, queued])
+    test_db.commit()
+
+    assert manager.resume(test_db.get_bind()) == 2
+    manager.wait(interrupted.id, timeout=10)
+    manager.wait(queued.id, timeout=10)
+    test_db.expire_all()
+    assert test_db.get(Job, interrupted.id).status == "succeeded"
+    assert test_db.get(Job, queued.id).result == '{"n": 2}'
+
+
+def test_job_events_stream_until_finished(client, test_db, manager):
+    release = threading.Event()
+    manager.register("blocking", _blocking_handler(release))
+    job = manager.submit(test_db, "blocking", {})
+    threading.Timer(0.3, release.set).start()
+
+    response = client.get(f"/jobs/{job.id}/events", params={"poll_interval": 0.05})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    assert events[-1].startswith("event: succeeded\n")
+    assert all(block.startswith("event: progress\n") for block in events[:-1])
+
+    assert client.get("/jobs/999").status_code == 404
+    assert client.get("/jobs/999/events").status_code == 404
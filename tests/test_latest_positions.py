@@ -0,0 +1,77 @@
+"""Tests for the latest-positions query"""
+
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend.models import Position
+from backend.services import PositionService
+
+
+def _position(portfolio_id: int, asset_id: int, position_date: date, quantity: str) -> Position:
+    return Position(
+        portfolio_id=portfolio_id,
+        asset_id=asset_id,
+        position_date=position_date,
+        quantity=Decimal(quantity),
+        average_cost=Decimal("10"),
+    )
+
+
+def test_latest_position_per_asset(test_db):
+    portfolio_id = test_db._test_portfolio.id
+    cmb = test_db._test_assets["600036.SH"].id
+    etf = test_db._test_assets["510300.SH"].id
+    test_db.add_all([
+        _position(portfolio_id, cmb, date(2024, 1, 2), "100"),
+        _position(portfolio_id, cmb, date(2024, 2, 1), "200"),
+        _position(portfolio_id, cmb, date(2024, 3, 1), "300"),
+        _position(portfolio_id, etf, date(2024, 1, 15), "50"),
+        # Another portfolio is ignored
+        _position(portfolio_id + 1, etf, date(2024, 4, 1), "999"),
+    ])
+    test_db.commit()
+    service = PositionService(test_db)
+
+    latest = {position.asset_id: position for position in service.get_latest_positions(portfolio_id)}
+    assert {asset_id: position.quantity for asset_id, position in latest.items()} == {
+        cmb: Decimal("300"), etf: Decimal("50")
+    }
+    assert latest[cmb].position_date == date(2024, 3, 1)
+
+    # Between two snapshot dates
+    latest = service.get_latest_positions(portfolio_id, date(2024, 2, 15))
+    assert {(position.asset_id, position.quantity) for position in latest} == {
+        (cmb, Decimal("200")), (etf, Decimal("50"))
+    }
+    assert {position.asset_id for position in service.get_latest_positions(portfolio_id, date(2024, 1, 10))} == {cmb}
+    assert service.get_latest_positions(portfolio_id, date(2023, 12, 31)) == []
+
+
+def test_latest_positions_use_the_index(test_db):
+    statement = (
+        "EXPLAIN QUERY PLAN SELECT asset_id, max(position_date) FROM position "
+        "WHERE portfolio_id = 1 AND position_date <= '2024-02-15' GROUP BY asset_id"
+    )
+    plan = " ".join(row[-1] for row in test_db.exec(text(statement)).all())
+    assert "ix_position_portfolio_asset_date" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_index_is_added_to_existing_databases(tmp_path, monkeypatch):
+    from backend import models
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'existing.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.exec(text("DROP INDEX ix_position_portfolio_asset_date"))
+        session.commit()
+
+    monkeypatch.setattr(models, "_engine", engine)
+    models.create_db_and_tables()
+    with Session(engine) as session:
+        indexes = [row[1] for row in session.exec(text("PRAGMA index_list('position')")).all()]
+    assert "ix_position_portfolio_asset_date" in indexes
+    engine.dispose()
@@ -0,0 +1,173 @@
+"""Tests for the live portfolio valuation stream"""
+
+import asyncio
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from backend import live, realtime
+from backend.models import Price
+
+TRANSACTIONS_CSV = (
+    "trade_date,action,symbol,quantity,price,amount,fees\n"
+    "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+    "2024-01-03,buy,600036.SH,1000,35,35000,0\n"
+    "2024-01-03,buy,510300.SH,2000,4,8000,0\n"
+)
+
+
+@pytest.fixture
+def hub(client, test_db, monkeypatch):
+    """A fresh hub and price feed, on a portfolio holding 600036.SH and 510300.SH"""
+    price_feed = realtime.PriceFeed()
+    price_feed.bind(test_db.get_bind())
+    monkeypatch.setattr(realtime, "feed", price_feed)
+    valuation_hub = live.LiveValuationHub()
+    monkeypatch.setattr(live, "hub", valuation_hub)
+
+    client.post("/import/transactions/", files={"file": ("transactions.csv", TRANSACTIONS_CSV, "text/csv")})
+    yesterday = date.today() - timedelta(days=1)
+    test_db.add_all([
+        Price(asset_id=test_db._test_assets["600036.SH"].id, price_date=yesterday, price=Decimal("35"),
+              price_type="historical"),
+        Price(asset_id=test_db._test_assets["510300.SH"].id, price_date=yesterday, price=Decimal("4"),
+              price_type="historical"),
+    ])
+    test_db.commit()
+    return valuation_hub
+
+
+def _positions(message: dict) -> dict[str, dict]:
+    return {position["symbol"]: position for position in message["positions"]}
+
+
+def test_live_portfolio_revalues_one_asset():
+    portfolio = live.LivePortfolio(1, {
+        1: live.LivePosition(1, "A", quantity=10, rate=1.0, price=None, pnl_base=-100),
+        2: live.LivePosition(2, "B", quantity=5, rate=2.0, price=None, pnl_base=0),
+    }, ledger=(2, 2), generation=0)
+    for position in portfolio.positions.values():
+        position.revalue(10.0)
+    portfolio = live.LivePortfolio(1, portfolio.positions, ledger=(2, 2), generation=0)
+    assert portfolio.totals()["total_market_value_primary"] == 200.0
+
+    assert portfolio.apply_price(1, 12.0)
+    assert not portfolio.apply_price(1, 12.0)
+    assert not portfolio.apply_price(3, 1.0)
+    assert portfolio.total_market_value == 220.0
+    assert portfolio.total_pnl == 120.0
+
+    delta = portfolio.delta_since(0)
+    assert delta["version"] == 1
+    assert [position["asset_id"] for position in delta["positions"]] == [1]
+    assert portfolio.delta_since(1)["positions"] == []
+
+    for step in range(live.CHANGE_LOG_SIZE + 1):
+        portfolio.apply_price(2, 20.0 + step)
+    # Too far behind for the change log
+    assert portfolio.delta_since(1) is None
+
+
+def test_bursts_are_coalesced_into_one_delta(test_db, hub):
+    portfolio_id = test_db._test_portfolio.id
+
+    async def scenario():
+        subscriber = await hub.subscribe(portfolio_id, test_db.get_bind())
+        stream = hub.stream(subscriber, test_db.get_bind(), min_interval=0.1)
+        try:
+            snapshot = await anext(stream)
+            now = datetime.now()
+            realtime.feed.ingest([
+                realtime.Tick("600036.SH", 35 + step / 10, now + timedelta(seconds=step)) for step in range(1, 6)
+            ])
+            return snapshot, await asyncio.wait_for(anext(stream), 5)
+        finally:
+            await stream.aclose()
+            hub.unsubscribe(subscriber)
+
+    snapshot, delta = asyncio.run(scenario())
+    assert snapshot["type"] == "snapshot"
+    assert _positions(snapshot)["600036.SH"]["market_value_primary"] == pytest.approx(35000)
+    assert snapshot["total_market_value_primary"] == pytest.approx(100000)
+
+    assert delta["type"] == "delta"
+    assert delta["version"] == 5
+    assert list(_positions(delta)) == ["600036.SH"]
+    assert _positions(delta)["600036.SH"]["price"] == pytest.approx(35.5)
+    assert delta["total_market_value_primary"] == pytest.approx(100500)
+    assert delta["total_pnl_primary"] == pytest.approx(500)
+    assert hub.portfolios == {}
+
+
+def test_live_valuation_websocket(client, test_db, hub):
+    url = f"/portfolios/{test_db._test_portfolio.id}/live/ws"
+    with client.websocket_connect(url, params={"min_interval": 0.05}) as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert _positions(snapshot)["510300.SH"]["market_value_primary"] == pytest.approx(8000)
+
+        client.post("/prices/ticks", json=[{"symbol": "510300.SH", "price": 4.2}])
+        delta = websocket.receive_json()
+        assert delta["type"] == "delta"
+        assert _positions(delta)["510300.SH"]["market_value_primary"] == pytest.approx(8400)
+
+        # A write reloads the holdings and sends new snapshots, the last one after the commit
+        client.post("/import/transactions/", files={"file": (
+            "transactions.csv",
+            "trade_date,action,symbol,quantity,price,amount,fees\n2024-01-04,buy,510300.SH,1000,4,4000,0\n",
+            "text/csv",
+        )})
+        for _ in range(3):
+            snapshot = websocket.receive_json()
+            assert snapshot["type"] == "snapshot"
+            if _positions(snapshot)["510300.SH"]["quantity"] == 3000:
+                break
+        assert _positions(snapshot)["510300.SH"]["quantity"] == 3000
+
+    assert client.get("/portfolios/999/live").status_code == 404
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        with client.websocket_connect("/portfolios/999/live/ws"):
+            pass
+    assert disconnect.value.code == 1008
+    assert client.get(f"/portfolios/{test_db._test_portfolio.id}/live", params={"min_interval": 0}).status_code == 422
+
+
+def test_writes_reload_only_changed_portfolios(client, test_db, hub, monkeypatch):
+    portfolio_id = test_db._test_portfolio.id
+    other = client.post("/portfolios/", json={"name": "Other", "base_currency_id": test_db._test_cny.id}).json()
+    loads = []
+    load = live.LivePortfolio.load.__func__
+
+    def counting_load(cls, session, loaded_portfolio_id, generation):
+        loads.append(loaded_portfolio_id)
+        return load(cls, session, loaded_portfolio_id, generation)
+
+    monkeypatch.setattr(live.LivePortfolio, "load", classmethod(counting_load))
+
+    async def next_message(stream):
+        return await asyncio.wait_for(anext(stream), 5)
+
+    async def scenario():
+        engine = test_db.get_bind()
+        subscribers = [await hub.subscribe(portfolio_id, engine), await hub.subscribe(other["id"], engine)]
+        streams = [hub.stream(subscriber, engine, min_interval=0.05, heartbeat=0.5) for subscriber in subscribers]
+        try:
+            for stream in streams:
+                await next_message(stream)
+
+            # A transaction of the other portfolio reloads that one only
+            client.post("/import/transactions/", params={"portfolio_id": other["id"]}, files={"file": (
+                "transactions.csv", TRANSACTIONS_CSV, "text/csv",
+            )})
+            assert (await next_message(streams[1]))["type"] == "snapshot"
+            assert (await next_message(streams[0]))["type"] == "heartbeat"
+            assert loads == [portfolio_id, other["id"], other["id"]]
+        finally:
+            for stream in streams:
+                await stream.aclose()
+            for subscriber in subscribers:
+                hub.unsubscribe(subscriber)
+
+    asyncio.run(scenario())
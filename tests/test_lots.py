@@ -0,0 +1,132 @@
+"""Tests for tax lots and realized gains"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlmodel import select
+
+from backend import lots
+from backend.models import LotSnapshot, Price
+
+
+def _transaction(trade_date: date, action: str, quantity: str, amount: str, notes: str | None = None, asset_id=1):
+    """A row with the transaction columns read by the lot engine"""
+    return SimpleNamespace(
+        trade_date=trade_date, action=action, asset_id=asset_id,
+        quantity=Decimal(quantity), amount=Decimal(amount), fees=Decimal("0"), notes=notes,
+    )
+
+
+LEDGER = [
+    _transaction(date(2023, 1, 2), "buy", "100", "1000"),   # lot 1 at 10
+    _transaction(date(2023, 2, 1), "buy", "100", "1200"),   # lot 2 at 12
+    _transaction(date(2023, 3, 1), "buy", "100", "1500"),   # lot 3 at 15
+    _transaction(date(2024, 3, 1), "sell", "150", "3000", notes="lots=3"),  # at 20
+]
+
+
+@pytest.mark.parametrize("method, expected", [
+    ("fifo", [(1, 100, 1000.0), (2, 50, 400.0)]),
+    ("lifo", [(3, 100, 500.0), (2, 50, 400.0)]),
+    # The named lot first, then FIFO
+    ("specific", [(3, 100, 500.0), (1, 50, 500.0)]),
+])
+def test_matching_methods(method, expected):
+    engine = lots.LotEngine(method)
+    for transaction in LEDGER:
+        engine.apply(transaction)
+    assert [(realized.lot_id, realized.quantity, realized.gain) for realized in engine.realized] == expected
+    assert sum(lot[3] for lot in engine.open_lots()) == 150
+    assert {realized.term for realized in engine.realized} == {"long"}
+    assert lots.RealizedLot(1, 1, date(2023, 3, 1), date(2024, 2, 28), 1, 2, 1).term == "short"
+
+
+def test_splits_and_oversold_quantity():
+    engine = lots.LotEngine()
+    engine.apply(_transaction(date(2024, 1, 2), "buy", "100", "1000"))
+    engine.apply(_transaction(date(2024, 2, 1), "split", "2", "0"))
+    assert engine.open_lots() == [(1, 1, date(2024, 1, 2), 200.0, 5.0)]
+
+    engine.apply(_transaction(date(2024, 3, 1), "sell", "250", "2500"))
+    realized = [(realized.lot_id, realized.quantity, realized.cost_basis) for realized in engine.realized]
+    assert realized == [(1, 200.0, 1000.0), (None, 50.0, 0.0)]
+    assert engine.open_lots() == []
+
+
+def test_partial_fills_keep_the_queue_compact():
+    engine = lots.LotEngine()
+    day = date(2020, 1, 1)
+    for step in range(20000):
+        engine.apply(_transaction(day + timedelta(days=step // 50), "buy", "10", "100"))
+        engine.apply(_transaction(day + timedelta(days=step // 50), "sell", "7", "84"))
+    queue = engine.queues[1]
+    assert sum(lot[2] for lot in queue.open_lots()) == pytest.approx(60000)
+    assert len(queue.ids) - queue.head < 20000
+    assert sum(realized.gain for realized in engine.realized) == pytest.approx(20000 * 14)
+
+    restored = lots.LotEngine.from_json("fifo", engine.to_json())
+    assert restored.open_lots() == engine.open_lots()
+
+
+def _import(client, rows: str):
+    response = client.post("/import/transactions/", files={"file": (
+        "transactions.csv", "trade_date,action,symbol,quantity,price,amount,fees,notes\n" + rows, "text/csv"
+    )})
+    assert response.status_code == 200
+
+
+def test_realized_gains_replay_from_year_end_snapshots(client, test_db):
+    portfolio_id = test_db._test_portfolio.id
+    _import(client,
+        "2022-01-03,cash_in,CNY,100000,1,100000,0,\n"
+        "2022-01-03,buy,600036.SH,1000,30,30000,0,\n"
+        "2022-06-01,buy,600036.SH,1000,32,32000,0,\n"
+        "2023-03-01,sell,600036.SH,500,35,17500,100,\n"
+        "2024-03-01,sell,600036.SH,1000,40,40000,0,lots=2\n"
+    )
+    service = lots.LotService(test_db)
+
+    gains_2024 = client.get(f"/portfolios/{portfolio_id}/realized-gains", params={
+        "year": 2024, "method": "specific",
+    }).json()
+    assert [(sale["lot_id"], sale["quantity"], sale["gain"]) for sale in gains_2024["sales"]] == [(2, 1000, 8000)]
+    assert gains_2024["long_term_gain"] == 8000
+    snapshot_dates = set(test_db.exec(select(LotSnapshot.snapshot_date)).all())
+    assert {date(2022, 12, 31), date(2023, 12, 31)} <= snapshot_dates
+
+    # A replay racing another one keeps the snapshot it finds
+    saved = test_db.exec(select(LotSnapshot.lots).where(LotSnapshot.method == "specific")).all()
+    service._save_snapshot(portfolio_id, lots.LotEngine("specific"), date(2022, 12, 31))
+    assert test_db.exec(select(LotSnapshot.lots).where(LotSnapshot.method == "specific")).all() == saved
+
+    gains_2023 = service.get_realized_gains(portfolio_id, 2023, "fifo")
+    assert gains_2023["total_gain"] == pytest.approx(17500 - 100 - 15000)
+    assert gains_2023["long_term_gain"] == gains_2023["total_gain"]
+
+    # A back-dated purchase makes the later snapshots stale
+    _import(client, "2022-12-01,buy,600036.SH,100,31,3100,0,\n")
+    lots_2024 = {lot["lot_id"]: lot for lot in service.get_lots(portfolio_id, date(2024, 6, 1), "fifo")}
+    assert {lot_id: lot["quantity"] for lot_id, lot in lots_2024.items()} == {2: 500, 3: 100}
+    assert all(lot["current_price"] is None for lot in lots_2024.values())
+
+
+def test_lots_endpoint(client, test_db):
+    _import(client,
+        "2024-01-02,cash_in,CNY,100000,1,100000,0,\n"
+        "2024-01-02,buy,600036.SH,1000,30,30000,0,\n"
+        "2024-02-01,buy,600036.SH,500,34,17000,0,\n"
+        "2024-03-01,sell,600036.SH,200,36,7200,0,\n"
+    )
+    test_db.add(Price(asset_id=test_db._test_assets["600036.SH"].id, price_date=date(2024, 3, 1),
+                      price=Decimal("36"), price_type="historical"))
+    test_db.commit()
+    url = f"/portfolios/{test_db._test_portfolio.id}/lots"
+
+    result = client.get(url, params={"as_of_date": "2024-03-31", "method": "lifo"}).json()
+    assert [(lot["lot_id"], lot["quantity"], lot["unit_cost"]) for lot in result["lots"]] == [
+        (1, 1000, 30), (2, 300, 34),
+    ]
+    assert result["lots"][1]["unrealized_gain"] == pytest.approx(300 * 2)
+    assert client.get(url, params={"method": "average"}).status_code == 400
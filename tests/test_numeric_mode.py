@@ -0,0 +1,64 @@
+"""Tests that the float numeric mode agrees with exact Decimal arithmetic.
+
+The tolerance is relative and can be changed with --numeric-tolerance.
+"""
+
+import pytest
+from datetime import timedelta
+from sqlmodel import Session
+
+from backend.services import PortfolioService
+
+pytestmark = pytest.mark.parametrize("synthetic_engine", [{"n_assets": 8, "n_transactions": 150}], indirect=True)
+
+
+def _assert_series_close(actual: dict, expected: dict, tolerance: float, keys: tuple[str, ...]):
+    assert actual["dates"] == expected["dates"]
+    for key in keys:
+        assert actual[key] == pytest.approx(expected[key], rel=tolerance, abs=tolerance), key
+    for key in ("twr", "annualized_return", "beginning_value", "ending_value"):
+        assert actual[key] == pytest.approx(expected[key], rel=tolerance, abs=tolerance), key
+
+
+def test_batch_nav_series_float_matches_decimal(synthetic_engine, numeric_tolerance):
+    """Float replay, valuation and NAV agree with the Decimal calculation"""
+    engine, dataset = synthetic_engine
+    # Start after the first trades, so the opening holdings come from the replay
+    start_date = dataset.start_date + timedelta(days=20)
+    with Session(engine) as session:
+        service = PortfolioService(session)
+        expected = service.batch_nav_series([dataset.portfolio_id], start_date, dataset.end_date)
+        actual = service.batch_nav_series(
+            [dataset.portfolio_id], start_date, dataset.end_date, numeric_mode="float"
+        )
+
+    expected = expected[dataset.portfolio_id]
+    actual = actual[dataset.portfolio_id]
+    assert len(actual["nav_history"]) == (dataset.end_date - start_date).days + 1
+    _assert_series_close(
+        actual, expected, numeric_tolerance, ("values", "nav_history", "shares_history", "daily_returns")
+    )
+
+
+def test_twr_float_matches_decimal(synthetic_engine, numeric_tolerance):
+    """twr() in float mode agrees with the Decimal twr()"""
+    engine, dataset = synthetic_engine
+    start_date = dataset.end_date - timedelta(days=10)
+    with Session(engine) as session:
+        service = PortfolioService(session)
+        expected = service.twr(dataset.portfolio_id, start_date, dataset.end_date)
+        actual = service.twr(dataset.portfolio_id, start_date, dataset.end_date, numeric_mode="float")
+
+    assert "values" not in actual
+    _assert_series_close(actual, expected, numeric_tolerance, ("nav_history", "shares_history", "daily_returns"))
+
+
+def test_invalid_numeric_mode(synthetic_engine):
+    engine, dataset = synthetic_engine
+    with Session(engine) as session:
+        with pytest.raises(ValueError, match="Invalid numeric mode"):
+            PortfolioService(session).batch_nav_series(
+                [dataset.portfolio_id], dataset.start_date, dataset.end_date, numeric_mode="fixed"
+            )
+        with pytest.raises(ValueError, match="Invalid numeric mode"):
+            PortfolioService(session).twr(dataset.portfolio_id, dataset.start_date, dataset.end_date, numeric_mode="flaot")
@@ -0,0 +1,132 @@
+"""Tests for the portfolio optimizer"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from backend import optimizer
+from backend.models import ExchangeRate, Price, Transaction
+
+
+@pytest.fixture
+def covariance():
+    rng = np.random.default_rng(3)
+    factor = rng.normal(0, 0.1, (5, 5))
+    return factor @ factor.T + np.diag([0.01, 0.02, 0.03, 0.04, 0.05])
+
+
+def test_min_variance():
+    # Two assets: w1 = (s2^2 - c) / (s1^2 + s2^2 - 2c)
+    matrix = np.array([[0.04, 0.006], [0.006, 0.09]])
+    weights, solver = optimizer.optimize_weights("min_variance", matrix)
+    assert solver["converged"]
+    assert weights[0] == pytest.approx((0.09 - 0.006) / (0.04 + 0.09 - 0.012), abs=1e-6)
+    assert weights.sum() == pytest.approx(1.0)
+
+    capped, _ = optimizer.optimize_weights("min_variance", matrix, lower=np.zeros(2), upper=np.array([0.6, 1.0]))
+    assert capped == pytest.approx([0.6, 0.4], abs=1e-6)
+    with pytest.raises(ValueError):
+        optimizer.optimize_weights("min_variance", matrix, lower=np.zeros(2), upper=np.array([0.4, 0.4]))
+    with pytest.raises(ValueError):
+        optimizer.validate("max_return")
+
+
+def test_max_sharpe_is_the_tangency_portfolio(covariance):
+    expected_returns = np.array([0.08, 0.1, 0.12, 0.09, 0.11])
+    tangency = np.linalg.solve(covariance, expected_returns - 0.02)
+    assert np.all(tangency > 0)
+    weights, solver = optimizer.optimize_weights("max_sharpe", covariance, expected_returns, 0.02)
+    assert solver["converged"]
+    assert weights == pytest.approx(tangency / tangency.sum(), abs=1e-5)
+
+    # A warm start lands on the same weights
+    again, _ = optimizer.optimize_weights("max_sharpe", covariance, expected_returns, 0.02, initial=weights)
+    assert again == pytest.approx(weights, abs=1e-5)
+    with pytest.raises(ValueError):
+        optimizer.optimize_weights("max_sharpe", covariance, expected_returns, 0.5)
+
+
+def test_risk_parity(covariance):
+    weights, solver = optimizer.optimize_weights("risk_parity", covariance)
+    contributions = weights * (covariance @ weights)
+    assert contributions == pytest.approx(np.full(5, contributions.mean()), rel=1e-6)
+    assert solver["message"] == "Unbounded risk parity"
+
+    # A binding cap leaves the other assets close to equal shares
+    upper = np.ones(5)
+    capped = np.argmax(weights)
+    upper[capped] = weights.max() - 0.05
+    bounded, solver = optimizer.optimize_weights("risk_parity", covariance, lower=np.zeros(5), upper=upper)
+    assert solver["converged"]
+    assert bounded[capped] == pytest.approx(upper[capped])
+    assert bounded.sum() == pytest.approx(1.0)
+    contributions = np.delete(bounded * (covariance @ bounded), capped)
+    assert contributions.max() / contributions.min() < 1.1
+
+
+def test_optimize_endpoint_trades_and_exchanges(client, test_db):
+    portfolio_id = test_db._test_portfolio.id
+    assets = test_db._test_assets
+    cmb, tencent, etf = assets["600036.SH"].id, assets["00700.HK"].id, assets["510300.SH"].id
+    for symbol, quantity, price in [("CNY_CASH", "200000", "1"), ("600036.SH", "2000", "30"), ("510300.SH", "5000", "4")]:
+        test_db.add(Transaction(
+            portfolio_id=portfolio_id, trade_date=date(2024, 1, 1), action="cash_in" if "CASH" in symbol else "buy",
+            asset_id=assets[symbol].id, quantity=Decimal(quantity), price=Decimal(price),
+            amount=Decimal(quantity) * Decimal(price), fees=Decimal("0"), currency_id=assets[symbol].currency_id,
+        ))
+    rng = np.random.default_rng(5)
+    days = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(80)]
+    closes = {
+        cmb: 30 * np.exp(np.cumsum(rng.normal(0.001, 0.02, 80))),
+        etf: 4 * np.exp(np.cumsum(rng.normal(0.0005, 0.01, 80))),
+        tencent: 300 * np.exp(np.cumsum(rng.normal(0.001, 0.025, 80))),
+    }
+    test_db.add_all(
+        [Price(asset_id=asset_id, price_date=day, price=Decimal(f"{close:.4f}"), price_type="historical")
+         for asset_id, series in closes.items() for day, close in zip(days, series)]
+        + [ExchangeRate(currency_id=test_db._test_hkd.id, rate_date=day, rate_to_primary=Decimal("0.9"))
+           for day in days]
+    )
+    test_db.commit()
+
+    url = f"/portfolios/{portfolio_id}/optimize"
+    response = client.post(url, json={
+        "as_of_date": days[-1].isoformat(), "objective": "risk_parity", "asset_ids": [tencent],
+        "cash_weight": 0.1, "method": "sample", "bounds": {"stock": {"max_weight": 0.6}},
+    })
+    assert response.status_code == 200
+    result = response.json()
+    assert result["converged"]
+    rows = {row["asset_id"]: row for row in result["assets"]}
+    assert set(rows) == {cmb, etf, tencent}
+    assert sum(row["target_weight"] for row in rows.values()) == pytest.approx(1.0)
+    assert sum(row["risk_contribution"] for row in rows.values()) == pytest.approx(1.0)
+    assert rows[tencent]["current_weight"] == 0
+
+    # Tencent is bought with Hong Kong dollars exchanged from the yuan
+    trades = {trade["asset_id"]: trade for trade in result["trades"]}
+    assert trades[tencent]["action"] == "buy"
+    assert trades[tencent]["currency"] == "HKD"
+    [conversion] = result["fx_conversions"]
+    assert (conversion["from_currency"], conversion["to_currency"]) == ("CNY", "HKD")
+    assert conversion["converted_amount"] == pytest.approx(conversion["amount"] / 0.9)
+    cash = {row["currency"]: row for row in result["cash"]}
+    assert cash["HKD"]["before"] == 0
+    assert 0 <= cash["HKD"]["after"] < closes[tencent][-1] + 1
+    # The cash left is the cash weight and what whole shares could not buy
+    cash_after = sum(row["after"] * (0.9 if code == "HKD" else 1) for code, row in cash.items())
+    assert result["total_value"] * 0.1 <= cash_after < result["total_value"] * 0.1 + sum(
+        trade["value"] / trade["quantity"] for trade in result["trades"]
+    )
+
+    # Without exchanges the Hong Kong buys have no cash
+    no_fx = client.post(url, json={
+        "as_of_date": days[-1].isoformat(), "objective": "risk_parity", "asset_ids": [tencent],
+        "cash_weight": 0.1, "method": "sample", "allow_fx": False,
+    }).json()
+    assert no_fx["fx_conversions"] == []
+    assert tencent not in {trade["asset_id"] for trade in no_fx["trades"]}
+
+    assert client.post(url, json={"objective": "max_return"}).status_code == 400
@@ -0,0 +1,123 @@
+"""Tests for consolidated views of portfolio groups"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlmodel import select
+
+from backend.models import Portfolio, Price, Transaction
+from backend.services import PortfolioGroupService, PortfolioService
+
+ALICE_CSV = (
+    "trade_date,action,symbol,quantity,price,amount,fees\n"
+    "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+    "2024-01-03,buy,600036.SH,1000,35,35000,0\n"
+    "2024-01-05,cash_out,CNY,10000,1,10000,0\n"
+)
+BOB_CSV = (
+    "trade_date,action,symbol,quantity,price,amount,fees\n"
+    "2024-01-02,cash_in,CNY,50000,1,50000,0\n"
+    "2024-01-03,buy,600036.SH,500,35,17500,0\n"
+    "2024-01-04,buy,510300.SH,2000,4,8000,0\n"
+    # Transfer received from the first portfolio
+    "2024-01-05,cash_in,CNY,10000,1,10000,0\n"
+)
+
+
+@pytest.fixture
+def household(client, test_db):
+    """Two portfolios with their own ledgers in one group"""
+    alice = test_db._test_portfolio
+    bob = Portfolio(name="Second Portfolio", base_currency_id=test_db._test_cny.id)
+    test_db.add(bob)
+    test_db.commit()
+    for portfolio, contents in ((alice, ALICE_CSV), (bob, BOB_CSV)):
+        response = client.post(
+            "/import/transactions/",
+            params={"portfolio_id": portfolio.id},
+            files={"file": ("transactions.csv", contents, "text/csv")},
+        )
+        assert response.status_code == 200
+    cmb = test_db._test_assets["600036.SH"].id
+    etf = test_db._test_assets["510300.SH"].id
+    test_db.add_all([
+        Price(asset_id=cmb, price_date=date(2024, 1, 3), price=Decimal("35"), price_type="historical"),
+        Price(asset_id=cmb, price_date=date(2024, 1, 8), price=Decimal("36"), price_type="historical"),
+        Price(asset_id=etf, price_date=date(2024, 1, 4), price=Decimal("4"), price_type="historical"),
+        Price(asset_id=etf, price_date=date(2024, 1, 8), price=Decimal("4.2"), price_type="historical"),
+    ])
+    test_db.commit()
+
+    response = client.post("/portfolio-groups/", json={"name": "Household", "portfolio_ids": [bob.id, alice.id]})
+    assert response.status_code == 200
+    return response.json(), alice, bob
+
+
+def test_imports_target_a_portfolio(test_db, household):
+    _, alice, bob = household
+    counts = {
+        portfolio.id: len(test_db.exec(select(Transaction).where(Transaction.portfolio_id == portfolio.id)).all())
+        for portfolio in (alice, bob)
+    }
+    assert counts == {alice.id: 3, bob.id: 4}
+
+
+def test_group_summary_combines_members(client, test_db, household):
+    group, alice, bob = household
+    assert group["portfolio_ids"] == sorted([alice.id, bob.id])
+
+    summary = client.get(f"/portfolio-groups/{group['id']}/summary", params={"as_of_date": "2024-01-08"}).json()
+    members = [
+        client.get(f"/portfolios/{portfolio.id}/summary", params={"as_of_date": "2024-01-08"}).json()
+        for portfolio in (alice, bob)
+    ]
+    assert summary["total_market_value_primary"] == pytest.approx(
+        sum(member["total_market_value_primary"] for member in members)
+    )
+    assert summary["total_pnl_primary"] == pytest.approx(sum(member["total_pnl_primary"] for member in members))
+    assert summary["net_contributions_primary"] == pytest.approx(150000)
+    holdings = {position["symbol"]: position for position in summary["positions"]}
+    assert holdings["600036.SH"]["quantity"] == 1500
+    assert holdings["600036.SH"]["market_value_primary"] == pytest.approx(54000)
+    assert holdings["600036.SH"]["total_pnl_primary"] == pytest.approx(1500)
+    assert holdings["CNY_CASH"]["quantity"] == 150000 - 35000 - 17500 - 8000
+
+    allocation = client.get(f"/portfolio-groups/{group['id']}/allocation", params={"as_of_date": "2024-01-08"}).json()
+    assert allocation["total_value"] == pytest.approx(summary["total_market_value_primary"])
+    assert sum(allocation["asset_allocation"].values()) == pytest.approx(1)
+    assert allocation["asset_allocation"]["etf"] == pytest.approx(8400 / allocation["total_value"])
+
+
+def test_group_performance_is_one_merged_ledger(client, test_db, household):
+    group, alice, bob = household
+    response = client.get(f"/portfolio-groups/{group['id']}/performance", params={
+        "start_date": "2024-01-02", "end_date": "2024-01-08",
+    }).json()
+    history = {row["date"]: row for row in response["history"]}
+    # The transfer between the members is not a cash flow of the group
+    assert history["2024-01-05"]["net_cash_flow"] == 0
+    assert history["2024-01-08"]["value"] == pytest.approx(150000 + 1500 + 400)
+    assert response["twr"] == pytest.approx((150000 + 1500 + 400) / 150000 - 1)
+
+    service = PortfolioGroupService(test_db)
+    decimal_result = service.nav_series(group["id"], date(2024, 1, 2), date(2024, 1, 8))
+    float_result = service.nav_series(group["id"], date(2024, 1, 2), date(2024, 1, 8), numeric_mode="float")
+    assert float_result["nav_history"] == pytest.approx(decimal_result["nav_history"])
+
+    # A group of one portfolio has the NAV series of the portfolio
+    client.put(f"/portfolio-groups/{group['id']}", json={"name": "Alice", "portfolio_ids": [alice.id]})
+    single = PortfolioService(test_db).batch_nav_series([alice.id], date(2024, 1, 2), date(2024, 1, 8))[alice.id]
+    grouped = service.nav_series(group["id"], date(2024, 1, 2), date(2024, 1, 8))
+    assert grouped["nav_history"] == pytest.approx(single["nav_history"])
+
+
+def test_group_endpoints_validate(client, household):
+    group, _, _ = household
+    assert client.post("/portfolio-groups/", json={"name": "Bad", "portfolio_ids": [999]}).status_code == 400
+    assert client.get("/portfolio-groups/999/summary").status_code == 404
+    assert client.delete(f"/portfolio-groups/{group['id']}").status_code == 200
+    assert client.get("/portfolio-groups/").json() == []
+    assert client.post("/import/transactions/", params={"portfolio_id": 999}, files={
+        "file": ("transactions.csv", ALICE_CSV, "text/csv")
+    }).status_code == 400
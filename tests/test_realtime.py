@@ -0,0 +1,146 @@
+"""Tests for the intraday price feed"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlmodel import Session, select
+
+from backend import realtime
+from backend.models import Position, Price, Transaction
+from backend.services import PriceService
+
+
+@pytest.fixture
+def feed(test_db, monkeypatch):
+    """A fresh price feed bound to the test database"""
+    price_feed = realtime.PriceFeed()
+    price_feed.bind(test_db.get_bind())
+    monkeypatch.setattr(realtime, "feed", price_feed)
+    return price_feed
+
+
+def _stored_prices(test_db) -> dict[tuple[int, date], tuple[Decimal, str]]:
+    with Session(test_db.get_bind()) as session:
+        return {
+            (price.asset_id, price.price_date): (price.price, price.price_type)
+            for price in session.exec(select(Price)).all()
+        }
+
+
+def test_latest_prices_are_read_from_memory(test_db, feed):
+    cmb = test_db._test_assets["600036.SH"]
+    now = datetime.now()
+    applied, unknown = feed.ingest([
+        realtime.Tick("600036.SH", 35.1, now - timedelta(minutes=2)),
+        realtime.Tick("600036.SH", 35.4, now),
+        # Late ticks do not replace a newer price
+        realtime.Tick("600036.SH", 34.0, now - timedelta(minutes=1)),
+        realtime.Tick("UNKNOWN", 1.0, now),
+    ])
+    assert applied == 2
+    assert unknown == ["UNKNOWN"]
+    assert feed.table.get(cmb.id).price == Decimal("35.4")
+
+    price = PriceService(test_db).get_latest_price(cmb.id)
+    assert price.price == Decimal("35.4")
+    assert price.price_type == "real_time"
+
+    # Earlier dates still read the price table
+    test_db.add(Price(asset_id=cmb.id, price_date=date.today() - timedelta(days=1), price=Decimal("34.8"),
+                      price_type="historical"))
+    test_db.commit()
+    price = PriceService(test_db).get_latest_price(cmb.id, date.today() - timedelta(days=1))
+    assert price.price == Decimal("34.8")
+
+
+def test_flush_writes_closes_without_replacing_historical_prices(test_db, feed):
+    cmb = test_db._test_assets["600036.SH"]
+    etf = test_db._test_assets["510300.SH"]
+    day = date(2024, 3, 1)
+    test_db.add(Price(asset_id=etf.id, price_date=day, price=Decimal("3.9"), price_type="historical"))
+    test_db.commit()
+
+    feed.ingest([
+        realtime.Tick("600036.SH", 35.1, datetime(2024, 3, 1, 9, 30)),
+        realtime.Tick("600036.SH", 35.6, datetime(2024, 3, 1, 15, 0)),
+        realtime.Tick("510300.SH", 4.1, datetime(2024, 3, 1, 15, 0)),
+    ])
+    assert _stored_prices(test_db) == {(etf.id, day): (Decimal("3.9"), "historical")}
+
+    assert feed.flush() == 2
+    assert _stored_prices(test_db) == {
+        (cmb.id, day): (Decimal("35.6"), "real_time"),
+        (etf.id, day): (Decimal("3.9"), "historical"),
+    }
+    assert feed.flush() == 0
+
+
+def test_first_tick_of_a_day_flushes_the_previous_close(test_db, feed):
+    cmb = test_db._test_assets["600036.SH"]
+    feed.ingest([realtime.Tick("600036.SH", 35.6, datetime(2024, 3, 1, 15, 0))])
+    feed.ingest([realtime.Tick("600036.SH", 36.0, datetime(2024, 3, 4, 9, 30))])
+    assert _stored_prices(test_db) == {(cmb.id, date(2024, 3, 1)): (Decimal("35.6"), "real_time")}
+
+
+def test_replay_file(test_db, feed, tmp_path):
+    cmb = test_db._test_assets["600036.SH"]
+    path = tmp_path / "ticks.csv"
+    path.write_text(
+        "symbol,price,timestamp\n"
+        "600036.SH,35.1,2024-03-01T09:30:00\n"
+        "00700.HK,301.2,2024-03-01T09:30:01\n"
+        "600036.SH,35.3,2024-03-01T09:30:02\n"
+    )
+    assert feed.replay(str(path)) == 3
+    assert feed.table.get(cmb.id).price == Decimal("35.3")
+
+    path = tmp_path / "ticks.ndjson"
+    path.write_text('{"symbol": "600036.SH", "price": 35.5, "timestamp": "2024-03-01T09:30:03"}\n')
+    assert feed.replay(str(path), speed=1000) == 1
+    assert feed.table.get(cmb.id).price == Decimal("35.5")
+
+
+def test_tick_endpoints(client, test_db, feed):
+    cmb = test_db._test_assets["600036.SH"]
+    response = client.post("/prices/ticks", json=[
+        {"symbol": "600036.SH", "price": 35.2},
+        {"symbol": "NOPE", "price": 1},
+    ])
+    assert response.json() == {"accepted": 1, "unknown_symbols": ["NOPE"]}
+
+    with client.websocket_connect("/prices/ticks/ws") as websocket:
+        websocket.send_json({"symbol": "510300.SH", "price": 4.05})
+        assert websocket.receive_json() == {"accepted": 1, "unknown_symbols": []}
+        websocket.send_json([{"symbol": "600036.SH", "price": 35.3}, {"symbol": "600036.SH"}])
+        assert "error" in websocket.receive_json()
+
+    latest = {row["symbol"]: row["price"] for row in client.get("/prices/latest").json()}
+    assert latest == {"600036.SH": 35.2, "510300.SH": 4.05}
+    assert client.get("/prices/latest", params={"symbols": "510300.SH"}).json()[0]["asset_id"] != cmb.id
+
+    assert client.post("/prices/feed/flush").json() == {"flushed": 2}
+    assert (cmb.id, date.today()) in _stored_prices(test_db)
+
+
+def test_ticks_revalue_todays_stored_positions(client, test_db, feed):
+    cmb = test_db._test_assets["600036.SH"]
+    test_db.add(Transaction(
+        portfolio_id=test_db._test_portfolio.id, trade_date=date.today(), action="buy", asset_id=cmb.id,
+        quantity=Decimal("100"), price=Decimal("30"), amount=Decimal("3000"), fees=Decimal("0"),
+        currency_id=cmb.currency_id,
+    ))
+    test_db.commit()
+    url = f"/portfolios/{test_db._test_portfolio.id}"
+
+    client.post("/prices/ticks", json=[{"symbol": "600036.SH", "price": 35}])
+    # 100 shares at 35 less the 3000 yuan paid for them
+    assert client.get(f"{url}/summary").json()["total_market_value_primary"] == 500
+    # The summary stored today's positions
+    with Session(test_db.get_bind()) as session:
+        assert session.exec(select(Position).where(Position.position_date == date.today())).all()
+
+    client.post("/prices/ticks", json=[{"symbol": "600036.SH", "price": 40}])
+    assert client.get(f"{url}/summary").json()["total_market_value_primary"] == 1000
+    positions = {row["symbol"]: row for row in client.get(f"{url}/positions").json()}
+    assert positions["600036.SH"]["market_value"] == 4000
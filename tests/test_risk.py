@@ -0,0 +1,124 @@
+"""Tests for Value-at-Risk and expected shortfall"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+
+from backend import risk
+from backend.corporate_actions import CorporateActionService
+from backend.models import ExchangeRate, Price
+
+
+@pytest.fixture
+def returns():
+    """Daily log returns of three correlated assets"""
+    rng = np.random.default_rng(3)
+    covariance = np.array([[4.0, 1.0, 0.5], [1.0, 2.0, 0.0], [0.5, 0.0, 1.0]]) * 1e-4
+    return rng.multivariate_normal(np.zeros(3), covariance, size=500)
+
+
+def test_parametric_and_historical_var(returns):
+    exposures = np.array([100000.0, 50000.0, -20000.0])
+    daily_pnl = np.expm1(returns) @ exposures
+    z = NormalDist().inv_cdf(0.99)
+    var, cvar = risk.parametric_var(returns, exposures, [0.99], [10])[0.99, 10]
+    assert var == pytest.approx(-10 * daily_pnl.mean() + z * daily_pnl.std(ddof=1) * np.sqrt(10))
+    assert cvar > var
+
+    historical = risk.historical_var(returns, exposures, [0.95], [1, 5, 1000])
+    assert historical[0.95, 1][0] == pytest.approx(np.quantile(-daily_pnl, 0.95))
+    five_day_pnl = np.array([
+        np.expm1(returns[start:start + 5].sum(axis=0)) @ exposures for start in range(len(returns) - 4)
+    ])
+    assert historical[0.95, 5][0] == pytest.approx(np.quantile(-five_day_pnl, 0.95))
+    # The window is too short for the horizon
+    assert (0.95, 1000) not in historical
+
+
+def test_monte_carlo_var_is_reproducible_and_converges(returns):
+    exposures = np.array([100000.0, 50000.0, 30000.0])
+    simulated = risk.monte_carlo_var(returns, exposures, [0.95, 0.99], [1, 10], simulations=40000, seed=11)
+    # Independent streams per block: the same scenarios in worker processes
+    assert risk.monte_carlo_var(
+        returns, exposures, [0.95, 0.99], [1, 10], simulations=40000, seed=11, workers=2
+    ) == simulated
+    other_seed = risk.monte_carlo_var(returns, exposures, [0.95], [1], simulations=40000, seed=12)
+    assert other_seed[0.95, 1] != simulated[0.95, 1]
+
+    parametric = risk.parametric_var(returns, exposures, [0.95, 0.99], [1, 10])
+    for (confidence, horizon), (var, cvar) in simulated.items():
+        # Simulated log returns have a thinner loss tail than a normal P&L over longer horizons
+        tolerance = 0.03 if horizon == 1 else 0.1
+        assert var == pytest.approx(parametric[confidence, horizon][0], rel=tolerance)
+        assert cvar == pytest.approx(parametric[confidence, horizon][1], rel=tolerance)
+
+    # Cash has no variance, which leaves the covariance singular
+    factor = risk.covariance_factor(np.diag([1e-4, 0.0]))
+    assert factor.shape == (2, 1)
+    assert factor @ factor.T == pytest.approx(np.diag([1e-4, 0.0]))
+
+    with pytest.raises(ValueError):
+        risk.value_at_risk(returns, exposures, methods=["delta_gamma"])
+
+
+def test_returns_are_adjusted_and_in_primary_currency(test_db):
+    cmb = test_db._test_assets["600036.SH"].id
+    tencent = test_db._test_assets["00700.HK"].id
+    etf = test_db._test_assets["510300.SH"].id
+    hkd = test_db._test_hkd.id
+    days = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(30)]
+    test_db.add_all(
+        [Price(asset_id=cmb, price_date=day, price=Decimal("40") if index < 15 else Decimal("20"), price_type="historical")
+         for index, day in enumerate(days)]
+        + [Price(asset_id=tencent, price_date=day, price=Decimal("300"), price_type="historical") for day in days]
+        + [ExchangeRate(currency_id=hkd, rate_date=day, rate_to_primary=Decimal("0.9") * (Decimal("1.01") ** index))
+           for index, day in enumerate(days)]
+        # Too little history
+        + [Price(asset_id=etf, price_date=day, price=Decimal("4"), price_type="historical") for day in days[-5:]]
+    )
+    test_db.commit()
+    CorporateActionService(test_db).create_action(cmb, days[15], "split", ratio=Decimal("2"))
+
+    matrix = risk.load_returns(test_db, [cmb, tencent, etf], days[-1], window=100)
+    assert matrix.asset_ids == [cmb, tencent]
+    assert matrix.excluded_asset_ids == [etf]
+    assert matrix.dates == days[1:]
+    # The split does not show as a return, the exchange rate does
+    assert matrix.returns[:, 0] == pytest.approx(np.zeros(29))
+    assert matrix.returns[:, 1] == pytest.approx(np.full(29, np.log(1.01)))
+
+
+def test_var_endpoint(client, test_db):
+    client.post("/import/transactions/", files={"file": (
+        "transactions.csv",
+        "trade_date,action,symbol,quantity,price,amount,fees\n"
+        "2024-01-02,cash_in,CNY,100000,1,100000,0\n"
+        "2024-01-02,buy,600036.SH,1000,30,30000,0\n",
+        "text/csv",
+    )})
+    cmb = test_db._test_assets["600036.SH"].id
+    rng = np.random.default_rng(5)
+    closes = 30 * np.exp(np.cumsum(rng.normal(0, 0.02, 60)))
+    test_db.add_all([
+        Price(asset_id=cmb, price_date=date(2024, 1, 2) + timedelta(days=offset),
+              price=Decimal(f"{close:.4f}"), price_type="historical")
+        for offset, close in enumerate(closes)
+    ])
+    test_db.commit()
+    url = f"/portfolios/{test_db._test_portfolio.id}/var"
+    params = {"as_of_date": "2024-03-01", "confidence": "0.95", "horizons": "1,5", "simulations": 20000}
+
+    response = client.get(url, params=params)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["observations"] == 59
+    assert result["total_value"] == pytest.approx(70000 + 1000 * float(f"{closes[59]:.4f}"))
+    rows = {(row["method"], row["horizon_days"]): row for row in result["results"]}
+    assert len(rows) == 6
+    assert all(0 < row["var"] <= row["cvar"] for row in rows.values())
+    assert rows["monte_carlo", 5]["var"] > rows["monte_carlo", 1]["var"]
+    assert client.get(url, params=params).json() == result
+    assert client.get(url, params={**params, "confidence": "1.5"}).status_code == 400
@@ -0,0 +1,100 @@
+"""Tests for the streaming NDJSON, CSV and Arrow exports"""
+
+import csv
+import io
+import json
+import pytest
+from datetime import date
+from decimal import Decimal
+from sqlmodel import Session
+
+from backend.models import Transaction, Price
+from backend.streaming import encode_rows
+
+
+@pytest.fixture
+def ledger(test_db: Session):
+    """A deposit and a buy, with prices for the bought stock"""
+    portfolio = test_db._test_portfolio
+    cny = test_db._test_cny
+    assets = test_db._test_assets
+    test_db.add_all([
+        Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 1), action="cash_in",
+                    asset_id=assets["CNY_CASH"].id, quantity=Decimal("10000"), price=Decimal("1"),
+                    amount=Decimal("10000"), currency_id=cny.id),
+        Transaction(portfolio_id=portfolio.id, trade_date=date(2025, 1, 2), action="buy",
+                    asset_id=assets["600036.SH"].id, quantity=Decimal("100"), price=Decimal("40.5"),
+                    amount=Decimal("4050"), fees=Decimal("5"), currency_id=cny.id, notes="first buy"),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, 2), price=Decimal("40.5"), price_type="historical"),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2025, 1, 3), price=Decimal("42"), price_type="historical"),
+    ])
+    test_db.commit()
+    return portfolio
+
+
+def test_encode_rows_yields_one_chunk_per_batch():
+    rows = ((index, f"row {index}") for index in range(25))
+    chunks = list(encode_rows(rows, [("id", "int"), ("name", "str")], "ndjson", batch_size=10))
+
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert json.loads(lines[24]) == {"id": 24, "name": "row 24"}
+
+
+def test_export_transactions_ndjson(client, ledger):
+    response = client.get("/transactions/export", params={"portfolio_id": ledger.id})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["action"] for row in rows] == ["cash_in", "buy"]
+    assert rows[1]["symbol"] == "600036.SH"
+    assert Decimal(rows[1]["amount"]) == Decimal("4050")
+    assert rows[1]["currency"] == "CNY"
+    assert rows[1]["trade_date"] == "2025-01-02"
+
+
+def test_export_performance_history_csv(client, ledger):
+    response = client.get(
+        f"/portfolios/{ledger.id}/performance-history/export",
+        params={"start_date": "2025-01-01", "end_date": "2025-01-03", "format": "csv"},
+    )
+    assert response.status_code == 200
+    assert 'filename="portfolio_1_performance.csv"' in response.headers["content-disposition"]
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["date"] for row in rows] == ["2025-01-01", "2025-01-02", "2025-01-03"]
+    assert float(rows[0]["nav"]) == 1.0
+    assert float(rows[-1]["value"]) == pytest.approx(5945 + 4200)
+
+    # The streamed rows are the chart rows
+    history = client.get(
+        f"/portfolios/{ledger.id}/performance-history",
+        params={"start_date": "2025-01-01", "end_date": "2025-01-03"},
+    ).json()
+    assert [float(row["nav"]) for row in rows] == pytest.approx([point["nav"] for point in history])
+
+
+def test_export_arrow(client, ledger):
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/transactions/export", params={"format": "arrow"})
+    assert response.status_code == 200
+
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 2
+    assert table.schema.field("amount").type == pa.decimal128(38, 10)
+    assert table.column("fees").to_pylist()[1] == Decimal("5")
+
+    response = client.get(
+        f"/portfolios/{ledger.id}/performance-history/export",
+        params={"start_date": "2025-01-02", "end_date": "2025-01-03", "format": "arrow"},
+    )
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("date").to_pylist() == [date(2025, 1, 2), date(2025, 1, 3)]
+    assert table.column("nav").to_pylist()[0] == 1.0
+
+
+def test_export_rejects_unknown_format(client, ledger):
+    response = client.get("/transactions/export", params={"format": "xml"})
+    assert response.status_code == 400
+    assert "Invalid export format" in response.json()["detail"]
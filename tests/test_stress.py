@@ -0,0 +1,117 @@
+"""Tests for scenario and stress-test revaluation"""
+
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from backend import stress
+from backend.models import AssetMetadata, ExchangeRate, Price, Transaction
+
+
+@pytest.fixture
+def holdings(test_db):
+    """CNY 70,000 cash, 1,000 CMB at 30 CNY, HKD 4,000 cash and 20 Tencent at 300 HKD (HKD at 0.9 CNY)"""
+    assets = test_db._test_assets
+    portfolio_id = test_db._test_portfolio.id
+    hkd = test_db._test_hkd.id
+    for trade_date, action, symbol, quantity, price in [
+        (date(2024, 1, 2), "cash_in", "CNY_CASH", "100000", "1"),
+        (date(2024, 1, 2), "buy", "600036.SH", "1000", "30"),
+        (date(2024, 1, 2), "cash_in", "HKD_CASH", "10000", "1"),
+        (date(2024, 1, 2), "buy", "00700.HK", "20", "300"),
+    ]:
+        test_db.add(Transaction(
+            portfolio_id=portfolio_id, trade_date=trade_date, action=action, asset_id=assets[symbol].id,
+            quantity=Decimal(quantity), price=Decimal(price), amount=Decimal(quantity) * Decimal(price),
+            fees=Decimal("0"), currency_id=assets[symbol].currency_id,
+        ))
+    test_db.add_all([
+        # A window to replay: CMB halves, Tencent gains 10% and HKD falls 5%
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2023, 6, 1), price=Decimal("40"), price_type="historical"),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2023, 6, 30), price=Decimal("20"), price_type="historical"),
+        Price(asset_id=assets["00700.HK"].id, price_date=date(2023, 6, 1), price=Decimal("300"), price_type="historical"),
+        Price(asset_id=assets["00700.HK"].id, price_date=date(2023, 6, 30), price=Decimal("330"), price_type="historical"),
+        ExchangeRate(currency_id=hkd, rate_date=date(2023, 6, 1), rate_to_primary=Decimal("1.0")),
+        ExchangeRate(currency_id=hkd, rate_date=date(2023, 6, 30), rate_to_primary=Decimal("0.95")),
+        Price(asset_id=assets["600036.SH"].id, price_date=date(2024, 1, 2), price=Decimal("30"), price_type="historical"),
+        Price(asset_id=assets["00700.HK"].id, price_date=date(2024, 1, 2), price=Decimal("300"), price_type="historical"),
+        ExchangeRate(currency_id=hkd, rate_date=date(2024, 1, 2), rate_to_primary=Decimal("0.9")),
+        AssetMetadata(asset_id=assets["600036.SH"].id, attribute_name="sector", attribute_value="Banks"),
+    ])
+    test_db.commit()
+    return portfolio_id
+
+
+def test_hypothetical_scenarios(test_db, holdings):
+    cmb = test_db._test_assets["600036.SH"].id
+    tencent = test_db._test_assets["00700.HK"].id
+    hkd_cash = test_db._test_assets["HKD_CASH"].id
+    scenarios = [
+        stress.Scenario("HKD -10%, banks -20%", (
+            stress.Shock("currency", "HKD", -0.1), stress.Shock("sector", "Banks", -0.2),
+        )),
+        # The asset shock is more specific than the type shock
+        stress.Scenario("Stocks -30%, Tencent +5%", (
+            stress.Shock("asset", "00700.HK", 0.05), stress.Shock("type", "stock", -0.3),
+        )),
+    ]
+    result = stress.StressTestService(test_db).run(holdings, date(2024, 1, 2), scenarios)
+    assert result["total_value"] == pytest.approx(70000 + 30000 + 4000 * 0.9 + 6000 * 0.9)
+
+    hkd_and_banks, stocks = result["scenarios"]
+    pnl = {row["asset_id"]: row["pnl"] for row in hkd_and_banks["assets"]}
+    assert pnl[cmb] == pytest.approx(-6000)
+    assert pnl[tencent] == pytest.approx(-540)
+    assert pnl[hkd_cash] == pytest.approx(-360)
+    assert hkd_and_banks["pnl"] == pytest.approx(-6900)
+    assert hkd_and_banks["value_after"] == pytest.approx(result["total_value"] - 6900)
+
+    pnl = {row["asset_id"]: row["pnl"] for row in stocks["assets"]}
+    assert pnl[cmb] == pytest.approx(-9000)
+    assert pnl[tencent] == pytest.approx(270)
+    assert stocks["pnl_pct"] == pytest.approx(-8730 / result["total_value"])
+
+    with pytest.raises(ValueError):
+        stress.Shock("country", "CN", -0.1)
+    with pytest.raises(ValueError):
+        stress.Shock("asset", "600036.SH", -1.5)
+
+
+def test_revaluation_is_vectorized():
+    exposures = np.array([100.0, 200.0])
+    pnl = stress.revalue(exposures, np.array([[-0.5, 0.0], [0.1, 0.2]]), np.array([[0.0, -0.1], [0.0, 0.0]]))
+    assert pnl == pytest.approx(np.array([[-50.0, -20.0], [10.0, 40.0]]))
+
+
+def test_stress_test_endpoint_replays_history(client, test_db, holdings):
+    cmb = test_db._test_assets["600036.SH"].id
+    tencent = test_db._test_assets["00700.HK"].id
+    url = f"/portfolios/{holdings}/stress-test"
+    etag = client.get(f"/portfolios/{holdings}/summary").headers["etag"]
+
+    response = client.post(url, json={
+        "as_of_date": "2024-01-02",
+        "scenarios": [{"name": "HKD -10%", "shocks": [{"target": "currency", "key": "HKD", "change": -0.1}]}],
+        "historical": [{"name": "June 2023", "start_date": "2023-06-01", "end_date": "2023-06-30"}],
+        "include_library": True,
+    })
+    assert response.status_code == 200
+    scenarios = {scenario["name"]: scenario for scenario in response.json()["scenarios"]}
+    assert len(scenarios) == 2 + len(stress.HISTORICAL_SCENARIOS)
+    assert scenarios["HKD -10%"]["pnl"] == pytest.approx(-900)
+
+    june = scenarios["June 2023"]
+    assert june["kind"] == "historical"
+    pnl = {row["asset_id"]: row["pnl"] for row in june["assets"]}
+    assert pnl[cmb] == pytest.approx(-15000)
+    assert pnl[tencent] == pytest.approx(5400 * (1.1 * 0.95 - 1))
+    assert june["missing_asset_ids"] == []
+    # No price history that far back
+    assert set(scenarios["2008 global financial crisis"]["missing_asset_ids"]) == {cmb, tencent}
+
+    # Stress tests leave the cached portfolio responses valid
+    assert client.get(f"/portfolios/{holdings}/summary").headers.get("etag") == etag
+    assert len(client.get("/stress-scenarios/").json()) == len(stress.HISTORICAL_SCENARIOS)
+    assert client.post(url, json={"historical": [{"name": "Unknown crash"}]}).status_code == 400
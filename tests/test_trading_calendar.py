@@ -0,0 +1,101 @@
+"""Tests for trading calendars and valuation on trading days only"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from sqlmodel import Session, select
+
+from backend import trading_calendar
+from backend.models import Price, Transaction
+from backend.services import MarketDataSnapshot, PortfolioService
+
+
+def test_exchange_calendars_from_price_history_and_holiday_files(test_db, tmp_path, monkeypatch):
+    cmb = test_db._test_assets["600036.SH"].id
+    tencent = test_db._test_assets["00700.HK"].id
+    # 2024-01-01 is a holiday of both exchanges, 2024-01-03 of Shanghai only
+    test_db.add_all([
+        Price(asset_id=cmb, price_date=day, price=Decimal("35"), price_type="historical")
+        for day in (date(2023, 12, 29), date(2024, 1, 2), date(2024, 1, 4))
+    ] + [
+        Price(asset_id=tencent, price_date=day, price=Decimal("300"), price_type="historical")
+        for day in (date(2023, 12, 29), date(2024, 1, 2), date(2024, 1, 3))
+    ])
+    test_db.commit()
+    (tmp_path / "XSHG.csv").write_text("# Spring festival\n2024-02-12,Spring festival\n2024-02-13\n")
+    monkeypatch.setenv("NICEAMS_CALENDAR_DIR", str(tmp_path))
+
+    calendars = trading_calendar.load_calendars(test_db)
+    shanghai = trading_calendar.TradingCalendar([calendars["XSHG"]])
+    assert shanghai.trading_days(date(2023, 12, 29), date(2024, 1, 5)) == [
+        date(2023, 12, 29), date(2024, 1, 2), date(2024, 1, 4), date(2024, 1, 5),
+    ]
+    # After the price history, weekdays that are not listed holidays
+    assert shanghai.trading_days(date(2024, 2, 9), date(2024, 2, 14)) == [date(2024, 2, 9), date(2024, 2, 14)]
+
+    both = trading_calendar.calendar_for_assets(calendars, test_db._test_assets.values())
+    assert [exchange.exchange for exchange in both.exchanges] == ["XHKG", "XSHG"]
+    assert both.valuation_days(date(2023, 12, 30), date(2024, 1, 4), [date(2024, 1, 1)]) == [
+        date(2023, 12, 30), date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4),
+    ]
+    assert trading_calendar.forward_fill_index([date(2024, 1, 2), date(2024, 1, 4)], [
+        date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4), date(2024, 1, 6),
+    ]) == [0, 0, 1, 1]
+    assert trading_calendar.exchange_of("AAPL") == trading_calendar.DEFAULT_EXCHANGE
+
+
+ONE_SPLIT = pytest.mark.parametrize("synthetic_engine", [{"n_splits": 1}], indirect=True)
+
+
+@ONE_SPLIT
+@pytest.mark.parametrize("numeric_mode", ["decimal", "float"])
+def test_forward_filled_series_equal_daily_valuation(synthetic_engine, monkeypatch, numeric_mode):
+    engine, dataset = synthetic_engine
+    start_date = dataset.start_date + timedelta(days=10)
+    with Session(engine) as session:
+        service = PortfolioService(session)
+        result = service.batch_nav_series(
+            [dataset.portfolio_id], start_date, dataset.end_date, numeric_mode=numeric_mode
+        )[dataset.portfolio_id]
+        ledger = session.exec(select(Transaction).where(Transaction.portfolio_id == dataset.portfolio_id)).all()
+        valued_days = len(MarketDataSnapshot(session, start_date, dataset.end_date).valuation_days(
+            ledger, start_date, dataset.end_date
+        ))
+
+        monkeypatch.setattr(
+            MarketDataSnapshot, "valuation_days",
+            lambda self, transactions, start, end: [start + timedelta(days=n) for n in range((end - start).days + 1)],
+        )
+        every_day = service.batch_nav_series(
+            [dataset.portfolio_id], start_date, dataset.end_date, numeric_mode=numeric_mode
+        )[dataset.portfolio_id]
+
+    assert valued_days < 0.75 * len(every_day["dates"])
+    assert result["dates"] == every_day["dates"]
+    for key in ("values", "nav_history", "shares_history", "daily_returns"):
+        assert result[key] == every_day[key], key
+
+
+@ONE_SPLIT
+def test_volatility_is_annualized_over_trading_days(synthetic_engine):
+    engine, dataset = synthetic_engine
+    with Session(engine) as session:
+        service = PortfolioService(session)
+        twr_data = service.batch_nav_series([dataset.portfolio_id], dataset.start_date, dataset.end_date)[
+            dataset.portfolio_id
+        ]
+        statistics = service.calculate_portfolio_statistics(
+            dataset.portfolio_id, dataset.start_date, dataset.end_date, twr_data=twr_data
+        )
+        calendar = trading_calendar.calendar_for_portfolio(session, dataset.portfolio_id)
+
+    navs = np.array([
+        nav for index, (day, nav) in enumerate(zip(twr_data["dates"], twr_data["nav_history"]))
+        if index == 0 or calendar.is_trading_day(day)
+    ])
+    returns = navs[1:] / navs[:-1] - 1
+    # Trading days per year times years is the number of trading days of the period
+    assert statistics["volatility"] == pytest.approx(np.std(returns, ddof=1) * np.sqrt(len(returns)))
+    assert 200 < calendar.trading_days_per_year(dataset.start_date, dataset.end_date) < 262
@@ -6,7 +6,7 @@ from datetime import date, timedelta
 from decimal import Decimal
 from sqlmodel import Session, select
 from backend.models import (
-    Transaction, Price, ExchangeRate
+    Transaction, Price, ExchangeRate, Portfolio
 )
 from backend.services import PortfolioService
 
@@ -370,4 +370,67 @@ class TestTimeWeightedReturn:
         # Verify CSV has content
         with open(csv_path, 'r', encoding='utf-8') as csvfile:
             lines = csvfile.readlines()
-            assert len(lines) > 1  # Header + at least one data row
\ No newline at end of file
+            assert len(lines) > 1  # Header + at least one data row
+
+class TestPortfolioScopedTWR:
+    """Test cases for portfolio scoping and batch NAV calculation"""
+
+    def test_twr_ignores_other_portfolio_cash_flows(self, test_db: Session, test_data_with_sample_transactions):
+        """Cash flows of another portfolio must not change the TWR of this portfolio"""
+        data = test_data_with_sample_transactions
+        service = data["service"]
+        portfolio = data["portfolio"]
+        assets = data["assets"]
+
+        start_date = date(2025, 1, 1)
+        end_date = date(2025, 2, 12)
+        expected = service.twr(portfolio.id, start_date, end_date)
+
+        # Add a second portfolio with large cash flows inside the period
+        other_portfolio = Portfolio(name="Other Portfolio", base_currency_id=data["currencies"]["cny"].id)
+        test_db.add(other_portfolio)
+        test_db.commit()
+        for trade_date, action in [(date(2025, 1, 20), "cash_in"), (date(2025, 2, 3), "cash_out")]:
+            test_db.add(Transaction(
+                portfolio_id=other_portfolio.id,
+                trade_date=trade_date,
+                action=action,
+                asset_id=assets["CNY_CASH"].id,
+                quantity=Decimal("500000"),
+                price=Decimal("1"),
+                amount=Decimal("500000"),
+                fees=Decimal("0"),
+                currency_id=assets["CNY_CASH"].currency_id,
+            ))
+        test_db.commit()
+
+        result = service.twr(portfolio.id, start_date, end_date)
+
+        assert result["nav_history"] == pytest.approx(expected["nav_history"])
+        assert result["twr"] == pytest.approx(expected["twr"])
+
+    def test_batch_nav_series_matches_twr(self, test_db: Session, test_data_with_sample_transactions):
+        """Batch NAV series should agree with twr() for every portfolio"""
+        data = test_data_with_sample_transactions
+        service = data["service"]
+        portfolio = data["portfolio"]
+
+        empty_portfolio = Portfolio(name="Empty Portfolio", base_currency_id=data["currencies"]["cny"].id)
+        test_db.add(empty_portfolio)
+        test_db.commit()
+
+        start_date = date(2025, 1, 1)
+        end_date = date(2025, 3, 10)
+        results = service.batch_nav_series([portfolio.id, empty_portfolio.id], start_date, end_date)
+
+        expected = service.twr(portfolio.id, start_date, end_date)
+        batch = results[portfolio.id]
+        assert batch["dates"] == expected["dates"]
+        assert batch["nav_history"] == pytest.approx(expected["nav_history"], rel=1e-9)
+        assert batch["shares_history"] == pytest.approx(expected["shares_history"], rel=1e-9)
+        assert batch["twr"] == pytest.approx(expected["twr"], rel=1e-9)
+        assert len(batch["values"]) == len(batch["dates"])
+
+        empty = results[empty_portfolio.id]
+        assert empty["twr"] == 0.0
+        assert all(value == 0.0 for value in empty["values"])